@@ -0,0 +1,40 @@
+from typing import Dict, Iterable, Type
+
+from sensor.sensor_datum import SensorDatum
+from sensor.datum_category import DatumCategory
+
+
+class AggregateDatum(SensorDatum):
+    '''
+    Summary of one sensor's readings over a window. There's one subclass per source datum class (ex:
+    DS18B20DatumAggregate), built on demand by get_class, with a field per source field and aggregate (ex:
+    temperature_celcius_max), along with the length of the window they cover.
+    '''
+
+    __slots__ = ()
+
+    def __init__(self, category: str, sensor_type: str, sensor_id: str, timestamp_ns: int, values: Dict):
+        super().__init__(DatumCategory(category), sensor_type, sensor_id, timestamp_ns)
+
+        for name in self.schema:
+            setattr(self, name, values.get(name))
+
+    ## Methods
+
+    @staticmethod
+    def get_field_name(field: str, aggregate: str) -> str:
+        return f"{field}_{aggregate}"
+
+
+    @staticmethod
+    def get_class(source_class: Type[SensorDatum], fields: Iterable[str], aggregates: Iterable[str]) -> Type['AggregateDatum']:
+        name = f"{source_class.__name__}Aggregate"
+        datum_class = SensorDatum.registry.get(name)
+        if (datum_class is None):
+            schema = {"window_seconds": float}
+            for field in fields:
+                for aggregate in aggregates:
+                    schema[AggregateDatum.get_field_name(field, aggregate)] = int if aggregate == "count" else float
+            datum_class = type(name, (AggregateDatum,), {"schema": schema, "__slots__": tuple(schema)})
+
+        return datum_class
@@ -0,0 +1,253 @@
+import logging
+import warnings
+from enum import Enum
+from typing import Dict, Iterable, List, Tuple, Type
+
+import numpy as np
+
+from sensor.datum_batch import DatumBatch
+from sensor.sensor_datum import SensorDatum
+from .aggregate_datum import AggregateDatum
+from utilities import ConfigSection, initialize_logging
+
+
+class WindowKind(Enum):
+    ## Back to back windows, so every reading is summarized exactly once
+    TUMBLING = "tumbling"
+    ## Overlapping windows, each covering the last window_seconds of readings as of when it's emitted
+    SLIDING = "sliding"
+
+
+AGGREGATES = ("min", "max", "mean", "last", "stddev", "count")
+
+
+class SeriesWindow:
+    '''
+    Buffered readings for a single series (datum class, sensor type and sensor id), kept in growable NumPy arrays with
+    one row per reading and one column per numeric field. Missing values are stored as NaN.
+    '''
+
+    INITIAL_CAPACITY = 16
+
+    def __init__(self, field_count: int):
+        self.timestamps_ns = np.empty(self.INITIAL_CAPACITY, dtype=np.int64)
+        self.values = np.empty((self.INITIAL_CAPACITY, field_count), dtype=np.float64)
+        self.size = 0
+
+    ## Methods
+
+    def append(self, timestamp_ns: int, row: Tuple[float, ...]):
+        if (self.size == len(self.timestamps_ns)):
+            capacity = len(self.timestamps_ns) * 2
+            self.timestamps_ns = np.resize(self.timestamps_ns, capacity)
+            self.values = np.resize(self.values, (capacity, self.values.shape[1]))
+
+        self.timestamps_ns[self.size] = timestamp_ns
+        self.values[self.size] = row
+        self.size += 1
+
+
+    def select(self, start_ns: int, end_ns: int) -> Tuple[np.ndarray, np.ndarray]:
+        '''Gets the timestamps and values of the readings in [start_ns, end_ns), ordered by timestamp.'''
+
+        timestamps_ns = self.timestamps_ns[:self.size]
+        mask = (timestamps_ns >= start_ns) & (timestamps_ns < end_ns)
+        timestamps_ns = timestamps_ns[mask]
+        order = np.argsort(timestamps_ns, kind="stable")
+
+        return timestamps_ns[order], self.values[:self.size][mask][order]
+
+
+    def discard_before(self, timestamp_ns: int):
+        keep = self.timestamps_ns[:self.size] >= timestamp_ns
+        kept = int(np.count_nonzero(keep))
+        if (kept == self.size):
+            return
+
+        self.timestamps_ns[:kept] = self.timestamps_ns[:self.size][keep]
+        self.values[:kept] = self.values[:self.size][keep]
+        self.size = kept
+
+
+class WindowAggregator:
+    '''
+    Streaming aggregation stage that sits between the sensors and storage. Sensors can then be sampled at a high rate,
+    while only a summary of each window (min, max, mean, last, stddev and count for every numeric field) gets stored,
+    so short spikes stay visible without storing every reading.
+
+    Readings are bucketed by their timestamp, so a window emitted at time T covers readings from before T, and anything
+    at or after T is left for the next one. A reading that arrives after its window has already been emitted is
+    counted in the next window instead.
+    '''
+
+    def __init__(
+            self,
+            window_seconds: float = 60.0,
+            kind: WindowKind = WindowKind.TUMBLING,
+            emit_interval_seconds: float = None,
+            aggregates: Iterable[str] = AGGREGATES,
+            sensor_types: Iterable[str] = None
+    ):
+        self.logger = initialize_logging(logging.getLogger(__name__))
+
+        aggregates = tuple(aggregates)
+        unknown_aggregates = [aggregate for aggregate in aggregates if aggregate not in AGGREGATES]
+        if (unknown_aggregates or not aggregates):
+            raise ValueError(f"Aggregates must be some of {AGGREGATES}, not {aggregates}")
+
+        self.window_seconds = window_seconds
+        self.kind = kind
+        ## Tumbling windows are emitted as they close, while sliding windows can be emitted as often as needed
+        if (kind == WindowKind.TUMBLING or emit_interval_seconds is None):
+            self.emit_interval_seconds = window_seconds
+        else:
+            self.emit_interval_seconds = emit_interval_seconds
+        self.aggregates = aggregates
+        ## Sensor types to aggregate, or None for all of them
+        self.sensor_types = set(sensor_types) if sensor_types else None
+
+        self._window_ns = int(window_seconds * 1_000_000_000)
+        self._emit_interval_ns = int(self.emit_interval_seconds * 1_000_000_000)
+        self._windows: Dict[Tuple[Type[SensorDatum], str, str], SeriesWindow] = {}
+        ## Source datum class -> (numeric field names, aggregate datum class), or None if it has no numeric fields
+        self._datum_classes: Dict[Type[SensorDatum], Tuple[List[str], Type[AggregateDatum]]] = {}
+        ## Category of each series, since it isn't part of the key
+        self._categories: Dict[Tuple[Type[SensorDatum], str, str], str] = {}
+
+        ## Metrics
+        self.aggregated_count = 0
+        self.emitted_count = 0
+
+
+    @classmethod
+    def from_config(cls, config: ConfigSection) -> 'WindowAggregator':
+        return cls(
+            window_seconds=config.get_float('window_seconds', 60.0, minimum=0.001),
+            kind=WindowKind(config.get_str('window', WindowKind.TUMBLING.value)),
+            emit_interval_seconds=config.get_float('emit_interval_seconds', minimum=0.001),
+            aggregates=config.get('aggregates', AGGREGATES),
+            sensor_types=config.get('sensor_types')
+        )
+
+    ## Methods
+
+    def _get_datum_class_info(self, datum_class: Type[SensorDatum]) -> Tuple[List[str], Type[AggregateDatum]]:
+        if (datum_class not in self._datum_classes):
+            fields = [name for name, field_type in datum_class.schema.items() if field_type in DatumBatch.NUMERIC_TYPES]
+            if (fields):
+                self._datum_classes[datum_class] = (fields, AggregateDatum.get_class(datum_class, fields, self.aggregates))
+            else:
+                self._datum_classes[datum_class] = None
+
+        return self._datum_classes[datum_class]
+
+
+    def add(self, data: Iterable[SensorDatum]) -> Tuple[List[SensorDatum], List[SensorDatum]]:
+        '''
+        Buffers up the data for aggregation. Returns the datums that were buffered, and the datums that weren't (sensor
+        types that aren't configured, or datums without any numeric fields) which should be stored as is.
+        '''
+
+        aggregated = []
+        passthrough = []
+        for datum in data:
+            info = None
+            if (self.sensor_types is None or datum.sensor_type in self.sensor_types):
+                info = self._get_datum_class_info(type(datum))
+            if (info is None):
+                passthrough.append(datum)
+                continue
+
+            fields, _ = info
+            key = (type(datum), datum.sensor_type, datum.sensor_id)
+            window = self._windows.get(key)
+            if (window is None):
+                window = SeriesWindow(len(fields))
+                self._windows[key] = window
+                self._categories[key] = datum.category
+
+            window.append(datum.timestamp_ns, tuple(
+                np.nan if value is None else value for value in (getattr(datum, name) for name in fields)
+            ))
+            aggregated.append(datum)
+
+        self.aggregated_count += len(aggregated)
+
+        return aggregated, passthrough
+
+
+    def _aggregate(self, values: np.ndarray) -> Dict[str, np.ndarray]:
+        '''Computes every configured aggregate for each column of values, with NaN wherever a column has no values.'''
+
+        valid = ~np.isnan(values)
+        counts = valid.sum(axis=0)
+        results = {"count": counts}
+
+        ## All NaN columns warn, but NaN is exactly the right answer for them
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore", RuntimeWarning)
+            if ("min" in self.aggregates):
+                results["min"] = np.nanmin(values, axis=0)
+            if ("max" in self.aggregates):
+                results["max"] = np.nanmax(values, axis=0)
+            if ("mean" in self.aggregates):
+                results["mean"] = np.nanmean(values, axis=0)
+            if ("stddev" in self.aggregates):
+                results["stddev"] = np.nanstd(values, axis=0)
+
+        if ("last" in self.aggregates):
+            ## Index of the last valid value in each column
+            last_indices = len(values) - 1 - np.argmax(valid[::-1], axis=0)
+            results["last"] = np.where(counts > 0, values[last_indices, np.arange(values.shape[1])], np.nan)
+
+        return results
+
+
+    def flush(self, end_ns: int) -> List[AggregateDatum]:
+        '''
+        Builds an aggregate datum (timestamped at end_ns) for every series with readings in the window ending at
+        end_ns, and discards any readings that won't be needed for later windows.
+        '''
+
+        start_ns = end_ns - self._window_ns
+        ## Readings older than the start of the next window won't be used again
+        discard_before_ns = end_ns if self.kind == WindowKind.TUMBLING else end_ns + self._emit_interval_ns - self._window_ns
+
+        aggregated_data: List[AggregateDatum] = []
+        for key, window in self._windows.items():
+            datum_class, sensor_type, sensor_id = key
+            fields, aggregate_class = self._datum_classes[datum_class]
+
+            ## Tumbling windows pick up any stragglers from before the window too, rather than dropping them
+            timestamps_ns, values = window.select(start_ns if self.kind == WindowKind.SLIDING else -(2 ** 63), end_ns)
+            window.discard_before(discard_before_ns)
+            if (not len(timestamps_ns)):
+                continue
+
+            results = self._aggregate(values)
+            aggregate_values = {"window_seconds": float(self.window_seconds)}
+            for aggregate in self.aggregates:
+                for index, field in enumerate(fields):
+                    value = results[aggregate][index]
+                    if (aggregate == "count"):
+                        value = int(value)
+                    elif (np.isnan(value)):
+                        value = None
+                    else:
+                        value = float(value)
+                    aggregate_values[AggregateDatum.get_field_name(field, aggregate)] = value
+
+            aggregated_data.append(
+                aggregate_class(self._categories[key], sensor_type, sensor_id, end_ns, aggregate_values)
+            )
+
+        ## Stop tracking series that have gone quiet
+        for key in [key for key, window in self._windows.items() if window.size == 0]:
+            del self._windows[key]
+            del self._categories[key]
+
+        self.emitted_count += len(aggregated_data)
+        if (self.logger.isEnabledFor(logging.DEBUG)):
+            self.logger.debug("Emitted %d aggregate datum(s) for the window ending at %d", len(aggregated_data), end_ns)
+
+        return aggregated_data
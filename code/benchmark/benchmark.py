@@ -0,0 +1,308 @@
+import argparse
+import asyncio
+import datetime
+import functools
+import json
+import logging
+import platform
+import sys
+import time
+import tracemalloc
+from typing import Dict, List
+
+from sensor.sensor_executor import shutdown_sensor_executor
+from sensor.sensor_manager import SensorManager
+from sensor.sensor_recording import get_sensor_recording
+from sensor.sensors.replay.replay_driver import ReplaySensorDriver
+from sensor.sensors.synthetic.synthetic_driver import SyntheticDriver
+from storage.clients.influx.influx_stub_server import InfluxStubServer
+from storage.clients.influx.influxdb_client import InfluxDBClient
+from storage.clients.influx.line_protocol_encoder import LineProtocolEncoder
+from storage.clients.memory.memory_storage import MemoryStorage
+from storage.storage_manager import StorageManager
+from telemetry.histogram import Histogram
+from telemetry.pipeline_telemetry import PipelineTelemetry
+
+
+SINKS = ("memory", "influx")
+
+
+class BenchmarkScenario:
+    '''
+    One benchmark run: sensor_count synthetic sensors, all read concurrently through a SensorManager and handed off to
+    a StorageManager with a single sink, for the given number of back to back cycles. With a recording, every sensor in
+    it is replayed as fast as possible instead (reads_per_cycle recorded reads per sensor per cycle, looping if it runs
+    out), and sensor_count is ignored.
+    '''
+
+    def __init__(
+            self,
+            sensor_count: int,
+            sink: str = "memory",
+            cycles: int = 5,
+            latency_seconds: float = 0.01,
+            jitter_seconds: float = 0.005,
+            failure_rate: float = 0.0,
+            field_count: int = 4,
+            blocking: bool = False,
+            batch_size: int = 5000,
+            recording: str = None,
+            reads_per_cycle: int = 1
+    ):
+        if (sink not in SINKS):
+            raise ValueError(f"Unknown sink '{sink}', expected one of: {SINKS}")
+
+        self.sensor_count = sensor_count
+        self.sink = sink
+        self.cycles = cycles
+        self.latency_seconds = latency_seconds
+        self.jitter_seconds = jitter_seconds
+        self.failure_rate = failure_rate
+        self.field_count = field_count
+        self.blocking = blocking
+        self.batch_size = batch_size
+        self.recording = recording
+        self.reads_per_cycle = reads_per_cycle
+
+
+    def __str__(self) -> str:
+        return self.name
+
+    ## Properties
+
+    @property
+    def name(self) -> str:
+        if (self.recording is not None):
+            return f"{self.sink}-replay"
+
+        return f"{self.sink}-{self.sensor_count}"
+
+    ## Methods
+
+    def to_dict(self) -> Dict:
+        return {"name": self.name, **self.__dict__}
+
+
+class BenchmarkRunner:
+    '''
+    Runs benchmark scenarios and collects their results as JSON friendly dicts, covering cycle time, throughput, read
+    latency, line protocol encoding CPU time and memory usage.
+    '''
+
+    ## Generous, so that a benchmark never drops datums and under reports its own throughput
+    READ_TIMEOUT_SECONDS = 60.0
+
+    def __init__(self, trace_memory: bool = False):
+        self.trace_memory = trace_memory
+
+    ## Methods
+
+    def _build_storage(self, scenario: BenchmarkScenario, stub_server: InfluxStubServer):
+        if (scenario.sink == "influx"):
+            return functools.partial(InfluxDBClient, config_overrides={
+                "url": stub_server.url,
+                "organization": "benchmark",
+                "bucket": "benchmark",
+                "api_token": "benchmark"
+            })
+
+        return MemoryStorage
+
+
+    def _measure_encoding(self, data: List) -> Dict:
+        '''Measures the CPU time taken to encode and compress one cycle's worth of data into line protocol.'''
+
+        encoder = LineProtocolEncoder()
+        start = time.process_time()
+        compressed_bytes = sum(len(chunk) for chunk in encoder.iter_gzip(encoder.iter_lines(data, "benchmark", "benchmark")))
+        cpu_seconds = time.process_time() - start
+
+        return {
+            "encode_cpu_seconds_per_cycle": cpu_seconds,
+            "encode_datums_per_cpu_second": (len(data) / cpu_seconds) if cpu_seconds > 0 else None,
+            "encoded_bytes_per_cycle": compressed_bytes
+        }
+
+
+    async def _run_scenario(self, scenario: BenchmarkScenario) -> Dict:
+        stub_server = InfluxStubServer().start() if scenario.sink == "influx" else None
+
+        try:
+            sensor_manager = SensorManager(self.READ_TIMEOUT_SECONDS)
+            if (scenario.recording is not None):
+                driver = functools.partial(
+                    ReplaySensorDriver,
+                    path=scenario.recording,
+                    speed=0,
+                    max_reads_per_read=scenario.reads_per_cycle,
+                    loop=True,
+                    timestamps="recorded"
+                )
+                sensor_ids = [f"{sensor_type}:{sensor_id}" for sensor_type, sensor_id in get_sensor_recording(scenario.recording).sensors]
+            else:
+                driver = functools.partial(
+                    SyntheticDriver,
+                    latency_seconds=scenario.latency_seconds,
+                    jitter_seconds=scenario.jitter_seconds,
+                    failure_rate=scenario.failure_rate,
+                    field_count=scenario.field_count,
+                    blocking=scenario.blocking,
+                    seed=0
+                )
+                sensor_ids = [f"synthetic_{index}" for index in range(scenario.sensor_count)]
+            for sensor_id in sensor_ids:
+                sensor_manager.register_sensor(driver, sensor_id)
+
+            storage_manager = StorageManager("benchmark", "benchmark", writer_config={
+                "max_queue_size": max(10000, len(sensor_ids) * scenario.reads_per_cycle * scenario.cycles),
+                "batch_size": scenario.batch_size,
+                "batch_max_age_seconds": 0.1,
+                "overflow_policy": "block",
+                "max_retries": 0
+            })
+            storage_manager.register_storage(self._build_storage(scenario, stub_server), "sink")
+            writer = storage_manager.writers["sink"]
+            await storage_manager.start()
+
+            if (self.trace_memory):
+                tracemalloc.start()
+
+            read_latency = Histogram()
+            cycle_seconds = []
+            read_seconds = []
+            datum_count = 0
+            failed_read_count = 0
+            data = []
+
+            wall_start = time.perf_counter()
+            cpu_start = time.process_time()
+            for _ in range(scenario.cycles):
+                cycle_start = time.perf_counter()
+                results = await sensor_manager.read_sensors(sensor_manager.sensors)
+                read_seconds.append(time.perf_counter() - cycle_start)
+
+                data = [datum for result in results for datum in result.data]
+                await storage_manager.store(data)
+                cycle_seconds.append(time.perf_counter() - cycle_start)
+
+                datum_count += len(data)
+                for result in results:
+                    read_latency.observe(result.latency_seconds)
+                    if (not result.succeeded):
+                        failed_read_count += 1
+
+            ## Include flushing whatever's still queued, so throughput reflects what actually made it to the sink
+            await storage_manager.stop()
+            wall_seconds = time.perf_counter() - wall_start
+            cpu_seconds = time.process_time() - cpu_start
+
+            python_peak_bytes = None
+            if (self.trace_memory):
+                python_peak_bytes = tracemalloc.get_traced_memory()[1]
+                tracemalloc.stop()
+
+            resident_bytes, peak_resident_bytes = PipelineTelemetry.get_memory_usage()
+            cycle_histogram = Histogram()
+            for seconds in cycle_seconds:
+                cycle_histogram.observe(seconds)
+
+            return {
+                "scenario": scenario.to_dict(),
+                "results": {
+                    "wall_seconds": wall_seconds,
+                    "cpu_seconds": cpu_seconds,
+                    "cycle_seconds_mean": cycle_histogram.mean,
+                    "cycle_seconds_max": max(cycle_seconds),
+                    "read_seconds_mean": sum(read_seconds) / len(read_seconds),
+                    "read_latency_seconds": read_latency.to_dict(),
+                    "datums_read": datum_count,
+                    "datums_written": writer.written_count,
+                    "datums_dropped": writer.dropped_count,
+                    "failed_reads": failed_read_count,
+                    "datums_per_second": writer.written_count / wall_seconds,
+                    "write_latency_seconds": writer.write_latency_histogram.to_dict(),
+                    **self._measure_encoding(data),
+                    "rss_bytes": resident_bytes,
+                    "peak_rss_bytes": peak_resident_bytes,
+                    "python_peak_bytes": python_peak_bytes,
+                    "influx_stub": stub_server.get_stats() if stub_server is not None else None
+                }
+            }
+        finally:
+            if (stub_server is not None):
+                stub_server.stop()
+
+
+    def run(self, scenarios: List[BenchmarkScenario]) -> Dict:
+        results = []
+        try:
+            for scenario in scenarios:
+                print(f"Running {scenario}...", file=sys.stderr)
+                result = asyncio.run(self._run_scenario(scenario))
+                print(
+                    f"  {result['results']['datums_per_second']:.0f} datums/s, " +
+                    f"mean cycle: {result['results']['cycle_seconds_mean']:.3f}s",
+                    file=sys.stderr
+                )
+                results.append(result)
+        finally:
+            shutdown_sensor_executor()
+
+        return {
+            "started": datetime.datetime.now().isoformat(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "scenarios": results
+        }
+
+
+def main(args: List[str] = None):
+    parser = argparse.ArgumentParser(description="Benchmarks the sensor-stasher pipeline with synthetic sensors.")
+    parser.add_argument("--sensors", type=int, nargs="+", default=[10, 100, 1000, 10000], help="Sensor counts to run")
+    parser.add_argument("--sinks", nargs="+", choices=SINKS, default=list(SINKS), help="Sinks to write into")
+    parser.add_argument("--cycles", type=int, default=5, help="Polling cycles per scenario")
+    parser.add_argument("--latency-seconds", type=float, default=0.01, help="Mean synthetic read latency")
+    parser.add_argument("--jitter-seconds", type=float, default=0.005, help="Maximum deviation from the mean latency")
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="Probability of a read failing")
+    parser.add_argument("--field-count", type=int, default=4, help="Fields per synthetic datum")
+    parser.add_argument("--blocking", action="store_true", help="Sleep on the sensor executor instead of the event loop")
+    parser.add_argument("--batch-size", type=int, default=5000, help="Storage writer batch size")
+    parser.add_argument("--recording", help="Replay this sensor recording (relative to the recordings directory) instead of using synthetic sensors")
+    parser.add_argument("--reads-per-cycle", type=int, default=1, help="Recorded reads replayed per sensor per cycle")
+    parser.add_argument("--trace-memory", action="store_true", help="Track peak Python memory (slows the run down)")
+    parser.add_argument("--output", help="Write the JSON results to this file, rather than stdout")
+    parser.add_argument("--verbose", action="store_true", help="Keep the pipeline's own info and debug logging")
+    parsed = parser.parse_args(args)
+
+    ## Per read debug logging would dominate the results
+    if (not parsed.verbose):
+        logging.disable(logging.INFO)
+
+    scenarios = [
+        BenchmarkScenario(
+            sensor_count,
+            sink,
+            cycles=parsed.cycles,
+            latency_seconds=parsed.latency_seconds,
+            jitter_seconds=parsed.jitter_seconds,
+            failure_rate=parsed.failure_rate,
+            field_count=parsed.field_count,
+            blocking=parsed.blocking,
+            batch_size=parsed.batch_size,
+            recording=parsed.recording,
+            reads_per_cycle=parsed.reads_per_cycle
+        )
+        ## A recording has its own sensors, so there's only the one scenario per sink
+        for sink in parsed.sinks for sensor_count in (parsed.sensors if parsed.recording is None else [0])
+    ]
+
+    results = json.dumps(BenchmarkRunner(parsed.trace_memory).run(scenarios), indent=4)
+    if (parsed.output):
+        with open(parsed.output, "w") as output_file:
+            output_file.write(results)
+    else:
+        print(results)
+
+
+if (__name__ == '__main__'):
+    main()
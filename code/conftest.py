@@ -0,0 +1,12 @@
+import sys
+from pathlib import Path
+
+
+## The modules import each other relative to the code directory, so make it importable when pytest is run from the
+## repository root too
+CODE_PATH = str(Path(__file__).parent)
+if (CODE_PATH not in sys.path):
+    sys.path.insert(0, CODE_PATH)
+
+## The test sensor driver only matches pytest's test module pattern by name, it isn't a test suite
+collect_ignore = ["sensor/sensors/test_sensor"]
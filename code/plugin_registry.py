@@ -0,0 +1,110 @@
+import importlib
+import logging
+from enum import Enum
+from importlib.metadata import entry_points
+from typing import Dict, List, Tuple, Type, Union
+
+from utilities import initialize_logging
+
+
+class PluginKind(Enum):
+    SENSOR = "sensor"
+    STORAGE = "storage"
+
+
+## Plugins that ship with sensor-stasher, as 'module:ClassName' import paths. Nothing gets imported until it's used, so
+## hardware specific dependencies (smbus, pms7003, etc) are only needed on boards that actually enable those sensors.
+BUILTIN_PLUGINS: Dict[PluginKind, Dict[str, str]] = {
+    PluginKind.SENSOR: {
+        "DS18B20": "sensor.sensors.ds18b20.ds18b20_driver:DS18B20Driver",
+        "PMS7003": "sensor.sensors.pms7003.pms7003_driver:PMS7003Driver",
+        "Replay": "sensor.sensors.replay.replay_driver:ReplaySensorDriver",
+        "SHT31": "sensor.sensors.sht31.sht31_driver:SHT31Driver",
+        "Synthetic": "sensor.sensors.synthetic.synthetic_driver:SyntheticDriver",
+        "TestSensor": "sensor.sensors.test_sensor.test_sensor_driver:TestSensorDriver"
+    },
+    PluginKind.STORAGE: {
+        "Archive": "storage.clients.archive.archive_storage:ArchiveStorage",
+        "InfluxDB": "storage.clients.influx.influxdb_client:InfluxDBClient",
+        "Memory": "storage.clients.memory.memory_storage:MemoryStorage",
+        "Relay": "storage.clients.relay.relay_storage:RelayStorage"
+    }
+}
+
+## Third party packages can provide their own plugins by declaring entry points in these groups
+ENTRY_POINT_GROUPS: Dict[PluginKind, str] = {
+    PluginKind.SENSOR: "sensor_stasher.sensors",
+    PluginKind.STORAGE: "sensor_stasher.storage"
+}
+
+
+class PluginRegistry:
+    '''
+    Maps plugin names (as used in the config) to sensor and storage adapter classes. Plugins are only imported the
+    first time they're asked for, so startup time and memory scale with what's configured rather than what's installed.
+
+    Names are resolved from explicitly registered plugins first, then the built in plugins, and finally from any
+    installed entry points.
+    '''
+
+    def __init__(self):
+        self.logger = initialize_logging(logging.getLogger(__name__))
+
+        self._plugins: Dict[PluginKind, Dict[str, Union[str, type]]] = {
+            kind: dict(plugins) for kind, plugins in BUILTIN_PLUGINS.items()
+        }
+        self._loaded: Dict[Tuple[PluginKind, str], type] = {}
+        self._entry_points_discovered = set()
+
+    ## Methods
+
+    def register(self, kind: PluginKind, name: str, target: Union[str, type]):
+        '''Registers a plugin, either as a 'module:ClassName' import path, or as the class itself.'''
+
+        self._plugins[kind][name] = target
+        self._loaded.pop((kind, name), None)
+
+
+    def _discover_entry_points(self, kind: PluginKind):
+        ## Only the entry point metadata is read here, the modules themselves are still imported lazily
+        if (kind in self._entry_points_discovered):
+            return
+
+        self._entry_points_discovered.add(kind)
+        for entry_point in entry_points(group=ENTRY_POINT_GROUPS[kind]):
+            self._plugins[kind].setdefault(entry_point.name, entry_point.value)
+
+
+    def _import(self, target: str) -> type:
+        module_name, _, class_name = target.partition(":")
+        if (not module_name or not class_name):
+            raise ValueError(f"Plugin import paths must look like 'module.path:ClassName', not '{target}'")
+
+        module = importlib.import_module(module_name)
+
+        return getattr(module, class_name)
+
+
+    def get(self, kind: PluginKind, name: str) -> Type:
+        loaded = self._loaded.get((kind, name))
+        if (loaded is not None):
+            return loaded
+
+        if (name not in self._plugins[kind]):
+            self._discover_entry_points(kind)
+
+        target = self._plugins[kind].get(name)
+        if (target is None):
+            raise KeyError(f"Unknown {kind.value} plugin '{name}', available plugins are: {self.get_available(kind)}")
+
+        plugin = target if isinstance(target, type) else self._import(target)
+        self._loaded[(kind, name)] = plugin
+        self.logger.debug(f"Loaded {kind.value} plugin '{name}' from {target}")
+
+        return plugin
+
+
+    def get_available(self, kind: PluginKind) -> List[str]:
+        self._discover_entry_points(kind)
+
+        return sorted(self._plugins[kind].keys())
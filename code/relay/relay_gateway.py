@@ -0,0 +1,432 @@
+import asyncio
+import logging
+import random
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Set, Tuple
+
+from sensor.sensor_datum import SensorDatum
+from storage.storage_adapter import StorageAdapter
+from telemetry.prometheus import MetricFamily
+from utilities import ConfigSection, initialize_logging
+from .relay_protocol import (
+    FRAME_HEADER,
+    RelayAuthenticationError,
+    RelayProtocolError,
+    RelayStatus,
+    decode_frame_body,
+    decode_frame_header,
+    encode_ack
+)
+
+
+class RelayedBatch:
+    '''A batch of datums received from an edge stasher, waiting to be written upstream.'''
+
+    __slots__ = ("system", "data", "received", "future")
+
+    def __init__(self, system: Tuple[str, str], data: List[SensorDatum], future: asyncio.Future):
+        self.system = system
+        self.data = data
+        self.received = time.monotonic()
+        self.future = future
+
+
+class RelayGateway:
+    '''
+    Accepts batches of datums from any number of edge stashers (see RelayStorage), and coalesces them into a few large
+    writes to its own upstream storage adapters. Batches are flushed once flush_max_datums have built up, or once the
+    oldest has waited flush_interval_seconds, and every node's readings in a flush go upstream in a single
+    store_relayed() call per adapter.
+
+    Each edge only gets its ack once its batch has been written upstream, so the edges' own spools keep the data safe
+    until then. Backpressure is applied in two ways: a connection's next frame isn't read until its current one has
+    been acked, and once max_pending_datums are waiting to be written, new batches wait up to
+    backpressure_timeout_seconds for room before being turned away as BUSY (which the edge retries later).
+
+    Every upstream adapter gets its own writer thread, so the blocking writes never hold up the event loop.
+
+    Every frame has to be signed with the auth_token that's shared with the edges, and frames that aren't are answered
+    UNAUTHORIZED and their connection dropped, so that nobody else can write data upstream or pass it off as coming from
+    another system. The gateway only listens on localhost by default, so set host to the address (or '0.0.0.0' for all
+    addresses) that the edges can reach it on.
+
+    The gateway remembers the last frame's sequence in each edge's session, so a frame that an edge resends because its
+    ack was lost is just acked again (once the original's been written) rather than being written upstream twice.
+    '''
+
+    METRIC_PREFIX = "sensor_stasher_relay"
+    ## Edge sessions to remember the last frame of, with the least recently heard from ones being forgotten first
+    MAX_SESSIONS = 10000
+
+    def __init__(
+            self,
+            storages: Dict[str, StorageAdapter],
+            auth_token: str,
+            host: str = "127.0.0.1",
+            port: int = 7465,
+            flush_interval_seconds: float = 1.0,
+            flush_max_datums: int = 10000,
+            max_pending_datums: int = 100000,
+            backpressure_timeout_seconds: float = 5.0,
+            max_frame_bytes: int = 16 * 1024 * 1024,
+            max_retries: int = 3,
+            retry_base_delay_seconds: float = 1.0,
+            retry_max_delay_seconds: float = 30.0
+    ):
+        self.logger = initialize_logging(logging.getLogger(__name__))
+
+        if (not storages):
+            raise ValueError("A relay gateway needs at least one upstream storage adapter")
+        if (not auth_token):
+            raise ValueError("A relay gateway needs an auth_token to check its edges' frames with")
+
+        self.storages = storages
+        self.auth_token = auth_token
+        self.host = host
+        self.port = port
+        self.flush_interval_seconds = flush_interval_seconds
+        self.flush_max_datums = flush_max_datums
+        self.max_pending_datums = max(max_pending_datums, flush_max_datums)
+        self.backpressure_timeout_seconds = backpressure_timeout_seconds
+        self.max_frame_bytes = max_frame_bytes
+        self.max_retries = max_retries
+        self.retry_base_delay_seconds = retry_base_delay_seconds
+        self.retry_max_delay_seconds = retry_max_delay_seconds
+
+        self._server: Optional[asyncio.AbstractServer] = None
+        self._flusher: Optional[asyncio.Task] = None
+        self._pending: List[RelayedBatch] = []
+        self._unflushed_datum_count = 0
+        ## Datums that have been accepted but not yet acked, including the ones in the flush that's underway
+        self._pending_datum_count = 0
+        self._data_available: Optional[asyncio.Event] = None
+        self._space_available: Optional[asyncio.Event] = None
+        self._connections: Set[asyncio.Task] = set()
+        ## (system, session) -> (sequence, result) of the last frame received in each edge session
+        self._sessions: Dict[Tuple[Tuple[str, str], int], Tuple[int, asyncio.Future]] = OrderedDict()
+        self._stopping = False
+        self._executors = {
+            name: ThreadPoolExecutor(max_workers=1, thread_name_prefix=f"relay-{name}") for name in storages
+        }
+
+        ## Metrics
+        self.connection_count = 0
+        self.received_frame_count = 0
+        self.received_datum_count = 0
+        self.received_bytes = 0
+        self.busy_count = 0
+        self.invalid_frame_count = 0
+        self.unauthorized_frame_count = 0
+        self.duplicate_frame_count = 0
+        self.flush_count = 0
+        self.written_count = 0
+        self.failed_flush_count = 0
+        self.nodes: Set[Tuple[str, str]] = set()
+
+
+    @classmethod
+    def from_config(cls, storages: Dict[str, StorageAdapter], config: ConfigSection) -> 'RelayGateway':
+        return cls(
+            storages,
+            config.get_str('auth_token', required=True),
+            host=config.get_str('host', '127.0.0.1'),
+            port=config.get_int('port', 7465, minimum=0),
+            flush_interval_seconds=config.get_float('flush_interval_seconds', 1.0, minimum=0),
+            flush_max_datums=config.get_int('flush_max_datums', 10000, minimum=1),
+            max_pending_datums=config.get_int('max_pending_datums', 100000, minimum=1),
+            backpressure_timeout_seconds=config.get_float('backpressure_timeout_seconds', 5.0, minimum=0),
+            max_frame_bytes=config.get_int('max_frame_bytes', 16 * 1024 * 1024, minimum=1),
+            max_retries=config.get_int('max_retries', 3, minimum=0),
+            retry_base_delay_seconds=config.get_float('retry_base_delay_seconds', 1.0, minimum=0),
+            retry_max_delay_seconds=config.get_float('retry_max_delay_seconds', 30.0, minimum=0)
+        )
+
+    ## Properties
+
+    @property
+    def running(self) -> bool:
+        return (self._server is not None)
+
+
+    @property
+    def pending_datum_count(self) -> int:
+        return self._pending_datum_count
+
+    ## Methods
+
+    async def start(self):
+        if (self.running):
+            return
+
+        self._stopping = False
+        self._data_available = asyncio.Event()
+        self._space_available = asyncio.Event()
+        self._flusher = asyncio.create_task(self._flush_loop())
+        self._server = await asyncio.start_server(self._handle_connection, self.host, self.port)
+        self.logger.info("Relay gateway listening on %s:%s, writing to %s", self.host, self.port, ", ".join(self.storages))
+
+
+    async def stop(self):
+        '''Stops accepting connections, and flushes whatever's already been accepted.'''
+
+        if (not self.running):
+            return
+
+        ## Let the flusher finish any write that's underway and then write out whatever's left, so that the edges
+        ## waiting on those batches still get their acks before they're disconnected
+        self._server.close()
+        self._stopping = True
+        self._data_available.set()
+        await self._flusher
+        self._flusher = None
+
+        for task in list(self._connections):
+            task.cancel()
+        await asyncio.gather(*self._connections, return_exceptions=True)
+        await self._server.wait_closed()
+        self._server = None
+
+        for name, executor in self._executors.items():
+            executor.shutdown(wait=True)
+            self.storages[name].close()
+
+
+    async def _handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        task = asyncio.current_task()
+        self._connections.add(task)
+        self.connection_count += 1
+        peer = writer.get_extra_info('peername')
+
+        try:
+            while (True):
+                try:
+                    header = await reader.readexactly(FRAME_HEADER.size)
+                except asyncio.IncompleteReadError:
+                    return
+
+                try:
+                    flags, length, session, sequence, signature = decode_frame_header(header)
+                    if (length > self.max_frame_bytes):
+                        raise RelayProtocolError(f"Frame of {length} bytes is bigger than the {self.max_frame_bytes} byte limit")
+                except RelayProtocolError as e:
+                    ## The stream can't be trusted to be in sync anymore, so there's nothing to do but hang up
+                    self.invalid_frame_count += 1
+                    self.logger.warning("Dropping relay connection from %s. %s", peer, e)
+                    writer.write(encode_ack(RelayStatus.INVALID))
+                    await writer.drain()
+                    return
+
+                body = await reader.readexactly(length)
+                self.received_frame_count += 1
+                self.received_bytes += FRAME_HEADER.size + length
+
+                try:
+                    system, data = decode_frame_body(
+                        flags,
+                        session,
+                        sequence,
+                        body,
+                        signature,
+                        self.auth_token,
+                        self.max_frame_bytes
+                    )
+                except RelayAuthenticationError as e:
+                    self.unauthorized_frame_count += 1
+                    self.logger.warning("Dropping relay connection from %s. %s", peer, e)
+                    writer.write(encode_ack(RelayStatus.UNAUTHORIZED))
+                    await writer.drain()
+                    return
+                except RelayProtocolError as e:
+                    self.invalid_frame_count += 1
+                    self.logger.warning("Rejected an invalid relay frame from %s. %s", peer, e)
+                    status = RelayStatus.INVALID
+                else:
+                    status = await self._receive(system, session, sequence, data)
+
+                writer.write(encode_ack(status))
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            self._connections.discard(task)
+            self.connection_count -= 1
+            writer.close()
+
+
+    async def _receive(self, system: Tuple[str, str], session: int, sequence: int, data: List[SensorDatum]) -> RelayStatus:
+        key = (system, session)
+        last = self._sessions.get(key)
+        if (last is not None):
+            last_sequence, result = last
+            ## A stale resend from a connection that's since been replaced, and the edge has already moved on from it
+            if (sequence < last_sequence):
+                self.duplicate_frame_count += 1
+                return RelayStatus.OK
+
+            ## Edges only resend a frame when they didn't get its ack, so one that's already been (or is being) written
+            ## just gets acked again. A frame that failed or was turned away is taken as a fresh attempt.
+            if (sequence == last_sequence and (not result.done() or result.result() == RelayStatus.OK)):
+                self.duplicate_frame_count += 1
+                self.logger.debug("Acking a resent frame %d from %s without storing it again", sequence, system)
+                return await asyncio.shield(result)
+
+        result = asyncio.ensure_future(self._submit(system, data))
+        self._sessions[key] = (sequence, result)
+        self._sessions.move_to_end(key)
+        while (len(self._sessions) > self.MAX_SESSIONS):
+            self._sessions.popitem(last=False)
+
+        ## Shielded, so that the edge hanging up doesn't cancel the submission that a resend may be waiting on
+        return await asyncio.shield(result)
+
+
+    async def _submit(self, system: Tuple[str, str], data: List[SensorDatum]) -> RelayStatus:
+        if (not data):
+            return RelayStatus.OK
+        if (self._stopping):
+            return RelayStatus.BUSY
+
+        ## A batch that's bigger than the whole limit is still let in on its own, rather than being turned away forever
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.backpressure_timeout_seconds
+        while (self._pending_datum_count and self._pending_datum_count + len(data) > self.max_pending_datums):
+            timeout = deadline - loop.time()
+            if (timeout <= 0):
+                self.busy_count += 1
+                return RelayStatus.BUSY
+
+            self._space_available.clear()
+            try:
+                await asyncio.wait_for(self._space_available.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+        batch = RelayedBatch(system, data, loop.create_future())
+        self._pending.append(batch)
+        self._pending_datum_count += len(data)
+        self._unflushed_datum_count += len(data)
+        self.received_datum_count += len(data)
+        self.nodes.add(system)
+        self._data_available.set()
+
+        ## Shielded, so that the edge hanging up doesn't cancel the write its batch is part of
+        return await asyncio.shield(batch.future)
+
+
+    def _take_pending(self) -> List[RelayedBatch]:
+        batches = self._pending
+        self._pending = []
+        self._unflushed_datum_count = 0
+
+        return batches
+
+
+    async def _wait_for_flush(self):
+        '''Waits until there are either flush_max_datums pending, or the oldest pending batch has aged out.'''
+
+        while (not self._stopping):
+            if (self._unflushed_datum_count >= self.flush_max_datums):
+                return
+
+            if (self._pending):
+                timeout = self._pending[0].received + self.flush_interval_seconds - time.monotonic()
+                if (timeout <= 0):
+                    return
+            else:
+                timeout = None
+
+            self._data_available.clear()
+            try:
+                await asyncio.wait_for(self._data_available.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+
+    async def _flush_loop(self):
+        while (True):
+            await self._wait_for_flush()
+
+            if (not self._pending):
+                if (self._stopping):
+                    return
+                continue
+
+            await self._flush(self._take_pending())
+
+
+    async def _flush(self, batches: List[RelayedBatch]):
+        data_by_system: Dict[Tuple[str, str], List[SensorDatum]] = {}
+        for batch in batches:
+            data_by_system.setdefault(batch.system, []).extend(batch.data)
+        datum_count = sum(len(batch.data) for batch in batches)
+
+        start = time.perf_counter()
+        results = await asyncio.gather(*[
+            self._write(name, storage, data_by_system) for name, storage in self.storages.items()
+        ])
+        succeeded = all(results)
+
+        self.flush_count += 1
+        if (succeeded):
+            self.written_count += datum_count
+            self.logger.debug(
+                "Relayed %d datum(s) from %d node(s) upstream in %.3fs",
+                datum_count,
+                len(data_by_system),
+                time.perf_counter() - start
+            )
+        else:
+            self.failed_flush_count += 1
+
+        for batch in batches:
+            if (not batch.future.done()):
+                batch.future.set_result(RelayStatus.OK if succeeded else RelayStatus.ERROR)
+
+        self._pending_datum_count -= datum_count
+        self._space_available.set()
+
+
+    async def _write(self, name: str, storage: StorageAdapter, data_by_system: Dict[Tuple[str, str], List[SensorDatum]]) -> bool:
+        loop = asyncio.get_running_loop()
+
+        for attempt in range(self.max_retries + 1):
+            try:
+                await loop.run_in_executor(self._executors[name], storage.store_relayed, data_by_system)
+                return True
+            except Exception as e:
+                if (attempt >= self.max_retries):
+                    self.logger.exception("Giving up on relaying to %s after %d attempt(s)", name, attempt + 1, exc_info=e)
+                    return False
+
+                ## Exponential backoff with 'full jitter', the same as the storage writers
+                delay = random.uniform(0, min(self.retry_max_delay_seconds, self.retry_base_delay_seconds * (2 ** attempt)))
+                self.logger.warning("Failed to relay to %s, retrying in %.2f seconds. %s", name, delay, e)
+                await asyncio.sleep(delay)
+
+
+    def get_metric_families(self) -> List[MetricFamily]:
+        metrics = [
+            ("connections", MetricFamily.GAUGE, self.connection_count, "Open edge connections."),
+            ("nodes", MetricFamily.GAUGE, len(self.nodes), "Distinct edge systems that have relayed data."),
+            ("pending_datums", MetricFamily.GAUGE, self._pending_datum_count, "Datums accepted but not yet written upstream."),
+            ("received_frames_total", MetricFamily.COUNTER, self.received_frame_count, "Frames received from edges."),
+            ("received_datums_total", MetricFamily.COUNTER, self.received_datum_count, "Datums accepted from edges."),
+            ("received_bytes_total", MetricFamily.COUNTER, self.received_bytes, "Frame bytes received from edges."),
+            ("busy_total", MetricFamily.COUNTER, self.busy_count, "Frames turned away due to backpressure."),
+            ("invalid_frames_total", MetricFamily.COUNTER, self.invalid_frame_count, "Frames that couldn't be decoded."),
+            ("unauthorized_frames_total", MetricFamily.COUNTER, self.unauthorized_frame_count, "Frames without a valid signature."),
+            ("duplicate_frames_total", MetricFamily.COUNTER, self.duplicate_frame_count, "Resent frames that were already received."),
+            ("flushes_total", MetricFamily.COUNTER, self.flush_count, "Coalesced upstream flushes."),
+            ("failed_flushes_total", MetricFamily.COUNTER, self.failed_flush_count, "Upstream flushes given up on."),
+            ("written_datums_total", MetricFamily.COUNTER, self.written_count, "Datums written upstream.")
+        ]
+
+        families = []
+        for name, metric_type, value, help_text in metrics:
+            family = MetricFamily(f"{self.METRIC_PREFIX}_{name}", metric_type, help_text)
+            family.add_sample(value)
+            families.append(family)
+
+        return families
@@ -0,0 +1,157 @@
+import hashlib
+import hmac
+import struct
+import zlib
+from enum import IntEnum
+from typing import List, Sequence, Tuple
+
+from sensor.datum_codec import DatumCodec
+from sensor.sensor_datum import SensorDatum
+
+
+class RelayStatus(IntEnum):
+    ## The batch was written upstream
+    OK = 0
+    ## The gateway's too far behind to take the batch right now, so try again later
+    BUSY = 1
+    ## The batch couldn't be written upstream
+    ERROR = 2
+    ## The frame couldn't be decoded, so resending it won't help
+    INVALID = 3
+    ## The frame wasn't signed with the gateway's auth token
+    UNAUTHORIZED = 4
+
+
+class RelayProtocolError(ValueError):
+    pass
+
+
+class RelayAuthenticationError(RelayProtocolError):
+    pass
+
+
+## Framing for batches of datums sent from edge stashers to a relay gateway over TCP. Each request is a single frame:
+##
+##     [magic "SR"][version: u8][flags: u8][body length: u32][session: u64][sequence: u64][signature: 32 bytes]
+##     [body, zlib compressed if flags has FLAG_ZLIB]
+##
+## The session is picked at random by each edge when it starts up, and the sequence counts up with every batch that the
+## edge sends in it. A batch that's resent because its ack never came back (ex: the connection dropped while the gateway
+## was writing it upstream) keeps its sequence, so the gateway can tell that it's already got it and just ack it again,
+## rather than writing its datums upstream twice.
+##
+## The signature is the HMAC-SHA256 of the header's first six fields and the body (as sent), keyed with the auth token
+## that's shared between the gateway and its edges. Frames that don't match are rejected before their body is even
+## decompressed, so that only edges holding the token can write data upstream, or claim to be any particular system.
+##
+## Where the (decompressed) body is:
+##
+##     [system type length: u16][utf-8 system type][system id length: u16][utf-8 system id][DatumCodec batch]
+##
+## The gateway answers each frame with an ack, [magic "SR"][status: u8], once the batch has been written upstream (or
+## couldn't be). Only one frame is in flight per connection at a time, so acks don't need to say which frame they're
+## for, and a slow gateway naturally slows down its edges.
+
+MAGIC = b"SR"
+VERSION = 3
+FLAG_ZLIB = 0x01
+
+FRAME_PREFIX = struct.Struct("<2sBBIQQ")
+FRAME_HEADER = struct.Struct("<2sBBIQQ32s")
+ACK = struct.Struct("<2sB")
+_STRING_LENGTH = struct.Struct("<H")
+
+
+def _sign(auth_token: str, flags: int, session: int, sequence: int, body: bytes) -> bytes:
+    message = FRAME_PREFIX.pack(MAGIC, VERSION, flags, len(body), session, sequence) + body
+
+    return hmac.new(auth_token.encode("utf-8"), message, hashlib.sha256).digest()
+
+
+def encode_frame(
+        system_type: str,
+        system_id: str,
+        data: Sequence[SensorDatum],
+        auth_token: str,
+        session: int,
+        sequence: int,
+        compression_level: int = 6
+) -> bytes:
+    parts = []
+    for value in (system_type, system_id):
+        encoded = value.encode("utf-8")
+        parts.append(_STRING_LENGTH.pack(len(encoded)))
+        parts.append(encoded)
+    parts.append(DatumCodec.encode(data))
+    body = b"".join(parts)
+
+    flags = 0
+    if (compression_level > 0):
+        body = zlib.compress(body, compression_level)
+        flags |= FLAG_ZLIB
+
+    signature = _sign(auth_token, flags, session, sequence, body)
+
+    return FRAME_HEADER.pack(MAGIC, VERSION, flags, len(body), session, sequence, signature) + body
+
+
+def decode_frame_header(header: bytes) -> Tuple[int, int, int, int, bytes]:
+    '''Returns the frame's (flags, body length, session, sequence, signature).'''
+
+    magic, version, flags, length, session, sequence, signature = FRAME_HEADER.unpack(header)
+    if (magic != MAGIC or version != VERSION):
+        raise RelayProtocolError(f"Not a version {VERSION} relay frame")
+
+    return (flags, length, session, sequence, signature)
+
+
+def decode_frame_body(
+        flags: int,
+        session: int,
+        sequence: int,
+        body: bytes,
+        signature: bytes,
+        auth_token: str,
+        max_body_bytes: int = None
+) -> Tuple[Tuple[str, str], List[SensorDatum]]:
+    '''Returns the frame's ((system type, system id), datums), once its signature has been checked.'''
+
+    if (not hmac.compare_digest(signature, _sign(auth_token, flags, session, sequence, body))):
+        raise RelayAuthenticationError("Relay frame isn't signed with the gateway's auth token")
+
+    try:
+        if (flags & FLAG_ZLIB):
+            ## Bounded, so that a tiny frame can't decompress into something enormous
+            decompressor = zlib.decompressobj()
+            body = decompressor.decompress(body, max_body_bytes or 0)
+            if (decompressor.unconsumed_tail):
+                raise RelayProtocolError(f"Frame decompresses to more than {max_body_bytes} bytes")
+
+        offset = 0
+        system = []
+        for _ in range(2):
+            length, = _STRING_LENGTH.unpack_from(body, offset)
+            offset += _STRING_LENGTH.size
+            system.append(str(body[offset:offset + length], "utf-8"))
+            offset += length
+
+        return (tuple(system), DatumCodec.decode(body[offset:]))
+    except RelayProtocolError:
+        raise
+    except (zlib.error, struct.error, ValueError, IndexError) as e:
+        raise RelayProtocolError(f"Unable to decode relay frame. {e}")
+
+
+def encode_ack(status: RelayStatus) -> bytes:
+    return ACK.pack(MAGIC, status)
+
+
+def decode_ack(ack: bytes) -> RelayStatus:
+    magic, status = ACK.unpack(ack)
+    if (magic != MAGIC):
+        raise RelayProtocolError("Not a relay ack")
+
+    try:
+        return RelayStatus(status)
+    except ValueError:
+        raise RelayProtocolError(f"Unknown relay status {status}")
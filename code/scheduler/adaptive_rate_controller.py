@@ -0,0 +1,237 @@
+import logging
+import math
+from typing import Dict, List, Optional, Tuple
+
+from sensor.datum_batch import DatumBatch
+from sensor.sensor_datum import SensorDatum
+from utilities import ConfigSection, initialize_logging
+
+
+class FieldState:
+    '''Smoothed mean and trend (the mean's rate of change) of a single numeric field, and its readings' variance around them.'''
+
+    __slots__ = ("mean", "variance", "slope", "count", "last_timestamp_ns")
+
+    def __init__(self, value: float, timestamp_ns: int):
+        self.mean = value
+        self.variance = 0.0
+        ## Per second
+        self.slope = 0.0
+        self.count = 1
+        self.last_timestamp_ns = timestamp_ns
+
+
+class AdaptiveRateController:
+    '''
+    Picks a sensor's polling interval from how much its readings are moving. Every numeric field (or just the given
+    fields) is tracked with an exponentially weighted moving average and its trend (Holt's linear smoothing), along with
+    the variance of the readings around that trend. A field is moving when its trend would carry the average further
+    than the tolerance within one interval, or when a reading jumps away from where the trend predicted it'd be by more
+    than the tolerance. The tolerance is relative_tolerance * |mean| + absolute_tolerance (the smallest change that's
+    worth spending a read on), widened by noise_multiplier standard deviations so that noise alone never counts as
+    movement, however noisy the sensor is.
+
+    Intervals are kept on a ladder of min_interval_seconds * backoff_factor^n (capped at max_interval_seconds), so that
+    aligned sensors keep sharing wall clock boundaries. Whenever a field moves, the interval drops straight down to the
+    rung that'd bring it back within the tolerance. Once every field has stayed calm for backoff_after_reads reads in
+    a row (with a trend that'd still be within the tolerance at the next rung up), the interval climbs one rung. Flat
+    signals therefore back off exponentially, and a moving signal is sampled as often as its changes need (within the
+    bounds).
+    '''
+
+    ## Reads a field needs before its noise is known well enough to judge whether it's moving
+    WARMUP_READS = 3
+
+    def __init__(
+            self,
+            initial_interval_seconds: float,
+            min_interval_seconds: float = None,
+            max_interval_seconds: float = None,
+            relative_tolerance: float = 0.01,
+            absolute_tolerance: float = 0.1,
+            ewma_alpha: float = 0.3,
+            backoff_factor: float = 2.0,
+            backoff_after_reads: int = 3,
+            noise_multiplier: float = 3.0,
+            fields: List[str] = None
+    ):
+        self.logger = initialize_logging(logging.getLogger(__name__))
+
+        ## Without explicit bounds, the configured interval can be sped up or slowed down by a few rungs either way
+        self.min_interval_seconds = float(min_interval_seconds or initial_interval_seconds / 4)
+        self.max_interval_seconds = float(max_interval_seconds or initial_interval_seconds * 8)
+        if (self.min_interval_seconds <= 0 or self.max_interval_seconds < self.min_interval_seconds):
+            raise ValueError(
+                f"Expected 0 < min_interval_seconds <= max_interval_seconds, not {self.min_interval_seconds} and {self.max_interval_seconds}"
+            )
+        if (not 0 < ewma_alpha <= 1):
+            raise ValueError(f"ewma_alpha must be greater than 0 and at most 1, not {ewma_alpha}")
+        if (backoff_factor <= 1):
+            raise ValueError(f"backoff_factor must be greater than 1, not {backoff_factor}")
+
+        self.relative_tolerance = relative_tolerance
+        self.absolute_tolerance = absolute_tolerance
+        self.ewma_alpha = ewma_alpha
+        self.backoff_factor = backoff_factor
+        self.backoff_after_reads = max(1, backoff_after_reads)
+        self.noise_multiplier = noise_multiplier
+        self.fields = set(fields) if fields else None
+
+        self.intervals = self._build_intervals()
+        self.level = self._get_level(initial_interval_seconds)
+        self._calm_reads = 0
+        self._fields: Dict[Tuple[str, str], FieldState] = {}
+
+        ## Metrics
+        self.speed_up_count = 0
+        self.backoff_count = 0
+
+
+    def __str__(self) -> str:
+        return f"every {self.interval_seconds}s (between {self.min_interval_seconds}s and {self.max_interval_seconds}s)"
+
+
+    @classmethod
+    def from_config(cls, config: ConfigSection, initial_interval_seconds: float) -> 'AdaptiveRateController':
+        return cls(
+            initial_interval_seconds,
+            config.get_float('min_interval_seconds', minimum=0),
+            config.get_float('max_interval_seconds', minimum=0),
+            config.get_float('relative_tolerance', 0.01, minimum=0),
+            config.get_float('absolute_tolerance', 0.1, minimum=0),
+            config.get_float('ewma_alpha', 0.3, minimum=0),
+            config.get_float('backoff_factor', 2.0, minimum=1),
+            config.get_int('backoff_after_reads', 3, minimum=1),
+            config.get_float('noise_multiplier', 3.0, minimum=0),
+            config.get('fields') or None
+        )
+
+    ## Properties
+
+    @property
+    def interval_seconds(self) -> float:
+        return self.intervals[self.level]
+
+    ## Methods
+
+    def _build_intervals(self) -> List[float]:
+        intervals = []
+        interval = self.min_interval_seconds
+        while (interval < self.max_interval_seconds):
+            intervals.append(interval)
+            interval *= self.backoff_factor
+        intervals.append(self.max_interval_seconds)
+
+        return intervals
+
+
+    def _get_level(self, interval_seconds: float) -> int:
+        '''The highest rung that's no longer than the given interval, or the bottom rung if they all are.'''
+
+        level = 0
+        for index, interval in enumerate(self.intervals):
+            if (interval <= interval_seconds):
+                level = index
+
+        return level
+
+
+    def _observe_field(self, key: Tuple[str, str], value: float, timestamp_ns: int) -> Optional[Tuple[float, float]]:
+        '''
+        Updates the field's stats, and returns how much it's moving as (trend, jump) multiples of its tolerance, where
+        anything at or above 1 needs a faster interval. Returns None while the field's still warming up.
+        '''
+
+        state = self._fields.get(key)
+        if (state is None):
+            self._fields[key] = FieldState(value, timestamp_ns)
+            return None
+
+        ## Judged against the trend's prediction from before this reading, so that a jump can't widen its own tolerance,
+        ## and so that a steady trend doesn't get mistaken for noise
+        elapsed_seconds = max(timestamp_ns - state.last_timestamp_ns, 0) / 1_000_000_000
+        predicted = state.mean + state.slope * elapsed_seconds
+        residual = value - predicted
+        tolerance = (
+            self.relative_tolerance * abs(predicted) +
+            self.absolute_tolerance +
+            self.noise_multiplier * math.sqrt(state.variance)
+        )
+
+        ## Holt's linear smoothing for the mean and its trend, with the exponentially weighted variance of the residuals
+        alpha = self.ewma_alpha
+        state.mean = predicted + alpha * residual
+        state.variance = (1 - alpha) * (state.variance + alpha * residual * residual)
+        if (elapsed_seconds > 0):
+            state.slope += alpha * alpha * residual / elapsed_seconds
+        state.last_timestamp_ns = timestamp_ns
+        state.count += 1
+
+        if (state.count <= self.WARMUP_READS):
+            return None
+
+        ## The trend is scaled to the current interval, since that's how far it'll carry the mean before the next read
+        trend = abs(state.slope) * self.interval_seconds
+        if (tolerance <= 0):
+            return (math.inf if trend > 0 else 0.0, math.inf if residual != 0 else 0.0)
+
+        return (trend / tolerance, abs(residual) / tolerance)
+
+
+    def observe(self, data: List[SensorDatum]) -> float:
+        '''Updates the controller with a read's datums, and returns the interval that the sensor should be polled at.'''
+
+        if (not data):
+            return self.interval_seconds
+
+        trend = None
+        jump = 0.0
+        for datum in data:
+            for field in datum.schema:
+                if (self.fields is not None and field not in self.fields):
+                    continue
+                ## Checked by value rather than by schema, since replayed datums' schemas don't have their types
+                value = getattr(datum, field)
+                if (type(value) not in DatumBatch.NUMERIC_TYPES or (isinstance(value, float) and math.isnan(value))):
+                    continue
+
+                field_activity = self._observe_field((datum.sensor_id, field), float(value), datum.timestamp_ns)
+                if (field_activity is not None):
+                    trend = max(trend or 0.0, field_activity[0])
+                    jump = max(jump, field_activity[1])
+
+        ## Nothing to compare against yet, so there's no telling whether it's moving
+        if (trend is None and self._fields):
+            return self.interval_seconds
+        ## Sensors without any numeric fields to watch just back off
+        trend = trend or 0.0
+        activity = max(trend, jump)
+
+        if (activity >= 1):
+            self._calm_reads = 0
+            level = self._get_level(self.interval_seconds / activity) if math.isfinite(activity) else 0
+            if (level < self.level):
+                self.logger.debug(
+                    "Speeding up from every %ss to every %ss, trend: %.2f, jump: %.2f",
+                    self.interval_seconds,
+                    self.intervals[level],
+                    trend,
+                    jump
+                )
+                self.level = level
+                self.speed_up_count += 1
+        ## Only calm if the trend would still be within the tolerance at the next rung up, so the interval doesn't flap
+        ## between two of them
+        elif (trend * self.backoff_factor < 1):
+            self._calm_reads += 1
+            if (self._calm_reads >= self.backoff_after_reads and self.level < len(self.intervals) - 1):
+                self._calm_reads = 0
+                self.level += 1
+                self.backoff_count += 1
+                self.logger.debug(
+                    "Backing off to every %ss, trend: %.2f, jump: %.2f", self.interval_seconds, trend, jump
+                )
+        else:
+            self._calm_reads = 0
+
+        return self.interval_seconds
@@ -0,0 +1,59 @@
+from enum import Enum
+from typing import Dict
+
+
+class OverrunPolicy(Enum):
+    ## Drop any ticks that were missed while the previous read was still running, and resume on the next boundary
+    SKIP = "skip"
+    ## Run missed ticks back to back (up to max_catch_up_ticks of them), each stamped with its own nominal time
+    CATCH_UP = "catch_up"
+
+
+class SensorSchedule:
+    '''
+    Describes when a single sensor should be polled. Ticks fall on multiples of interval_seconds (shifted by
+    phase_offset_seconds), and when aligned to the wall clock those multiples are counted from the unix epoch so that
+    sensors with compatible intervals land on the exact same timestamps.
+    '''
+
+    def __init__(
+            self,
+            interval_seconds: float,
+            phase_offset_seconds: float = 0.0,
+            align_to_wall_clock: bool = True,
+            overrun_policy: OverrunPolicy = OverrunPolicy.SKIP,
+            max_catch_up_ticks: int = 3
+    ):
+        if (interval_seconds is None or interval_seconds <= 0):
+            raise ValueError(f"interval_seconds must be greater than 0, not {interval_seconds}")
+        if (max_catch_up_ticks < 0):
+            raise ValueError(f"max_catch_up_ticks must not be negative, not {max_catch_up_ticks}")
+
+        self.interval_seconds = float(interval_seconds)
+        self.phase_offset_seconds = float(phase_offset_seconds)
+        self.align_to_wall_clock = align_to_wall_clock
+        self.overrun_policy = overrun_policy
+        self.max_catch_up_ticks = max_catch_up_ticks
+
+
+    def __str__(self) -> str:
+        return (
+            f"every {self.interval_seconds}s (phase: {self.phase_offset_seconds}s, " +
+            f"aligned: {self.align_to_wall_clock}, overrun policy: {self.overrun_policy.value})"
+        )
+
+
+    @classmethod
+    def from_config(cls, config: Dict, defaults: Dict = None) -> 'SensorSchedule':
+        '''Builds a schedule from a config dictionary, falling back to the provided defaults for any missing keys.'''
+
+        merged = dict(defaults or {})
+        merged.update(config or {})
+
+        return cls(
+            interval_seconds=merged.get('interval_seconds'),
+            phase_offset_seconds=merged.get('phase_offset_seconds', 0.0),
+            align_to_wall_clock=merged.get('align_to_wall_clock', True),
+            overrun_policy=OverrunPolicy(merged.get('overrun_policy', OverrunPolicy.SKIP.value)),
+            max_catch_up_ticks=merged.get('max_catch_up_ticks', 3)
+        )
@@ -0,0 +1,239 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import math
+import time
+from typing import Awaitable, Callable, Dict, Hashable, List, Optional, Tuple
+
+from .sensor_schedule import OverrunPolicy, SensorSchedule
+
+from utilities import initialize_logging
+
+
+class ScheduledJob:
+    '''
+    Bookkeeping for one scheduled key. Tick times are always computed from the tick index rather than by accumulating
+    intervals, so no amount of uptime or slow reads will let the schedule drift. The interval starts out as the
+    schedule's, but can be changed while the job runs (see SensorScheduler.set_interval).
+    '''
+
+    def __init__(self, key: Hashable, schedule: SensorSchedule, base_wall_time: float):
+        self.key = key
+        self.schedule = schedule
+        self.base_wall_time = base_wall_time
+        self.tick = 0
+        self.interval_seconds = schedule.interval_seconds
+        ## Applied when the job moves on to its next tick, since the current tick's deadline might already be queued
+        self.pending_interval_seconds: Optional[float] = None
+
+        ## Stats
+        self.runs = 0
+        self.overruns = 0
+        self.skipped_ticks = 0
+        self.last_slip_seconds = 0.0
+        self.last_duration_seconds = 0.0
+        self.interval_changes = 0
+
+
+    def __str__(self) -> str:
+        return (
+            f"{self.key}: {self.runs} runs, {self.overruns} overruns, {self.skipped_ticks} skipped ticks, " +
+            f"last slip: {self.last_slip_seconds:.3f}s, last duration: {self.last_duration_seconds:.3f}s"
+        )
+
+
+    def get_wall_time(self, tick: int = None) -> float:
+        '''The nominal wall clock time (unix seconds) of the given tick, defaulting to the current one.'''
+
+        return self.base_wall_time + (self.tick if tick is None else tick) * self.interval_seconds
+
+
+class SensorScheduler:
+    '''
+    Timer heap that fires each registered key on its own schedule. Deadlines are tracked on the monotonic clock (so
+    wall clock adjustments can't make ticks fire twice or stall), while each tick is labelled with its nominal wall
+    clock time so that readings taken on the same boundary share a timestamp.
+
+    Every due key is dispatched in its own task, so a slow sensor only ever delays itself.
+    '''
+
+    ## Deadlines this close to now are treated as already due, rather than sleeping for a fraction of a millisecond
+    DEADLINE_TOLERANCE_SECONDS = 0.001
+
+    def __init__(self, monotonic_clock: Callable[[], float] = time.monotonic, wall_clock: Callable[[], float] = time.time):
+        self.logger = initialize_logging(logging.getLogger(__name__))
+
+        self._monotonic_clock = monotonic_clock
+        self._wall_clock = wall_clock
+        ## Converts nominal wall clock times into monotonic deadlines. Captured once so that every job shares it.
+        self._monotonic_offset = self._monotonic_clock() - self._wall_clock()
+
+        self.jobs: Dict[Hashable, ScheduledJob] = {}
+        self._heap: List[Tuple[float, int, ScheduledJob]] = []
+        self._sequence = itertools.count()
+        self._wakeup: Optional[asyncio.Event] = None
+        self._tasks = set()
+
+    ## Methods
+
+    def _get_deadline(self, job: ScheduledJob, tick: int = None) -> float:
+        return job.get_wall_time(tick) + self._monotonic_offset
+
+
+    def _push(self, job: ScheduledJob):
+        heapq.heappush(self._heap, (self._get_deadline(job), next(self._sequence), job))
+
+        if (self._wakeup is not None):
+            self._wakeup.set()
+
+
+    def add(self, key: Hashable, schedule: SensorSchedule) -> ScheduledJob:
+        if (key in self.jobs):
+            raise ValueError(f"'{key}' has already been scheduled")
+
+        interval = schedule.interval_seconds
+        phase = schedule.phase_offset_seconds
+        now = self._wall_clock()
+
+        if (schedule.align_to_wall_clock):
+            ## First boundary (counted from the epoch, shifted by the phase) at or after now
+            base_wall_time = phase + math.ceil((now - phase) / interval) * interval
+        else:
+            base_wall_time = now + phase
+
+        job = ScheduledJob(key, schedule, base_wall_time)
+        self.jobs[key] = job
+        self._push(job)
+
+        self.logger.debug(f"Scheduled '{key}' {schedule}, first tick at: {base_wall_time}")
+
+        return job
+
+
+    def set_interval(self, key: Hashable, interval_seconds: float):
+        '''
+        Changes how often an already scheduled key fires, starting from the tick after its current one. Aligned jobs
+        move on to the new interval's wall clock boundaries, and unaligned ones just wait the new interval.
+        '''
+
+        if (interval_seconds is None or interval_seconds <= 0):
+            raise ValueError(f"interval_seconds must be greater than 0, not {interval_seconds}")
+
+        job = self.jobs[key]
+        if (interval_seconds == job.interval_seconds):
+            job.pending_interval_seconds = None
+        else:
+            job.pending_interval_seconds = float(interval_seconds)
+
+
+    def _rebase(self, job: ScheduledJob, interval_seconds: float):
+        '''Restarts the job's tick count from its current tick, so that the ticks after it use the new interval.'''
+
+        current_wall_time = job.get_wall_time()
+        phase = job.schedule.phase_offset_seconds
+
+        if (job.schedule.align_to_wall_clock):
+            ## Last boundary of the new interval at or before the current tick, so that tick 1 is the first one after it.
+            ## The nudge keeps float fuzz from putting a tick that's right on a boundary just before it.
+            base_wall_time = phase + math.floor((current_wall_time - phase) / interval_seconds + 1e-9) * interval_seconds
+        else:
+            base_wall_time = current_wall_time
+
+        self.logger.debug(f"Rescheduling '{job.key}' from every {job.interval_seconds}s to every {interval_seconds}s")
+
+        job.base_wall_time = base_wall_time
+        job.tick = 0
+        job.interval_seconds = interval_seconds
+        job.interval_changes += 1
+
+
+    def _pop_due_jobs(self) -> List[ScheduledJob]:
+        due_jobs: List[ScheduledJob] = []
+        cutoff = self._monotonic_clock() + self.DEADLINE_TOLERANCE_SECONDS
+
+        while (self._heap and self._heap[0][0] <= cutoff):
+            _, _, job = heapq.heappop(self._heap)
+            due_jobs.append(job)
+
+        return due_jobs
+
+
+    def _advance(self, job: ScheduledJob):
+        '''Moves the job on to its next tick, applying its overrun policy if it has fallen behind.'''
+
+        if (job.pending_interval_seconds is not None):
+            self._rebase(job, job.pending_interval_seconds)
+            job.pending_interval_seconds = None
+
+        now = self._monotonic_clock()
+        schedule = job.schedule
+        next_tick = job.tick + 1
+
+        if (self._get_deadline(job, next_tick) < now):
+            job.overruns += 1
+
+            ## Index of the first tick that's still in the future
+            current_tick = math.ceil((now - self._monotonic_offset - job.base_wall_time) / job.interval_seconds)
+
+            if (schedule.overrun_policy == OverrunPolicy.SKIP):
+                target_tick = current_tick
+            else:
+                target_tick = max(next_tick, current_tick - schedule.max_catch_up_ticks)
+
+            job.skipped_ticks += target_tick - next_tick
+            next_tick = target_tick
+
+        job.tick = next_tick
+        self._push(job)
+
+
+    async def _run_job(self, dispatch: Callable[[Hashable, float], Awaitable], job: ScheduledJob):
+        ## Round off any float fuzz so that jobs on the same boundary get exactly the same timestamp
+        wall_time = round(job.get_wall_time(), 6)
+        start = self._monotonic_clock()
+        job.last_slip_seconds = start - self._get_deadline(job)
+
+        try:
+            await dispatch(job.key, wall_time)
+        except Exception as e:
+            self.logger.exception("Error while dispatching scheduled tick at %s for '%s'", wall_time, job.key, exc_info=e)
+        finally:
+            job.runs += 1
+            job.last_duration_seconds = self._monotonic_clock() - start
+            self._advance(job)
+
+
+    async def _wait_for_next_deadline(self):
+        if (not self._heap):
+            await self._wakeup.wait()
+        else:
+            delay = self._heap[0][0] - self._monotonic_clock()
+            if (delay > 0):
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), delay)
+                except asyncio.TimeoutError:
+                    pass
+
+        self._wakeup.clear()
+
+
+    async def run(self, dispatch: Callable[[Hashable, float], Awaitable]):
+        '''
+        Runs forever, calling dispatch(key, nominal_wall_time) whenever a key comes due.
+        '''
+
+        self._wakeup = asyncio.Event()
+
+        try:
+            while (True):
+                await self._wait_for_next_deadline()
+
+                for job in self._pop_due_jobs():
+                    task = asyncio.create_task(self._run_job(dispatch, job))
+                    self._tasks.add(task)
+                    task.add_done_callback(self._tasks.discard)
+        finally:
+            for task in list(self._tasks):
+                task.cancel()
+            self._wakeup = None
@@ -0,0 +1,109 @@
+import math
+from array import array
+from typing import Dict, Iterable, Iterator, List, Tuple, Type, Union
+
+from sensor.sensor_datum import SensorDatum
+
+
+class DatumBatch:
+    '''
+    Columnar container for many readings of the same datum class and sensor type. Timestamps and numeric fields are
+    kept in contiguous typed arrays (missing numeric values are stored as NaN), and any other fields are kept in plain
+    lists. This avoids a Python object per reading, and lets storage adapters work on whole columns at once.
+    '''
+
+    NUMERIC_TYPES = (float, int)
+
+    def __init__(self, datum_class: Type[SensorDatum], category: str, sensor_type: str):
+        self.datum_class = datum_class
+        self.category = category
+        self.sensor_type = sensor_type
+
+        self.sensor_ids: List[str] = []
+        self.timestamps_ns = array('q')
+        self.columns: Dict[str, Union[array, List]] = {
+            name: array('d') if field_type in self.NUMERIC_TYPES else []
+            for name, field_type in datum_class.schema.items()
+        }
+
+
+    def __len__(self) -> int:
+        return len(self.timestamps_ns)
+
+
+    def __iter__(self) -> Iterator[SensorDatum]:
+        return iter(self.to_datums())
+
+
+    def __str__(self) -> str:
+        return f"{self.datum_class.__name__} batch of {len(self)} {self.sensor_type} reading(s)"
+
+    ## Properties
+
+    @property
+    def key(self) -> Tuple[Type[SensorDatum], str]:
+        return (self.datum_class, self.sensor_type)
+
+    ## Methods
+
+    @staticmethod
+    def get_key(datum: SensorDatum) -> Tuple[Type[SensorDatum], str]:
+        return (type(datum), datum.sensor_type)
+
+
+    @classmethod
+    def from_data(cls, data: Iterable[SensorDatum]) -> List['DatumBatch']:
+        '''Groups the data into one batch per datum class and sensor type, preserving the order of the readings.'''
+
+        batches: Dict[Tuple[Type[SensorDatum], str], DatumBatch] = {}
+        for datum in data:
+            key = cls.get_key(datum)
+            batch = batches.get(key)
+            if (batch is None):
+                batch = cls(type(datum), datum.category, datum.sensor_type)
+                batches[key] = batch
+
+            batch.append(datum)
+
+        return list(batches.values())
+
+
+    def append(self, datum: SensorDatum):
+        if (self.get_key(datum) != self.key):
+            raise ValueError(f"Can't add a {type(datum).__name__} from a {datum.sensor_type} sensor to a {self}")
+
+        self.sensor_ids.append(datum.sensor_id)
+        self.timestamps_ns.append(datum.timestamp_ns)
+        for name, column in self.columns.items():
+            value = getattr(datum, name)
+            if (isinstance(column, array)):
+                column.append(math.nan if value is None else value)
+            else:
+                column.append(value)
+
+
+    def get_value(self, name: str, index: int):
+        '''Gets a single field value, converting it back from its columnar representation.'''
+
+        value = self.columns[name][index]
+        if (isinstance(value, float) and math.isnan(value)):
+            return None
+        if (self.datum_class.schema[name] is int):
+            return int(value)
+
+        return value
+
+
+    def to_datums(self) -> List[SensorDatum]:
+        datums = []
+        for index in range(len(self)):
+            datum = self.datum_class.__new__(self.datum_class)
+            datum.category = self.category
+            datum.sensor_type = self.sensor_type
+            datum.sensor_id = self.sensor_ids[index]
+            datum.timestamp_ns = self.timestamps_ns[index]
+            for name in self.columns:
+                setattr(datum, name, self.get_value(name, index))
+            datums.append(datum)
+
+        return datums
@@ -13,3 +13,4 @@ class DatumCategory(Enum):
     SOUND = "sound"
     LOCATION = "location"
     TEST = "test"
+    SYSTEM = "system"
@@ -0,0 +1,196 @@
+import struct
+from typing import Dict, List, Sequence, Tuple, Type
+
+from .sensor_datum import SensorDatum
+
+
+class DatumCodec:
+    '''
+    Compact binary encoding for batches of SensorDatums, for moving them between processes (or hosts) without the
+    overhead of pickling or JSON.
+
+    Every string in a batch (class names, field names, categories, sensor types and ids, and string values) is stored
+    once in a string table, and everything else refers to it by index. Likewise each datum class's field names are
+    stored once (along with their schema types, as value tags), so a datum itself is just its class, metadata
+    references, timestamp and tagged field values:
+
+        [magic "SD"][version: u8]
+        [string count: u32] { [length: u32][utf-8 bytes] } ...
+        [class count: u32] { [name: str][field count: u16] { [field name: str][field type tag: u8] } ... } ...
+        [datum count: u32] { [class: u32][category: str][sensor type: str][sensor id: str][timestamp ns: i64]
+                             { [tag: u8][value] } ... } ...
+
+    Where each str is a u32 string table index. Integers and values are little endian. Decoded datums are rebuilt as
+    their original class if it's loaded in the decoding process, or as a generic stand in with the same fields (and
+    field types) if not. Version 1 batches (without field types) can still be decoded, but their stand ins are untyped.
+    '''
+
+    MAGIC = b"SD"
+    VERSION = 2
+    SUPPORTED_VERSIONS = (1, 2)
+
+    ## Field value tags
+    TAG_NONE = 0
+    TAG_FALSE = 1
+    TAG_TRUE = 2
+    TAG_INT = 3
+    TAG_FLOAT = 4
+    TAG_STR = 5
+
+    _HEADER = struct.Struct("<2sB")
+    _U16 = struct.Struct("<H")
+    _U32 = struct.Struct("<I")
+    _DATUM = struct.Struct("<IIIIq")
+    _TAG = struct.Struct("<B")
+    _TAGGED_INT = struct.Struct("<Bq")
+    _TAGGED_FLOAT = struct.Struct("<Bd")
+    _TAGGED_STR = struct.Struct("<BI")
+
+    ## Schema field types by the tag of the values that they hold. Booleans use the TRUE tag, and NONE is any other type.
+    _TYPE_TAGS: Dict[type, int] = {bool: TAG_TRUE, int: TAG_INT, float: TAG_FLOAT, str: TAG_STR}
+    _TAG_TYPES: Dict[int, type] = {tag: field_type for field_type, tag in _TYPE_TAGS.items()}
+
+    ## Methods
+
+    @staticmethod
+    def encode(data: Sequence[SensorDatum]) -> bytes:
+        strings: Dict[str, int] = {}
+        classes: Dict[Type[SensorDatum], Tuple[int, Tuple[str, ...]]] = {}
+
+        def get_string(value: str) -> int:
+            index = strings.get(value)
+            if (index is None):
+                index = len(strings)
+                strings[value] = index
+            return index
+
+        datum_parts = []
+        for datum in data:
+            datum_class = type(datum)
+            class_info = classes.get(datum_class)
+            if (class_info is None):
+                class_info = (len(classes), tuple(datum_class.schema))
+                classes[datum_class] = class_info
+            class_index, fields = class_info
+
+            datum_parts.append(DatumCodec._DATUM.pack(
+                class_index,
+                get_string(datum.category),
+                get_string(datum.sensor_type),
+                get_string(datum.sensor_id),
+                datum.timestamp_ns
+            ))
+            for name in fields:
+                value = getattr(datum, name)
+                ## bool has to be checked before int, since it's a subclass of it
+                if (value is None):
+                    datum_parts.append(DatumCodec._TAG.pack(DatumCodec.TAG_NONE))
+                elif (value is True or value is False):
+                    datum_parts.append(DatumCodec._TAG.pack(DatumCodec.TAG_TRUE if value else DatumCodec.TAG_FALSE))
+                elif (isinstance(value, int)):
+                    datum_parts.append(DatumCodec._TAGGED_INT.pack(DatumCodec.TAG_INT, value))
+                elif (isinstance(value, float)):
+                    datum_parts.append(DatumCodec._TAGGED_FLOAT.pack(DatumCodec.TAG_FLOAT, value))
+                elif (isinstance(value, str)):
+                    datum_parts.append(DatumCodec._TAGGED_STR.pack(DatumCodec.TAG_STR, get_string(value)))
+                else:
+                    raise TypeError(f"Can't encode {datum_class.__name__}.{name} of type {type(value).__name__}")
+
+        class_parts = [DatumCodec._U32.pack(len(classes))]
+        for datum_class, (_, fields) in classes.items():
+            class_parts.append(DatumCodec._U32.pack(get_string(datum_class.__name__)))
+            class_parts.append(DatumCodec._U16.pack(len(fields)))
+            for name in fields:
+                class_parts.append(DatumCodec._U32.pack(get_string(name)))
+                class_parts.append(DatumCodec._TAG.pack(DatumCodec._TYPE_TAGS.get(datum_class.schema[name], DatumCodec.TAG_NONE)))
+
+        ## The string table is only complete once everything else has been encoded, even though it goes first
+        string_parts = [DatumCodec._U32.pack(len(strings))]
+        for value in strings:
+            encoded = value.encode("utf-8")
+            string_parts.append(DatumCodec._U32.pack(len(encoded)))
+            string_parts.append(encoded)
+
+        return b"".join([
+            DatumCodec._HEADER.pack(DatumCodec.MAGIC, DatumCodec.VERSION),
+            *string_parts,
+            *class_parts,
+            DatumCodec._U32.pack(len(data)),
+            *datum_parts
+        ])
+
+
+    @staticmethod
+    def decode(payload: bytes) -> List[SensorDatum]:
+        buffer = memoryview(payload)
+        magic, version = DatumCodec._HEADER.unpack_from(buffer, 0)
+        if (magic != DatumCodec.MAGIC or version not in DatumCodec.SUPPORTED_VERSIONS):
+            raise ValueError(f"Not a supported datum batch (version {version})")
+        offset = DatumCodec._HEADER.size
+
+        def read_u32() -> int:
+            nonlocal offset
+            value, = DatumCodec._U32.unpack_from(buffer, offset)
+            offset += 4
+            return value
+
+        strings = []
+        for _ in range(read_u32()):
+            length = read_u32()
+            strings.append(str(buffer[offset:offset + length], "utf-8"))
+            offset += length
+
+        classes = []
+        for _ in range(read_u32()):
+            name = strings[read_u32()]
+            field_count, = DatumCodec._U16.unpack_from(buffer, offset)
+            offset += 2
+            schema = {}
+            for _ in range(field_count):
+                field = strings[read_u32()]
+                if (version >= 2):
+                    schema[field] = DatumCodec._TAG_TYPES.get(buffer[offset], object)
+                    offset += 1
+                else:
+                    schema[field] = object
+            ## The field order is the encoder's, which might not match a different version of the class here
+            classes.append((SensorDatum.get_datum_class(name, schema), list(schema)))
+
+        data = []
+        for _ in range(read_u32()):
+            class_index, category, sensor_type, sensor_id, timestamp_ns = DatumCodec._DATUM.unpack_from(buffer, offset)
+            offset += DatumCodec._DATUM.size
+            datum_class, fields = classes[class_index]
+
+            ## Skip __init__, since everything it would build is already in the payload
+            datum = datum_class.__new__(datum_class)
+            datum.category = strings[category]
+            datum.sensor_type = strings[sensor_type]
+            datum.sensor_id = strings[sensor_id]
+            datum.timestamp_ns = timestamp_ns
+
+            values = {}
+            for name in fields:
+                tag = buffer[offset]
+                offset += 1
+                if (tag == DatumCodec.TAG_NONE):
+                    value = None
+                elif (tag == DatumCodec.TAG_FALSE or tag == DatumCodec.TAG_TRUE):
+                    value = tag == DatumCodec.TAG_TRUE
+                elif (tag == DatumCodec.TAG_INT):
+                    value, = struct.unpack_from("<q", buffer, offset)
+                    offset += 8
+                elif (tag == DatumCodec.TAG_FLOAT):
+                    value, = struct.unpack_from("<d", buffer, offset)
+                    offset += 8
+                elif (tag == DatumCodec.TAG_STR):
+                    value = strings[read_u32()]
+                else:
+                    raise ValueError(f"Unknown value tag {tag}")
+                values[name] = value
+
+            for name in datum_class.schema:
+                setattr(datum, name, values.get(name))
+            data.append(datum)
+
+        return data
@@ -0,0 +1,205 @@
+import asyncio
+import logging
+import sys
+import threading
+import time
+from typing import Dict, List, Optional, Sequence
+
+## The recommended Raspberry Pi i2c library doesn't play nice with Windows
+if (sys.platform.startswith('linux')):
+    import smbus
+
+from .sensor_executor import get_sensor_executor
+from utilities import initialize_logging
+
+
+class I2CMeasurement:
+    '''A single measure-then-read exchange with a device, as queued up on an I2CBus.'''
+
+    __slots__ = ("address", "command", "conversion_seconds", "read_length", "read_register", "future", "result", "error")
+
+    def __init__(
+            self,
+            address: int,
+            command: Sequence[int],
+            conversion_seconds: float,
+            read_length: int,
+            read_register: int,
+            future: asyncio.Future
+    ):
+        self.address = address
+        self.command = command
+        self.conversion_seconds = conversion_seconds
+        self.read_length = read_length
+        self.read_register = read_register
+        self.future = future
+        self.result: Optional[List[int]] = None
+        self.error: Optional[Exception] = None
+
+
+class I2CBus:
+    '''
+    Owns the single SMBus handle for an i2c bus, and serializes every transaction on it with an asyncio lock.
+
+    Measurements are pipelined across devices: every measurement that's requested while the bus is busy (or within the
+    same event loop iteration) is batched up, so that the commands go out to every device first, then there's a single
+    wait for the longest conversion, and then every result gets read back. Ten sensors on the same bus then take about
+    as long to read as one does.
+    '''
+
+    def __init__(self, bus_number: int):
+        self.logger = initialize_logging(logging.getLogger(__name__))
+
+        self.bus_number = bus_number
+        self.name = f"i2c-{bus_number}"
+
+        self._smbus = None
+        self._lock: Optional[asyncio.Lock] = None
+        self._lock_loop: Optional[asyncio.AbstractEventLoop] = None
+        self._pending: List[I2CMeasurement] = []
+        self._batch_task: Optional[asyncio.Task] = None
+
+        ## Metrics
+        self.batch_count = 0
+        self.measurement_count = 0
+
+    ## Properties
+
+    @property
+    def smbus(self):
+        ## Opened on first use, so that nothing touches the bus until a sensor actually needs it
+        if (self._smbus is None):
+            self._smbus = smbus.SMBus(self.bus_number)
+
+        return self._smbus
+
+    ## Methods
+
+    def _get_lock(self) -> asyncio.Lock:
+        ## asyncio locks are bound to the loop they're first used on, so start fresh if the loop has been replaced
+        loop = asyncio.get_running_loop()
+        if (self._lock_loop is not loop):
+            self._lock = asyncio.Lock()
+            self._lock_loop = loop
+
+        return self._lock
+
+
+    async def _run_blocking(self, func, *args):
+        ## Tagged with the bus too, so that drivers still doing their own run_blocking(bus='i2c-N') calls don't collide
+        return await get_sensor_executor().run(func, *args, bus=self.name)
+
+
+    async def write(self, address: int, command: Sequence[int]):
+        '''Sends a command (its first byte, then the rest as data) to the device.'''
+
+        async with self._get_lock():
+            await self._run_blocking(self._write_command, address, command)
+
+
+    async def read(self, address: int, length: int, register: int = 0x00) -> List[int]:
+        async with self._get_lock():
+            return await self._run_blocking(self.smbus.read_i2c_block_data, address, register, length)
+
+
+    async def measure(
+            self,
+            address: int,
+            command: Sequence[int],
+            conversion_seconds: float,
+            read_length: int,
+            read_register: int = 0x00
+    ) -> List[int]:
+        '''
+        Sends the command to the device, waits conversion_seconds for it to take the measurement, and then reads back
+        read_length bytes. Concurrent measurements on the bus are batched together, see the class docstring.
+        '''
+
+        loop = asyncio.get_running_loop()
+        measurement = I2CMeasurement(address, command, conversion_seconds, read_length, read_register, loop.create_future())
+        self._pending.append(measurement)
+
+        if (self._batch_task is None or self._batch_task.done() or self._batch_task.get_loop() is not loop):
+            self._batch_task = loop.create_task(self._run_batches())
+
+        ## Shielded, so that one reader timing out doesn't leave the rest of its batch hanging
+        return await asyncio.shield(measurement.future)
+
+
+    async def _run_batches(self):
+        ## Give every other sensor that's reading on this tick a chance to join the first batch
+        await asyncio.sleep(0)
+
+        while (self._pending):
+            batch = self._pending
+            self._pending = []
+
+            try:
+                async with self._get_lock():
+                    await self._run_batch(batch)
+            except Exception as e:
+                for measurement in batch:
+                    if (measurement.error is None):
+                        measurement.error = e
+
+            for measurement in batch:
+                if (measurement.future.done()):
+                    continue
+                if (measurement.error is not None):
+                    measurement.future.set_exception(measurement.error)
+                else:
+                    measurement.future.set_result(measurement.result)
+
+
+    async def _run_batch(self, batch: List[I2CMeasurement]):
+        start = time.perf_counter()
+
+        await self._run_blocking(self._write_commands, batch)
+        conversion_seconds = max((measurement.conversion_seconds for measurement in batch if measurement.error is None), default=0)
+        if (conversion_seconds > 0):
+            await asyncio.sleep(conversion_seconds)
+        await self._run_blocking(self._read_results, batch)
+
+        self.batch_count += 1
+        self.measurement_count += len(batch)
+        if (self.logger.isEnabledFor(logging.DEBUG)):
+            self.logger.debug("Measured %d device(s) on %s in %.4fs", len(batch), self.name, time.perf_counter() - start)
+
+
+    def _write_command(self, address: int, command: Sequence[int]):
+        self.smbus.write_i2c_block_data(address, command[0], list(command[1:]))
+
+
+    def _write_commands(self, batch: List[I2CMeasurement]):
+        ## One device failing (ex: a NACK) shouldn't stop the rest of the batch
+        for measurement in batch:
+            try:
+                self._write_command(measurement.address, measurement.command)
+            except Exception as e:
+                measurement.error = e
+
+
+    def _read_results(self, batch: List[I2CMeasurement]):
+        for measurement in batch:
+            if (measurement.error is not None):
+                continue
+            try:
+                ## Futures aren't thread safe, so the result is only set on the future back on the event loop
+                measurement.result = self.smbus.read_i2c_block_data(measurement.address, measurement.read_register, measurement.read_length)
+            except Exception as e:
+                measurement.error = e
+
+
+_buses: Dict[int, I2CBus] = {}
+_buses_lock = threading.Lock()
+
+def get_i2c_bus(bus_number: int) -> I2CBus:
+    '''Returns the process-wide I2CBus for the given bus number, creating it on first use.'''
+
+    with _buses_lock:
+        bus = _buses.get(bus_number)
+        if (bus is None):
+            bus = I2CBus(bus_number)
+            _buses[bus_number] = bus
+
+    return bus
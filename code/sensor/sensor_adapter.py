@@ -1,14 +1,24 @@
 from abc import ABC, abstractmethod
-from typing import List
+from typing import Callable, List
 
 from .sensor_datum import SensorDatum
+from .sensor_executor import get_sensor_executor
+from utilities import ConfigError, ConfigSection
 
 
 class SensorAdapter(ABC):
+    ## Whether the pipeline should stamp this sensor's readings with the time of the tick that read them (which lines
+    ## up readings from sensors that share a tick), rather than keeping the timestamps that the sensor gave them
+    align_timestamps_to_tick = True
+
     @abstractmethod
     def __init__(self, sensor_id: str):
         pass
 
+
+    def __str__(self) -> str:
+        return f"{self.sensor_type} - {self.sensor_id}"
+
     ## Properties
 
     @property
@@ -24,6 +34,50 @@ class SensorAdapter(ABC):
 
     ## Methods
 
+    @classmethod
+    def discover_sensor_ids(cls) -> List[str]:
+        '''
+        Finds the ids of every sensor of this type that's attached, so that each can be registered as its own sensor.
+        Only supported by adapters for sensors that can be enumerated (ex: devices on a 1-Wire bus).
+        '''
+
+        raise NotImplementedError(f"{cls.__name__} doesn't support sensor discovery")
+
+
+    @classmethod
+    def get_configured_sensor_ids(cls, config: ConfigSection) -> List[str]:
+        '''
+        The ids of the sensors that a 'sensors' config entry registers. That's just the entry's 'id', or every attached
+        sensor if 'discover' is set.
+        '''
+
+        if (not config.get_bool('discover', False)):
+            return [config.get_str('id')]
+
+        try:
+            return cls.discover_sensor_ids()
+        except NotImplementedError as e:
+            raise ConfigError(f"{config.name} has 'discover' set, but {cls.__name__} doesn't support sensor discovery") from e
+
+
     @abstractmethod
     async def read(self) -> List[SensorDatum]:
         pass
+
+
+    async def close(self):
+        '''
+        Releases anything the driver holds onto between reads (background readers, open ports, etc). Called once when
+        the pipeline shuts down. Does nothing by default.
+        '''
+
+        pass
+
+
+    async def run_blocking(self, func: Callable, *args, bus: str = None, isolated: bool = False, **kwargs):
+        '''
+        Runs a blocking section of the driver (i2c transfers, sysfs reads, serial reads, etc) on the shared sensor
+        executor, keeping the event loop free for other sensors. Calls tagged with the same bus are serialized.
+        '''
+
+        return await get_sensor_executor().run(func, *args, bus=bus, isolated=isolated, **kwargs)
@@ -1,26 +1,113 @@
 import datetime
-from typing import Dict
+import time
+from typing import Dict, Iterable, Type, Union
 
 from sensor.datum_category import DatumCategory
 
 
 class SensorDatum:
-    def __init__(self, category: DatumCategory, sensor_type: str, sensor_id: str):
-        self.metadata = {
-            "sensor_type": sensor_type,
-            "sensor_id": sensor_id,
-            "category": category.value,
-            "timestamp": datetime.datetime.now().isoformat()
-        }
+    '''
+    A single reading from a sensor. Each datum class declares its fields in its schema (a field name to type mapping),
+    and stores them in __slots__ rather than a per-instance __dict__, ex:
+
+        class ExampleDatum(SensorDatum):
+            schema = {"temperature_celcius": float}
+            __slots__ = tuple(schema)
+
+    Timestamps are integer nanoseconds since the unix epoch (UTC).
+    '''
+
+    __slots__ = ("category", "sensor_type", "sensor_id", "timestamp_ns")
+
+    ## Field name -> field type, declared by each datum class
+    schema: Dict[str, type] = {}
+
+    ## All datum classes by name, so that serialized datums can be rebuilt as the correct type
+    registry: Dict[str, Type['SensorDatum']] = {}
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+
+        missing_slots = [name for name in cls.schema if not hasattr(cls, name)]
+        if (missing_slots):
+            raise TypeError(f"{cls.__name__} is missing __slots__ for its schema fields: {missing_slots}")
+
+        SensorDatum.registry[cls.__name__] = cls
+
+
+    def __init__(self, category: DatumCategory, sensor_type: str, sensor_id: str, timestamp_ns: int = None):
+        self.category: str = category.value
+        self.sensor_type = sensor_type
+        self.sensor_id = sensor_id
+        self.timestamp_ns: int = time.time_ns() if timestamp_ns is None else timestamp_ns
 
 
     def __str__(self) -> str:
-        return str(self.__dict__)
+        return str(self.to_record())
+
+    ## Properties
+
+    @property
+    def metadata(self) -> Dict:
+        return {
+            "sensor_type": self.sensor_type,
+            "sensor_id": self.sensor_id,
+            "category": self.category,
+            "timestamp": self.timestamp_ns
+        }
+
+    ## Methods
+
+    @staticmethod
+    def get_datum_class(name: str, fields: Union[Dict[str, type], Iterable[str]] = ()) -> Type['SensorDatum']:
+        '''
+        Gets the datum class with the given name. If it hasn't been defined (ex: its driver isn't loaded in this
+        process), then a generic class with the given fields is built in its place. Fields can be given as a schema
+        (a field name to type mapping), otherwise the stand in's fields are untyped, which means that anything that
+        picks out numeric fields by their schema type (aggregation, batching, etc) will skip them.
+        '''
+
+        datum_class = SensorDatum.registry.get(name)
+        if (datum_class is None):
+            schema = dict(fields) if isinstance(fields, dict) else {field: object for field in fields}
+            datum_class = type(name, (SensorDatum,), {"schema": schema, "__slots__": tuple(schema)})
+
+        return datum_class
 
 
     def to_dict(self) -> Dict:
-        output = self.__dict__.copy()
-        ## Don't expose the metadata in the output dict to be stored in the database
-        del output["metadata"]
+        ## Only the fields are exposed in the output dict to be stored in the database, not the metadata
+        return {name: getattr(self, name) for name in self.schema}
+
+
+    def to_record(self) -> Dict:
+        '''Serializes the datum into a JSON friendly dict, which can be turned back into a datum with from_record.'''
+
+        return {
+            "type": type(self).__name__,
+            "metadata": self.metadata,
+            "fields": self.to_dict()
+        }
+
+
+    @staticmethod
+    def from_record(record: Dict) -> 'SensorDatum':
+        fields = record["fields"]
+        metadata = record["metadata"]
+        ## Records don't hold the field types, so a stand in class's are taken from the values instead
+        schema = {name: type(value) if type(value) in (bool, int, float, str) else object for name, value in fields.items()}
+        datum_class = SensorDatum.get_datum_class(record["type"], schema)
+
+        ## Skip __init__, since everything it would build is already in the record
+        datum = datum_class.__new__(datum_class)
+        datum.category = metadata["category"]
+        datum.sensor_type = metadata["sensor_type"]
+        datum.sensor_id = metadata["sensor_id"]
+        datum.timestamp_ns = metadata["timestamp"]
+        if (isinstance(datum.timestamp_ns, str)):
+            ## Records spooled before timestamps were nanosecond integers hold naive, local ISO 8601 strings
+            datum.timestamp_ns = int(datetime.datetime.fromisoformat(datum.timestamp_ns).timestamp() * 1_000_000) * 1000
+        for name in datum_class.schema:
+            setattr(datum, name, fields.get(name))
 
-        return output
+        return datum
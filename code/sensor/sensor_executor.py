@@ -0,0 +1,135 @@
+import asyncio
+import logging
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from functools import partial
+from typing import Callable, Dict, Optional
+
+from utilities import load_config, initialize_logging
+
+
+class SensorExecutor:
+    '''
+    Shared, bounded pool for running blocking driver I/O (i2c transfers, sysfs reads, serial reads, sleeps) off of the
+    event loop, so that one sensor's wait doesn't freeze every other sensor.
+
+    Work can optionally be tagged with a bus name (ex: 'i2c-1'), in which case calls on the same bus are serialized
+    while calls on different buses still overlap. Isolated work runs in a separate process pool, which is useful for
+    misbehaving drivers, but requires the callable and its arguments to be picklable.
+    '''
+
+    def __init__(self, max_workers: int = 4, process_max_workers: int = 1, serialize_buses: bool = True):
+        self.logger = initialize_logging(logging.getLogger(__name__))
+
+        self.max_workers = max_workers
+        self.process_max_workers = process_max_workers
+        self.serialize_buses = serialize_buses
+
+        self._thread_pool = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="sensor-io")
+        self._process_pool: Optional[ProcessPoolExecutor] = None
+        self._bus_locks: Dict[str, asyncio.Lock] = {}
+        self._bus_locks_loop: Optional[asyncio.AbstractEventLoop] = None
+
+        self.logger.debug(f"Initialized SensorExecutor. max_workers: {self.max_workers}, process_max_workers: {self.process_max_workers}, serialize_buses: {self.serialize_buses}")
+
+    ## Properties
+
+    @property
+    def process_pool(self) -> ProcessPoolExecutor:
+        ## Spinning up worker processes is expensive, so only do it if something actually asks for isolation
+        if (self._process_pool is None):
+            self._process_pool = ProcessPoolExecutor(max_workers=self.process_max_workers)
+
+        return self._process_pool
+
+    ## Methods
+
+    def _get_bus_lock(self, bus: str) -> asyncio.Lock:
+        ## asyncio locks are bound to the loop they're first used on, so start fresh if the loop has been replaced
+        loop = asyncio.get_running_loop()
+        if (self._bus_locks_loop is not loop):
+            self._bus_locks = {}
+            self._bus_locks_loop = loop
+
+        lock = self._bus_locks.get(bus)
+        if (lock is None):
+            lock = asyncio.Lock()
+            self._bus_locks[bus] = lock
+
+        return lock
+
+
+    async def _submit(self, executor: Executor, call: Callable):
+        return await asyncio.wrap_future(executor.submit(call))
+
+
+    async def _submit_serialized(self, executor: Executor, call: Callable, lock: asyncio.Lock):
+        loop = asyncio.get_running_loop()
+
+        def release_lock(_):
+            try:
+                loop.call_soon_threadsafe(lock.release)
+            except RuntimeError:
+                ## The loop has already been closed, so there's nobody left to wait on the lock
+                pass
+
+        await lock.acquire()
+        try:
+            future = executor.submit(call)
+        except Exception:
+            lock.release()
+            raise
+
+        ## Release the bus only once the blocking call has actually finished. If the caller gets cancelled (ex: by a
+        ## read timeout) while the call is already running, the bus stays held until the hardware is done with it.
+        future.add_done_callback(release_lock)
+
+        return await asyncio.wrap_future(future)
+
+
+    async def run(self, func: Callable, *args, bus: str = None, isolated: bool = False, **kwargs):
+        '''
+        Runs the blocking callable in the appropriate pool and returns its result.
+        :param bus: Optional name of the bus that this call uses, calls on the same bus will be serialized.
+        :param isolated: Whether or not to run the call in the process pool instead of the thread pool.
+        '''
+
+        call = partial(func, *args, **kwargs)
+        executor = self.process_pool if isolated else self._thread_pool
+
+        if (bus is not None and self.serialize_buses):
+            return await self._submit_serialized(executor, call, self._get_bus_lock(bus))
+        else:
+            return await self._submit(executor, call)
+
+
+    def shutdown(self, wait: bool = True):
+        self._thread_pool.shutdown(wait=wait, cancel_futures=True)
+        if (self._process_pool is not None):
+            self._process_pool.shutdown(wait=wait, cancel_futures=True)
+            self._process_pool = None
+
+
+_sensor_executor: Optional[SensorExecutor] = None
+
+def get_sensor_executor() -> SensorExecutor:
+    '''Returns the process-wide SensorExecutor, building it from the root config on first use.'''
+
+    global _sensor_executor
+
+    if (_sensor_executor is None):
+        config = load_config()
+        _sensor_executor = SensorExecutor(
+            max_workers=config.get_int('sensor_executor_max_workers', 4, minimum=1),
+            process_max_workers=config.get_int('sensor_executor_process_max_workers', 1, minimum=1),
+            serialize_buses=config.get_bool('sensor_executor_serialize_buses', True)
+        )
+
+    return _sensor_executor
+
+
+def shutdown_sensor_executor(wait: bool = True):
+    global _sensor_executor
+
+    if (_sensor_executor is not None):
+        _sensor_executor.shutdown(wait=wait)
+        _sensor_executor = None
@@ -1,44 +1,130 @@
+import asyncio
 import logging
-from typing import List, Set
+import time
+from typing import TYPE_CHECKING, Dict, List, Optional
 
 from .sensor_adapter import SensorAdapter
 from .sensor_datum import SensorDatum
-
+from .sensor_read_result import SensorReadResult
 from utilities import initialize_logging
 
+## Only needed for the annotations, so that recording's dependencies aren't loaded unless it's enabled
+if TYPE_CHECKING:
+    from .sensor_recording import SensorRecorder
+
 
 class SensorManager:
-    def __init__(self):
+    def __init__(self, read_timeout_seconds: Optional[float] = None, recorder: Optional['SensorRecorder'] = None):
         self.logger = initialize_logging(logging.getLogger(__name__))
 
-        self.sensors: Set[SensorAdapter] = set()
+        self.read_timeout_seconds = read_timeout_seconds
+        ## Gets every read's result (successful or not) as it completes, for replaying later
+        self.recorder = recorder
 
+        ## Kept as a list (rather than a set) so that results always come back in registration order
+        self.sensors: List[SensorAdapter] = []
+        self._read_timeouts: Dict[SensorAdapter, Optional[float]] = {}
+        self.last_read_results: List[SensorReadResult] = []
 
-    def register_sensor(self, sensor: SensorAdapter, sensor_id: str):
-        self.sensors.add(sensor(sensor_id))
 
+    def register_sensor(self, sensor: SensorAdapter, sensor_id: str, read_timeout_seconds: Optional[float] = None):
+        '''
+        Instantiates and registers a sensor. The optional read_timeout_seconds overrides the manager's default timeout
+        for this sensor only, which is handy for slow sensors like the PMS7003 that need to spin up before reading.
+        '''
 
-    async def accumulate_all_sensor_data(self) -> List[SensorDatum]:
-        sensor_data = []
+        return self.add_sensor(sensor(sensor_id), read_timeout_seconds)
+
+
+    def add_sensor(self, sensor_instance: SensorAdapter, read_timeout_seconds: Optional[float] = None) -> SensorAdapter:
+        '''Registers an already instantiated sensor (ex: a proxy for a sensor running in a worker process).'''
+
+        self.sensors.append(sensor_instance)
+        self._read_timeouts[sensor_instance] = read_timeout_seconds
+
+        return sensor_instance
 
-        sensor: SensorAdapter
-        for sensor in self.sensors:
+
+    def get_read_timeout_seconds(self, sensor: SensorAdapter) -> Optional[float]:
+        timeout = self._read_timeouts.get(sensor)
+
+        return timeout if timeout is not None else self.read_timeout_seconds
+
+
+    async def _read_sensor(self, sensor: SensorAdapter) -> SensorReadResult:
+        result = SensorReadResult(sensor.sensor_type, sensor.sensor_id)
+        timeout = self.get_read_timeout_seconds(sensor)
+
+        start = time.perf_counter()
+        try:
+            ## wait_for cancels the read on timeout, so a hung sensor doesn't leave work running in the background
+            data = await asyncio.wait_for(sensor.read(), timeout)
+        except asyncio.TimeoutError:
+            result.timed_out = True
+            self.logger.error("Timed out after %s seconds reading from sensor type: '%s' with id: '%s'", timeout, sensor.sensor_type, sensor.sensor_id)
+            data = None
+        except Exception as e:
+            ## Don't let a single failed sensor read stop the rest
+            result.error = e
+            self.logger.exception("Unable to read from sensor type: '%s' with id: '%s'", sensor.sensor_type, sensor.sensor_id, exc_info=e)
             data = None
+        finally:
+            result.latency_seconds = time.perf_counter() - start
+
+        if (data is not None):
+            if (isinstance(data, list)):
+                result.data = data
+            elif (isinstance(data, SensorDatum)):
+                result.data = [data]
+            if (self.logger.isEnabledFor(logging.DEBUG)):
+                self.logger.debug(
+                    "Read from %s sensor with id: '%s' in %.3fs: %s",
+                    sensor.sensor_type,
+                    sensor.sensor_id,
+                    result.latency_seconds,
+                    [datum.to_dict() for datum in result.data]
+                )
+        elif (result.succeeded):
+            self.logger.warning("No data read from sensor type: '%s' with id: '%s'", sensor.sensor_type, sensor.sensor_id)
+
+        if (self.recorder is not None):
             try:
-                data = await sensor.read()
+                self.recorder.record(result)
             except Exception as e:
-                ## Don't let a single failed sensor read stop the rest
-                self.logger.exception(f"Unable to read from sensor type: '{sensor.sensor_type}' with id: '{sensor.sensor_id}'", exc_info=e)
-                continue
-
-            if (data is not None):
-                if (isinstance(data, list)):
-                    sensor_data.extend(data)
-                    self.logger.debug(f"Read from {sensor.sensor_type} sensor with id: '{sensor.sensor_id}': {[datum.to_dict() for datum in data]}")
-                elif (isinstance(data, SensorDatum)):
-                    sensor_data.append(data)
-                    self.logger.debug(f"Read from {sensor.sensor_type} sensor with id: '{sensor.sensor_id}': {data.to_dict()}")
-            else:
-                self.logger.warning(f"No data read from sensor type: '{sensor.sensor_type}' with id: '{sensor.sensor_id}'")
+                ## Losing the recording shouldn't mean losing the readings too
+                self.logger.exception("Unable to record the read from sensor type: '%s' with id: '%s'", sensor.sensor_type, sensor.sensor_id, exc_info=e)
+
+        return result
+
+
+    async def read_sensors(self, sensors: List[SensorAdapter]) -> List[SensorReadResult]:
+        '''
+        Reads from all of the given sensors concurrently, so a polling cycle only takes as long as its slowest sensor.
+        Results are returned in the same order as the provided sensors.
+        '''
+
+        results = await asyncio.gather(*[self._read_sensor(sensor) for sensor in sensors])
+        self.last_read_results = list(results)
+
+        return self.last_read_results
+
+
+    async def accumulate_all_sensor_data(self) -> List[SensorDatum]:
+        sensor_data = []
+
+        for result in await self.read_sensors(self.sensors):
+            sensor_data.extend(result.data)
 
         return sensor_data
+
+
+    async def close(self):
+        '''Closes every registered sensor, carrying on past any that fail to close cleanly.'''
+
+        results = await asyncio.gather(*[sensor.close() for sensor in self.sensors], return_exceptions=True)
+        for sensor, result in zip(self.sensors, results):
+            if (isinstance(result, Exception)):
+                self.logger.error("Unable to close sensor type: '%s' with id: '%s'", sensor.sensor_type, sensor.sensor_id, exc_info=result)
+
+        if (self.recorder is not None):
+            self.recorder.close()
@@ -0,0 +1,32 @@
+from typing import List, Optional
+
+from .sensor_datum import SensorDatum
+
+
+class SensorReadResult:
+    '''
+    Outcome of a single sensor read during a polling cycle, used to report on per-sensor latency and failures without
+    having to dig through the logs.
+    '''
+
+    def __init__(self, sensor_type: str, sensor_id: str):
+        self.sensor_type = sensor_type
+        self.sensor_id = sensor_id
+        self.data: List[SensorDatum] = []
+        self.latency_seconds: float = 0.0
+        self.timed_out: bool = False
+        self.error: Optional[BaseException] = None
+
+
+    def __str__(self) -> str:
+        return (
+            f"{self.sensor_type} - {self.sensor_id}: {len(self.data)} datum(s) in {self.latency_seconds:.3f}s" +
+            (", timed out" if self.timed_out else "") +
+            (f", error: {self.error}" if self.error is not None else "")
+        )
+
+    ## Properties
+
+    @property
+    def succeeded(self) -> bool:
+        return (not self.timed_out and self.error is None)
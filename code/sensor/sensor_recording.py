@@ -0,0 +1,283 @@
+import logging
+import mmap
+import os
+import struct
+import threading
+import time
+import zlib
+from datetime import datetime
+from enum import IntEnum
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from .datum_codec import DatumCodec
+from .sensor_datum import SensorDatum
+from .sensor_read_result import SensorReadResult
+from utilities import get_root_path, initialize_logging
+
+
+class ReadStatus(IntEnum):
+    SUCCEEDED = 0
+    FAILED = 1
+    TIMED_OUT = 2
+
+
+## A recording is a file header followed by one record per sensor read, each framed like the spool's records (with its
+## length and a CRC32) so that a torn final record (ex: from losing power mid-append) is detected and ignored:
+##
+##     [magic "SREC"][version: u8]
+##     { [payload length: u32][payload crc32: u32][payload] } ...
+##
+## Where each payload is:
+##
+##     [read wall time ns: i64][latency seconds: f64][status: u8]
+##     [sensor type: u16 length + utf-8][sensor id: u16 length + utf-8][error: u16 length + utf-8]
+##     [DatumCodec batch, only if the read returned any data]
+FILE_HEADER = struct.Struct("<4sB")
+FILE_MAGIC = b"SREC"
+FILE_VERSION = 1
+RECORD_HEADER = struct.Struct("<II")
+READ_HEADER = struct.Struct("<qdB")
+_STRING_LENGTH = struct.Struct("<H")
+
+
+class RecordedRead:
+    '''
+    A single sensor read from a recording. Only the position of its datums in the memory mapped recording is kept, and
+    they're decoded when they're asked for.
+    '''
+
+    __slots__ = ("time_ns", "latency_seconds", "status", "sensor_type", "sensor_id", "error", "_source", "_data_offset", "_data_length")
+
+    def __init__(
+            self,
+            time_ns: int,
+            latency_seconds: float,
+            status: int,
+            sensor_type: str,
+            sensor_id: str,
+            error: str,
+            source: mmap.mmap,
+            data_offset: int,
+            data_length: int
+    ):
+        self.time_ns = time_ns
+        self.latency_seconds = latency_seconds
+        self.status = status
+        self.sensor_type = sensor_type
+        self.sensor_id = sensor_id
+        self.error = error
+        self._source = source
+        self._data_offset = data_offset
+        self._data_length = data_length
+
+    ## Methods
+
+    def decode_data(self) -> List[SensorDatum]:
+        if (not self._data_length):
+            return []
+
+        return DatumCodec.decode(self._source[self._data_offset:self._data_offset + self._data_length])
+
+
+class SensorRecorder:
+    '''
+    Streams every sensor read that goes through a SensorManager (its raw datums, when it happened, how long it took, and
+    whether it failed) to a compact, append-only recording file, which ReplaySensorDriver can play back later.
+
+    Records are appended on the event loop as reads complete, so they go through a buffered file that's only flushed
+    every flush_interval_seconds.
+    '''
+
+    FILE_SUFFIX = ".rec"
+
+    def __init__(self, path: Path, flush_interval_seconds: float = 5.0):
+        self.logger = initialize_logging(logging.getLogger(__name__))
+
+        self.path = Path(path)
+        self.flush_interval_seconds = flush_interval_seconds
+
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._file = open(self.path, "ab")
+        if (self._file.tell() == 0):
+            self._file.write(FILE_HEADER.pack(FILE_MAGIC, FILE_VERSION))
+        self._last_flush = time.monotonic()
+
+        ## Metrics
+        self.recorded_count = 0
+        self.recorded_bytes = 0
+
+        self.logger.info("Recording sensor reads to '%s'", self.path)
+
+
+    @classmethod
+    def from_config(cls, config: Dict, default_directory: Path) -> 'SensorRecorder':
+        directory = config.get('path')
+        directory = Path(directory) if directory else default_directory
+        name = f"sensor-stasher-{datetime.now().strftime('%Y%m%d-%H%M%S')}{cls.FILE_SUFFIX}"
+
+        return cls(Path(directory, name), float(config.get('flush_interval_seconds', 5.0)))
+
+    ## Methods
+
+    @staticmethod
+    def _encode_string(value: str) -> bytes:
+        encoded = value.encode("utf-8")
+        if (len(encoded) > 0xFFFF):
+            ## Cut down to fit the length prefix, without leaving half of a character on the end
+            encoded = encoded[:0xFFFF].decode("utf-8", errors="ignore").encode("utf-8")
+
+        return _STRING_LENGTH.pack(len(encoded)) + encoded
+
+
+    def record(self, result: SensorReadResult, time_ns: int = None):
+        if (self._file is None):
+            return
+
+        if (result.timed_out):
+            status = ReadStatus.TIMED_OUT
+        elif (result.error is not None):
+            status = ReadStatus.FAILED
+        else:
+            status = ReadStatus.SUCCEEDED
+        ## Stamped with when the read started, so that replays are paced like the original reads were
+        time_ns = time_ns if time_ns is not None else time.time_ns() - round(result.latency_seconds * 1_000_000_000)
+
+        payload = b"".join([
+            READ_HEADER.pack(time_ns, result.latency_seconds, status),
+            self._encode_string(result.sensor_type),
+            self._encode_string(result.sensor_id),
+            self._encode_string("" if result.error is None else f"{type(result.error).__name__}: {result.error}"),
+            DatumCodec.encode(result.data) if result.data else b""
+        ])
+        self._file.write(RECORD_HEADER.pack(len(payload), zlib.crc32(payload)))
+        self._file.write(payload)
+        self.recorded_count += 1
+        self.recorded_bytes += RECORD_HEADER.size + len(payload)
+
+        if (time.monotonic() - self._last_flush >= self.flush_interval_seconds):
+            self.flush()
+
+
+    def flush(self):
+        if (self._file is not None):
+            self._file.flush()
+        self._last_flush = time.monotonic()
+
+
+    def close(self):
+        if (self._file is not None):
+            self._file.close()
+            self._file = None
+            self.logger.info("Recorded %d sensor read(s) (%d bytes) to '%s'", self.recorded_count, self.recorded_bytes, self.path)
+
+
+class SensorRecording:
+    '''
+    A recording made by a SensorRecorder, indexed by sensor. The file is memory mapped rather than read in, and loading
+    only parses each read's header, so a long recording doesn't have to fit in memory. The datums themselves are
+    decoded on demand, straight out of the map.
+    '''
+
+    def __init__(self, path: Path):
+        self.logger = initialize_logging(logging.getLogger(__name__))
+
+        self.path = Path(path)
+        self.reads: Dict[Tuple[str, str], List[RecordedRead]] = {}
+        self.start_time_ns: Optional[int] = None
+        self.end_time_ns: Optional[int] = None
+        self._map: Optional[mmap.mmap] = None
+
+        self._load()
+
+    ## Properties
+
+    @property
+    def duration_ns(self) -> int:
+        return (self.end_time_ns - self.start_time_ns) if self.start_time_ns is not None else 0
+
+
+    @property
+    def sensors(self) -> List[Tuple[str, str]]:
+        return list(self.reads)
+
+    ## Methods
+
+    def _load(self):
+        with open(self.path, "rb") as fd:
+            size = os.fstat(fd.fileno()).st_size
+            if (size < FILE_HEADER.size):
+                raise ValueError(f"'{self.path}' isn't a version {FILE_VERSION} sensor recording")
+            ## Only covers what's been recorded so far, if the recording's still being appended to
+            self._map = mmap.mmap(fd.fileno(), size, access=mmap.ACCESS_READ)
+
+        magic, version = FILE_HEADER.unpack_from(self._map, 0)
+        if (magic != FILE_MAGIC or version != FILE_VERSION):
+            raise ValueError(f"'{self.path}' isn't a version {FILE_VERSION} sensor recording")
+
+        ## Every read of a sensor shares the same type and id strings, rather than each having its own copies
+        names: Dict[str, str] = {}
+        data = memoryview(self._map)
+        offset = FILE_HEADER.size
+        while (offset + RECORD_HEADER.size <= size):
+            length, crc = RECORD_HEADER.unpack_from(data, offset)
+            payload_offset = offset + RECORD_HEADER.size
+            if (payload_offset + length > size or zlib.crc32(data[payload_offset:payload_offset + length]) != crc):
+                self.logger.warning("Found a torn or corrupt record in '%s' at offset %d, ignoring the rest of it", self.path, offset)
+                break
+            offset = payload_offset + length
+
+            time_ns, latency_seconds, status = READ_HEADER.unpack_from(data, payload_offset)
+            position = payload_offset + READ_HEADER.size
+            strings = []
+            for _ in range(3):
+                string_length, = _STRING_LENGTH.unpack_from(data, position)
+                position += _STRING_LENGTH.size
+                string = str(data[position:position + string_length], "utf-8")
+                strings.append(names.setdefault(string, string))
+                position += string_length
+            sensor_type, sensor_id, error = strings
+
+            read = RecordedRead(
+                time_ns,
+                latency_seconds,
+                status,
+                sensor_type,
+                sensor_id,
+                error or None,
+                self._map,
+                position,
+                offset - position
+            )
+            self.reads.setdefault((sensor_type, sensor_id), []).append(read)
+            self.start_time_ns = time_ns if self.start_time_ns is None else min(self.start_time_ns, time_ns)
+            self.end_time_ns = time_ns if self.end_time_ns is None else max(self.end_time_ns, time_ns)
+
+        ## Concurrent reads can finish (and so be recorded) out of order
+        for reads in self.reads.values():
+            reads.sort(key=lambda read: read.time_ns)
+
+
+_recordings: Dict[Path, SensorRecording] = {}
+_recordings_lock = threading.Lock()
+
+def resolve_recording_path(path: str) -> Path:
+    '''Relative paths are inside the recordings directory, which is where SensorRecorder writes by default.'''
+
+    return Path(get_root_path(), 'recordings', path)
+
+
+def get_sensor_recording(path: Path) -> SensorRecording:
+    '''
+    Returns the process-wide SensorRecording for the given file, loading it on first use. Relative paths are resolved
+    with resolve_recording_path().
+    '''
+
+    path = resolve_recording_path(path).resolve()
+    with _recordings_lock:
+        recording = _recordings.get(path)
+        if (recording is None):
+            recording = SensorRecording(path)
+            _recordings[path] = recording
+
+    return recording
@@ -5,6 +5,9 @@ from sensor.datum_category import DatumCategory
 
 
 class DS18B20Datum(SensorDatum):
+    schema = {"temperature_celcius": float}
+    __slots__ = tuple(schema)
+
     def __init__(self, sensor_type: str, sensor_id: str, measurement: Dict):
         super().__init__(DatumCategory.TEMPERATURE, sensor_type, sensor_id)
 
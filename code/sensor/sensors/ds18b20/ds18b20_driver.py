@@ -1,4 +1,3 @@
-import os
 import logging
 from pathlib import Path
 from typing import List
@@ -6,30 +5,40 @@ from typing import List
 from sensor.sensor_adapter import SensorAdapter
 from sensor.sensor_datum import SensorDatum
 from .ds18b20_datum import DS18B20Datum
+from .one_wire_bus import discover_device_ids, find_bus_masters, get_one_wire_bus, load_kernel_modules
 from utilities import load_config, initialize_logging
 
 class DS18B20Driver(SensorAdapter):
+    '''
+    Interface for the DS18B20 temperature sensor, over the kernel's 1-Wire interface.
+
+    The sensor id can be the id of the device on the bus (ex: 28-0316a2791eff), which is what discover_sensor_ids
+    provides. Otherwise, the device is found with the one_wire_device_path config instead. Reads are handed off to the
+    device's OneWireBus, so every DS18B20 on the bus converts at the same time.
+    '''
+
     def __init__(self, sensor_id: str):
         config = load_config(Path(__file__).parent)
         self.logger = initialize_logging(logging.getLogger(__name__))
 
+        ## Load relevant kernel modules for the sensor
+        load_kernel_modules(self.logger)
+
         ## Load config
-        self.one_wire_device_path = config.get('one_wire_device_path')
-        assert (self.one_wire_device_path is not None)
-        self.temperature_celcius_offset = config.get('temperature_celcius_offset', 0.0)
+        self.one_wire_master_path: str = config.get_str('one_wire_master_path', "/sys/bus/w1/devices/w1_bus_master*")
+        device_path = self._find_device_path(sensor_id)
+        self.one_wire_device_path = device_path / "w1_slave" if device_path is not None else config.get_str('one_wire_device_path', required=True)
+        self.temperature_celcius_offset = config.get_float('temperature_celcius_offset', 0.0)
 
+        self.device_id = self.one_wire_device_path.parent.name
         self._sensor_type = "DS18B20"
-        self._sensor_id = sensor_id or self.one_wire_device_path.parent.name or self.one_wire_device_path
-
-        ## Load relevant kernel modules for the sensor
-        os.system("modprobe w1-gpio")
-        os.system("modprobe w1-therm")
+        self._sensor_id = sensor_id or self.device_id or self.one_wire_device_path
 
-        ## Perform initial read to make sure the sensor is ready. Sometimes on startup the sensor will return 85 degrees
-        ## celcius, but will fix itself on the next read.
-        self.read_one_wire_device_temperature_celcius()
+        ## The device's directory links back into its bus master's directory
+        self.bus = get_one_wire_bus(self.one_wire_device_path.parent.resolve().parent)
+        self.bus.register(self.device_id)
 
-        self.logger.debug(f"Initialized {self.sensor_type} sensor. id: '{self.sensor_id}'")
+        self.logger.debug(f"Initialized {self.sensor_type} sensor. id: '{self.sensor_id}', device_id: '{self.device_id}', bus: '{self.bus.master_path}'")
 
     ## Properties
 
@@ -50,16 +59,18 @@ class DS18B20Driver(SensorAdapter):
 
     @one_wire_device_path.setter
     def one_wire_device_path(self, value):
-        if (type(value) is Path):
+        if (isinstance(value, Path)):
             self._one_wire_device_path = value
         elif (type(value) is str):
             if (value[0] == "/"):
-                try:
-                    ## todo: What happens if there are multiple one-wire devices? Is there a smart way to differentiate
-                    ## them programatically?
-                    self._one_wire_device_path = next(Path("/").glob(value[1:]))
-                except StopIteration:
+                ## Only the first match is used here. With more than one device on the bus, use discovery (or give
+                ## each sensor its device id) instead.
+                matches = sorted(Path("/").glob(value[1:]))
+                if (not matches):
                     raise ValueError(f"Could not find path for '{value}'")
+                if (len(matches) > 1):
+                    self.logger.warning("Found %d devices matching '%s', using '%s'", len(matches), value, matches[0])
+                self._one_wire_device_path = matches[0]
             else:
                 ## Can't glob off of a relative path, so just attempt to resolve it normally.
                 self._one_wire_device_path = Path(value)
@@ -68,8 +79,16 @@ class DS18B20Driver(SensorAdapter):
 
     ## Adapter methods
 
+    @classmethod
+    def discover_sensor_ids(cls) -> List[str]:
+        config = load_config(Path(__file__).parent)
+        load_kernel_modules(initialize_logging(logging.getLogger(__name__)))
+
+        return discover_device_ids(config.get_str('one_wire_master_path', "/sys/bus/w1/devices/w1_bus_master*"))
+
+
     async def read(self) -> List[SensorDatum]:
-        temperature_celcius = self.read_one_wire_device_temperature_celcius()
+        temperature_celcius = await self.bus.read_temperature_celcius(self.device_id)
 
         return [
             DS18B20Datum(self.sensor_type, self.sensor_id, {
@@ -79,7 +98,12 @@ class DS18B20Driver(SensorAdapter):
 
     ## Methods
 
-    def read_one_wire_device_temperature_celcius(self) -> float:
-        with open(self.one_wire_device_path, 'r') as device_file:
-            lines = device_file.readlines()
-            return float(lines[1].split("=")[1]) / 1000.0
+    def _find_device_path(self, device_id: str) -> Path:
+        if (not device_id):
+            return None
+
+        for master_path in find_bus_masters(self.one_wire_master_path):
+            if ((master_path / device_id).is_dir()):
+                return master_path / device_id
+
+        return None
@@ -0,0 +1,198 @@
+import asyncio
+import logging
+import subprocess
+import threading
+import time
+from pathlib import Path
+from typing import Dict, List, Optional, Set, Union
+
+from sensor.sensor_executor import get_sensor_executor
+from utilities import initialize_logging
+
+
+## 1-Wire family code of the DS18B20
+DS18B20_FAMILY_CODE = "28"
+
+_kernel_modules_loaded = False
+_kernel_modules_lock = threading.Lock()
+
+
+def load_kernel_modules(logger: logging.Logger = None):
+    '''
+    Loads the w1-gpio and w1-therm kernel modules with a single modprobe call, once per process no matter how many
+    DS18B20 sensors there are. Skipped entirely if w1-therm is already loaded.
+    '''
+
+    global _kernel_modules_loaded
+
+    with _kernel_modules_lock:
+        if (_kernel_modules_loaded):
+            return
+        _kernel_modules_loaded = True
+
+        if (Path("/sys/module/w1_therm").exists()):
+            return
+
+        try:
+            subprocess.run(["modprobe", "-a", "w1-gpio", "w1-therm"], check=True, capture_output=True, timeout=30)
+        except (OSError, subprocess.SubprocessError) as e:
+            ## Not necessarily fatal, the modules might be built into the kernel, or loaded some other way
+            if (logger is not None):
+                logger.warning("Unable to load the 1-Wire kernel modules: %s", e)
+
+
+def find_bus_masters(master_path_glob: str) -> List[Path]:
+    return sorted(Path("/").glob(master_path_glob.lstrip("/")))
+
+
+def discover_device_ids(master_path_glob: str, family_code: str = DS18B20_FAMILY_CODE) -> List[str]:
+    '''Gets the ids (ex: 28-0316a2791eff) of every device with the given family code, across all matching masters.'''
+
+    return sorted(
+        device_path.name for master_path in find_bus_masters(master_path_glob) for device_path in master_path.glob(f"{family_code}-*")
+    )
+
+
+class OneWireBus:
+    '''
+    Coordinates the temperature reads for every DS18B20 on a single 1-Wire bus master.
+
+    Reads that come in together (ex: sensors sharing a schedule) share a single conversion cycle, rather than each
+    waiting on their own ~750ms conversion. Where the kernel supports it, a cycle writes 'trigger' to the master's
+    therm_bulk_read file to have every device on the bus convert simultaneously, and then reads each device's
+    temperature file in parallel. Older kernels fall back to reading every w1_slave file in parallel, which still
+    overlaps the conversions since w1-therm releases the bus while waiting on them.
+    '''
+
+    ## How long a 12 bit conversion takes, and how often to check in on a bulk conversion after that
+    CONVERSION_SECONDS = 0.75
+    POLL_INTERVAL_SECONDS = 0.05
+    MAX_CONVERSION_SECONDS = 2.0
+
+    def __init__(self, master_path: Path):
+        self.logger = initialize_logging(logging.getLogger(__name__))
+
+        self.master_path = master_path
+        self.bus_name = f"w1-{master_path.name}"
+        self.bulk_read_path = master_path / "therm_bulk_read"
+        self.bulk_read_supported = self.bulk_read_path.exists()
+
+        ## Devices that have sensors registered, only these get read out after a conversion
+        self.device_ids: Set[str] = set()
+        self._cycle_task: Optional[asyncio.Task] = None
+        ## Sensors sometimes report their 85C power on value for the first conversion, so it gets thrown away
+        self._primed = False
+
+        self.logger.debug(f"Initialized OneWireBus. master: '{self.master_path}', bulk_read_supported: {self.bulk_read_supported}")
+
+    ## Methods
+
+    def register(self, device_id: str):
+        self.device_ids.add(device_id)
+
+
+    async def read_temperature_celcius(self, device_id: str) -> float:
+        '''Reads the device's temperature, joining the conversion cycle that's already in progress if there is one.'''
+
+        loop = asyncio.get_running_loop()
+        if (self._cycle_task is None or self._cycle_task.done() or self._cycle_task.get_loop() is not loop):
+            self._cycle_task = loop.create_task(self._run_cycle())
+
+        ## Shielded, so that one reader timing out doesn't cancel the cycle for everyone else
+        readings = await asyncio.shield(self._cycle_task)
+        reading = readings.get(device_id)
+        if (reading is None):
+            raise KeyError(f"Device '{device_id}' isn't registered on {self.master_path}")
+        if (isinstance(reading, Exception)):
+            raise reading
+
+        return reading
+
+
+    async def _run_cycle(self) -> Dict[str, Union[float, Exception]]:
+        if (not self._primed):
+            await self._convert_and_read()
+            self._primed = True
+
+        start = time.perf_counter()
+        readings = await self._convert_and_read()
+        if (self.logger.isEnabledFor(logging.DEBUG)):
+            self.logger.debug("Read %d device(s) on %s in %.3fs", len(readings), self.master_path, time.perf_counter() - start)
+
+        return readings
+
+
+    async def _convert_and_read(self) -> Dict[str, Union[float, Exception]]:
+        executor = get_sensor_executor()
+        device_ids = sorted(self.device_ids)
+
+        if (self.bulk_read_supported):
+            await executor.run(self._trigger_bulk_read, bus=self.bus_name)
+            await self._wait_for_bulk_read()
+            read = self._read_temperature_file
+        else:
+            read = self._read_w1_slave_file
+
+        ## The kernel serializes the actual bus transactions, so there's no need to serialize these on the bus too
+        readings = await asyncio.gather(*[executor.run(read, device_id) for device_id in device_ids], return_exceptions=True)
+
+        return dict(zip(device_ids, readings))
+
+
+    async def _wait_for_bulk_read(self):
+        executor = get_sensor_executor()
+        deadline = time.monotonic() + self.MAX_CONVERSION_SECONDS
+
+        await asyncio.sleep(self.CONVERSION_SECONDS)
+        ## -1 means that at least one device is still converting
+        while (await executor.run(self._read_bulk_read_status, bus=self.bus_name) == -1):
+            if (time.monotonic() >= deadline):
+                ## Reading the temperature files will wait on the stragglers anyway
+                self.logger.warning("Bulk conversion on %s is taking longer than %ss", self.master_path, self.MAX_CONVERSION_SECONDS)
+                break
+            await asyncio.sleep(self.POLL_INTERVAL_SECONDS)
+
+
+    def _trigger_bulk_read(self):
+        with open(self.bulk_read_path, 'w') as bulk_read_file:
+            bulk_read_file.write("trigger\n")
+
+
+    def _read_bulk_read_status(self) -> int:
+        with open(self.bulk_read_path, 'r') as bulk_read_file:
+            return int(bulk_read_file.read().strip())
+
+
+    def _read_temperature_file(self, device_id: str) -> float:
+        with open(self.master_path / device_id / "temperature", 'r') as temperature_file:
+            ## Reported in thousandths of a degree, and empty if the conversion never finished
+            value = temperature_file.read().strip()
+            if (not value):
+                raise ValueError(f"No temperature available for '{device_id}'")
+
+            return int(value) / 1000.0
+
+
+    def _read_w1_slave_file(self, device_id: str) -> float:
+        with open(self.master_path / device_id / "w1_slave", 'r') as device_file:
+            lines = device_file.readlines()
+            if (len(lines) < 2 or not lines[0].strip().endswith("YES")):
+                raise ValueError(f"Failed CRC check reading '{device_id}'")
+
+            return float(lines[1].split("=")[1]) / 1000.0
+
+
+_buses: Dict[Path, OneWireBus] = {}
+_buses_lock = threading.Lock()
+
+def get_one_wire_bus(master_path: Path) -> OneWireBus:
+    '''Returns the process-wide OneWireBus for the given bus master, creating it on first use.'''
+
+    master_path = master_path.resolve()
+    with _buses_lock:
+        bus = _buses.get(master_path)
+        if (bus is None):
+            bus = OneWireBus(master_path)
+            _buses[master_path] = bus
+
+    return bus
@@ -5,6 +5,13 @@ from sensor.datum_category import DatumCategory
 
 
 class PMS7003Datum(SensorDatum):
+    schema = {
+        "pm1_0cf1": int, "pm2_5cf1": int, "pm10cf1": int,
+        "pm1_0sat": int, "pm2_5sat": int, "pm10sat": int,
+        "n0_3": int, "n0_5": int, "n1_0": int, "n2_5": int, "n5_0": int, "n10": int
+    }
+    __slots__ = tuple(schema)
+
     def __init__(self, sensor_type: str, sensor_id: str, measurement: Dict):
         super().__init__(DatumCategory.AIR_QUALITY, sensor_type, sensor_id)
 
@@ -1,30 +1,72 @@
 import asyncio
 import logging
+import time
+from enum import Enum
 from pms7003 import Pms7003Sensor, PmsSensorException
 from pathlib import Path
-from typing import List
+from typing import Dict, List, Optional
 
 from sensor.sensor_adapter import SensorAdapter
 from sensor.sensor_datum import SensorDatum
 from .pms7003_datum import PMS7003Datum
+from .pms7003_frame_parser import PMS7003FrameAverager, PMS7003FrameParser
 from utilities import load_config, initialize_logging
 
+
+class PMS7003StreamError(RuntimeError):
+    pass
+
+
+class PMS7003Mode(Enum):
+    ## Wake the sensor up for every read, wait for the air to start moving, read once, then put it back to sleep
+    SLEEP = "sleep"
+    ## Keep the fan running and stream frames continuously, so reads return the average since the last read instantly
+    ACTIVE = "active"
+    ## Stream while reads keep coming in quickly, and fall back to sleeping between reads once they slow down
+    DUTY_CYCLE = "duty_cycle"
+
+
 class PMS7003Driver(SensorAdapter):
+    WAKEUP_COMMAND = bytes([0x42, 0x4D, 0xE4, 0x00, 0x01, 0x01, 0x74])
+    SLEEP_COMMAND = bytes([0x42, 0x4D, 0xE4, 0x00, 0x00, 0x01, 0x73])
+    ACTIVE_MODE_COMMAND = bytes([0x42, 0x4D, 0xE1, 0x00, 0x01, 0x01, 0x71])
+
     def __init__(self, sensor_id: str):
         config = load_config(Path(__file__).parent)
         self.logger = initialize_logging(logging.getLogger(__name__))
 
         ## Load config
-        self.serial_device_path = config.get('serial_device_path')
-        assert (self.serial_device_path is not None)
-        self.wakeup_time_seconds: int = config.get('wakeup_time_seconds', 30)
+        self.serial_device_path = config.get_str('serial_device_path', required=True)
+        self.wakeup_time_seconds: int = config.get_int('wakeup_time_seconds', 30, minimum=0)
+        self.mode = PMS7003Mode(config.get_str('mode', PMS7003Mode.SLEEP.value))
+        self.frame_max_age_seconds: float = config.get_float('frame_max_age_seconds', 10.0, minimum=0)
+        self.duty_cycle_max_interval_seconds: float = config.get_float('duty_cycle_max_interval_seconds', 120.0, minimum=0)
 
         self._sensor_type = "PMS7003"
         self._sensor_id = sensor_id or self.serial_device_path
 
         self.sensor = Pms7003Sensor(self.serial_device_path)
 
-        self.logger.debug(f"Initialized {self.sensor_type} sensor. path: '{self.serial_device_path}', id: '{self.sensor_id}', wakeup_time_seconds: '{self.wakeup_time_seconds}'")
+        ## Reads (and stream state changes) are serialized, since the sensor can only do one thing at a time
+        self._lock: Optional[asyncio.Lock] = None
+        self._lock_loop: Optional[asyncio.AbstractEventLoop] = None
+        self._last_read_time: Optional[float] = None
+
+        ## Streaming state
+        self._parser = PMS7003FrameParser()
+        self._averager = PMS7003FrameAverager()
+        self._streaming_loop: Optional[asyncio.AbstractEventLoop] = None
+        self._serial_timeout: Optional[float] = None
+        self._warmup_until = 0.0
+        self._frame_event: Optional[asyncio.Event] = None
+        self._stream_error: Optional[Exception] = None
+        self._latest_reading: Optional[Dict[str, int]] = None
+        self._latest_frame_time = 0.0
+        self._idle_handle: Optional[asyncio.TimerHandle] = None
+        self._idle_task: Optional[asyncio.Task] = None
+        self._stream_error_task: Optional[asyncio.Task] = None
+
+        self.logger.debug(f"Initialized {self.sensor_type} sensor. path: '{self.serial_device_path}', id: '{self.sensor_id}', wakeup_time_seconds: '{self.wakeup_time_seconds}', mode: '{self.mode.value}'")
 
     ## Properties
 
@@ -37,39 +79,243 @@ class PMS7003Driver(SensorAdapter):
     def sensor_id(self) -> str:
         return self._sensor_id
 
+
+    @property
+    def streaming(self) -> bool:
+        return self._streaming_loop is not None
+
     ## Adapter methods
 
     async def read(self) -> List[SensorDatum]:
-        ## Todo: what if this method is called multiple times within a short interval? This really needs some flavor of lock
+        async with self._get_lock():
+            now = time.monotonic()
+            interval = None if self._last_read_time is None else now - self._last_read_time
+            self._last_read_time = now
+
+            if (self._should_stream(interval)):
+                data = await self._read_streaming()
+                if (self.mode == PMS7003Mode.DUTY_CYCLE):
+                    self._schedule_idle_stop()
+            else:
+                data = await self._read_sleeping()
+
+        ## Format and return the data
+        return [PMS7003Datum(self.sensor_type, self.sensor_id, data)]
+
+
+    async def close(self):
+        async with self._get_lock():
+            await self._stop_streaming()
+            await self._close_failed_stream()
+
+    ## Methods
 
-        data = {}
+    def _get_lock(self) -> asyncio.Lock:
+        ## asyncio locks are bound to the loop they're first used on, so start fresh if the loop has been replaced
+        loop = asyncio.get_running_loop()
+        if (self._lock_loop is not loop):
+            self._lock = asyncio.Lock()
+            self._lock_loop = loop
 
+        return self._lock
+
+
+    def _should_stream(self, interval: Optional[float]) -> bool:
+        if (self.mode == PMS7003Mode.SLEEP):
+            return False
+        if (self.mode == PMS7003Mode.ACTIVE or self.streaming):
+            return True
+
+        ## Duty cycling, so only start streaming once reads are close enough together that sleeping between them isn't
+        ## worth the wakeup time
+        return interval is not None and interval <= self.duty_cycle_max_interval_seconds
+
+
+    async def _read_sleeping(self) -> Dict:
         ## Wake the sensor up and spin the fan to get air flowing, and wait for the sensor to move air around
-        self.wakeup()
+        await self.run_blocking(self.wakeup, bus=self.serial_device_path)
         await asyncio.sleep(self.wakeup_time_seconds)
 
         ## Read the data from the sensor
         try:
-            data = self.sensor.read()
+            return await self.run_blocking(self.sensor.read, bus=self.serial_device_path)
         except PmsSensorException as e:
             self.logger.exception(f"Unable to read sensor with type: '{self.sensor_type}' and id: '{self.sensor_id}'", exc_info=e)
             raise e
         finally:
             ## Put the sensor back to sleep, and shut off the fan
-            self.sleep()
+            await self.run_blocking(self.sleep, bus=self.serial_device_path)
 
-        ## Format and return the data
-        return [PMS7003Datum(self.sensor_type, self.sensor_id, data)]
 
-    ## Methods
+    async def _read_streaming(self) -> Dict:
+        if (not self.streaming):
+            await self._start_streaming()
+
+        reading = self._averager.take()
+        if (reading is None):
+            ## Nothing new since the last read, so reuse the last average as long as the stream hasn't gone quiet
+            if (self._latest_reading is not None and time.monotonic() - self._latest_frame_time <= self.frame_max_age_seconds):
+                return self._latest_reading
+
+            ## Otherwise (ex: the fan's still spinning up) wait for the next frame
+            self._frame_event.clear()
+            timeout = max(self._warmup_until - time.monotonic(), 0) + self.frame_max_age_seconds
+            try:
+                await asyncio.wait_for(self._frame_event.wait(), timeout)
+            except asyncio.TimeoutError:
+                raise PMS7003StreamError(f"No valid frames from {self} within {timeout:.1f} seconds") from None
+
+            if (self._stream_error is not None):
+                raise PMS7003StreamError(f"Lost the stream from {self}") from self._stream_error
+            reading = self._averager.take()
+
+        self._latest_reading = reading
+
+        return reading
+
+
+    async def _start_streaming(self):
+        loop = asyncio.get_running_loop()
+        await self.run_blocking(self._open_stream, bus=self.serial_device_path)
+
+        self._parser.reset()
+        self._averager = PMS7003FrameAverager()
+        self._frame_event = asyncio.Event()
+        self._stream_error = None
+        self._latest_reading = None
+        ## Frames from while the fan is spinning up aren't representative, so they're dropped
+        self._warmup_until = time.monotonic() + self.wakeup_time_seconds
+
+        try:
+            loop.add_reader(self.sensor._serial.fileno(), self._on_serial_readable)
+        except NotImplementedError:
+            await self.run_blocking(self._close_stream, bus=self.serial_device_path)
+            raise PMS7003StreamError("Streaming needs an event loop that supports add_reader, like the default selector event loop") from None
+        self._streaming_loop = loop
+
+        self.logger.info("Started streaming from %s", self)
+
+
+    async def _stop_streaming(self):
+        self._cancel_idle_stop()
+        if (not self.streaming):
+            return
+
+        self._remove_reader()
+        await self.run_blocking(self._close_stream, bus=self.serial_device_path)
+
+        self.logger.info(
+            "Stopped streaming from %s. Frames: %d, checksum errors: %d, discarded bytes: %d",
+            self,
+            self._parser.frame_count,
+            self._parser.checksum_error_count,
+            self._parser.discarded_byte_count
+        )
+
+
+    def _remove_reader(self):
+        try:
+            self._streaming_loop.remove_reader(self.sensor._serial.fileno())
+        except Exception as e:
+            self.logger.warning("Unable to remove the serial reader for %s: %s", self, e)
+        self._streaming_loop = None
+
+
+    def _on_serial_readable(self):
+        try:
+            data = self.sensor._serial.read(self.sensor._serial.in_waiting or 1)
+        except OSError as e:
+            ## pyserial's SerialException is an OSError too. Stop reading, and let the next read restart the stream
+            self.logger.error("Lost the serial stream from %s: %s", self, e)
+            self._remove_reader()
+            self._stream_error = e
+            self._frame_event.set()
+            ## Don't leave the fan running (and the port open) until the next read comes along
+            self._stream_error_task = asyncio.ensure_future(self._on_stream_error())
+            return
+
+        readings = self._parser.feed(data)
+        if (not readings or time.monotonic() < self._warmup_until):
+            return
+
+        for reading in readings:
+            self._averager.add(reading)
+        self._latest_frame_time = time.monotonic()
+        self._frame_event.set()
+
+
+    async def _on_stream_error(self):
+        async with self._get_lock():
+            await self._close_failed_stream()
+
+
+    async def _close_failed_stream(self):
+        '''Sends the sensor back to sleep and closes the port after the stream failed, unless it's been restarted since.'''
+
+        if (self.streaming or self._serial_timeout is None):
+            return
+
+        try:
+            await self.run_blocking(self._close_stream, bus=self.serial_device_path)
+        except Exception as e:
+            self.logger.warning("Unable to cleanly close the failed serial stream from %s: %s", self, e)
+
+
+    def _schedule_idle_stop(self):
+        ## Put the sensor to sleep if another read doesn't come along soon enough to make streaming worthwhile
+        self._cancel_idle_stop()
+        self._idle_handle = asyncio.get_running_loop().call_later(self.duty_cycle_max_interval_seconds, self._on_idle)
+
+
+    def _cancel_idle_stop(self):
+        if (self._idle_handle is not None):
+            self._idle_handle.cancel()
+            self._idle_handle = None
+
+
+    def _on_idle(self):
+        self._idle_handle = None
+        self._idle_task = asyncio.ensure_future(self._stop_idle_stream())
+
+
+    async def _stop_idle_stream(self):
+        async with self._get_lock():
+            ## A read might've come along (and rescheduled this) while waiting on the lock
+            if (self._idle_handle is None):
+                self.logger.debug("No reads from %s within %s seconds, going back to sleep", self, self.duty_cycle_max_interval_seconds)
+                await self._stop_streaming()
+
+
+    def _open_stream(self):
+        serial = self.sensor._serial
+        if (not serial.is_open):
+            serial.open()
+
+        ## Non-blocking, so the reader only ever takes whatever's already arrived. The original timeout is only saved if
+        ## it hasn't been already, since a stream that failed without being closed leaves the port non-blocking.
+        if (self._serial_timeout is None):
+            self._serial_timeout = serial.timeout
+        serial.timeout = 0
+        serial.reset_input_buffer()
+        serial.write(self.WAKEUP_COMMAND)
+        serial.write(self.ACTIVE_MODE_COMMAND)
+
+
+    def _close_stream(self):
+        serial = self.sensor._serial
+        try:
+            serial.write(self.SLEEP_COMMAND)
+        finally:
+            serial.timeout = self._serial_timeout
+            self._serial_timeout = None
+            serial.close()
+
 
     def wakeup(self):
         with self.sensor._serial as sensor:
-            command = bytearray([0x42, 0x4D, 0xE4, 0x00, 0x01, 0x01, 0x74])
-            sensor.write(command)
+            sensor.write(self.WAKEUP_COMMAND)
 
 
     def sleep(self):
         with self.sensor._serial as sensor:
-            command = bytearray([0x42, 0x4D, 0xE4, 0x00, 0x00, 0x01, 0x73])
-            sensor.write(command)
+            sensor.write(self.SLEEP_COMMAND)
@@ -0,0 +1,117 @@
+import struct
+from typing import Dict, List, Optional
+
+
+## Data words in the order they appear in a frame, named to match the pms7003 library's (and so PMS7003Datum's) keys
+FRAME_FIELDS = (
+    "pm1_0cf1", "pm2_5cf1", "pm10cf1",
+    "pm1_0", "pm2_5", "pm10",
+    "n0_3", "n0_5", "n1_0", "n2_5", "n5_0", "n10"
+)
+
+
+class PMS7003FrameParser:
+    '''
+    Incremental parser for the 32 byte frames that the PMS7003 streams over serial in active mode. Bytes can be fed in
+    however they arrive (partial frames, several frames at once, noise in between), and every complete frame with a
+    valid checksum is returned as a dict of its readings.
+
+    A frame is the 0x42 0x4D start bytes, a big endian length (always 28), thirteen big endian data words (the last of
+    which is reserved), and a checksum word that's the sum of all of the bytes before it.
+    '''
+
+    START_BYTES = b"\x42\x4D"
+    FRAME_LENGTH = 32
+    ## Length of everything after the length word itself
+    PAYLOAD_LENGTH = FRAME_LENGTH - 4
+    _FRAME_STRUCT = struct.Struct(">2sH13HH")
+
+    def __init__(self):
+        self._buffer = bytearray()
+
+        ## Metrics
+        self.frame_count = 0
+        self.checksum_error_count = 0
+        self.discarded_byte_count = 0
+
+    ## Methods
+
+    def _discard(self, count: int):
+        del self._buffer[:count]
+        self.discarded_byte_count += count
+
+
+    def _parse_frame(self, frame: bytes) -> Optional[Dict[str, int]]:
+        _, length, *words, checksum = self._FRAME_STRUCT.unpack(frame)
+        if (length != self.PAYLOAD_LENGTH):
+            return None
+
+        if (sum(frame[:-2]) & 0xFFFF != checksum):
+            self.checksum_error_count += 1
+            return None
+
+        return dict(zip(FRAME_FIELDS, words))
+
+
+    def feed(self, data: bytes) -> List[Dict[str, int]]:
+        '''Adds the given bytes to the buffer, and returns the readings from any frames that are now complete.'''
+
+        self._buffer.extend(data)
+        readings = []
+
+        while (len(self._buffer) >= self.FRAME_LENGTH):
+            start = self._buffer.find(self.START_BYTES)
+            if (start < 0):
+                ## Hang onto a trailing 0x42, since it might be the first half of the next start bytes
+                self._discard(len(self._buffer) - 1 if self._buffer[-1] == self.START_BYTES[0] else len(self._buffer))
+                break
+            if (start > 0):
+                self._discard(start)
+                continue
+
+            reading = self._parse_frame(bytes(self._buffer[:self.FRAME_LENGTH]))
+            if (reading is None):
+                ## Most likely the start bytes turned up inside of some other data, so resync from just past them
+                self._discard(1)
+                continue
+
+            del self._buffer[:self.FRAME_LENGTH]
+            self.frame_count += 1
+            readings.append(reading)
+
+        return readings
+
+
+    def reset(self):
+        self._buffer.clear()
+
+
+class PMS7003FrameAverager:
+    '''Running average of the readings from every frame added since it was last taken.'''
+
+    def __init__(self):
+        self._sums = dict.fromkeys(FRAME_FIELDS, 0)
+        self.count = 0
+
+    ## Methods
+
+    def add(self, reading: Dict[str, int]):
+        for field in FRAME_FIELDS:
+            self._sums[field] += reading[field]
+        self.count += 1
+
+
+    def take(self) -> Optional[Dict[str, int]]:
+        '''
+        Gets the average of the readings added so far (rounded, since the sensor only reports whole numbers) and
+        starts a new average. Returns None if nothing's been added.
+        '''
+
+        if (self.count == 0):
+            return None
+
+        averages = {field: round(total / self.count) for field, total in self._sums.items()}
+        self._sums = dict.fromkeys(FRAME_FIELDS, 0)
+        self.count = 0
+
+        return averages
@@ -0,0 +1,183 @@
+import asyncio
+import logging
+import time
+from pathlib import Path
+from typing import List
+
+from sensor.sensor_adapter import SensorAdapter
+from sensor.sensor_datum import SensorDatum
+from sensor.sensor_recording import ReadStatus, RecordedRead, get_sensor_recording
+from utilities import load_config, initialize_logging
+
+
+class ReplayedReadError(RuntimeError):
+    pass
+
+
+class ReplaySensorDriver(SensorAdapter):
+    '''
+    Plays back a sensor's reads from a recording made by a SensorRecorder, so that the pipeline can be run (and
+    profiled, or benchmarked) against real sensor traffic without any hardware. The sensor id is the recorded sensor's
+    type and id, joined with a colon (ex: 'SHT31:office'), and discovery registers every sensor in the recording.
+
+    With a speed above zero, the recording is played back against a clock that runs speed times faster than real time,
+    and each read returns every recorded read that the clock has passed since the last one. With a speed of zero, the
+    recording is played back as fast as it can be read, max_reads_per_read recorded reads at a time. Recorded failures
+    and timeouts are replayed too, and recorded latencies are replayed at the same speed.
+
+    Replayed readings keep their own timestamps rather than the tick's. With 'recorded' timestamps they're left as they
+    were, and with 'shifted' timestamps they're moved so that the recording starts when the replay did. Looped
+    recordings are shifted forward again on each pass.
+    '''
+
+    ## The recorded timestamps are the point of replaying, so don't let the tick's timestamps replace them
+    align_timestamps_to_tick = False
+
+    TIMESTAMP_MODES = ("recorded", "shifted")
+
+    def __init__(
+            self,
+            sensor_id: str,
+            path: str = None,
+            speed: float = None,
+            max_reads_per_read: int = None,
+            loop: bool = None,
+            timestamps: str = None
+    ):
+        config = load_config(Path(__file__).parent)
+        self.logger = initialize_logging(logging.getLogger(__name__))
+
+        ## Load config
+        self.path = path if path is not None else config.get_str('path')
+        self.speed = speed if speed is not None else config.get_float('speed', 1.0, minimum=0)
+        self.max_reads_per_read = max_reads_per_read if max_reads_per_read is not None else config.get_int('max_reads_per_read', 1, minimum=1)
+        self.loop = loop if loop is not None else config.get_bool('loop', False)
+        self.timestamps = timestamps if timestamps is not None else config.get_str('timestamps', "shifted")
+        if (not self.path):
+            raise ValueError(f"No recording path was given for the replay sensor '{sensor_id}'")
+        if (self.timestamps not in self.TIMESTAMP_MODES):
+            raise ValueError(f"timestamps must be one of {self.TIMESTAMP_MODES}, not '{self.timestamps}'")
+
+        self._recording = get_sensor_recording(self.path)
+        self._sensor_type, self._sensor_id = self._find_recorded_sensor(sensor_id)
+        self._reads: List[RecordedRead] = self._recording.reads[(self._sensor_type, self._sensor_id)]
+
+        ## Each pass over a looped recording is pushed back by the recording's length, plus a gap between passes
+        self._loop_span_ns = self._recording.duration_ns + max(self._recording.duration_ns // max(len(self._reads), 1), 1)
+        self._loop_offset_ns = 0
+        self._next_index = 0
+        self._finished = False
+        ## Set on the first read, since that's when the replay starts
+        self._clock_start_monotonic: float = None
+        self._timestamp_shift_ns = 0
+
+        self.logger.debug(f"Initialized {self.sensor_type} replay sensor. id: '{self.sensor_id}', reads: {len(self._reads)}, speed: {self.speed}")
+
+    ## Properties
+
+    @property
+    def sensor_type(self) -> str:
+        return self._sensor_type
+
+
+    @property
+    def sensor_id(self) -> str:
+        return self._sensor_id
+
+    ## Methods
+
+    def _find_recorded_sensor(self, sensor_id: str):
+        if (":" in sensor_id):
+            sensor = tuple(sensor_id.split(":", 1))
+            if (sensor in self._recording.reads):
+                return sensor
+        else:
+            ## A bare sensor id is fine too, as long as only one of the recording's sensors has it
+            matches = [sensor for sensor in self._recording.sensors if sensor[1] == sensor_id]
+            if (len(matches) == 1):
+                return matches[0]
+
+        raise ValueError(f"Couldn't find a sensor matching '{sensor_id}' in the recording '{self._recording.path}'")
+
+
+    def _start_clock(self):
+        self._clock_start_monotonic = time.monotonic()
+        if (self.timestamps == "shifted"):
+            self._timestamp_shift_ns = time.time_ns() - self._recording.start_time_ns
+
+
+    def _take_due_reads(self) -> List[RecordedRead]:
+        if (self.speed > 0):
+            elapsed_ns = (time.monotonic() - self._clock_start_monotonic) * self.speed * 1_000_000_000
+            replay_time_ns = self._recording.start_time_ns + round(elapsed_ns)
+            limit = None
+        else:
+            replay_time_ns = None
+            limit = self.max_reads_per_read
+
+        reads = []
+        while (limit is None or len(reads) < limit):
+            if (self._next_index >= len(self._reads)):
+                if (not self.loop):
+                    break
+                self._next_index = 0
+                self._loop_offset_ns += self._loop_span_ns
+
+            read = self._reads[self._next_index]
+            if (replay_time_ns is not None and read.time_ns + self._loop_offset_ns > replay_time_ns):
+                break
+
+            reads.append(read)
+            self._next_index += 1
+
+        return reads
+
+
+    def _build_data(self, read: RecordedRead) -> List[SensorDatum]:
+        data = read.decode_data()
+        shift_ns = self._timestamp_shift_ns + self._loop_offset_ns
+        if (shift_ns):
+            for datum in data:
+                datum.timestamp_ns += shift_ns
+
+        return data
+
+    ## Adapter methods
+
+    @classmethod
+    def discover_sensor_ids(cls) -> List[str]:
+        config = load_config(Path(__file__).parent)
+        path = config.get_str('path')
+        if (not path):
+            return []
+
+        return [f"{sensor_type}:{sensor_id}" for sensor_type, sensor_id in get_sensor_recording(path).sensors]
+
+
+    async def read(self) -> List[SensorDatum]:
+        if (self._clock_start_monotonic is None):
+            self._start_clock()
+
+        reads = self._take_due_reads()
+        if (not reads):
+            if (not self._finished and self._next_index >= len(self._reads) and not self.loop):
+                self._finished = True
+                self.logger.info("Finished replaying %d read(s) for %s", len(self._reads), self)
+            return []
+
+        ## Only the latest read's latency, since the reads it's catching up on would've overlapped anyway
+        if (self.speed > 0 and reads[-1].latency_seconds > 0):
+            await asyncio.sleep(reads[-1].latency_seconds / self.speed)
+
+        data = []
+        for read in reads:
+            if (read.status == ReadStatus.SUCCEEDED):
+                data.extend(self._build_data(read))
+
+        ## A batch with any successful read in it succeeds, otherwise the latest failure is replayed
+        if (not any(read.status == ReadStatus.SUCCEEDED for read in reads)):
+            if (reads[-1].status == ReadStatus.TIMED_OUT):
+                raise asyncio.TimeoutError()
+            raise ReplayedReadError(f"Replayed read failure from {self}: {reads[-1].error}")
+
+        return data
@@ -5,6 +5,9 @@ from sensor.datum_category import DatumCategory
 
 
 class SHT31TemperatureDatum(SensorDatum):
+    schema = {"temperature_celcius": float}
+    __slots__ = tuple(schema)
+
     def __init__(self, sensor_type: str, sensor_id: str, measurement: Dict):
         super().__init__(DatumCategory.TEMPERATURE, sensor_type, sensor_id)
 
@@ -12,6 +15,9 @@ class SHT31TemperatureDatum(SensorDatum):
 
 
 class SHT31HumidityDatum(SensorDatum):
+    schema = {"humidity_relative": float}
+    __slots__ = tuple(schema)
+
     def __init__(self, sensor_type: str, sensor_id: str, measurement: Dict):
         super().__init__(DatumCategory.HUMIDITY, sensor_type, sensor_id)
 
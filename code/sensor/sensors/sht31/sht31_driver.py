@@ -1,25 +1,45 @@
+import asyncio
 import logging
-import sys
 import time
+from enum import Enum
 from pathlib import Path
-from typing import List
-
-## The recommended Raspberry Pi i2c library doesn't play nice with Windows
-## Eventually, with proper orchestration, this check won't be necessary as module will be spun up on demand via
-## importlib, and init can be a bit more clever about modules, their capabilities, and their requirements.
-if (sys.platform.startswith('linux')):
-    import smbus
+from typing import List, Optional
 
+from sensor.i2c_bus import get_i2c_bus
 from sensor.sensor_adapter import SensorAdapter
 from sensor.sensor_datum import SensorDatum
 from .sht31_datum import SHT31TemperatureDatum, SHT31HumidityDatum
+from .sht31_protocol import (
+    BREAK_COMMAND,
+    FETCH_DATA_COMMAND,
+    MEASUREMENT_DURATION_SECONDS,
+    PERIODIC_COMMANDS,
+    SINGLE_SHOT_COMMANDS,
+    Repeatability,
+    SHT31CrcError,
+    validate_measurement
+)
 from utilities import load_config, initialize_logging
 
 
+class SHT31Mode(Enum):
+    ## Trigger a measurement on every read, and wait for it to complete
+    SINGLE_SHOT = "single_shot"
+    ## Have the sensor measure continuously by itself, and just fetch the latest measurement on every read
+    PERIODIC = "periodic"
+
+
 class SHT31Driver(SensorAdapter):
     '''
     Simple interface for the SHT31 temperature and humidity sensor.
 
+    In periodic mode the sensor takes measurements_per_second measurements by itself, so reads only need to fetch the
+    latest one. Note that fetching clears it, so polling faster than the sensor measures will have reads wait for the
+    next measurement.
+
+    All i2c traffic goes through the bus's shared I2CBus, so measurements from every sensor on the bus are pipelined
+    together rather than each waiting out their own conversion.
+
     See the datasheet for more information:
     https://sensirion.com/media/documents/213E6A3B/61641DC3/Sensirion_Humidity_Sensors_SHT3x_Datasheet_digital.pdf
     '''
@@ -29,19 +49,25 @@ class SHT31Driver(SensorAdapter):
         self.logger = initialize_logging(logging.getLogger(__name__))
 
         ## Load config
-        self.i2c_bus = int(config.get('i2c_bus', 1))
-        assert (self.i2c_bus is not None)
-        self.i2c_address = int(config.get('i2c_address', "0x44"), base=16)
-        assert (self.i2c_address is not None)
-        self.temperature_celcius_offset = config.get('temperature_celcius_offset', 0.0)
-        self.humidity_relative_offset = config.get('humidity_relative_offset', 0.0)
+        self.i2c_bus = config.get_int('i2c_bus', 1, minimum=0)
+        self.i2c_address = int(config.get_str('i2c_address', "0x44"), base=16)
+        self.temperature_celcius_offset = config.get_float('temperature_celcius_offset', 0.0)
+        self.humidity_relative_offset = config.get_float('humidity_relative_offset', 0.0)
+        self.mode = SHT31Mode(config.get_str('mode', SHT31Mode.SINGLE_SHOT.value))
+        self.repeatability = Repeatability(config.get_str('repeatability', Repeatability.HIGH.value))
+        self.measurements_per_second = config.get_float('measurements_per_second', 1.0)
+        self.max_read_attempts = config.get_int('max_read_attempts', 3, minimum=1)
+        if (self.measurements_per_second not in PERIODIC_COMMANDS):
+            raise ValueError(f"measurements_per_second must be one of {list(PERIODIC_COMMANDS)}, not {self.measurements_per_second}")
 
         self._sensor_type = "SHT31"
         self._sensor_id = sensor_id or f"{self.i2c_bus}-{self.i2c_address}"
 
-        self.bus = smbus.SMBus(self.i2c_bus)
+        self.bus = get_i2c_bus(self.i2c_bus)
+        ## When periodic acquisition was started, or None if it isn't running
+        self._periodic_started_at: Optional[float] = None
 
-        self.logger.debug(f"Initialized {self.sensor_type} sensor. id: {self.sensor_id}, i2c_bus: {self.i2c_bus}, i2c_address: {self.i2c_address}")
+        self.logger.debug(f"Initialized {self.sensor_type} sensor. id: {self.sensor_id}, i2c_bus: {self.i2c_bus}, i2c_address: {self.i2c_address}, mode: {self.mode.value}, repeatability: {self.repeatability.value}")
 
     ## Properties
 
@@ -54,25 +80,72 @@ class SHT31Driver(SensorAdapter):
     def sensor_id(self) -> str:
         return self._sensor_id
 
+
+    @property
+    def measurement_period_seconds(self) -> float:
+        return 1 / self.measurements_per_second
+
     ## Methods
 
-    def _read_sht3x_data(self) -> List[bytes]:
+    async def _read_single_shot(self) -> List[int]:
         '''
         Handles sht3x communications according to the datasheet. Note that this method does one single-shot
         measurement, not a continous series of measurements.
         '''
 
-        ## Initiate single-shot measurement
-        self.bus.write_i2c_block_data(self.i2c_address, 0x2C, [0x06])
-        ## Give sensor time to process this
-        time.sleep(0.5)
-
         ## Read the raw bytes (6 of them) from the sensor, they are as follows:
         ## [Temperature MSB][Temperature LSB][Temperature CRC][Humidity MSB][Humidity LSB][Humidity CRC]
-        return self.bus.read_i2c_block_data(self.i2c_address, 0x00, 6)
+        data = await self.bus.measure(
+            self.i2c_address,
+            SINGLE_SHOT_COMMANDS[self.repeatability],
+            MEASUREMENT_DURATION_SECONDS[self.repeatability],
+            6
+        )
+        validate_measurement(data)
+
+        return data
+
 
+    async def _read_periodic(self) -> List[int]:
+        if (self._periodic_started_at is None):
+            await self.bus.write(self.i2c_address, PERIODIC_COMMANDS[self.measurements_per_second][self.repeatability])
+            self._periodic_started_at = time.monotonic()
 
-    def _extract_temperature_celcius_from_bytes(self, data: List[bytes]) -> float:
+        ## Don't bother asking before the very first measurement could possibly be ready
+        first_ready_at = self._periodic_started_at + self.measurement_period_seconds + MEASUREMENT_DURATION_SECONDS[self.repeatability]
+        if (time.monotonic() < first_ready_at):
+            await asyncio.sleep(first_ready_at - time.monotonic())
+
+        ## Fetching is near instant, and the sensor NACKs the read (raising an OSError) if there's nothing to fetch
+        data = await self.bus.measure(self.i2c_address, FETCH_DATA_COMMAND, 0, 6)
+        validate_measurement(data)
+
+        return data
+
+
+    async def _read_with_retries(self) -> List[int]:
+        '''
+        Reads a measurement with valid CRCs, retrying up to max_read_attempts times. Failed fetches in periodic mode
+        wait for the next measurement before trying again, since the sensor won't have anything new until then.
+        '''
+
+        for attempt in range(1, self.max_read_attempts + 1):
+            try:
+                if (self.mode == SHT31Mode.PERIODIC):
+                    return await self._read_periodic()
+                else:
+                    return await self._read_single_shot()
+            except (OSError, SHT31CrcError) as e:
+                if (attempt == self.max_read_attempts):
+                    ## The sensor might've lost power and dropped out of periodic mode, so restart it on the next read
+                    self._periodic_started_at = None
+                    raise
+                self.logger.warning("Attempt %d to read %s failed, retrying. %s", attempt, self, e)
+                if (self.mode == SHT31Mode.PERIODIC):
+                    await asyncio.sleep(self.measurement_period_seconds)
+
+
+    def _extract_temperature_celcius_from_bytes(self, data: List[int]) -> float:
         temperature_msb = data[0]
         temperature_lsb = data[1]
 
@@ -80,7 +153,7 @@ class SHT31Driver(SensorAdapter):
         return -45 + (175 * (temperature_msb * 256 + temperature_lsb) / 65535.0)
 
 
-    def _extract_humidity_relative_from_bytes(self, data: List[bytes]) -> float:
+    def _extract_humidity_relative_from_bytes(self, data: List[int]) -> float:
         humidity_msb = data[3]
         humidity_lsb = data[4]
 
@@ -99,7 +172,7 @@ class SHT31Driver(SensorAdapter):
         '''
 
         try:
-            data = self._read_sht3x_data()
+            data = await self._read_with_retries()
         except Exception as e:
             self.logger.error(f"Failed to interact with {self.sensor_type} - {self.sensor_id} over i2c. {e}")
             return None
@@ -113,3 +186,12 @@ class SHT31Driver(SensorAdapter):
         })
 
         return [temperature_datum, humdity_datum]
+
+
+    async def close(self):
+        if (self._periodic_started_at is None):
+            return
+
+        ## Return the sensor to single-shot mode, so it isn't left measuring with nothing reading it
+        await self.bus.write(self.i2c_address, BREAK_COMMAND)
+        self._periodic_started_at = None
@@ -0,0 +1,68 @@
+from enum import Enum
+from typing import Dict, List, Tuple
+
+
+class SHT31CrcError(ValueError):
+    pass
+
+
+class Repeatability(Enum):
+    HIGH = "high"
+    MEDIUM = "medium"
+    LOW = "low"
+
+
+## Worst case time for one measurement to complete, in seconds, per the datasheet
+MEASUREMENT_DURATION_SECONDS: Dict[Repeatability, float] = {
+    Repeatability.HIGH: 0.0155,
+    Repeatability.MEDIUM: 0.0065,
+    Repeatability.LOW: 0.0045
+}
+
+## Single-shot measurement, with clock stretching enabled
+SINGLE_SHOT_COMMANDS: Dict[Repeatability, Tuple[int, int]] = {
+    Repeatability.HIGH: (0x2C, 0x06),
+    Repeatability.MEDIUM: (0x2C, 0x0D),
+    Repeatability.LOW: (0x2C, 0x10)
+}
+
+## Periodic data acquisition, keyed by measurements per second
+PERIODIC_COMMANDS: Dict[float, Dict[Repeatability, Tuple[int, int]]] = {
+    0.5: {Repeatability.HIGH: (0x20, 0x32), Repeatability.MEDIUM: (0x20, 0x24), Repeatability.LOW: (0x20, 0x2F)},
+    1: {Repeatability.HIGH: (0x21, 0x30), Repeatability.MEDIUM: (0x21, 0x26), Repeatability.LOW: (0x21, 0x2D)},
+    2: {Repeatability.HIGH: (0x22, 0x36), Repeatability.MEDIUM: (0x22, 0x20), Repeatability.LOW: (0x22, 0x2B)},
+    4: {Repeatability.HIGH: (0x23, 0x34), Repeatability.MEDIUM: (0x23, 0x22), Repeatability.LOW: (0x23, 0x29)},
+    10: {Repeatability.HIGH: (0x27, 0x37), Repeatability.MEDIUM: (0x27, 0x21), Repeatability.LOW: (0x27, 0x2A)}
+}
+
+## Reads out the latest periodic measurement, after which the sensor has no data until the next one completes
+FETCH_DATA_COMMAND = (0xE0, 0x00)
+## Stops periodic data acquisition, returning the sensor to single-shot mode
+BREAK_COMMAND = (0x30, 0x93)
+
+
+def calculate_crc8(data: List[int]) -> int:
+    '''CRC-8 as used by the SHT3x, with polynomial 0x31 (x^8 + x^5 + x^4 + 1), initialized to 0xFF and no final XOR.'''
+
+    crc = 0xFF
+    for byte in data:
+        crc ^= byte
+        for _ in range(8):
+            crc = ((crc << 1) ^ 0x31) & 0xFF if crc & 0x80 else (crc << 1) & 0xFF
+
+    return crc
+
+
+def validate_measurement(data: List[int]):
+    '''
+    Checks both words of a raw measurement against their CRCs. The raw bytes (6 of them) are as follows:
+    [Temperature MSB][Temperature LSB][Temperature CRC][Humidity MSB][Humidity LSB][Humidity CRC]
+    '''
+
+    if (len(data) != 6):
+        raise SHT31CrcError(f"Expected 6 bytes, got {len(data)}")
+
+    for name, offset in (("temperature", 0), ("humidity", 3)):
+        expected_crc = calculate_crc8(data[offset:offset + 2])
+        if (data[offset + 2] != expected_crc):
+            raise SHT31CrcError(f"Invalid {name} CRC, expected 0x{expected_crc:02X} but got 0x{data[offset + 2]:02X}")
@@ -0,0 +1,31 @@
+from typing import Dict, Type
+
+from sensor.sensor_datum import SensorDatum
+from sensor.datum_category import DatumCategory
+
+
+class SyntheticDatum(SensorDatum):
+    '''
+    Base for the synthetic driver's datums. Since the number of fields is configurable, there's one subclass per field
+    count (ex: SyntheticDatum4 with value_0 through value_3), built on demand by get_class.
+    '''
+
+    __slots__ = ()
+
+    def __init__(self, sensor_type: str, sensor_id: str, measurement: Dict):
+        super().__init__(DatumCategory.TEST, sensor_type, sensor_id)
+
+        for name in self.schema:
+            setattr(self, name, measurement.get(name))
+
+    ## Methods
+
+    @staticmethod
+    def get_class(field_count: int) -> Type['SyntheticDatum']:
+        name = f"SyntheticDatum{field_count}"
+        datum_class = SensorDatum.registry.get(name)
+        if (datum_class is None):
+            schema = {f"value_{index}": float for index in range(field_count)}
+            datum_class = type(name, (SyntheticDatum,), {"schema": schema, "__slots__": tuple(schema)})
+
+        return datum_class
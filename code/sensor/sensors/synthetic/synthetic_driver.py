@@ -0,0 +1,90 @@
+import asyncio
+import logging
+import random
+import time
+from pathlib import Path
+from typing import List
+
+from sensor.sensor_adapter import SensorAdapter
+from sensor.sensor_datum import SensorDatum
+from .synthetic_datum import SyntheticDatum
+from utilities import load_config, initialize_logging
+
+
+class SyntheticReadError(RuntimeError):
+    pass
+
+
+class SyntheticDriver(SensorAdapter):
+    '''
+    Fake sensor for benchmarking and load testing the pipeline without any hardware. Each read takes latency_seconds
+    (give or take up to jitter_seconds), fails with probability failure_rate, and returns a single datum with
+    field_count random float fields.
+
+    Reads normally just sleep on the event loop, but with blocking enabled they sleep on the sensor executor instead,
+    like a real driver's blocking I/O would. Any of the config values can be overridden per instance, ex:
+    functools.partial(SyntheticDriver, latency_seconds=0.5).
+    '''
+
+    def __init__(
+            self,
+            sensor_id: str,
+            latency_seconds: float = None,
+            jitter_seconds: float = None,
+            failure_rate: float = None,
+            field_count: int = None,
+            blocking: bool = None,
+            seed: int = None
+    ):
+        config = load_config(Path(__file__).parent)
+        self.logger = initialize_logging(logging.getLogger(__name__))
+
+        ## Load config
+        self.latency_seconds = latency_seconds if latency_seconds is not None else config.get_float('latency_seconds', 0.01, minimum=0)
+        self.jitter_seconds = jitter_seconds if jitter_seconds is not None else config.get_float('jitter_seconds', 0.0, minimum=0)
+        self.failure_rate = failure_rate if failure_rate is not None else config.get_float('failure_rate', 0.0, minimum=0)
+        self.field_count = field_count if field_count is not None else config.get_int('field_count', 1, minimum=1)
+        self.blocking = blocking if blocking is not None else config.get_bool('blocking', False)
+        seed = seed if seed is not None else config.get_int('seed')
+
+        self._sensor_type = "Synthetic"
+        self._sensor_id = sensor_id
+
+        ## Seeding off of the sensor id keeps every sensor's readings distinct, but repeatable from run to run
+        self._random = random.Random(f"{seed}-{sensor_id}" if seed is not None else None)
+        self._datum_class = SyntheticDatum.get_class(self.field_count)
+        self._field_names = list(self._datum_class.schema)
+
+        self.logger.debug(f"Initialized {self.sensor_type} sensor. id: '{self.sensor_id}'")
+
+    ## Properties
+
+    @property
+    def sensor_type(self) -> str:
+        return self._sensor_type
+
+
+    @property
+    def sensor_id(self) -> str:
+        return self._sensor_id
+
+    ## Adapter Methods
+
+    async def read(self) -> List[SensorDatum]:
+        delay = max(0.0, self.latency_seconds + self._random.uniform(-self.jitter_seconds, self.jitter_seconds))
+        if (delay > 0):
+            if (self.blocking):
+                await self.run_blocking(time.sleep, delay)
+            else:
+                await asyncio.sleep(delay)
+
+        if (self.failure_rate and self._random.random() < self.failure_rate):
+            raise SyntheticReadError(f"Simulated read failure from {self}")
+
+        return [
+            self._datum_class(
+                self.sensor_type,
+                self.sensor_id,
+                {name: self._random.uniform(0, 100) for name in self._field_names}
+            )
+        ]
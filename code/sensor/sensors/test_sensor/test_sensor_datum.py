@@ -5,6 +5,9 @@ from sensor.datum_category import DatumCategory
 
 
 class TestSensorDatum(SensorDatum):
+    schema = {"name": str, "test_key": str}
+    __slots__ = tuple(schema)
+
     def __init__(self, sensor_type: str, sensor_id: str, measurement: Dict):
         super().__init__(DatumCategory.TEST, sensor_type, sensor_id)
 
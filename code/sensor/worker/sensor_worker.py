@@ -0,0 +1,177 @@
+import asyncio
+import logging
+import signal
+from multiprocessing.connection import Connection
+from typing import Dict, List, Tuple
+
+from plugin_registry import PluginKind, PluginRegistry
+from sensor.datum_codec import DatumCodec
+from sensor.sensor_adapter import SensorAdapter
+from sensor.sensor_executor import shutdown_sensor_executor
+from sensor.sensor_manager import SensorManager
+from .shared_memory_ring import SharedMemoryRing
+from utilities import ConfigSection, initialize_logging, initialize_worker_logging, load_config
+
+
+## Control messages, sent over the worker's pipe as (kind, ...) tuples
+## (READY, [(config index, sensor type, sensor id), ...])
+READY = "ready"
+## (READ, request id, [(sensor type, sensor id), ...])
+READ = "read"
+## (RESULT, request id, has payload, [(sensor type, sensor id, latency seconds, timed out, error or None), ...])
+RESULT = "result"
+## (STOP,)
+STOP = "stop"
+
+
+class SensorWorker:
+    '''
+    The worker process side of a SensorWorkerPool. Builds its own instances of the sensors it's been given, and reads
+    them whenever the parent process asks. Each read's datums are encoded with the DatumCodec and written into the
+    shared memory ring, and only a small per-sensor summary goes back over the pipe.
+    '''
+
+    ## How long to wait for the parent to make room in the ring, before giving up on a read's datums
+    RING_FULL_TIMEOUT_SECONDS = 5.0
+    RING_FULL_RETRY_SECONDS = 0.01
+
+    def __init__(self, name: str, sensor_configs: List[Tuple[int, Dict]], ring_name: str, connection: Connection):
+        self.logger = initialize_logging(logging.getLogger(__name__))
+
+        self.name = name
+        self.sensor_configs = sensor_configs
+        self.ring = SharedMemoryRing.attach(ring_name)
+        self.connection = connection
+
+        self.sensor_manager: SensorManager = None
+        self.sensors: Dict[Tuple[str, str], SensorAdapter] = {}
+        self._messages: asyncio.Queue = None
+
+    ## Methods
+
+    def _register_sensors(self) -> List[Tuple[int, str, str]]:
+        config = load_config()
+        plugin_registry = PluginRegistry()
+        for name, target in config.get_section('plugins').get_section('sensors').items():
+            plugin_registry.register(PluginKind.SENSOR, name, target)
+
+        self.sensor_manager = SensorManager(config.get_float('sensor_read_timeout_seconds', minimum=0))
+        registered = []
+        for index, sensor_config in self.sensor_configs:
+            sensor_config = ConfigSection(sensor_config, f"sensors[{index}]")
+
+            ## One sensor failing to start shouldn't take the rest of the worker's sensors with it
+            try:
+                sensor = plugin_registry.get(PluginKind.SENSOR, sensor_config.get_str('type', required=True))
+                for sensor_id in sensor.get_configured_sensor_ids(sensor_config):
+                    sensor_instance = self.sensor_manager.register_sensor(
+                        sensor,
+                        sensor_id,
+                        sensor_config.get_float('read_timeout_seconds', minimum=0)
+                    )
+                    self.sensors[(sensor_instance.sensor_type, sensor_instance.sensor_id)] = sensor_instance
+                    registered.append((index, sensor_instance.sensor_type, sensor_instance.sensor_id))
+            except Exception as e:
+                self.logger.exception("Unable to start the sensor(s) for %s in worker '%s'", sensor_config.name, self.name, exc_info=e)
+
+        return registered
+
+
+    def _on_message(self):
+        try:
+            message = self.connection.recv()
+        except (EOFError, OSError):
+            ## The parent's gone, so there's nothing left to do
+            asyncio.get_running_loop().remove_reader(self.connection.fileno())
+            message = (STOP,)
+
+        self._messages.put_nowait(message)
+
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        self._messages = asyncio.Queue()
+        loop.add_reader(self.connection.fileno(), self._on_message)
+        self.connection.send((READY, self._register_sensors()))
+        self.logger.info("Worker '%s' started with %d sensor(s)", self.name, len(self.sensors))
+
+        tasks = set()
+        try:
+            while (True):
+                message = await self._messages.get()
+                if (message[0] == STOP):
+                    break
+                elif (message[0] == READ):
+                    task = loop.create_task(self._read(*message[1:]))
+                    tasks.add(task)
+                    task.add_done_callback(tasks.discard)
+        finally:
+            for task in tasks:
+                task.cancel()
+            try:
+                loop.remove_reader(self.connection.fileno())
+            except Exception:
+                pass
+            await self.sensor_manager.close()
+            shutdown_sensor_executor(wait=False)
+            self.ring.close()
+
+
+    async def _read(self, request_id: int, sensor_keys: List[Tuple[str, str]]):
+        sensors = [self.sensors[tuple(key)] for key in sensor_keys if tuple(key) in self.sensors]
+        results = await self.sensor_manager.read_sensors(sensors)
+
+        summaries = {
+            (sensor_type, sensor_id): (sensor_type, sensor_id, 0.0, False, f"Sensor isn't running in worker '{self.name}'")
+            for sensor_type, sensor_id in sensor_keys
+        }
+        for result in results:
+            summaries[(result.sensor_type, result.sensor_id)] = (
+                result.sensor_type,
+                result.sensor_id,
+                result.latency_seconds,
+                result.timed_out,
+                None if result.error is None else f"{type(result.error).__name__}: {result.error}"
+            )
+
+        data = [datum for result in results for datum in result.data]
+        has_payload = False
+        if (data):
+            try:
+                has_payload = await self._write_payload(DatumCodec.encode(data))
+            except Exception as e:
+                self.logger.exception("Unable to encode the data read by worker '%s'", self.name, exc_info=e)
+            if (not has_payload):
+                for key, summary in summaries.items():
+                    if (summary[4] is None):
+                        summaries[key] = (*summary[:4], "Unable to send the read data back from the worker")
+
+        ## Nothing can be awaited between writing the payload and sending its result, so that the results arrive in the
+        ## same order as the payloads in the ring
+        self.connection.send((RESULT, request_id, has_payload, list(summaries.values())))
+
+
+    async def _write_payload(self, payload: bytes) -> bool:
+        if (len(payload) + 4 > self.ring.capacity):
+            self.logger.error("Read data (%d bytes) is too big for the ring buffer of worker '%s'", len(payload), self.name)
+            return False
+
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.RING_FULL_TIMEOUT_SECONDS
+        while (not self.ring.write(payload)):
+            if (loop.time() >= deadline):
+                self.logger.error("Timed out waiting for room in the ring buffer of worker '%s'", self.name)
+                return False
+            await asyncio.sleep(self.RING_FULL_RETRY_SECONDS)
+
+        return True
+
+
+def run_sensor_worker(name: str, sensor_configs: List[Tuple[int, Dict]], ring_name: str, connection: Connection, log_queue):
+    '''Entry point for a worker process.'''
+
+    ## The parent handles Ctrl+C, and tells its workers when to stop
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    initialize_worker_logging(log_queue)
+
+    asyncio.run(SensorWorker(name, sensor_configs, ring_name, connection).run())
@@ -0,0 +1,368 @@
+import asyncio
+import logging
+import multiprocessing
+import time
+from logging.handlers import QueueListener
+from typing import Dict, List, Optional, Tuple
+
+from sensor.datum_codec import DatumCodec
+from sensor.sensor_adapter import SensorAdapter
+from sensor.sensor_datum import SensorDatum
+from .sensor_worker import READ, READY, RESULT, STOP, run_sensor_worker
+from .shared_memory_ring import SharedMemoryRing
+from utilities import ConfigSection, ForwardedLogHandler, initialize_logging
+
+
+class SensorWorkerError(RuntimeError):
+    pass
+
+
+class WorkerSensorProxy(SensorAdapter):
+    '''Stands in for a sensor running in a worker process, so that the rest of the pipeline can treat it as any other.'''
+
+    def __init__(self, pool: 'SensorWorkerPool', sensor_type: str, sensor_id: str):
+        self._pool = pool
+        self._sensor_type = sensor_type
+        self._sensor_id = sensor_id
+
+    ## Properties
+
+    @property
+    def sensor_type(self) -> str:
+        return self._sensor_type
+
+
+    @property
+    def sensor_id(self) -> str:
+        return self._sensor_id
+
+    ## Adapter methods
+
+    async def read(self) -> List[SensorDatum]:
+        return await self._pool.read(self.sensor_type, self.sensor_id)
+
+
+class SensorWorkerPool:
+    '''
+    Runs a group of sensors in a supervised worker process, so that a driver that hangs (ex: stuck in a C extension) or
+    leaks only costs its own readings, rather than taking down the whole process. Spreading sensors across workers also
+    spreads their parsing across cores.
+
+    Reads from the pool's sensors that come in together are batched into a single request to the worker. The worker
+    writes the datums into a shared memory ring buffer (encoded with the DatumCodec, rather than pickled), and sends a
+    small summary of the results back over a pipe.
+
+    A request that goes unanswered for watchdog_timeout_seconds, or the worker exiting, gets the worker killed and
+    restarted after restart_delay_seconds (doubling with every consecutive failure, up to max_restart_delay_seconds).
+    Reads fail immediately while it's restarting.
+    '''
+
+    def __init__(
+            self,
+            name: str,
+            sensor_configs: List[Tuple[int, Dict]],
+            ring_buffer_bytes: int = 1048576,
+            watchdog_timeout_seconds: float = 120.0,
+            startup_timeout_seconds: float = 30.0,
+            restart_delay_seconds: float = 5.0,
+            max_restart_delay_seconds: float = 300.0
+    ):
+        self.logger = initialize_logging(logging.getLogger(__name__))
+
+        self.name = name
+        ## (index in the root config's sensors list, sensor config) pairs
+        self.sensor_configs = sensor_configs
+        self.ring_buffer_bytes = ring_buffer_bytes
+        self.watchdog_timeout_seconds = watchdog_timeout_seconds
+        self.startup_timeout_seconds = startup_timeout_seconds
+        self.restart_delay_seconds = restart_delay_seconds
+        self.max_restart_delay_seconds = max_restart_delay_seconds
+
+        ## Spawned rather than forked, so the worker doesn't inherit this process's threads, event loop or open devices
+        self._context = multiprocessing.get_context("spawn")
+        self._log_queue = self._context.Queue()
+        self._log_listener = QueueListener(self._log_queue, ForwardedLogHandler())
+
+        self.process: Optional[multiprocessing.process.BaseProcess] = None
+        self._connection = None
+        self._ring: Optional[SharedMemoryRing] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._ready = False
+        self._stopping = False
+        self._startup_timer: Optional[asyncio.TimerHandle] = None
+        self._restart_task: Optional[asyncio.Task] = None
+        self._consecutive_failures = 0
+
+        ## Reads waiting to be sent to the worker, and the requests that have been sent, by request id
+        self._pending: Dict[Tuple[str, str], List[asyncio.Future]] = {}
+        self._requests: Dict[int, Tuple[Dict[Tuple[str, str], List[asyncio.Future]], asyncio.TimerHandle]] = {}
+        self._next_request_id = 0
+
+        ## Metrics
+        self.request_count = 0
+        self.failure_count = 0
+        self.restart_count = 0
+
+
+    @classmethod
+    def from_config(cls, name: str, sensor_configs: List[Tuple[int, Dict]], config: ConfigSection) -> 'SensorWorkerPool':
+        return cls(
+            name,
+            sensor_configs,
+            ring_buffer_bytes=config.get_int('ring_buffer_bytes', 1048576, minimum=1024),
+            watchdog_timeout_seconds=config.get_float('watchdog_timeout_seconds', 120.0, minimum=0.001),
+            startup_timeout_seconds=config.get_float('startup_timeout_seconds', 30.0, minimum=0.001),
+            restart_delay_seconds=config.get_float('restart_delay_seconds', 5.0, minimum=0),
+            max_restart_delay_seconds=config.get_float('max_restart_delay_seconds', 300.0, minimum=0)
+        )
+
+    ## Methods
+
+    def start(self) -> List[Tuple[int, WorkerSensorProxy]]:
+        '''
+        Starts the worker, and waits for it to start up its sensors. Returns a proxy for every sensor that the worker
+        started, along with the index of the config it was started from.
+        '''
+
+        self._log_listener.start()
+        self._spawn()
+
+        try:
+            if (not self._connection.poll(self.startup_timeout_seconds)):
+                raise SensorWorkerError(f"Worker '{self.name}' didn't start within {self.startup_timeout_seconds} seconds")
+            try:
+                _, sensors = self._connection.recv()
+            except EOFError:
+                self.process.join(1)
+                raise SensorWorkerError(f"Worker '{self.name}' exited while starting up, with code {self.process.exitcode}") from None
+        except SensorWorkerError:
+            self._teardown()
+            self._log_listener.stop()
+            raise
+
+        self._ready = True
+        self.logger.info("Started worker '%s' (pid %s) with %d sensor(s)", self.name, self.process.pid, len(sensors))
+
+        return [(index, WorkerSensorProxy(self, sensor_type, sensor_id)) for index, sensor_type, sensor_id in sensors]
+
+
+    async def stop(self, timeout_seconds: float = 10.0):
+        self._stopping = True
+        if (self._restart_task is not None):
+            self._restart_task.cancel()
+
+        if (self.process is not None and self.process.is_alive()):
+            try:
+                self._connection.send((STOP,))
+                ## Give the worker a chance to close its sensors cleanly
+                deadline = time.monotonic() + timeout_seconds
+                while (self.process.is_alive() and time.monotonic() < deadline):
+                    await asyncio.sleep(0.05)
+            except OSError:
+                pass
+
+        self._teardown()
+        self._fail_all(SensorWorkerError(f"Worker '{self.name}' stopped"))
+        self._log_listener.stop()
+
+
+    def _spawn(self):
+        self._ring = SharedMemoryRing.create(self.ring_buffer_bytes)
+        self._connection, worker_connection = self._context.Pipe()
+        self.process = self._context.Process(
+            target=run_sensor_worker,
+            args=(self.name, self.sensor_configs, self._ring.name, worker_connection, self._log_queue),
+            name=f"sensor-worker-{self.name}",
+            daemon=True
+        )
+        self.process.start()
+        ## The worker has its own copy now
+        worker_connection.close()
+
+
+    def _attach(self, loop: asyncio.AbstractEventLoop):
+        if (self._loop is loop):
+            return
+
+        self._loop = loop
+        loop.add_reader(self._connection.fileno(), self._on_message)
+        loop.add_reader(self.process.sentinel, self._on_process_exit)
+
+
+    def _detach(self):
+        if (self._loop is None):
+            return
+
+        for file_descriptor in (self._connection.fileno(), self.process.sentinel):
+            try:
+                self._loop.remove_reader(file_descriptor)
+            except Exception:
+                pass
+        self._loop = None
+
+
+    def _teardown(self):
+        if (self._startup_timer is not None):
+            self._startup_timer.cancel()
+            self._startup_timer = None
+        self._ready = False
+
+        if (self.process is None):
+            return
+
+        self._detach()
+        if (self.process.is_alive()):
+            ## It's either hung or being shut down, so there's no point in being gentle
+            self.process.kill()
+        self.process.join(1)
+        self._connection.close()
+        self._ring.close()
+        self.process = None
+        self._connection = None
+        self._ring = None
+
+
+    async def read(self, sensor_type: str, sensor_id: str) -> List[SensorDatum]:
+        if (not self._ready):
+            raise SensorWorkerError(f"Worker '{self.name}' isn't running")
+
+        loop = asyncio.get_running_loop()
+        self._attach(loop)
+
+        future = loop.create_future()
+        if (not self._pending):
+            ## Send everything that's requested in this loop iteration together
+            loop.call_soon(self._send_pending)
+        self._pending.setdefault((sensor_type, sensor_id), []).append(future)
+
+        return await future
+
+
+    def _send_pending(self):
+        pending = self._pending
+        self._pending = {}
+        if (not self._ready):
+            self._fail(pending, SensorWorkerError(f"Worker '{self.name}' isn't running"))
+            return
+
+        request_id = self._next_request_id
+        self._next_request_id += 1
+        try:
+            self._connection.send((READ, request_id, list(pending)))
+        except OSError as e:
+            self._fail(pending, SensorWorkerError(f"Unable to send a request to worker '{self.name}': {e}"))
+            self._handle_failure(f"unable to send a request: {e}")
+            return
+
+        watchdog = self._loop.call_later(self.watchdog_timeout_seconds, self._on_watchdog, request_id)
+        self._requests[request_id] = (pending, watchdog)
+        self.request_count += 1
+
+
+    def _on_message(self):
+        try:
+            message = self._connection.recv()
+        except (EOFError, OSError) as e:
+            self._handle_failure(f"lost the connection to the worker: {e!r}")
+            return
+
+        if (message[0] == RESULT):
+            self._handle_result(*message[1:])
+        elif (message[0] == READY):
+            ## A restarted worker is back up
+            if (self._startup_timer is not None):
+                self._startup_timer.cancel()
+                self._startup_timer = None
+            self._ready = True
+            self.restart_count += 1
+            self.logger.info("Restarted worker '%s' (pid %s) with %d sensor(s)", self.name, self.process.pid, len(message[1]))
+
+
+    def _handle_result(self, request_id: int, has_payload: bool, summaries: List[Tuple]):
+        request = self._requests.pop(request_id, None)
+        ## The payload has to be taken out of the ring either way, to keep it in step with the results
+        payload = self._ring.read() if has_payload else None
+        if (request is None):
+            return
+
+        futures_by_key, watchdog = request
+        watchdog.cancel()
+        self._consecutive_failures = 0
+
+        data_by_key: Dict[Tuple[str, str], List[SensorDatum]] = {}
+        if (payload is not None):
+            for datum in DatumCodec.decode(payload):
+                data_by_key.setdefault((datum.sensor_type, datum.sensor_id), []).append(datum)
+
+        for sensor_type, sensor_id, latency_seconds, timed_out, error in summaries:
+            for future in futures_by_key.get((sensor_type, sensor_id), []):
+                if (future.done()):
+                    continue
+                if (timed_out):
+                    future.set_exception(asyncio.TimeoutError())
+                elif (error is not None):
+                    future.set_exception(SensorWorkerError(error))
+                else:
+                    future.set_result(data_by_key.get((sensor_type, sensor_id), []))
+
+
+    def _on_watchdog(self, request_id: int):
+        if (request_id in self._requests):
+            self._handle_failure(f"no response within {self.watchdog_timeout_seconds} seconds")
+
+
+    def _on_startup_timeout(self):
+        self._startup_timer = None
+        if (not self._ready):
+            self._handle_failure(f"didn't start within {self.startup_timeout_seconds} seconds")
+
+
+    def _on_process_exit(self):
+        self._handle_failure(f"exited with code {self.process.exitcode}")
+
+
+    def _fail(self, futures_by_key: Dict[Tuple[str, str], List[asyncio.Future]], error: Exception):
+        for futures in futures_by_key.values():
+            for future in futures:
+                if (not future.done()):
+                    future.set_exception(error)
+
+
+    def _fail_all(self, error: Exception):
+        for futures_by_key, watchdog in self._requests.values():
+            watchdog.cancel()
+            self._fail(futures_by_key, error)
+        self._requests = {}
+        self._fail(self._pending, error)
+        self._pending = {}
+
+
+    def _handle_failure(self, reason: str):
+        if (self._stopping or (self._restart_task is not None and not self._restart_task.done())):
+            return
+
+        loop = self._loop or asyncio.get_running_loop()
+        self.failure_count += 1
+        delay = min(self.restart_delay_seconds * (2 ** self._consecutive_failures), self.max_restart_delay_seconds)
+        self._consecutive_failures += 1
+        self.logger.error("Worker '%s' failed (%s), restarting it in %s seconds", self.name, reason, delay)
+
+        self._teardown()
+        self._fail_all(SensorWorkerError(f"Worker '{self.name}' failed: {reason}"))
+        self._restart_task = loop.create_task(self._restart(delay))
+
+
+    async def _restart(self, delay: float):
+        await asyncio.sleep(delay)
+
+        try:
+            self._spawn()
+        except Exception as e:
+            self._restart_task = None
+            self._handle_failure(f"unable to start: {e}")
+            return
+
+        loop = asyncio.get_running_loop()
+        self._attach(loop)
+        ## Ready once the worker says so, see _on_message
+        self._startup_timer = loop.call_later(self.startup_timeout_seconds, self._on_startup_timeout)
@@ -0,0 +1,111 @@
+import struct
+from multiprocessing.shared_memory import SharedMemory
+from typing import Optional
+
+
+class SharedMemoryRing:
+    '''
+    Single producer, single consumer ring buffer of length prefixed messages in a block of shared memory, for handing
+    large payloads between processes without pickling them through a pipe.
+
+    The header holds the total number of bytes ever written and read, so the free space is always the capacity minus
+    their difference, and each side only ever writes its own counter. Messages can wrap around the end of the buffer.
+    Nothing here blocks or signals, so the producer should let the consumer know (ex: over a pipe) once a message is
+    written, which also orders the writes for the consumer.
+    '''
+
+    _HEADER = struct.Struct("<QQ")
+    _LENGTH = struct.Struct("<I")
+
+    def __init__(self, shared_memory: SharedMemory, owner: bool):
+        self._shared_memory = shared_memory
+        self._owner = owner
+        self._buffer = shared_memory.buf
+        self.capacity = shared_memory.size - self._HEADER.size
+
+    ## Properties
+
+    @property
+    def name(self) -> str:
+        return self._shared_memory.name
+
+
+    @property
+    def used_bytes(self) -> int:
+        write_position, read_position = self._HEADER.unpack_from(self._buffer, 0)
+
+        return write_position - read_position
+
+    ## Methods
+
+    @classmethod
+    def create(cls, capacity: int) -> 'SharedMemoryRing':
+        shared_memory = SharedMemory(create=True, size=capacity + cls._HEADER.size)
+        cls._HEADER.pack_into(shared_memory.buf, 0, 0, 0)
+
+        return cls(shared_memory, owner=True)
+
+
+    @classmethod
+    def attach(cls, name: str) -> 'SharedMemoryRing':
+        ## Processes started by multiprocessing share their parent's resource tracker, so only the creator's unlink
+        ## releases the block, no matter how many processes attach to it
+        return cls(SharedMemory(name=name), owner=False)
+
+
+    def _copy_in(self, position: int, data: bytes):
+        offset = position % self.capacity
+        first = min(len(data), self.capacity - offset)
+        start = self._HEADER.size + offset
+        self._buffer[start:start + first] = data[:first]
+        if (first < len(data)):
+            self._buffer[self._HEADER.size:self._HEADER.size + len(data) - first] = data[first:]
+
+
+    def _copy_out(self, position: int, length: int) -> bytes:
+        offset = position % self.capacity
+        first = min(length, self.capacity - offset)
+        start = self._HEADER.size + offset
+        data = bytes(self._buffer[start:start + first])
+        if (first < length):
+            data += bytes(self._buffer[self._HEADER.size:self._HEADER.size + length - first])
+
+        return data
+
+
+    def write(self, payload: bytes) -> bool:
+        '''Writes the payload as a single message. Returns False (writing nothing) if there isn't room for it.'''
+
+        write_position, read_position = self._HEADER.unpack_from(self._buffer, 0)
+        message_length = self._LENGTH.size + len(payload)
+        if (message_length > self.capacity - (write_position - read_position)):
+            return False
+
+        self._copy_in(write_position, self._LENGTH.pack(len(payload)))
+        self._copy_in(write_position + self._LENGTH.size, payload)
+        ## Publish the message only once it's completely written
+        struct.pack_into("<Q", self._buffer, 0, write_position + message_length)
+
+        return True
+
+
+    def read(self) -> Optional[bytes]:
+        '''Reads the oldest message, or returns None if there aren't any.'''
+
+        write_position, read_position = self._HEADER.unpack_from(self._buffer, 0)
+        if (write_position == read_position):
+            return None
+
+        length, = self._LENGTH.unpack(self._copy_out(read_position, self._LENGTH.size))
+        payload = self._copy_out(read_position + self._LENGTH.size, length)
+        struct.pack_into("<Q", self._buffer, 8, read_position + self._LENGTH.size + length)
+
+        return payload
+
+
+    def close(self):
+        ## The memoryview has to go before the block can be closed
+        self._buffer.release()
+        self._shared_memory.close()
+        if (self._owner):
+            self._shared_memory.unlink()
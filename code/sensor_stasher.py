@@ -4,20 +4,34 @@ import subprocess
 import platform
 import uuid
 import logging
-from datetime import datetime, timedelta
+import time
+from datetime import datetime
+from functools import partial
+from pathlib import Path
+from typing import TYPE_CHECKING, Dict, Hashable, List, Optional
 
 from sensor.sensor_manager import SensorManager
 from sensor.sensor_adapter import SensorAdapter
-from sensor.sensors.ds18b20.ds18b20_driver import DS18B20Driver
-from sensor.sensors.pms7003.pms7003_driver import PMS7003Driver
-from sensor.sensors.sht31.sht31_driver import SHT31Driver
-from sensor.sensors.test_sensor.test_sensor_driver import TestSensorDriver
+from sensor.sensor_datum import SensorDatum
+from sensor.sensor_executor import shutdown_sensor_executor
 
+from scheduler.adaptive_rate_controller import AdaptiveRateController
+from scheduler.sensor_schedule import SensorSchedule
+from scheduler.sensor_scheduler import SensorScheduler
 from storage.storage_manager import StorageManager
 from storage.storage_adapter import StorageAdapter
-from storage.clients.influx.influxdb_client import InfluxDBClient
+from telemetry.metrics_server import MetricsServer
+from telemetry.pipeline_telemetry import PipelineTelemetry
 
-from utilities import load_config, initialize_logging
+from plugin_registry import PluginKind, PluginRegistry
+from utilities import ConfigSection, get_root_path, load_config, initialize_logging
+
+## The optional subsystems are only imported when they're enabled, so that startup only pays for what's configured
+if TYPE_CHECKING:
+    from sensor.sensor_recording import SensorRecorder
+    from sensor.worker.sensor_worker_pool import SensorWorkerPool
+    from relay.relay_gateway import RelayGateway
+    from storage.recent.recent_readings import RecentReadings
 
 
 class SensorStasher:
@@ -25,15 +39,101 @@ class SensorStasher:
         config = load_config()
         self.logger = initialize_logging(logging.getLogger(__name__))
 
-        self.sensor_poll_interval_seconds: int = config.get('sensor_poll_interval_seconds')
-        system_type = config.get('system_type')
+        self.sensor_poll_interval_seconds: int = config.get_int('sensor_poll_interval_seconds', required=True, minimum=1)
+        self.sensor_read_timeout_seconds: float = config.get_float('sensor_read_timeout_seconds', minimum=0)
+        self.sensor_schedule_defaults: Dict = config.get_section('sensor_schedule_defaults')
+        self.sensor_schedules: Dict[str, Dict] = config.get_section('sensor_schedules')
+        self.storage_flush_timeout_seconds: float = config.get_float('storage_flush_timeout_seconds', 30, minimum=0)
+        self.sensor_configs = config.get('sensors', [])
+        self.storage_configs = config.get('storage', [])
+        self.plugin_configs = config.get_section('plugins')
+        self.sensor_workers_config = config.get_section('sensor_workers')
+        self.relay_gateway_config = config.get_section('relay_gateway')
+        telemetry_config = config.get_section('telemetry')
+        recent_readings_config = config.get_section('recent_readings')
+        aggregation_config = config.get_section('aggregation')
+        recording_config = config.get_section('recording')
+        system_type = config.get_str('system_type')
         self.system_type: str = system_type if system_type is not None else platform.platform()
-        system_id = config.get('system_id')
+        system_id = config.get_str('system_id')
         self.system_id: str = system_id if system_id is not None else self._get_system_id()
 
         self._loop = None
-        self.sensor_manager: SensorManager = SensorManager()
-        self.storage_manager: StorageManager = StorageManager(self.system_type, self.system_id)
+        self.sensor_recorder: Optional['SensorRecorder'] = None
+        if (recording_config.get_bool('enabled', False)):
+            from sensor.sensor_recording import SensorRecorder
+
+            self.sensor_recorder = SensorRecorder.from_config(recording_config, Path(get_root_path(), 'recordings'))
+        self.sensor_manager: SensorManager = SensorManager(self.sensor_read_timeout_seconds, self.sensor_recorder)
+        self.storage_manager: StorageManager = StorageManager(
+            self.system_type,
+            self.system_id,
+            config.get_section('storage_writer'),
+            config.get_section('storage_spool'),
+            config.get_section('compression')
+        )
+        self.scheduler: SensorScheduler = SensorScheduler()
+        self.rate_controllers: Dict[SensorAdapter, AdaptiveRateController] = {}
+        self.sensor_worker_pools: List['SensorWorkerPool'] = []
+        self.relay_gateway: Optional['RelayGateway'] = None
+        self.plugin_registry: PluginRegistry = PluginRegistry()
+        for name, target in self.plugin_configs.get_section('sensors').items():
+            self.plugin_registry.register(PluginKind.SENSOR, name, target)
+        for name, target in self.plugin_configs.get_section('storage').items():
+            self.plugin_registry.register(PluginKind.STORAGE, name, target)
+
+        self.telemetry: PipelineTelemetry = None
+        self.recent_readings: Optional['RecentReadings'] = None
+        self.metrics_server: MetricsServer = None
+        if (telemetry_config.get_bool('enabled', True)):
+            self.telemetry = PipelineTelemetry(self.storage_manager)
+        if (recent_readings_config.get_bool('enabled', False)):
+            from storage.recent.recent_readings import RecentReadings
+
+            self.recent_readings = RecentReadings.from_config(recent_readings_config)
+
+        ## The metrics server also serves the recent readings, so it's needed if either of them is enabled
+        if (
+            telemetry_config.get_bool('metrics_server_enabled', True) and
+            (self.telemetry is not None or self.recent_readings is not None)
+        ):
+            self.metrics_server = MetricsServer(
+                telemetry_config.get_str('metrics_server_host', '127.0.0.1'),
+                telemetry_config.get_int('metrics_server_port', 9464, minimum=0),
+                telemetry_config.get_str('metrics_server_unix_socket_path')
+            )
+            if (self.recent_readings is not None):
+                self.recent_readings.register_routes(self.metrics_server)
+
+        if (self.telemetry is not None):
+            if (self.metrics_server is not None):
+                self.metrics_server.add_metric_provider(self.telemetry.get_metric_families)
+                self.metrics_server.add_route(
+                    '/metrics.json',
+                    lambda query: MetricsServer.build_json_response(self.telemetry.get_snapshot())
+                )
+
+            ## Telemetry datums are stored through the same pipeline as sensor data, on their own schedule
+            if (telemetry_config.get_bool('emit_datums', False)):
+                self.scheduler.add(
+                    self.telemetry,
+                    SensorSchedule(telemetry_config.get_float('emit_interval_seconds', 60, minimum=1))
+                )
+
+        self.aggregator = None
+        self.store_raw_data = True
+        self.raw_storage_names = None
+        self.aggregate_storage_names = None
+        if (aggregation_config.get_bool('enabled', False)):
+            ## Only imported when it's used, since it needs NumPy
+            from aggregation.window_aggregator import WindowAggregator
+
+            self.aggregator = WindowAggregator.from_config(aggregation_config)
+            self.store_raw_data = aggregation_config.get_bool('store_raw_data', False)
+            ## Empty lists mean every registered storage adapter
+            self.raw_storage_names = aggregation_config.get('raw_storage') or None
+            self.aggregate_storage_names = aggregation_config.get('aggregate_storage') or None
+            self.scheduler.add(self.aggregator, SensorSchedule(self.aggregator.emit_interval_seconds))
 
         self.logger.debug(f"Initialized SensorStasher with system type: '{self.system_type}', system id: '{self.system_id}', and sensor poll interval: '{self.sensor_poll_interval_seconds}' seconds.")
 
@@ -58,43 +158,303 @@ class SensorStasher:
         return system_id
 
 
-    def register_sensor(self, sensor: SensorAdapter, sensor_id: str):
-        self.sensor_manager.register_sensor(sensor, sensor_id)
+    def _get_schedule_config(self, sensor_type: str, overrides: Dict = None) -> ConfigSection:
+        config = {'interval_seconds': self.sensor_poll_interval_seconds}
+        adaptive_config = {}
+        for layer in (self.sensor_schedule_defaults, self.sensor_schedules.get(sensor_type, {}), overrides or {}):
+            config.update(layer)
+            ## Merged key by key, so that a sensor can change one adaptive setting without repeating all of the others
+            adaptive_config.update(layer.get('adaptive') or {})
+        config['adaptive'] = adaptive_config
 
+        return ConfigSection(config, f"schedule for '{sensor_type}'")
 
-    def register_storage(self, storage: StorageAdapter):
-        self.storage_manager.register_storage(storage)
 
+    def _schedule_sensor(self, sensor: SensorAdapter, overrides: Dict = None, schedule: SensorSchedule = None):
+        '''
+        Schedules a sensor with its sensor type's entry in the 'sensor_schedules' config (merged over the
+        'sensor_schedule_defaults'), and gives it an adaptive rate controller if that's enabled for it.
+        '''
 
-    async def _process_sensor_data_loop(self):
-        while (True):
-            sensor_data = await self.sensor_manager.accumulate_all_sensor_data()
-            active_sensor_ids = {sensor_datum.metadata['sensor_id']: sensor_datum for sensor_datum in sensor_data}
-            self.logger.debug(
-                f"Retrieved {len(sensor_data)} data point{'s' if len(sensor_data) != 1 else ''} from " +
-                f"{len(active_sensor_ids)} sensor{'s' if len(active_sensor_ids) != 1 else ''}."
+        schedule_config = self._get_schedule_config(sensor.sensor_type, overrides)
+        schedule = schedule or SensorSchedule.from_config(schedule_config)
+        self.scheduler.add(sensor, schedule)
+
+        adaptive_config = schedule_config.get_section('adaptive')
+        if (adaptive_config.get_bool('enabled', False)):
+            rate_controller = AdaptiveRateController.from_config(adaptive_config, schedule.interval_seconds)
+            self.rate_controllers[sensor] = rate_controller
+            ## The starting interval gets rounded onto the controller's ladder of intervals
+            self.scheduler.set_interval(sensor, rate_controller.interval_seconds)
+            self.logger.debug(f"Adapting the polling rate of {sensor} {rate_controller}")
+
+
+    def register_sensor(
+            self,
+            sensor: SensorAdapter,
+            sensor_id: str,
+            read_timeout_seconds: float = None,
+            schedule: SensorSchedule = None
+    ):
+        '''
+        Registers a sensor and schedules it. Without an explicit schedule, the sensor type's entry in the
+        'sensor_schedules' config is used, falling back to polling every 'sensor_poll_interval_seconds'.
+        '''
+
+        sensor_instance = self.sensor_manager.register_sensor(sensor, sensor_id, read_timeout_seconds)
+        self._schedule_sensor(sensor_instance, schedule=schedule)
+
+
+    def register_storage(self, storage: StorageAdapter, name: str = None, writer_config: Dict = None):
+        self.storage_manager.register_storage(storage, name, writer_config)
+
+
+    def register_configured_plugins(self):
+        '''
+        Registers the sensors and storage adapters declared in the 'sensors' and 'storage' lists of the config. Only
+        the plugins that are enabled there get imported.
+        '''
+
+        ## Sensors that run in a worker process, grouped by worker name
+        worker_sensor_configs: Dict[str, List] = {}
+
+        for index, sensor_config in enumerate(self.sensor_configs):
+            sensor_config = ConfigSection(sensor_config, f"sensors[{index}]")
+            if (not sensor_config.get_bool('enabled', True)):
+                continue
+
+            worker_name = sensor_config.get_str('worker')
+            if (worker_name):
+                worker_sensor_configs.setdefault(worker_name, []).append((index, dict(sensor_config)))
+                continue
+
+            sensor = self.plugin_registry.get(PluginKind.SENSOR, sensor_config.get_str('type', required=True))
+            ## Discovery expands the entry into one sensor per attached device, all sharing the entry's settings
+            sensor_ids = sensor.get_configured_sensor_ids(sensor_config)
+            if (sensor_config.get_bool('discover', False)):
+                if (not sensor_ids):
+                    self.logger.warning("Didn't discover any sensors for %s", sensor_config.name)
+                else:
+                    self.logger.info("Discovered %d sensor(s) for %s: %s", len(sensor_ids), sensor_config.name, sensor_ids)
+
+            for sensor_id in sensor_ids:
+                sensor_instance = self.sensor_manager.register_sensor(
+                    sensor,
+                    sensor_id,
+                    sensor_config.get_float('read_timeout_seconds', minimum=0)
+                )
+                self._schedule_sensor(sensor_instance, sensor_config.get_section('schedule'))
+
+        if (worker_sensor_configs):
+            from sensor.worker.sensor_worker_pool import SensorWorkerPool
+
+        for worker_name, sensor_configs in worker_sensor_configs.items():
+            pool = SensorWorkerPool.from_config(worker_name, sensor_configs, self.sensor_workers_config)
+            proxies = pool.start()
+            self.sensor_worker_pools.append(pool)
+
+            for index, proxy in proxies:
+                sensor_config = ConfigSection(self.sensor_configs[index], f"sensors[{index}]")
+                ## The worker enforces the sensor's own read timeout, and the watchdog covers the worker itself
+                self.sensor_manager.add_sensor(proxy, pool.watchdog_timeout_seconds)
+                self._schedule_sensor(proxy, sensor_config.get_section('schedule'))
+
+        for index, storage_config in enumerate(self.storage_configs):
+            storage_config = ConfigSection(storage_config, f"storage[{index}]")
+            if (not storage_config.get_bool('enabled', True)):
+                continue
+
+            self.register_storage(
+                self._get_configured_storage(storage_config),
+                storage_config.get_str('name'),
+                storage_config.get_section('writer')
             )
 
-            self.storage_manager.store(sensor_data)
+        if (self.relay_gateway_config.get_bool('enabled', False)):
+            self.register_relay_gateway()
+
+
+    def _get_configured_storage(self, storage_config: ConfigSection) -> StorageAdapter:
+        storage = self.plugin_registry.get(PluginKind.STORAGE, storage_config.get_str('type', required=True))
+        ## Lets the same adapter be registered more than once with different settings (ex: a different bucket)
+        config_overrides = storage_config.get_section('config')
+        if (config_overrides):
+            storage = partial(storage, config_overrides=config_overrides)
+
+        return storage
+
+
+    def register_relay_gateway(self):
+        '''
+        Turns this stasher into a relay gateway, which accepts readings from edge stashers (ones using the Relay storage
+        adapter) and writes them upstream in large, coalesced batches. The gateway writes to the storage adapters in
+        the 'relay_gateway' config's own 'storage' list, or to instances of the main 'storage' list's adapters if
+        that's empty. Either way, it keeps its own instances (and connections) apart from this stasher's own writers.
+        Edges have to sign their frames with the gateway's 'auth_token', and it only listens on localhost unless its
+        'host' is set.
+        '''
+
+        from relay.relay_gateway import RelayGateway
+
+        storage_configs = self.relay_gateway_config.get('storage') or self.storage_configs
+        storages: Dict[str, StorageAdapter] = {}
+        for index, storage_config in enumerate(storage_configs):
+            storage_config = ConfigSection(storage_config, f"relay_gateway.storage[{index}]")
+            if (not storage_config.get_bool('enabled', True)):
+                continue
+
+            storage_instance = self._get_configured_storage(storage_config)(self.system_type, self.system_id)
+            name = storage_config.get_str('name') or storage_instance.storage_type
+            if (name in storages):
+                name = f"{name}-{index}"
+            storages[name] = storage_instance
+
+        self.relay_gateway = RelayGateway.from_config(storages, self.relay_gateway_config)
+        if (self.metrics_server is not None):
+            self.metrics_server.add_metric_provider(self.relay_gateway.get_metric_families)
+
+
+    async def _process_sensor(self, sensor: SensorAdapter, tick_wall_time: float):
+        start = time.perf_counter()
+
+        try:
+            await self._read_and_store_sensor(sensor, tick_wall_time)
+        finally:
+            if (self.telemetry is not None):
+                self.telemetry.record_cycle(
+                    sensor.sensor_type,
+                    sensor.sensor_id,
+                    time.perf_counter() - start,
+                    self.scheduler.jobs.get(sensor)
+                )
+
+
+    async def _read_and_store_sensor(self, sensor: SensorAdapter, tick_wall_time: float):
+        results = await self.sensor_manager.read_sensors([sensor])
+        if (self.telemetry is not None):
+            for result in results:
+                self.telemetry.record_read(result)
+        sensor_data = [datum for result in results for datum in result.data]
+
+        ## Stamp everything with the tick's nominal time, so that readings from sensors sharing a boundary line up
+        if (sensor.align_timestamps_to_tick):
+            tick_timestamp_ns = round(tick_wall_time * 1_000_000) * 1000
+            for datum in sensor_data:
+                datum.timestamp_ns = tick_timestamp_ns
+
+        ## Recorded as soon as they're read, rather than after the storage writers have batched them up
+        if (self.recent_readings is not None):
+            self.recent_readings.record(sensor_data)
+
+        ## Takes effect from the sensor's next tick
+        rate_controller = self.rate_controllers.get(sensor)
+        if (rate_controller is not None):
+            self.scheduler.set_interval(sensor, rate_controller.observe(sensor_data))
+
+        active_sensor_ids = {sensor_datum.sensor_id: sensor_datum for sensor_datum in sensor_data}
+        ## Building these messages isn't free, so skip it entirely unless they'll actually be logged
+        debug_enabled = self.logger.isEnabledFor(logging.DEBUG)
+        if (debug_enabled):
             self.logger.debug(
-                f"Stored {len(sensor_data)} data point{'s' if len(sensor_data) != 1 else ''} inside " +
-                f"{self.storage_manager.storage.storage_type}."
+                "Retrieved %d data point(s) from %d sensor(s) for tick at %s. Sensor read results: %s",
+                len(sensor_data),
+                len(active_sensor_ids),
+                datetime.fromtimestamp(tick_wall_time),
+                [str(result) for result in results]
             )
 
-            ## DEBUG level has more detailed info, but offer up a simplified version for less intense log levels
-            if (self.logger.level == logging.INFO):
-                self.logger.info(
-                    f"Retrieved and stored {len(sensor_data)} data point{'s' if len(sensor_data) != 1 else ''} " +
-                    f"from {len(active_sensor_ids)} sensor{'s' if len(active_sensor_ids) != 1 else ''} " +
-                    f"inside {self.storage_manager.storage.storage_type}. " +
-                    f"Will now sleep for {self.sensor_poll_interval_seconds} seconds."
-                )
+        failed_reads = [result for result in results if not result.succeeded]
+        if (failed_reads):
+            self.logger.warning(
+                "%d sensor read(s) failed: %s",
+                len(failed_reads),
+                [str(result) for result in failed_reads]
+            )
 
+        if (not sensor_data):
+            return
+
+        await self._store_sensor_data(sensor_data)
+        if (debug_enabled):
             self.logger.debug(
-                f"Sleeping for {self.sensor_poll_interval_seconds} seconds, next poll starts at: " +
-                f"{datetime.now() + timedelta(seconds=self.sensor_poll_interval_seconds)}"
+                "Queued %d data point(s) for storage inside %s. Writer status: %s",
+                len(sensor_data),
+                ", ".join(self.storage_manager.storage_names),
+                self.storage_manager.get_metrics()
             )
-            await asyncio.sleep(self.sensor_poll_interval_seconds)
+
+        ## DEBUG level has more detailed info, but offer up a simplified version for less intense log levels
+        if (self.logger.level == logging.INFO):
+            self.logger.info(
+                "Retrieved and queued %d data point(s) from %d sensor(s) inside %s.",
+                len(sensor_data),
+                len(active_sensor_ids),
+                ", ".join(self.storage_manager.storage_names)
+            )
+
+
+    async def _store_sensor_data(self, sensor_data: List[SensorDatum]):
+        if (self.aggregator is None):
+            await self.storage_manager.store(sensor_data)
+            return
+
+        ## Readings that are being aggregated are only stored raw if asked to, and only in the raw storage adapters
+        aggregated_data, passthrough_data = self.aggregator.add(sensor_data)
+        if (passthrough_data):
+            await self.storage_manager.store(passthrough_data)
+        if (aggregated_data and self.store_raw_data):
+            await self.storage_manager.store(aggregated_data, self.raw_storage_names)
+
+
+    async def _emit_aggregates(self, tick_wall_time: float):
+        aggregate_data = self.aggregator.flush(round(tick_wall_time * 1_000_000) * 1000)
+        if (aggregate_data):
+            await self.storage_manager.store(aggregate_data, self.aggregate_storage_names)
+
+
+    async def _emit_telemetry(self, tick_wall_time: float):
+        telemetry_data = self.telemetry.build_datums()
+
+        tick_timestamp_ns = round(tick_wall_time * 1_000_000) * 1000
+        for datum in telemetry_data:
+            datum.timestamp_ns = tick_timestamp_ns
+
+        await self.storage_manager.store(telemetry_data)
+
+
+    async def _dispatch(self, key: Hashable, tick_wall_time: float):
+        if (key is self.telemetry):
+            await self._emit_telemetry(tick_wall_time)
+        elif (key is self.aggregator):
+            await self._emit_aggregates(tick_wall_time)
+        else:
+            await self._process_sensor(key, tick_wall_time)
+
+
+    async def _process_sensor_data_loop(self):
+        ## A dedicated gateway might not have any storage of its own, just the gateway's upstreams
+        if (self.relay_gateway is None or self.storage_manager.writers):
+            await self.storage_manager.start()
+        if (self.metrics_server is not None):
+            await self.metrics_server.start()
+        if (self.relay_gateway is not None):
+            await self.relay_gateway.start()
+
+        try:
+            await self.scheduler.run(self._dispatch)
+        finally:
+            try:
+                ## Don't lose the readings from the final, partial window
+                if (self.aggregator is not None):
+                    await self._emit_aggregates(time.time())
+            finally:
+                await self.sensor_manager.close()
+                await asyncio.gather(*[pool.stop() for pool in self.sensor_worker_pools])
+                if (self.relay_gateway is not None):
+                    await self.relay_gateway.stop()
+                if (self.metrics_server is not None):
+                    await self.metrics_server.stop()
+                await self.storage_manager.stop(self.storage_flush_timeout_seconds)
 
 
     def start_monitoring(self):
@@ -111,16 +471,10 @@ class SensorStasher:
         self._loop.close()
         self._loop = None
 
+        shutdown_sensor_executor(wait=False)
+
 
 if (__name__ == '__main__'):
     monitor = SensorStasher()
-    # monitor.register_sensor(DS18B20Driver, None)
-    # monitor.register_sensor(PMS7003Driver, None)
-    # monitor.register_sensor(SHT31Driver, None)
-    monitor.register_sensor(TestSensorDriver, 'test_sensor_0')
-    monitor.register_sensor(TestSensorDriver, 'test_sensor_1')
-    monitor.register_sensor(TestSensorDriver, 'test_sensor_2')
-    monitor.register_sensor(TestSensorDriver, 'test_sensor_3')
-    monitor.register_sensor(TestSensorDriver, 'test_sensor_4')
-    monitor.register_storage(InfluxDBClient)
+    monitor.register_configured_plugins()
     monitor.start_monitoring()
@@ -0,0 +1,90 @@
+import logging
+import math
+from array import array
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+from storage.storage_adapter import StorageAdapter
+from sensor.datum_batch import DatumBatch
+from sensor.sensor_datum import SensorDatum
+from .columnar_archive import ColumnarArchive, SeriesKey
+from utilities import get_root_path, load_config, initialize_logging
+
+
+class ArchiveStorage(StorageAdapter):
+    '''
+    Storage adapter that keeps every numeric field in a local ColumnarArchive, so that nodes without a network
+    connection still have somewhere to keep their data (and something to query it from). Non numeric fields aren't
+    archived.
+
+    Any config_overrides are merged over the values from config.json (ex: to keep a second archive elsewhere).
+    '''
+
+    consumes_batches = True
+
+    def __init__(self, system_type: str, system_id: str, config_overrides: Dict = None):
+        config = load_config(Path(__file__).parent)
+        config.update(config_overrides or {})
+        self.logger = initialize_logging(logging.getLogger(__name__))
+
+        archive_path = config.get_str('path')
+        self.path = Path(archive_path) if archive_path else Path(get_root_path(), 'archive')
+        self.retention_days = config.get_int('retention_days', 0, minimum=0)
+        self.fsync = config.get_bool('fsync', True)
+        self.max_future_seconds = config.get_float('max_future_seconds', 3600, minimum=0)
+        self.system_type = system_type
+        self.system_id = system_id
+
+        self._storage_type = 'Archive'
+
+        self.archive = ColumnarArchive(self.path, self.retention_days, self.fsync, max_future_seconds=self.max_future_seconds)
+
+        self.logger.debug(f"Initialized archive storage. path: '{self.path}', retention_days: {self.retention_days}, fsync: {self.fsync}")
+
+    ## Properties
+
+    @property
+    def storage_type(self) -> str:
+        return self._storage_type
+
+    ## Methods
+
+    @staticmethod
+    def _add_batch_columns(batch: DatumBatch, columns: Dict[SeriesKey, Tuple[array, array]]):
+        rows_by_sensor_id: Dict[str, List[int]] = {}
+        for row, sensor_id in enumerate(batch.sensor_ids):
+            rows_by_sensor_id.setdefault(sensor_id, []).append(row)
+
+        for name, column in batch.columns.items():
+            ## Only the numeric columns are typed arrays
+            if (not isinstance(column, array)):
+                continue
+
+            for sensor_id, rows in rows_by_sensor_id.items():
+                timestamps_ns, values = columns.setdefault((batch.sensor_type, sensor_id, name), (array('q'), array('d')))
+                for row in rows:
+                    value = column[row]
+                    ## Missing values are NaN in a batch, and are just left out of the archive
+                    if (not math.isnan(value)):
+                        timestamps_ns.append(batch.timestamps_ns[row])
+                        values.append(value)
+
+
+    def store(self, data: List[SensorDatum]):
+        columns: Dict[SeriesKey, Tuple[array, array]] = {}
+        for batch in DatumBatch.from_data(data):
+            self._add_batch_columns(batch, columns)
+
+        self.archive.append(columns)
+
+
+    def store_batches(self, batches: List[DatumBatch]):
+        columns: Dict[SeriesKey, Tuple[array, array]] = {}
+        for batch in batches:
+            self._add_batch_columns(batch, columns)
+
+        self.archive.append(columns)
+
+
+    def close(self):
+        self.archive.close()
@@ -0,0 +1,533 @@
+import bisect
+import json
+import logging
+import math
+import mmap
+import os
+import shutil
+import struct
+import threading
+import time
+from array import array
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+from utilities import initialize_logging
+
+
+## (sensor type, sensor id, field)
+SeriesKey = Tuple[str, str, str]
+
+NS_PER_DAY = 24 * 60 * 60 * 1_000_000_000
+
+
+class SeriesSummary:
+    '''Running stats for one series in one day's partition, so that whole days can be aggregated without reading them.'''
+
+    __slots__ = ("count", "first_timestamp_ns", "last_timestamp_ns", "minimum", "maximum", "total", "ordered")
+
+    def __init__(self):
+        self.count = 0
+        self.first_timestamp_ns = 0
+        self.last_timestamp_ns = 0
+        self.minimum = math.inf
+        self.maximum = -math.inf
+        self.total = 0.0
+        ## Whether the timestamps have only ever been appended in order, which lets queries binary search them
+        self.ordered = True
+
+    ## Methods
+
+    def add(self, timestamps_ns: array, values: array):
+        if (not timestamps_ns):
+            return
+
+        in_order = all(earlier <= later for earlier, later in zip(timestamps_ns, timestamps_ns[1:]))
+        earliest = timestamps_ns[0] if in_order else min(timestamps_ns)
+        latest = timestamps_ns[-1] if in_order else max(timestamps_ns)
+        if (self.count == 0):
+            self.first_timestamp_ns = earliest
+            self.last_timestamp_ns = latest
+        else:
+            in_order = in_order and timestamps_ns[0] >= self.last_timestamp_ns
+            self.first_timestamp_ns = min(self.first_timestamp_ns, earliest)
+            self.last_timestamp_ns = max(self.last_timestamp_ns, latest)
+
+        self.count += len(timestamps_ns)
+        self.minimum = min(self.minimum, min(values))
+        self.maximum = max(self.maximum, max(values))
+        self.total += math.fsum(values)
+        self.ordered = self.ordered and in_order
+
+
+class ColumnarArchive:
+    '''
+    Local, append-only time series archive. Every numeric series (sensor type, sensor id and field) is stored as a pair
+    of fixed width columns, partitioned into one directory per UTC day:
+
+        <directory>/
+            series.json             The series catalog, where each series' number is its index in the list
+            2026-10-18/
+                000001.ts           int64 little endian timestamps (ns since the unix epoch)
+                000001.val          float64 little endian values
+                index.bin           A SeriesSummary record for every series in the partition
+
+    Appends are done a whole batch at a time, with one write per column file. Reads memory map the column files and
+    binary search the timestamps, so a range query only touches the pages it returns. Aggregate queries use the
+    partition summaries for every day that's entirely inside the range, and only scan the days at either end, which
+    keeps queries over months of data down to milliseconds.
+
+    Partitions more than retention_days behind the current (UTC) day are deleted as the archive rolls over into new
+    days. Retention follows the clock rather than the newest reading, and readings more than max_future_seconds ahead
+    of the clock are rejected, so that one reading from a node with a bad clock can't expire everything else. A single
+    process should write to the archive, but any number can read it (see refresh()).
+    '''
+
+    CATALOG_NAME = "series.json"
+    INDEX_NAME = "index.bin"
+    TIMESTAMPS_SUFFIX = ".ts"
+    VALUES_SUFFIX = ".val"
+    DAY_FORMAT = "%Y-%m-%d"
+
+    _INDEX_HEADER = struct.Struct("<4sI")
+    _INDEX_MAGIC = b"SAI1"
+    ## series number, count, first timestamp, last timestamp, minimum, maximum, total, ordered
+    _INDEX_RECORD = struct.Struct("<IQqqdddB")
+    _COLUMN_ITEM_SIZE = 8
+
+    def __init__(
+            self,
+            directory: Path,
+            retention_days: int = 0,
+            fsync: bool = True,
+            read_only: bool = False,
+            max_future_seconds: float = 3600,
+            clock: Callable[[], int] = time.time_ns
+    ):
+        self.logger = initialize_logging(logging.getLogger(__name__))
+
+        self.directory = Path(directory)
+        self.retention_days = retention_days
+        self.fsync = fsync
+        self.read_only = read_only
+        self.max_future_seconds = max_future_seconds
+        self._clock = clock
+
+        if (not read_only):
+            self.directory.mkdir(parents=True, exist_ok=True)
+
+        ## The writer and any number of readers can share an instance, so the in-memory index is guarded
+        self._lock = threading.RLock()
+        self._series: List[SeriesKey] = []
+        self._series_numbers: Dict[SeriesKey, int] = {}
+        self._summaries: Dict[int, Dict[int, SeriesSummary]] = {}
+        ## Open append handles for (day, series number), as (timestamps file, values file)
+        self._handles: Dict[Tuple[int, int], Tuple] = {}
+        self._latest_day: Optional[int] = None
+        ## The day that retention was last enforced for
+        self._retention_day: Optional[int] = None
+
+        ## Metrics
+        self.rejected_count = 0
+
+        self.refresh()
+        if (not read_only):
+            self.enforce_retention()
+
+    ## Properties
+
+    @property
+    def days(self) -> List[int]:
+        with self._lock:
+            return sorted(self._summaries)
+
+
+    @property
+    def series(self) -> List[SeriesKey]:
+        with self._lock:
+            return list(self._series)
+
+    ## Methods
+
+    @classmethod
+    def _get_day_name(cls, day: int) -> str:
+        return (datetime(1970, 1, 1, tzinfo=timezone.utc) + timedelta(days=day)).strftime(cls.DAY_FORMAT)
+
+
+    @classmethod
+    def _parse_day_name(cls, name: str) -> Optional[int]:
+        try:
+            return (datetime.strptime(name, cls.DAY_FORMAT).replace(tzinfo=timezone.utc) - datetime(1970, 1, 1, tzinfo=timezone.utc)).days
+        except ValueError:
+            return None
+
+
+    def _get_partition_path(self, day: int) -> Path:
+        return Path(self.directory, self._get_day_name(day))
+
+
+    def _get_column_paths(self, day: int, series_number: int) -> Tuple[Path, Path]:
+        partition_path = self._get_partition_path(day)
+
+        return (
+            Path(partition_path, f"{series_number:06d}{self.TIMESTAMPS_SUFFIX}"),
+            Path(partition_path, f"{series_number:06d}{self.VALUES_SUFFIX}")
+        )
+
+
+    def _replace_file(self, path: Path, data: bytes):
+        ## Write then rename, so a crash can never leave a half written file behind
+        temporary_path = path.with_suffix(".tmp")
+        with open(temporary_path, "wb") as fd:
+            fd.write(data)
+            if (self.fsync):
+                fd.flush()
+                os.fsync(fd.fileno())
+        os.replace(temporary_path, path)
+
+
+    def refresh(self):
+        '''(Re)loads the series catalog and partition indexes from disk, ex: to see what another process has written.'''
+
+        with self._lock:
+            catalog_path = Path(self.directory, self.CATALOG_NAME)
+            if (catalog_path.exists()):
+                with open(catalog_path) as fd:
+                    self._series = [tuple(key) for key in json.load(fd)["series"]]
+                self._series_numbers = {key: number for number, key in enumerate(self._series)}
+
+            self._summaries = {}
+            if (self.directory.exists()):
+                for path in self.directory.iterdir():
+                    day = self._parse_day_name(path.name) if path.is_dir() else None
+                    if (day is not None):
+                        self._summaries[day] = self._load_index(day)
+
+            self._latest_day = max(self._summaries, default=None)
+
+
+    def _load_index(self, day: int) -> Dict[int, SeriesSummary]:
+        summaries: Dict[int, SeriesSummary] = {}
+        index_path = Path(self._get_partition_path(day), self.INDEX_NAME)
+        try:
+            data = index_path.read_bytes()
+            magic, count = self._INDEX_HEADER.unpack_from(data, 0)
+            if (magic != self._INDEX_MAGIC):
+                raise ValueError(f"Unknown index format {magic}")
+            for offset in range(self._INDEX_HEADER.size, self._INDEX_HEADER.size + count * self._INDEX_RECORD.size, self._INDEX_RECORD.size):
+                series_number, *fields = self._INDEX_RECORD.unpack_from(data, offset)
+                summary = SeriesSummary()
+                (
+                    summary.count,
+                    summary.first_timestamp_ns,
+                    summary.last_timestamp_ns,
+                    summary.minimum,
+                    summary.maximum,
+                    summary.total,
+                    summary.ordered
+                ) = fields
+                summary.ordered = bool(summary.ordered)
+                summaries[series_number] = summary
+        except FileNotFoundError:
+            pass
+        except (ValueError, struct.error) as e:
+            self.logger.warning("Unable to parse the index of archive partition %s, rebuilding it. %s", self._get_day_name(day), e)
+
+        ## The index is written after the columns, so a crash in between leaves the index behind its columns
+        for path in self._get_partition_path(day).glob(f"*{self.TIMESTAMPS_SUFFIX}"):
+            if (not path.stem.isdigit()):
+                continue
+            series_number = int(path.stem)
+            summary = summaries.get(series_number)
+            if (summary is None or summary.count != self._get_column_count(day, series_number)):
+                summaries[series_number] = self._rebuild_summary(day, series_number)
+
+        return summaries
+
+
+    def _save_index(self, day: int):
+        summaries = self._summaries.get(day, {})
+        parts = [self._INDEX_HEADER.pack(self._INDEX_MAGIC, len(summaries))]
+        for series_number, summary in summaries.items():
+            parts.append(self._INDEX_RECORD.pack(
+                series_number,
+                summary.count,
+                summary.first_timestamp_ns,
+                summary.last_timestamp_ns,
+                summary.minimum,
+                summary.maximum,
+                summary.total,
+                summary.ordered
+            ))
+
+        self._replace_file(Path(self._get_partition_path(day), self.INDEX_NAME), b"".join(parts))
+
+
+    def _get_column_count(self, day: int, series_number: int) -> int:
+        ## A torn append can leave the columns at different lengths, so only rows that made it into both count
+        timestamps_path, values_path = self._get_column_paths(day, series_number)
+        try:
+            return min(timestamps_path.stat().st_size, values_path.stat().st_size) // self._COLUMN_ITEM_SIZE
+        except FileNotFoundError:
+            return 0
+
+
+    def _rebuild_summary(self, day: int, series_number: int) -> SeriesSummary:
+        summary = SeriesSummary()
+        with self._map_columns(day, series_number) as (timestamps_ns, values, count):
+            if (count):
+                summary.add(array('q', timestamps_ns[:count]), array('d', values[:count]))
+
+        return summary
+
+
+    def _get_series_number(self, key: SeriesKey) -> int:
+        series_number = self._series_numbers.get(key)
+        if (series_number is None):
+            series_number = len(self._series)
+            self._series.append(key)
+            self._series_numbers[key] = series_number
+            self._replace_file(
+                Path(self.directory, self.CATALOG_NAME),
+                json.dumps({"series": self._series}).encode("utf-8")
+            )
+
+        return series_number
+
+
+    def _get_handles(self, day: int, series_number: int) -> Tuple:
+        handles = self._handles.get((day, series_number))
+        if (handles is None):
+            self._get_partition_path(day).mkdir(parents=True, exist_ok=True)
+            timestamps_path, values_path = self._get_column_paths(day, series_number)
+            handles = (open(timestamps_path, "ab"), open(values_path, "ab"))
+
+            ## Drop any partial row left behind by a torn append, so that the columns line up again
+            count = self._get_column_count(day, series_number)
+            for handle in handles:
+                if (handle.tell() != count * self._COLUMN_ITEM_SIZE):
+                    handle.truncate(count * self._COLUMN_ITEM_SIZE)
+                    handle.seek(0, os.SEEK_END)
+
+            self._handles[(day, series_number)] = handles
+
+        return handles
+
+
+    def _close_handles(self, keep_day: int = None):
+        for key in [key for key in self._handles if key[0] != keep_day]:
+            for handle in self._handles.pop(key):
+                handle.close()
+
+
+    def append(self, columns: Dict[SeriesKey, Tuple[array, array]]):
+        '''
+        Appends the (timestamps_ns, values) columns of each series. Rows are routed into their day's partition, and
+        each column file is written to once per call.
+        '''
+
+        if (self.read_only):
+            raise RuntimeError(f"The archive at '{self.directory}' was opened read only")
+
+        now_ns = self._clock()
+        latest_allowed_ns = now_ns + round(self.max_future_seconds * 1_000_000_000)
+
+        with self._lock:
+            ## Split each series' rows up by day first, in the common case that's just a single chunk
+            chunks: Dict[Tuple[int, int], Tuple[array, array]] = {}
+            rejected_count = 0
+            for key, (timestamps_ns, values) in columns.items():
+                if (timestamps_ns and max(timestamps_ns) > latest_allowed_ns):
+                    kept_rows = [row for row, timestamp_ns in enumerate(timestamps_ns) if timestamp_ns <= latest_allowed_ns]
+                    rejected_count += len(timestamps_ns) - len(kept_rows)
+                    timestamps_ns = array('q', (timestamps_ns[row] for row in kept_rows))
+                    values = array('d', (values[row] for row in kept_rows))
+                if (not timestamps_ns):
+                    continue
+
+                series_number = self._get_series_number(key)
+                first_day = timestamps_ns[0] // NS_PER_DAY
+                if (first_day == timestamps_ns[-1] // NS_PER_DAY and first_day == min(timestamps_ns) // NS_PER_DAY):
+                    chunks[(first_day, series_number)] = (timestamps_ns, values)
+                    continue
+
+                for timestamp_ns, value in zip(timestamps_ns, values):
+                    chunk = chunks.setdefault((timestamp_ns // NS_PER_DAY, series_number), (array('q'), array('d')))
+                    chunk[0].append(timestamp_ns)
+                    chunk[1].append(value)
+
+            touched_days = set()
+            for (day, series_number), (timestamps_ns, values) in chunks.items():
+                timestamps_file, values_file = self._get_handles(day, series_number)
+                timestamps_file.write(timestamps_ns.tobytes())
+                values_file.write(values.tobytes())
+                self._summaries.setdefault(day, {}).setdefault(series_number, SeriesSummary()).add(timestamps_ns, values)
+                touched_days.add(day)
+
+            for timestamps_file, values_file in (self._handles[key] for key in chunks):
+                timestamps_file.flush()
+                values_file.flush()
+                if (self.fsync):
+                    os.fsync(timestamps_file.fileno())
+                    os.fsync(values_file.fileno())
+
+            for day in touched_days:
+                self._save_index(day)
+
+            if (rejected_count):
+                self.rejected_count += rejected_count
+                self.logger.warning(
+                    "Rejected %d reading(s) timestamped more than %ss in the future, check the clock of whatever recorded them",
+                    rejected_count,
+                    self.max_future_seconds
+                )
+
+            latest_day = max(touched_days, default=self._latest_day)
+            if (latest_day is not None and (self._latest_day is None or latest_day > self._latest_day)):
+                self._latest_day = latest_day
+            if (self._retention_day is None or now_ns // NS_PER_DAY > self._retention_day):
+                self.enforce_retention()
+            ## Only the newest day's files are kept open, as anything older only gets the occasional late reading
+            self._close_handles(self._latest_day)
+
+
+    def enforce_retention(self):
+        if (self.retention_days <= 0):
+            return
+
+        with self._lock:
+            self._retention_day = self._clock() // NS_PER_DAY
+            oldest_day = self._retention_day - self.retention_days + 1
+            expired_days = sorted(day for day in self._summaries if day < oldest_day)
+            if (expired_days):
+                self._close_handles(self._latest_day)
+            for day in expired_days:
+                shutil.rmtree(self._get_partition_path(day), ignore_errors=True)
+                del self._summaries[day]
+                self.logger.info("Deleted archive partition %s, as it's past the %d day retention", self._get_day_name(day), self.retention_days)
+
+
+    @contextmanager
+    def _map_columns(self, day: int, series_number: int) -> Iterator[Tuple[memoryview, memoryview, int]]:
+        '''Memory maps a series' columns in a partition, yielding (timestamps, values, row count).'''
+
+        timestamps_path, values_path = self._get_column_paths(day, series_number)
+        count = self._get_column_count(day, series_number)
+        if (count == 0):
+            ## Empty files can't be mapped
+            yield (memoryview(b"").cast('q'), memoryview(b"").cast('d'), 0)
+            return
+
+        with open(timestamps_path, "rb") as timestamps_fd, open(values_path, "rb") as values_fd:
+            with mmap.mmap(timestamps_fd.fileno(), count * self._COLUMN_ITEM_SIZE, access=mmap.ACCESS_READ) as timestamps_map, \
+                    mmap.mmap(values_fd.fileno(), count * self._COLUMN_ITEM_SIZE, access=mmap.ACCESS_READ) as values_map:
+                timestamps_ns = memoryview(timestamps_map).cast('q')
+                values = memoryview(values_map).cast('d')
+                try:
+                    yield (timestamps_ns, values, count)
+                finally:
+                    ## The maps can't be closed while there are still views into them
+                    timestamps_ns.release()
+                    values.release()
+
+
+    def _get_query_plan(self, key: SeriesKey, start_ns: int = None, end_ns: int = None) -> List[Tuple[int, int, SeriesSummary]]:
+        ## (day, series number, summary) for each partition that might have readings in [start_ns, end_ns)
+        with self._lock:
+            series_number = self._series_numbers.get(tuple(key))
+            if (series_number is None):
+                return []
+
+            plan = []
+            for day in sorted(self._summaries):
+                if (start_ns is not None and (day + 1) * NS_PER_DAY <= start_ns):
+                    continue
+                if (end_ns is not None and day * NS_PER_DAY >= end_ns):
+                    break
+                summary = self._summaries[day].get(series_number)
+                if (summary is not None and summary.count):
+                    plan.append((day, series_number, summary))
+
+            return plan
+
+
+    @staticmethod
+    def _get_row_range(timestamps_ns: memoryview, count: int, start_ns: int = None, end_ns: int = None) -> Tuple[int, int]:
+        first = 0 if start_ns is None else bisect.bisect_left(timestamps_ns, start_ns, 0, count)
+        last = count if end_ns is None else bisect.bisect_left(timestamps_ns, end_ns, first, count)
+
+        return (first, last)
+
+
+    def query_range(self, key: SeriesKey, start_ns: int = None, end_ns: int = None) -> Tuple[array, array]:
+        '''Returns the timestamps and values of the series' readings in [start_ns, end_ns), in partition order.'''
+
+        result_timestamps_ns = array('q')
+        result_values = array('d')
+        for day, series_number, summary in self._get_query_plan(key, start_ns, end_ns):
+            with self._map_columns(day, series_number) as (timestamps_ns, values, count):
+                if (summary.ordered):
+                    first, last = self._get_row_range(timestamps_ns, count, start_ns, end_ns)
+                    result_timestamps_ns.frombytes(timestamps_ns[first:last].tobytes())
+                    result_values.frombytes(values[first:last].tobytes())
+                else:
+                    for timestamp_ns, value in zip(timestamps_ns, values):
+                        if ((start_ns is None or timestamp_ns >= start_ns) and (end_ns is None or timestamp_ns < end_ns)):
+                            result_timestamps_ns.append(timestamp_ns)
+                            result_values.append(value)
+
+        return (result_timestamps_ns, result_values)
+
+
+    def query_aggregate(self, key: SeriesKey, start_ns: int = None, end_ns: int = None) -> Dict[str, Optional[float]]:
+        '''
+        Returns the count, min, max, sum and mean of the series' readings in [start_ns, end_ns). Partitions that are
+        entirely inside the range are aggregated from their summaries, without reading their columns.
+        '''
+
+        count = 0
+        minimum = math.inf
+        maximum = -math.inf
+        totals = []
+        for day, series_number, summary in self._get_query_plan(key, start_ns, end_ns):
+            if ((start_ns is None or summary.first_timestamp_ns >= start_ns) and (end_ns is None or summary.last_timestamp_ns < end_ns)):
+                count += summary.count
+                minimum = min(minimum, summary.minimum)
+                maximum = max(maximum, summary.maximum)
+                totals.append(summary.total)
+                continue
+
+            with self._map_columns(day, series_number) as (timestamps_ns, values, row_count):
+                if (summary.ordered):
+                    first, last = self._get_row_range(timestamps_ns, row_count, start_ns, end_ns)
+                    selected = values[first:last]
+                else:
+                    selected = array('d', (
+                        value for timestamp_ns, value in zip(timestamps_ns, values)
+                        if (start_ns is None or timestamp_ns >= start_ns) and (end_ns is None or timestamp_ns < end_ns)
+                    ))
+
+                if (len(selected)):
+                    count += len(selected)
+                    minimum = min(minimum, min(selected))
+                    maximum = max(maximum, max(selected))
+                    totals.append(math.fsum(selected))
+                if (isinstance(selected, memoryview)):
+                    selected.release()
+
+        total = math.fsum(totals)
+
+        return {
+            "count": count,
+            "min": minimum if count else None,
+            "max": maximum if count else None,
+            "sum": total if count else None,
+            "mean": total / count if count else None
+        }
+
+
+    def close(self):
+        with self._lock:
+            self._close_handles()
@@ -0,0 +1,158 @@
+import threading
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional
+
+
+class InfluxStubServer:
+    '''
+    Local stand-in for InfluxDB's /api/v2/write endpoint, so the real InfluxDB client (encoding, compression and HTTP)
+    and the storage writer's pipeline in front of it can be tested and benchmarked without a database. Bodies are
+    decompressed and their lines counted, but they're only kept if keep_lines is set. fail_next() makes the next few
+    writes fail, to exercise the writer's retries.
+    '''
+
+    WRITE_PATH = "/api/v2/write"
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, keep_lines: bool = False):
+        self.host = host
+        self.port = port
+        self.keep_lines = keep_lines
+
+        self._lock = threading.Lock()
+        self.request_count = 0
+        self.line_count = 0
+        self.compressed_bytes = 0
+        self.uncompressed_bytes = 0
+        self.failed_request_count = 0
+        self.lines: List[str] = []
+        self._failures_remaining = 0
+        self._failure_status = 503
+
+        self._server: ThreadingHTTPServer = None
+        self._thread: threading.Thread = None
+
+    ## Properties
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+
+        return f"http://{host}:{port}"
+
+    ## Methods
+
+    def fail_next(self, count: int, status: int = 503):
+        '''Answers the next count writes with the given error status, rather than accepting them.'''
+
+        with self._lock:
+            self._failures_remaining = count
+            self._failure_status = status
+
+
+    def _take_failure(self) -> Optional[int]:
+        with self._lock:
+            if (self._failures_remaining <= 0):
+                return None
+
+            self._failures_remaining -= 1
+            self.failed_request_count += 1
+            return self._failure_status
+
+
+    def _record_write(self, compressed_bytes: int, body: bytes):
+        with self._lock:
+            self.request_count += 1
+            self.line_count += body.count(b"\n") + (1 if body and not body.endswith(b"\n") else 0)
+            self.compressed_bytes += compressed_bytes
+            self.uncompressed_bytes += len(body)
+            if (self.keep_lines):
+                self.lines.extend(str(body, "utf-8").splitlines())
+
+
+    def _build_handler(self) -> type:
+        stub = self
+
+        class WriteHandler(BaseHTTPRequestHandler):
+            ## Keep-alive, like the real thing, so the client's persistent connection gets exercised
+            protocol_version = "HTTP/1.1"
+
+            def _read_body(self) -> bytes:
+                if (self.headers.get("Transfer-Encoding", "").lower() == "chunked"):
+                    chunks = []
+                    while (True):
+                        size = int(self.rfile.readline().split(b";", 1)[0].strip(), 16)
+                        if (size == 0):
+                            ## Skip any trailers, up to the final blank line
+                            while (self.rfile.readline() not in (b"\r\n", b"\n", b"")):
+                                pass
+                            break
+                        chunks.append(self.rfile.read(size))
+                        self.rfile.readline()
+                    return b"".join(chunks)
+
+                return self.rfile.read(int(self.headers.get("Content-Length", 0)))
+
+
+            def _respond(self, status: int, body: bytes = b""):
+                self.send_response(status)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+
+            def do_POST(self):
+                body = self._read_body()
+                if (not self.path.startswith(stub.WRITE_PATH)):
+                    self._respond(404)
+                    return
+
+                failure_status = stub._take_failure()
+                if (failure_status is not None):
+                    self._respond(failure_status, b'{"code":"unavailable","message":"Failure injected by the stub"}')
+                    return
+
+                compressed_bytes = len(body)
+                if (self.headers.get("Content-Encoding", "").lower() == "gzip"):
+                    try:
+                        body = zlib.decompress(body, 31)
+                    except zlib.error as e:
+                        self._respond(400, f"Invalid gzip body: {e}".encode("utf-8"))
+                        return
+
+                stub._record_write(compressed_bytes, body)
+                self._respond(204)
+
+
+            def log_message(self, format, *args):
+                ## Logging every request would swamp the benchmark
+                pass
+
+        return WriteHandler
+
+
+    def start(self) -> 'InfluxStubServer':
+        self._server = ThreadingHTTPServer((self.host, self.port), self._build_handler())
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, name="influx-stub", daemon=True)
+        self._thread.start()
+
+        return self
+
+
+    def stop(self):
+        if (self._server is not None):
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+
+    def get_stats(self) -> Dict:
+        with self._lock:
+            return {
+                "requests": self.request_count,
+                "failed_requests": self.failed_request_count,
+                "lines": self.line_count,
+                "compressed_bytes": self.compressed_bytes,
+                "uncompressed_bytes": self.uncompressed_bytes
+            }
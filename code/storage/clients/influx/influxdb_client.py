@@ -1,31 +1,59 @@
-from pathlib import Path
-from typing import List
+import http.client
 import logging
-import influxdb_client
-from influxdb_client.client.write_api import SYNCHRONOUS
+from itertools import chain
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Tuple
+from urllib.parse import urlencode, urlsplit
 
 from storage.storage_adapter import StorageAdapter
+from sensor.datum_batch import DatumBatch
 from sensor.sensor_datum import SensorDatum
+from .line_protocol_encoder import LineProtocolEncoder, WritePrecision
 from utilities import load_config, initialize_logging
 
 class InfluxDBClient(StorageAdapter):
-    def __init__(self, system_type: str, system_id: str):
+    '''
+    Writes datums into InfluxDB (v2) through its /api/v2/write endpoint. Each write is one streamed, gzip compressed
+    body of line protocol sent over a persistent HTTP connection, which is transparently reopened if the server drops
+    it.
+
+    Any config_overrides are merged over the values from config.json (ex: to point a benchmark at a local endpoint).
+    '''
+
+    consumes_batches = True
+
+    def __init__(self, system_type: str, system_id: str, config_overrides: Dict = None):
         config = load_config(Path(__file__).parent)
+        config.update(config_overrides or {})
         self.logger = initialize_logging(logging.getLogger(__name__))
 
-        self.url = config.get('url')
-        self.api_token = config.get('api_token')
-        self.organization = config.get('organization')
-        self.bucket = config.get('bucket')
+        self.url = config.get_str('url', required=True)
+        self.api_token = config.get_str('api_token', required=True)
+        self.organization = config.get_str('organization', required=True)
+        self.bucket = config.get_str('bucket', required=True)
+        self.precision = WritePrecision(config.get_str('precision', WritePrecision.NANOSECONDS.value))
+        self.gzip = config.get_bool('gzip', True)
+        self.gzip_level = config.get_int('gzip_level', 6, minimum=0)
+        self.timeout_seconds = config.get_float('timeout_seconds', 10, minimum=0)
         self.system_type = system_type
         self.system_id = system_id
 
         self._storage_type = 'InfluxDB'
 
-        self.client = influxdb_client.InfluxDBClient(url=self.url, token=self.api_token, org=self.organization)
-        self.write_api = self.client.write_api(write_options=SYNCHRONOUS)
+        self.encoder = LineProtocolEncoder(self.precision)
+        self._connection: http.client.HTTPConnection = None
 
-        self.logger.debug(f"Initialized InfluxDB client. url: '{self.url}', organization: '{self.organization}', bucket: '{self.bucket}'")
+        url = urlsplit(self.url)
+        self._connection_class = http.client.HTTPSConnection if url.scheme == 'https' else http.client.HTTPConnection
+        self._host = url.hostname
+        self._port = url.port
+        self._write_path = url.path.rstrip('/') + '/api/v2/write?' + urlencode({
+            'org': self.organization,
+            'bucket': self.bucket,
+            'precision': self.precision.value
+        })
+
+        self.logger.debug(f"Initialized InfluxDB client. url: '{self.url}', organization: '{self.organization}', bucket: '{self.bucket}', precision: '{self.precision.value}', gzip: {self.gzip}")
 
     ## Properties
 
@@ -35,31 +63,75 @@ class InfluxDBClient(StorageAdapter):
 
     ## Methods
 
-    def _build_points_from_data(self, data: SensorDatum) -> List[influxdb_client.Point]:
-        category = data.metadata.get('category')
-        sensor_type = data.metadata.get('sensor_type')
-        sensor_id = data.metadata.get('sensor_id')
-        timestamp = data.metadata.get('timestamp')
+    def _get_connection(self) -> http.client.HTTPConnection:
+        if (self._connection is None):
+            self._connection = self._connection_class(self._host, self._port, timeout=self.timeout_seconds)
+
+        return self._connection
+
+
+    def _build_body(self, lines: List[str]) -> Iterator[bytes]:
+        if (self.gzip):
+            return self.encoder.iter_gzip(lines, self.gzip_level)
+        else:
+            return iter([("\n".join(lines)).encode("utf-8")])
 
-        points: List[influxdb_client.Point] = []
 
-        for key, value in data.to_dict().items():
-            point = influxdb_client.Point(category) \
-                .tag("system_type", self.system_type) \
-                .tag("system_id", self.system_id) \
-                .tag("sensor_type", sensor_type) \
-                .tag("sensor_id", sensor_id) \
-                .time(timestamp) \
-                .field(key, value)
+    def _post(self, lines: List[str]):
+        headers = {
+            'Authorization': f"Token {self.api_token}",
+            'Content-Type': 'text/plain; charset=utf-8',
+            'Accept': 'application/json'
+        }
+        if (self.gzip):
+            headers['Content-Encoding'] = 'gzip'
 
-            points.append(point)
+        connection = self._get_connection()
+        connection.request('POST', self._write_path, body=self._build_body(lines), headers=headers, encode_chunked=True)
+        response = connection.getresponse()
+        body = response.read()
 
-        return points
+        if (response.status != 204):
+            raise RuntimeError(f"InfluxDB write failed with status {response.status}: {body.decode('utf-8', errors='replace')}")
+
+
+    def write_lines(self, lines: Iterable[str]):
+        lines = list(lines)
+        if (not lines):
+            return
+
+        try:
+            self._post(lines)
+        except (http.client.HTTPException, ConnectionError) as e:
+            ## The kept-alive connection may have been dropped by the server since the last write, so reconnect and
+            ## try once more before giving up
+            self.logger.debug(f"Reconnecting to InfluxDB after connection error: {e}")
+            self.close()
+            self._post(lines)
+        except Exception:
+            self.close()
+            raise
 
 
     def store(self, data: List[SensorDatum]):
-        points = []
-        for datum in data:
-            points.extend(self._build_points_from_data(datum))
+        self.write_lines(self.encoder.iter_lines(data, self.system_type, self.system_id))
+
+
+    def store_batches(self, batches: List[DatumBatch]):
+        self.write_lines(chain.from_iterable(
+            self.encoder.iter_batch_lines(batch, self.system_type, self.system_id) for batch in batches
+        ))
+
+
+    def store_relayed(self, data_by_system: Dict[Tuple[str, str], List[SensorDatum]]):
+        ## Every system's readings go out in the same request, each tagged with the system that read them
+        self.write_lines(chain.from_iterable(
+            self.encoder.iter_lines(data, system_type, system_id)
+            for (system_type, system_id), data in data_by_system.items()
+        ))
+
 
-        self.write_api.write(self.bucket, self.organization, points)
+    def close(self):
+        if (self._connection is not None):
+            self._connection.close()
+            self._connection = None
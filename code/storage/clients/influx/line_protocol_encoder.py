@@ -0,0 +1,179 @@
+import math
+import zlib
+from enum import Enum
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+from sensor.datum_batch import DatumBatch
+from sensor.sensor_datum import SensorDatum
+
+
+class WritePrecision(Enum):
+    NANOSECONDS = "ns"
+    MICROSECONDS = "us"
+    MILLISECONDS = "ms"
+    SECONDS = "s"
+
+    ## Properties
+
+    @property
+    def divisor(self) -> int:
+        return {"ns": 1, "us": 1_000, "ms": 1_000_000, "s": 1_000_000_000}[self.value]
+
+
+class LineProtocolEncoder:
+    '''
+    Encodes datums into InfluxDB line protocol, with one multi-field line per datum. The escaped measurement and tag
+    set for each (category, system, sensor) combination is only built once and then cached, so encoding a datum is
+    just a matter of formatting its fields and timestamp.
+
+    See: https://docs.influxdata.com/influxdb/v2/reference/syntax/line-protocol/
+    '''
+
+    ## Clear out the tag set cache if it ever grows past this many entries, rather than letting it grow unbounded
+    MAX_CACHED_TAG_SETS = 10000
+    ## How much line protocol to buffer up before handing it off to the compressor
+    GZIP_CHUNK_BYTES = 64 * 1024
+
+    _MEASUREMENT_ESCAPES = str.maketrans({",": "\\,", " ": "\\ "})
+    _KEY_ESCAPES = str.maketrans({",": "\\,", "=": "\\=", " ": "\\ "})
+    _STRING_ESCAPES = str.maketrans({"\"": "\\\"", "\\": "\\\\"})
+
+    def __init__(self, precision: WritePrecision = WritePrecision.NANOSECONDS):
+        self.precision = precision
+
+        self._tag_sets: Dict[Tuple[str, str, str, str, str], str] = {}
+        self._field_keys: Dict[str, str] = {}
+
+    ## Methods
+
+    def _escape_key(self, value: str) -> str:
+        return str(value).translate(self._KEY_ESCAPES)
+
+
+    def _get_tag_set(self, category: str, system_type: str, system_id: str, sensor_type: str, sensor_id: str) -> str:
+        key = (category, system_type, system_id, sensor_type, sensor_id)
+        tag_set = self._tag_sets.get(key)
+
+        if (tag_set is None):
+            if (len(self._tag_sets) >= self.MAX_CACHED_TAG_SETS):
+                self._tag_sets.clear()
+
+            ## Tags are sorted by key (as Influx recommends), and empty tag values aren't allowed so they're skipped
+            tags = sorted({
+                "sensor_id": sensor_id,
+                "sensor_type": sensor_type,
+                "system_id": system_id,
+                "system_type": system_type
+            }.items())
+            tag_set = str(category).translate(self._MEASUREMENT_ESCAPES) + "".join(
+                f",{name}={self._escape_key(value)}" for name, value in tags if value is not None and value != ""
+            )
+            self._tag_sets[key] = tag_set
+
+        return tag_set
+
+
+    def _get_field_key(self, name: str) -> str:
+        field_key = self._field_keys.get(name)
+        if (field_key is None):
+            field_key = self._escape_key(name)
+            self._field_keys[name] = field_key
+
+        return field_key
+
+
+    def _format_field(self, name: str, value) -> Optional[str]:
+        '''Formats a single field, or returns None if its value can't be written (NaN or infinity).'''
+
+        ## bool has to be checked before int, since it's a subclass of it
+        if (isinstance(value, bool)):
+            formatted = "true" if value else "false"
+        elif (isinstance(value, int)):
+            formatted = f"{value}i"
+        elif (isinstance(value, float)):
+            ## Influx doesn't accept NaN or infinity
+            if (not math.isfinite(value)):
+                return None
+            formatted = repr(value)
+        else:
+            formatted = f"\"{str(value).translate(self._STRING_ESCAPES)}\""
+
+        return f"{self._get_field_key(name)}={formatted}"
+
+
+    def _format_line(self, tag_set: str, fields: Iterable[Tuple[str, object]], timestamp_ns: int) -> Optional[str]:
+        '''Formats a whole line, or returns None if none of its fields have a value that can be written.'''
+
+        field_set = ",".join(
+            field for field in (self._format_field(name, value) for name, value in fields if value is not None)
+            if field is not None
+        )
+
+        ## A line needs at least one field, so readings without any values are dropped
+        if (not field_set):
+            return None
+
+        return f"{tag_set} {field_set} {timestamp_ns // self.precision.divisor}"
+
+
+    def encode_datum(self, datum: SensorDatum, system_type: str, system_id: str) -> Optional[str]:
+        '''
+        Encodes the datum as a single line, or returns None if it doesn't have any values that can be written (ex: all
+        of its fields are missing or NaN), since Influx won't take a line without any fields.
+        '''
+
+        tag_set = self._get_tag_set(datum.category, system_type, system_id, datum.sensor_type, datum.sensor_id)
+
+        return self._format_line(tag_set, ((name, getattr(datum, name)) for name in datum.schema), datum.timestamp_ns)
+
+
+    def iter_lines(self, data: Iterable[SensorDatum], system_type: str, system_id: str) -> Iterator[str]:
+        for datum in data:
+            line = self.encode_datum(datum, system_type, system_id)
+            if (line is not None):
+                yield line
+
+
+    def iter_batch_lines(self, batch: DatumBatch, system_type: str, system_id: str) -> Iterator[str]:
+        names = list(batch.columns.keys())
+
+        for index in range(len(batch)):
+            tag_set = self._get_tag_set(batch.category, system_type, system_id, batch.sensor_type, batch.sensor_ids[index])
+            line = self._format_line(
+                tag_set,
+                ((name, batch.get_value(name, index)) for name in names),
+                batch.timestamps_ns[index]
+            )
+            if (line is not None):
+                yield line
+
+
+    def encode(self, data: Iterable[SensorDatum], system_type: str, system_id: str) -> bytes:
+        return "\n".join(self.iter_lines(data, system_type, system_id)).encode("utf-8")
+
+
+    def iter_gzip(self, lines: Iterable[str], level: int = 6) -> Iterator[bytes]:
+        '''
+        Streams gzip compressed line protocol, compressing it in chunks rather than building up the whole body first.
+        '''
+
+        compressor = zlib.compressobj(level, zlib.DEFLATED, 31)   # wbits of 31 gets a gzip header and trailer
+        buffer: List[str] = []
+        buffered_bytes = 0
+
+        for line in lines:
+            buffer.append(line)
+            buffered_bytes += len(line) + 1
+            if (buffered_bytes >= self.GZIP_CHUNK_BYTES):
+                chunk = compressor.compress(("\n".join(buffer) + "\n").encode("utf-8"))
+                buffer = []
+                buffered_bytes = 0
+                if (chunk):
+                    yield chunk
+
+        if (buffer):
+            chunk = compressor.compress(("\n".join(buffer) + "\n").encode("utf-8"))
+            if (chunk):
+                yield chunk
+
+        yield compressor.flush()
@@ -0,0 +1,87 @@
+import threading
+import time
+from collections import deque
+from pathlib import Path
+from typing import Deque, Dict, List
+
+from storage.storage_adapter import StorageAdapter
+from sensor.datum_batch import DatumBatch
+from sensor.sensor_datum import SensorDatum
+from utilities import load_config
+
+
+class MemoryStorage(StorageAdapter):
+    '''
+    Storage adapter that keeps everything in memory, for benchmarks and for trying out the pipeline without a database.
+    It counts what it's been given (per sensor type, too), and optionally keeps the most recent max_kept_datums datums
+    around for inspection. An artificial write_latency_seconds can be added to stand in for a slower sink.
+    '''
+
+    consumes_batches = True
+
+    def __init__(self, system_type: str, system_id: str, config_overrides: Dict = None):
+        config = load_config(Path(__file__).parent)
+        config.update(config_overrides or {})
+
+        self.max_kept_datums = config.get_int('max_kept_datums', 0, minimum=0)
+        self.write_latency_seconds = config.get_float('write_latency_seconds', 0.0, minimum=0)
+        self.system_type = system_type
+        self.system_id = system_id
+
+        self._storage_type = 'Memory'
+        ## Kept datums have to be rebuilt from the batches anyway, so it's cheaper to just be handed the datums
+        self.consumes_batches = not self.max_kept_datums
+
+        ## Writes come in from the storage writer's thread, while counts may be read from anywhere
+        self._lock = threading.Lock()
+        self.stored_count = 0
+        self.stored_batch_count = 0
+        self.stored_counts_by_sensor_type: Dict[str, int] = {}
+        self.data: Deque[SensorDatum] = deque(maxlen=self.max_kept_datums)
+
+    ## Properties
+
+    @property
+    def storage_type(self) -> str:
+        return self._storage_type
+
+    ## Methods
+
+    def _count(self, sensor_type: str, count: int):
+        self.stored_counts_by_sensor_type[sensor_type] = self.stored_counts_by_sensor_type.get(sensor_type, 0) + count
+
+
+    def store(self, data: List[SensorDatum]):
+        if (self.write_latency_seconds):
+            time.sleep(self.write_latency_seconds)
+
+        with self._lock:
+            self.stored_count += len(data)
+            self.stored_batch_count += 1
+            for datum in data:
+                self._count(datum.sensor_type, 1)
+            if (self.max_kept_datums):
+                self.data.extend(data)
+
+
+    def store_batches(self, batches: List[DatumBatch]):
+        if (self.max_kept_datums):
+            self.store([datum for batch in batches for datum in batch.to_datums()])
+            return
+
+        if (self.write_latency_seconds):
+            time.sleep(self.write_latency_seconds)
+
+        with self._lock:
+            self.stored_count += sum(len(batch) for batch in batches)
+            self.stored_batch_count += 1
+            for batch in batches:
+                self._count(batch.sensor_type, len(batch))
+
+
+    def reset(self):
+        with self._lock:
+            self.stored_count = 0
+            self.stored_batch_count = 0
+            self.stored_counts_by_sensor_type = {}
+            self.data.clear()
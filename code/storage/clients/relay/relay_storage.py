@@ -0,0 +1,135 @@
+import logging
+import random
+import socket
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from storage.storage_adapter import StorageAdapter
+from sensor.sensor_datum import SensorDatum
+from relay.relay_protocol import ACK, RelayProtocolError, RelayStatus, decode_ack, encode_frame
+from utilities import load_config, initialize_logging
+
+
+class RelayBusyError(RuntimeError):
+    pass
+
+
+class RelayStorage(StorageAdapter):
+    '''
+    Forwards datums to a relay gateway (see RelayGateway) rather than writing them anywhere itself, so that a fleet of
+    edge stashers can share the gateway's few, large upstream writes instead of each holding its own connection and
+    credentials. Each batch is sent as a single compressed frame over a persistent TCP connection, and a store only
+    returns once the gateway has written the batch upstream.
+
+    A busy or failing gateway raises from store(), so the storage writer's retries (and the spool, if it's enabled)
+    hold onto the data until the gateway can take it.
+
+    Every frame is signed with auth_token, which has to match the gateway's own auth_token.
+
+    Each batch gets the next sequence number in this storage's session, and a batch is only resent (with that same
+    sequence) when its ack never came back, so that the gateway can tell a resend from a new batch and doesn't write it
+    upstream twice.
+
+    Any config_overrides are merged over the values from config.json.
+    '''
+
+    def __init__(self, system_type: str, system_id: str, config_overrides: Dict = None):
+        config = load_config(Path(__file__).parent)
+        config.update(config_overrides or {})
+        self.logger = initialize_logging(logging.getLogger(__name__))
+
+        self.host = config.get_str('host', required=True)
+        self.port = config.get_int('port', 7465, minimum=1)
+        self.auth_token = config.get_str('auth_token', required=True)
+        if (not self.auth_token):
+            raise ValueError("No auth_token was given for the relay gateway")
+        self.compression_level = config.get_int('compression_level', 6, minimum=0)
+        ## Has to cover the gateway's flush interval and its upstream write, since that's when the ack comes back
+        self.timeout_seconds = config.get_float('timeout_seconds', 60, minimum=0)
+        self.system_type = system_type
+        self.system_id = system_id
+
+        self._storage_type = 'Relay'
+
+        self._socket: Optional[socket.socket] = None
+        ## Random, so that the gateway doesn't mistake a restarted edge's first batches for resends of old ones
+        self._session = random.getrandbits(64)
+        self._sequence = 0
+
+        self.logger.debug(f"Initialized relay storage. host: '{self.host}', port: {self.port}, compression_level: {self.compression_level}")
+
+    ## Properties
+
+    @property
+    def storage_type(self) -> str:
+        return self._storage_type
+
+    ## Methods
+
+    def _get_socket(self) -> socket.socket:
+        if (self._socket is None):
+            self._socket = socket.create_connection((self.host, self.port), timeout=self.timeout_seconds)
+            self._socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+        return self._socket
+
+
+    def _receive_exactly(self, sock: socket.socket, length: int) -> bytes:
+        data = b""
+        while (len(data) < length):
+            chunk = sock.recv(length - len(data))
+            if (not chunk):
+                raise ConnectionError("Relay gateway closed the connection")
+            data += chunk
+
+        return data
+
+
+    def _send(self, frame: bytes) -> RelayStatus:
+        sock = self._get_socket()
+        sock.sendall(frame)
+
+        return decode_ack(self._receive_exactly(sock, ACK.size))
+
+
+    def store(self, data: List[SensorDatum]):
+        if (not data):
+            return
+
+        self._sequence += 1
+        frame = encode_frame(
+            self.system_type,
+            self.system_id,
+            data,
+            self.auth_token,
+            self._session,
+            self._sequence,
+            self.compression_level
+        )
+        try:
+            status = self._send(frame)
+        except (ConnectionError, socket.timeout) as e:
+            ## The kept-alive connection may have been dropped by the gateway since the last write, so reconnect and
+            ## try once more before giving up. No ack came back, so the gateway may well have the batch already, and
+            ## the resend keeps its sequence so that the gateway can ack it without storing it again
+            self.logger.debug(f"Reconnecting to the relay gateway after connection error: {e}")
+            self.close()
+            try:
+                status = self._send(frame)
+            except Exception:
+                self.close()
+                raise
+        except (OSError, RelayProtocolError):
+            self.close()
+            raise
+
+        if (status == RelayStatus.BUSY):
+            raise RelayBusyError(f"Relay gateway {self.host}:{self.port} is too busy to take {len(data)} datum(s)")
+        elif (status != RelayStatus.OK):
+            raise RuntimeError(f"Relay gateway {self.host}:{self.port} failed to store {len(data)} datum(s): {status.name}")
+
+
+    def close(self):
+        if (self._socket is not None):
+            self._socket.close()
+            self._socket = None
@@ -0,0 +1,355 @@
+import math
+from array import array
+from enum import Enum
+from typing import Dict, Iterable, List, Optional, Tuple, Type
+
+from sensor.datum_batch import DatumBatch
+from sensor.sensor_datum import SensorDatum
+from utilities import ConfigSection
+
+
+class CompressionMode(Enum):
+    ## Store every value
+    NONE = "none"
+    ## Store a value once it's moved far enough from the last stored value
+    DEADBAND = "deadband"
+    ## Store just the points needed to linearly interpolate the signal to within the deviation
+    SWINGING_DOOR = "swinging_door"
+
+
+class FieldCompression:
+    '''How a single field is compressed. Deviations can be absolute, or a percentage of the last stored value.'''
+
+    def __init__(
+            self,
+            mode: CompressionMode = CompressionMode.NONE,
+            deviation: float = 0.0,
+            percent: float = 0.0,
+            max_silence_seconds: float = None
+    ):
+        self.mode = mode
+        self.deviation = deviation
+        self.percent = percent
+        self.max_silence_seconds = max_silence_seconds
+
+
+    def __str__(self) -> str:
+        return (
+            f"{self.mode.value}, deviation: {self.deviation}, percent: {self.percent}, " +
+            f"max silence: {self.max_silence_seconds}s"
+        )
+
+
+    @classmethod
+    def from_config(cls, config: ConfigSection, defaults: 'FieldCompression' = None) -> 'FieldCompression':
+        defaults = defaults or FieldCompression()
+
+        return cls(
+            mode=CompressionMode(config.get_str('mode', defaults.mode.value)),
+            deviation=config.get_float('deviation', defaults.deviation, minimum=0),
+            percent=config.get_float('percent', defaults.percent, minimum=0),
+            max_silence_seconds=config.get_float('max_silence_seconds', defaults.max_silence_seconds, minimum=0)
+        )
+
+    ## Methods
+
+    def get_deviation(self, reference: float) -> float:
+        return max(self.deviation, abs(reference) * self.percent / 100.0)
+
+
+class SeriesState:
+    '''
+    Compression state for one series (datum class, sensor type and sensor id), with one slot per field in each of its
+    compact arrays. NaN marks a field that hasn't been stored yet.
+    '''
+
+    __slots__ = (
+        "stored_values", "stored_ns",
+        "upper_slopes", "lower_slopes",
+        "previous_values", "previous_ns"
+    )
+
+    def __init__(self, field_count: int):
+        ## Last stored (archived) point of each field
+        self.stored_values = array('d', [math.nan] * field_count)
+        self.stored_ns = array('q', [0] * field_count)
+        ## Swinging door slopes (per nanosecond), as of the latest point
+        self.upper_slopes = array('d', [-math.inf] * field_count)
+        self.lower_slopes = array('d', [math.inf] * field_count)
+        ## Latest point received for each field, which a swinging door may need to go back and store
+        self.previous_values = array('d', [math.nan] * field_count)
+        self.previous_ns = array('q', [0] * field_count)
+
+
+    def copy(self) -> 'SeriesState':
+        state = SeriesState.__new__(SeriesState)
+        for name in SeriesState.__slots__:
+            setattr(state, name, array(getattr(self, name).typecode, getattr(self, name)))
+
+        return state
+
+
+class CompressionFilter:
+    '''
+    Per field deadband and swinging door compression of a stream of datums. Values that can be reconstructed from what's
+    already been stored (to within the field's deviation) are dropped, leaving just the points that matter. Every field
+    is stored at least once per max_silence_seconds regardless, as a heartbeat showing the sensor is still alive.
+
+    Since a swinging door only knows that a point was needed once a later point breaks through the door, the output can
+    include datums for earlier readings, with just the fields that need them. Those points are stored as they sit on
+    the line fitted through the doors (within the deviation of the raw reading), which keeps every reading in between
+    within tolerance of the interpolated signal.
+    '''
+
+    def __init__(self, default: FieldCompression = None, sensor_types: Dict[str, Dict[str, FieldCompression]] = None):
+        self.default = default or FieldCompression()
+        ## Sensor type -> field name -> compression, with the "*" field being the sensor type's default
+        self.sensor_types = sensor_types or {}
+
+        self._states: Dict[Tuple[Type[SensorDatum], str, str], SeriesState] = {}
+        self._categories: Dict[Tuple[Type[SensorDatum], str, str], str] = {}
+        ## (datum class, sensor type) -> (numeric field names, and their compression settings)
+        self._fields: Dict[Tuple[Type[SensorDatum], str], Tuple[List[str], List[FieldCompression]]] = {}
+
+        ## Metrics
+        self.received_count = 0
+        self.stored_count = 0
+
+
+    @classmethod
+    def from_config(cls, config: ConfigSection) -> 'CompressionFilter':
+        '''
+        Builds a filter from a config like:
+            {
+                "default": {"mode": "none"},
+                "sensor_types": {
+                    "DS18B20": {"mode": "swinging_door", "deviation": 0.1, "max_silence_seconds": 900},
+                    "SHT31": {"mode": "deadband", "deviation": 0.2, "fields": {"humidity_relative": {"percent": 1}}}
+                }
+            }
+        '''
+
+        default = FieldCompression.from_config(config.get_section('default'))
+
+        sensor_types = {}
+        for sensor_type, sensor_type_config in config.get_section('sensor_types').items():
+            sensor_type_config = ConfigSection(sensor_type_config, f"sensor_types.{sensor_type}")
+            sensor_type_default = FieldCompression.from_config(sensor_type_config, default)
+            fields = {"*": sensor_type_default}
+            for field, field_config in sensor_type_config.get_section('fields').items():
+                fields[field] = FieldCompression.from_config(
+                    ConfigSection(field_config, f"sensor_types.{sensor_type}.fields.{field}"),
+                    sensor_type_default
+                )
+            sensor_types[sensor_type] = fields
+
+        return cls(default, sensor_types)
+
+    ## Properties
+
+    @property
+    def compression_ratio(self) -> float:
+        '''Stored field values per received field value, so lower is better.'''
+
+        return (self.stored_count / self.received_count) if self.received_count else 1.0
+
+    ## Methods
+
+    def _get_fields(self, datum_class: Type[SensorDatum], sensor_type: str) -> Tuple[List[str], List[FieldCompression]]:
+        key = (datum_class, sensor_type)
+        fields = self._fields.get(key)
+        if (fields is None):
+            sensor_type_fields = self.sensor_types.get(sensor_type, {})
+            sensor_type_default = sensor_type_fields.get("*", self.default)
+            names = [name for name, field_type in datum_class.schema.items() if field_type in DatumBatch.NUMERIC_TYPES]
+            fields = (names, [sensor_type_fields.get(name, sensor_type_default) for name in names])
+            self._fields[key] = fields
+
+        return fields
+
+
+    def snapshot(self, data: Iterable[SensorDatum]) -> Dict[Tuple[Type[SensorDatum], str, str], Optional[SeriesState]]:
+        '''
+        Copies the state of just the series that the data belongs to (None for series that haven't been seen yet), so
+        that filtering it can be rolled back with restore() if the filtered data fails to store.
+        '''
+
+        snapshot = {}
+        for datum in data:
+            key = (type(datum), datum.sensor_type, datum.sensor_id)
+            if (key not in snapshot):
+                state = self._states.get(key)
+                snapshot[key] = state.copy() if state is not None else None
+
+        return snapshot
+
+
+    def restore(self, snapshot: Dict[Tuple[Type[SensorDatum], str, str], Optional[SeriesState]]):
+        for key, state in snapshot.items():
+            if (state is None):
+                self._states.pop(key, None)
+                self._categories.pop(key, None)
+            else:
+                self._states[key] = state
+
+
+    def _store_point(self, state: SeriesState, index: int, timestamp_ns: int, value: float):
+        state.stored_values[index] = value
+        state.stored_ns[index] = timestamp_ns
+        state.upper_slopes[index] = -math.inf
+        state.lower_slopes[index] = math.inf
+
+
+    def _is_silent_too_long(self, compression: FieldCompression, state: SeriesState, index: int, timestamp_ns: int) -> bool:
+        return (
+            compression.max_silence_seconds is not None and
+            timestamp_ns - state.stored_ns[index] >= compression.max_silence_seconds * 1_000_000_000
+        )
+
+
+    def _update_doors(self, compression: FieldCompression, state: SeriesState, index: int, timestamp_ns: int, value: float) -> bool:
+        '''
+        Narrows the field's doors to fit the new point. If they'd no longer overlap, then they're left as they were and
+        False is returned.
+        '''
+
+        elapsed_ns = timestamp_ns - state.stored_ns[index]
+        if (elapsed_ns <= 0):
+            return True
+
+        stored_value = state.stored_values[index]
+        deviation = compression.get_deviation(stored_value)
+        upper_slope = max(state.upper_slopes[index], (value - stored_value - deviation) / elapsed_ns)
+        lower_slope = min(state.lower_slopes[index], (value - stored_value + deviation) / elapsed_ns)
+        if (upper_slope > lower_slope):
+            return False
+
+        state.upper_slopes[index] = upper_slope
+        state.lower_slopes[index] = lower_slope
+
+        return True
+
+
+    def _get_door_value(self, state: SeriesState, index: int, timestamp_ns: int) -> float:
+        '''
+        Gets the value at the given time along the line through the middle of the field's doors. Every point since the
+        last stored one is within the deviation of this line, so storing this value (rather than the raw reading) keeps
+        the interpolated signal within tolerance.
+        '''
+
+        slope = (state.upper_slopes[index] + state.lower_slopes[index]) / 2
+
+        return state.stored_values[index] + slope * (timestamp_ns - state.stored_ns[index])
+
+
+    @staticmethod
+    def _to_field_value(datum_class: Type[SensorDatum], name: str, value: float):
+        ## The state arrays hold everything as floats
+        return int(value) if datum_class.schema[name] is int else value
+
+
+    @staticmethod
+    def _build_datum(key: Tuple[Type[SensorDatum], str, str], category: str, timestamp_ns: int, values: Dict) -> SensorDatum:
+        ## Incoming datums are shared with every other storage adapter, so new ones are built rather than modifying them
+        datum_class, sensor_type, sensor_id = key
+        datum = datum_class.__new__(datum_class)
+        datum.category = category
+        datum.sensor_type = sensor_type
+        datum.sensor_id = sensor_id
+        datum.timestamp_ns = timestamp_ns
+        for name in datum_class.schema:
+            setattr(datum, name, values.get(name))
+
+        return datum
+
+
+    def filter(self, data: List[SensorDatum]) -> List[SensorDatum]:
+        filtered: List[SensorDatum] = []
+
+        for datum in data:
+            datum_class = type(datum)
+            names, compressions = self._get_fields(datum_class, datum.sensor_type)
+            ## Non numeric fields can't be compressed, so they're stored with every reading
+            values = {name: getattr(datum, name) for name in datum.schema if name not in names}
+
+            key = (datum_class, datum.sensor_type, datum.sensor_id)
+            state = self._states.get(key)
+            if (state is None):
+                state = SeriesState(len(names))
+                self._states[key] = state
+                self._categories[key] = datum.category
+
+            timestamp_ns = datum.timestamp_ns
+            ## Fields of earlier readings that a swinging door needs to go back and store, keyed by timestamp
+            archived: Dict[int, Dict[str, float]] = {}
+
+            for index, (name, compression) in enumerate(zip(names, compressions)):
+                value = getattr(datum, name)
+                if (value is None or (isinstance(value, float) and math.isnan(value))):
+                    continue
+
+                self.received_count += 1
+                store = False
+                if (compression.mode == CompressionMode.NONE or math.isnan(state.stored_values[index])):
+                    store = True
+                elif (compression.mode == CompressionMode.DEADBAND):
+                    stored_value = state.stored_values[index]
+                    store = (
+                        abs(value - stored_value) > compression.get_deviation(stored_value) or
+                        self._is_silent_too_long(compression, state, index, timestamp_ns)
+                    )
+                else:
+                    doors_overlap = self._update_doors(compression, state, index, timestamp_ns, value)
+                    if (not doors_overlap or self._is_silent_too_long(compression, state, index, timestamp_ns)):
+                        ## Either the doors have opened past parallel so the previous point can't be interpolated
+                        ## through, or it's time for a heartbeat. Either way, store the previous point (as it sits on
+                        ## the line through the doors), and start over from there.
+                        if (state.previous_ns[index] != state.stored_ns[index]):
+                            previous_ns = state.previous_ns[index]
+                            previous_value = self._get_door_value(state, index, previous_ns)
+                            archived.setdefault(previous_ns, {})[name] = self._to_field_value(datum_class, name, previous_value)
+                            self.stored_count += 1
+                            self._store_point(state, index, previous_ns, previous_value)
+
+                        if (doors_overlap or not self._update_doors(compression, state, index, timestamp_ns, value)):
+                            store = True
+
+                if (store):
+                    values[name] = value
+                    self.stored_count += 1
+                    self._store_point(state, index, timestamp_ns, value)
+
+                state.previous_values[index] = value
+                state.previous_ns[index] = timestamp_ns
+
+            for archived_ns, archived_values in sorted(archived.items()):
+                filtered.append(self._build_datum(key, datum.category, archived_ns, archived_values))
+            if (any(values.get(name) is not None for name in names)):
+                filtered.append(self._build_datum(key, datum.category, timestamp_ns, values))
+
+        return filtered
+
+
+    def flush(self) -> List[SensorDatum]:
+        '''
+        Gets the latest point of every swinging door field that hasn't been stored yet, so that the tail end of each
+        signal isn't lost (ex: on shutdown).
+        '''
+
+        flushed: List[SensorDatum] = []
+        for key, state in self._states.items():
+            datum_class, sensor_type, _ = key
+            names, compressions = self._get_fields(datum_class, sensor_type)
+            pending: Dict[int, Dict[str, float]] = {}
+            for index, (name, compression) in enumerate(zip(names, compressions)):
+                previous_ns = state.previous_ns[index]
+                if (compression.mode == CompressionMode.SWINGING_DOOR and previous_ns != state.stored_ns[index]):
+                    value = self._get_door_value(state, index, previous_ns)
+                    pending.setdefault(previous_ns, {})[name] = self._to_field_value(datum_class, name, value)
+                    self.stored_count += 1
+                    self._store_point(state, index, previous_ns, value)
+
+            for timestamp_ns, values in sorted(pending.items()):
+                flushed.append(self._build_datum(key, self._categories[key], timestamp_ns, values))
+
+        return flushed
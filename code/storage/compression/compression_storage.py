@@ -0,0 +1,87 @@
+import logging
+from typing import Dict, List
+
+from sensor.datum_batch import DatumBatch
+from sensor.sensor_datum import SensorDatum
+from storage.storage_adapter import StorageAdapter
+from storage.compression.compression_filter import CompressionFilter
+from utilities import ConfigSection, initialize_logging
+
+
+class CompressionStorage(StorageAdapter):
+    '''
+    Wraps any StorageAdapter with deadband and swinging door compression, so only the points needed to reconstruct each
+    signal (to within its configured tolerance) are actually written. If the wrapped storage fails to store a batch,
+    the compression state is rolled back so that a retry of the same batch is filtered exactly the same way.
+
+    If the wrapped storage consumes columnar batches, then so does this, and the filtered datums are rebuilt into
+    batches for it.
+    '''
+
+    def __init__(self, storage: StorageAdapter, compression_filter: CompressionFilter):
+        self.logger = initialize_logging(logging.getLogger(__name__))
+
+        self.storage = storage
+        self.compression_filter = compression_filter
+
+
+    @classmethod
+    def from_config(cls, storage: StorageAdapter, config: Dict) -> 'CompressionStorage':
+        return cls(storage, CompressionFilter.from_config(ConfigSection(config or {}, "compression")))
+
+    ## Properties
+
+    @property
+    def storage_type(self) -> str:
+        return self.storage.storage_type
+
+
+    @property
+    def consumes_batches(self) -> bool:
+        return self.storage.consumes_batches
+
+    ## Methods
+
+    def _store_filtered(self, data: List[SensorDatum], batched: bool):
+        snapshot = self.compression_filter.snapshot(data)
+        filtered = self.compression_filter.filter(data)
+        if (not filtered):
+            return
+
+        try:
+            if (batched):
+                self.storage.store_batches(DatumBatch.from_data(filtered))
+            else:
+                self.storage.store(filtered)
+        except Exception:
+            self.compression_filter.restore(snapshot)
+            raise
+
+        if (self.logger.isEnabledFor(logging.DEBUG)):
+            self.logger.debug(
+                "Compressed %d datum(s) down to %d for %s (overall ratio: %.3f)",
+                len(data),
+                len(filtered),
+                self.storage_type,
+                self.compression_filter.compression_ratio
+            )
+
+
+    def store(self, data: List[SensorDatum]):
+        self._store_filtered(data, False)
+
+
+    def store_batches(self, batches: List[DatumBatch]):
+        self._store_filtered([datum for batch in batches for datum in batch.to_datums()], True)
+
+
+    def close(self):
+        ## Write out the held back ends of any swinging door signals before closing up
+        try:
+            flushed = self.compression_filter.flush()
+            if (flushed):
+                self.storage.store(flushed)
+        except Exception as e:
+            self.logger.warning("Failed to store the final %s compressed point(s): %s", self.storage_type, e)
+        finally:
+            self.storage.close()
@@ -0,0 +1,262 @@
+import math
+import re
+from array import array
+from typing import Dict, Iterable, List, Optional, Tuple, Type
+
+from sensor.datum_batch import DatumBatch
+from sensor.sensor_datum import SensorDatum
+from telemetry.metrics_server import MetricsServer
+from telemetry.prometheus import MetricFamily
+from utilities import ConfigSection
+
+
+## (sensor type, sensor id, field)
+SeriesKey = Tuple[str, str, str]
+
+
+class RecentSeries:
+    '''
+    Fixed size ring of the most recent readings of one numeric field from one sensor. Timestamps and values live in
+    preallocated typed arrays, so keeping a series around costs the same no matter how many readings it's seen.
+    '''
+
+    __slots__ = ("capacity", "timestamps_ns", "values", "_next", "count")
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self.timestamps_ns = array('q', [0]) * capacity
+        self.values = array('d', [math.nan]) * capacity
+        self._next = 0
+        self.count = 0
+
+    ## Methods
+
+    def append(self, timestamp_ns: int, value: float):
+        self.timestamps_ns[self._next] = timestamp_ns
+        self.values[self._next] = value
+        self._next = (self._next + 1) % self.capacity
+        self.count = min(self.count + 1, self.capacity)
+
+
+    def _get_index(self, position: int) -> int:
+        ## Maps a position in oldest to newest order onto its slot in the arrays
+        return (self._next - self.count + position) % self.capacity
+
+
+    def _bisect(self, timestamp_ns: int) -> int:
+        ## Readings arrive in timestamp order for a series, so the ring is sorted once it's unrolled
+        low, high = 0, self.count
+        while (low < high):
+            middle = (low + high) // 2
+            if (self.timestamps_ns[self._get_index(middle)] < timestamp_ns):
+                low = middle + 1
+            else:
+                high = middle
+
+        return low
+
+
+    def get_range(self, start_ns: int = None, end_ns: int = None, limit: int = None) -> Tuple[List[int], List[float]]:
+        '''
+        Returns the timestamps and values of the readings in [start_ns, end_ns), oldest first. With a limit, only the
+        newest readings in the range are returned.
+        '''
+
+        first = 0 if start_ns is None else self._bisect(start_ns)
+        last = self.count if end_ns is None else self._bisect(end_ns)
+        if (limit is not None):
+            first = max(first, last - limit)
+
+        indexes = [self._get_index(position) for position in range(first, last)]
+
+        return ([self.timestamps_ns[index] for index in indexes], [self.values[index] for index in indexes])
+
+
+class RecentReadings:
+    '''
+    Keeps the latest value of every (sensor type, sensor id, field), and a bounded history of the most recent readings
+    of every numeric field, so that dashboards and local automations can get at live data straight from the stasher
+    rather than querying the database.
+
+    Everything's served over the MetricsServer:
+
+        /recent/latest  The latest value of each field, as JSON
+        /recent/range   The buffered readings of each numeric field, as JSON, optionally bounded by 'start' and 'end'
+                        (unix seconds) and/or the newest 'limit' readings
+        /metrics        The latest numeric values as 'sensor_reading_<field>' gauges
+
+    Every route accepts (repeatable) 'sensor_type', 'sensor_id' and 'field' parameters to pick out specific series.
+
+    Readings are recorded and served on the event loop, so no locking is needed, and the cost of recording a reading
+    is a couple of array writes.
+    '''
+
+    METRIC_PREFIX = "sensor_reading"
+    _METRIC_NAME_INVALID_CHARACTERS = re.compile(r"[^a-zA-Z0-9_]")
+
+    def __init__(self, max_readings_per_series: int = 720, max_series: int = 10000):
+        if (max_readings_per_series < 1):
+            raise ValueError(f"max_readings_per_series must be at least 1, not {max_readings_per_series}")
+
+        self.max_readings_per_series = max_readings_per_series
+        self.max_series = max_series
+
+        self.series: Dict[SeriesKey, RecentSeries] = {}
+        ## Every field's latest (timestamp, value), including the non numeric ones
+        self.latest: Dict[SeriesKey, Tuple[int, object]] = {}
+        self._numeric_fields: Dict[Type[SensorDatum], Tuple[str, ...]] = {}
+
+        ## Metrics
+        self.recorded_count = 0
+        self.dropped_count = 0
+
+
+    @classmethod
+    def from_config(cls, config: ConfigSection) -> 'RecentReadings':
+        return cls(
+            max_readings_per_series=config.get_int('max_readings_per_series', 720, minimum=1),
+            max_series=config.get_int('max_series', 10000, minimum=1)
+        )
+
+    ## Methods
+
+    def _get_numeric_fields(self, datum_class: Type[SensorDatum]) -> Tuple[str, ...]:
+        fields = self._numeric_fields.get(datum_class)
+        if (fields is None):
+            fields = tuple(name for name, field_type in datum_class.schema.items() if field_type in DatumBatch.NUMERIC_TYPES)
+            self._numeric_fields[datum_class] = fields
+
+        return fields
+
+
+    def record(self, data: Iterable[SensorDatum]):
+        for datum in data:
+            numeric_fields = self._get_numeric_fields(type(datum))
+
+            for name in datum.schema:
+                value = getattr(datum, name)
+                if (value is None):
+                    continue
+
+                key = (datum.sensor_type, datum.sensor_id, name)
+                if (key not in self.latest and len(self.latest) >= self.max_series):
+                    ## Bounded, so that a misbehaving sensor churning through ids can't eat all of the memory
+                    self.dropped_count += 1
+                    continue
+                self.latest[key] = (datum.timestamp_ns, value)
+
+                if (name in numeric_fields):
+                    series = self.series.get(key)
+                    if (series is None):
+                        series = RecentSeries(self.max_readings_per_series)
+                        self.series[key] = series
+                    series.append(datum.timestamp_ns, value)
+
+            self.recorded_count += 1
+
+
+    @staticmethod
+    def _get_filter(query: Dict[str, List[str]], name: str) -> Optional[set]:
+        values = query.get(name)
+
+        return set(values) if values else None
+
+
+    @staticmethod
+    def _get_number(query: Dict[str, List[str]], name: str, number_type: type):
+        values = query.get(name)
+        if (not values):
+            return None
+
+        try:
+            return number_type(values[-1])
+        except ValueError:
+            raise ValueError(f"'{name}' must be a number, not '{values[-1]}'")
+
+
+    @staticmethod
+    def _get_json_value(value):
+        ## JSON has no NaN or infinity, and a NaN here just means the sensor didn't have a value for the field
+        if (isinstance(value, float) and not math.isfinite(value)):
+            return None
+
+        return value
+
+
+    def _select(self, keys: Iterable[SeriesKey], query: Dict[str, List[str]]) -> List[SeriesKey]:
+        filters = [self._get_filter(query, name) for name in ("sensor_type", "sensor_id", "field")]
+
+        return [
+            key for key in keys
+            if all(allowed is None or part in allowed for part, allowed in zip(key, filters))
+        ]
+
+
+    def get_latest(self, query: Dict[str, List[str]] = None) -> List[Dict]:
+        latest = []
+        for key in self._select(self.latest.keys(), query or {}):
+            timestamp_ns, value = self.latest[key]
+            latest.append({
+                "sensor_type": key[0],
+                "sensor_id": key[1],
+                "field": key[2],
+                "timestamp_ns": timestamp_ns,
+                "value": self._get_json_value(value)
+            })
+
+        return latest
+
+
+    def get_range(self, query: Dict[str, List[str]] = None) -> List[Dict]:
+        query = query or {}
+        start = self._get_number(query, "start", float)
+        end = self._get_number(query, "end", float)
+        limit = self._get_number(query, "limit", int)
+        if (limit is not None and limit < 0):
+            raise ValueError(f"'limit' can't be negative, not {limit}")
+        start_ns = None if start is None else round(start * 1_000_000_000)
+        end_ns = None if end is None else round(end * 1_000_000_000)
+
+        ranges = []
+        for key in self._select(self.series.keys(), query):
+            timestamps_ns, values = self.series[key].get_range(start_ns, end_ns, limit)
+            ranges.append({
+                "sensor_type": key[0],
+                "sensor_id": key[1],
+                "field": key[2],
+                "timestamps_ns": timestamps_ns,
+                "values": [self._get_json_value(value) for value in values]
+            })
+
+        return ranges
+
+
+    def get_metric_families(self) -> List[MetricFamily]:
+        families: Dict[str, MetricFamily] = {}
+        for (sensor_type, sensor_id, field), (_, value) in self.latest.items():
+            if ((sensor_type, sensor_id, field) not in self.series):
+                continue
+
+            family = families.get(field)
+            if (family is None):
+                name = f"{self.METRIC_PREFIX}_{self._METRIC_NAME_INVALID_CHARACTERS.sub('_', field)}"
+                family = MetricFamily(name, MetricFamily.GAUGE, f"Latest '{field}' reading.")
+                families[field] = family
+            family.add_sample(value, {"sensor_type": sensor_type, "sensor_id": sensor_id})
+
+        return list(families.values())
+
+
+    def get_metrics(self) -> Dict:
+        return {
+            "series": len(self.series),
+            "fields": len(self.latest),
+            "recorded": self.recorded_count,
+            "dropped": self.dropped_count
+        }
+
+
+    def register_routes(self, metrics_server: MetricsServer):
+        metrics_server.add_route('/recent/latest', lambda query: MetricsServer.build_json_response(self.get_latest(query)))
+        metrics_server.add_route('/recent/range', lambda query: MetricsServer.build_json_response(self.get_range(query)))
+        metrics_server.add_metric_provider(self.get_metric_families)
@@ -0,0 +1,184 @@
+import logging
+import time
+from pathlib import Path
+from typing import Dict, List
+
+from sensor.datum_batch import DatumBatch
+from sensor.sensor_datum import SensorDatum
+from storage.storage_adapter import StorageAdapter
+from storage.spool.write_ahead_spool import WriteAheadSpool
+from utilities import get_root_path, initialize_logging
+
+
+class SpoolStorage(StorageAdapter):
+    '''
+    Wraps any StorageAdapter with a durable write-ahead spool. Batches that the wrapped storage fails to store are
+    persisted to disk instead of being lost, and once the storage starts accepting writes again the backlog is replayed
+    in bulk, rate limited so that a long outage doesn't turn into a flood against a freshly recovered server.
+
+    Note that failed writes are absorbed by the spool, so store() only raises if the spool itself can't be written.
+    '''
+
+    def __init__(
+            self,
+            storage: StorageAdapter,
+            spool: WriteAheadSpool,
+            replay_batch_size: int = 5000,
+            replay_max_datums_per_second: float = 10000,
+            replay_max_seconds_per_store: float = 5.0
+    ):
+        self.logger = initialize_logging(logging.getLogger(__name__))
+
+        self.storage = storage
+        self.spool = spool
+        self.replay_batch_size = replay_batch_size
+        self.replay_max_datums_per_second = replay_max_datums_per_second
+        self.replay_max_seconds_per_store = replay_max_seconds_per_store
+
+        ## Token bucket for replay rate limiting, allowing up to a second's worth of burst
+        self._replay_tokens = float(replay_max_datums_per_second)
+        self._replay_tokens_updated = time.monotonic()
+
+        ## Metrics
+        self.spooled_count = 0
+        self.replayed_count = 0
+
+        self.logger.debug(f"Initialized spool for {self.storage.storage_type} at '{self.spool.directory}'")
+
+
+    @classmethod
+    def from_config(cls, storage: StorageAdapter, config: Dict, name: str = None) -> 'SpoolStorage':
+        config = config or {}
+
+        spool_path = config.get('path')
+        spool_path = Path(spool_path) if spool_path else Path(get_root_path(), 'spool')
+
+        spool = WriteAheadSpool(
+            Path(spool_path, name or storage.storage_type),
+            segment_max_bytes=int(config.get('segment_max_bytes', 4 * 1024 * 1024)),
+            max_total_bytes=int(config.get('max_total_bytes', 256 * 1024 * 1024)),
+            max_age_seconds=float(config.get('max_age_seconds', 7 * 24 * 60 * 60)),
+            fsync_every_records=int(config.get('fsync_every_records', 16)),
+            fsync_interval_seconds=float(config.get('fsync_interval_seconds', 5.0))
+        )
+
+        return cls(
+            storage,
+            spool,
+            replay_batch_size=int(config.get('replay_batch_size', 5000)),
+            replay_max_datums_per_second=float(config.get('replay_max_datums_per_second', 10000)),
+            replay_max_seconds_per_store=float(config.get('replay_max_seconds_per_store', 5.0))
+        )
+
+    ## Properties
+
+    @property
+    def storage_type(self) -> str:
+        return self.storage.storage_type
+
+
+    @property
+    def consumes_batches(self) -> bool:
+        return self.storage.consumes_batches
+
+    ## Methods
+
+    def _spool(self, data: List[SensorDatum]):
+        self.spool.append([datum.to_record() for datum in data])
+        self.spooled_count += len(data)
+
+
+    def _refill_replay_tokens(self):
+        now = time.monotonic()
+        self._replay_tokens = min(
+            self.replay_max_datums_per_second,
+            self._replay_tokens + (now - self._replay_tokens_updated) * self.replay_max_datums_per_second
+        )
+        self._replay_tokens_updated = now
+
+
+    def _replay_batch(self, batch: List[SensorDatum], cursor) -> bool:
+        try:
+            self.storage.store(batch)
+        except Exception as e:
+            self.logger.warning(f"Failed to replay {len(batch)} spooled datum(s) into {self.storage_type}, will try again later. {e}")
+            return False
+
+        self.spool.commit(cursor)
+        ## The bucket is allowed to go into debt, so that a single oversized batch can't wedge the replay
+        self._replay_tokens -= len(batch)
+
+        return True
+
+
+    def replay(self) -> int:
+        '''
+        Replays as much of the backlog as the rate limit allows, in batches of up to replay_batch_size datums. Returns
+        the number of datums replayed, and stops early (leaving the rest spooled) if the storage fails again.
+        '''
+
+        replayed = 0
+        failed = False
+        deadline = time.monotonic() + self.replay_max_seconds_per_store
+        batch: List[SensorDatum] = []
+        batch_cursor = None
+
+        records_iterator = self.spool.read()
+        for records, cursor in records_iterator:
+            self._refill_replay_tokens()
+            if (self._replay_tokens <= 0 or time.monotonic() >= deadline):
+                break
+
+            batch.extend(SensorDatum.from_record(record) for record in records)
+            batch_cursor = cursor
+
+            if (len(batch) >= self.replay_batch_size):
+                if (not self._replay_batch(batch, batch_cursor)):
+                    failed = True
+                    break
+                replayed += len(batch)
+                batch = []
+        records_iterator.close()
+
+        if (batch and not failed and self._replay_batch(batch, batch_cursor)):
+            replayed += len(batch)
+
+        if (replayed > 0):
+            self.spool.compact()
+            self.replayed_count += replayed
+            self.logger.info(f"Replayed {replayed} spooled datum(s) into {self.storage_type}")
+
+        return replayed
+
+
+    def _replay_backlog(self):
+        ## The storage is evidently up, so chip away at any backlog
+        if (self.spool.has_backlog):
+            self.replay()
+
+
+    def store(self, data: List[SensorDatum]):
+        try:
+            self.storage.store(data)
+        except Exception as e:
+            self.logger.warning("Failed to store %d datum(s) in %s, spooling them to disk. %s", len(data), self.storage_type, e)
+            self._spool(data)
+            return
+
+        self._replay_backlog()
+
+
+    def store_batches(self, batches: List[DatumBatch]):
+        try:
+            self.storage.store_batches(batches)
+        except Exception as e:
+            data = [datum for batch in batches for datum in batch.to_datums()]
+            self.logger.warning("Failed to store %d datum(s) in %s, spooling them to disk. %s", len(data), self.storage_type, e)
+            self._spool(data)
+            return
+
+        self._replay_backlog()
+
+
+    def close(self):
+        self.spool.close()
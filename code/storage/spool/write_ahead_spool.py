@@ -0,0 +1,364 @@
+import json
+import logging
+import os
+import struct
+import time
+import zlib
+from pathlib import Path
+from typing import Iterator, List, Optional, Tuple
+
+from utilities import initialize_logging
+
+
+class SpoolCursor:
+    '''Position of the next record to be replayed, as (segment sequence number, byte offset into that segment).'''
+
+    def __init__(self, segment: int = 0, offset: int = 0):
+        self.segment = segment
+        self.offset = offset
+
+
+    def __str__(self) -> str:
+        return f"{self.segment}:{self.offset}"
+
+
+class WriteAheadSpool:
+    '''
+    Append-only, on-disk queue of JSON records. Records are appended to numbered segment files, each framed with its
+    length and a CRC32 so that a torn write (ex: from losing power mid-append) is detected and skipped rather than
+    replayed as garbage.
+
+    fsyncs are batched (every N records or every T seconds, whichever comes first) to spare the SD card, and the spool
+    is kept within its size and age caps by dropping its oldest segments. Consumed records are tracked with a cursor,
+    and fully consumed segments are deleted by compact().
+    '''
+
+    SEGMENT_SUFFIX = ".seg"
+    COMPACTED_SUFFIX = ".compacted"
+    CURSOR_NAME = "cursor.json"
+    ## A partially consumed segment is only rewritten once at least this much of it has been consumed, so that every
+    ## partial replay doesn't turn into a rewrite (and fsync) of the whole segment
+    COMPACT_MIN_CONSUMED_FRACTION = 0.5
+    ## (payload length, payload crc32)
+    RECORD_HEADER = struct.Struct("<II")
+
+    def __init__(
+            self,
+            directory: Path,
+            segment_max_bytes: int = 4 * 1024 * 1024,
+            max_total_bytes: int = 256 * 1024 * 1024,
+            max_age_seconds: float = 7 * 24 * 60 * 60,
+            fsync_every_records: int = 16,
+            fsync_interval_seconds: float = 5.0
+    ):
+        self.logger = initialize_logging(logging.getLogger(__name__))
+
+        self.directory = Path(directory)
+        self.segment_max_bytes = segment_max_bytes
+        self.max_total_bytes = max_total_bytes
+        self.max_age_seconds = max_age_seconds
+        self.fsync_every_records = fsync_every_records
+        self.fsync_interval_seconds = fsync_interval_seconds
+
+        self.directory.mkdir(parents=True, exist_ok=True)
+
+        self._active_file = None
+        self._active_segment: Optional[int] = None
+        self._active_size = 0
+        self._unsynced_records = 0
+        self._last_fsync = time.monotonic()
+
+        self._compaction_pending = False
+        self.cursor = self._load_cursor()
+        self._recover_compaction()
+
+        ## Always start a fresh segment, rather than appending after a potentially torn record from a previous run
+        segments = self.list_segments()
+        self._next_segment = (segments[-1] + 1) if segments else 1
+        if (segments and self.cursor.segment < segments[0]):
+            self.cursor = SpoolCursor(segments[0], 0)
+
+        self.logger.debug(f"Opened spool at '{self.directory}' with {len(segments)} existing segment(s), cursor: {self.cursor}")
+
+    ## Properties
+
+    @property
+    def total_bytes(self) -> int:
+        return sum(self._get_segment_path(segment).stat().st_size for segment in self.list_segments())
+
+
+    @property
+    def has_backlog(self) -> bool:
+        for segment in self.list_segments():
+            if (segment > self.cursor.segment):
+                return True
+            if (segment == self.cursor.segment and self._get_segment_size(segment) > self.cursor.offset):
+                return True
+
+        return False
+
+    ## Methods
+
+    def _get_segment_path(self, segment: int) -> Path:
+        return Path(self.directory, f"{segment:012d}{self.SEGMENT_SUFFIX}")
+
+
+    def _get_segment_size(self, segment: int) -> int:
+        if (segment == self._active_segment):
+            return self._active_size
+
+        try:
+            return self._get_segment_path(segment).stat().st_size
+        except FileNotFoundError:
+            return 0
+
+
+    def list_segments(self) -> List[int]:
+        return sorted(int(path.stem) for path in self.directory.glob(f"*{self.SEGMENT_SUFFIX}") if path.stem.isdigit())
+
+
+    def _load_cursor(self) -> SpoolCursor:
+        cursor_path = Path(self.directory, self.CURSOR_NAME)
+        if (not cursor_path.exists()):
+            return SpoolCursor()
+
+        try:
+            with open(cursor_path) as fd:
+                data = json.load(fd)
+            self._compaction_pending = bool(data.get("compacting", False))
+            return SpoolCursor(int(data["segment"]), int(data["offset"]))
+        except (ValueError, KeyError) as e:
+            self.logger.warning(f"Unable to parse spool cursor, replaying from the oldest segment. {e}")
+            return SpoolCursor()
+
+
+    def _save_cursor(self, durable: bool = False):
+        '''
+        Writes out the cursor. A lost cursor update normally just means replaying a few records again, but durable
+        saves are fsynced (along with the directory's entry for them) for when the spool's files depend on the cursor.
+        '''
+
+        ## Write then rename, so a crash can never leave a half written cursor behind
+        cursor_path = Path(self.directory, self.CURSOR_NAME)
+        temporary_path = cursor_path.with_suffix(".tmp")
+        cursor = {"segment": self.cursor.segment, "offset": self.cursor.offset}
+        if (self._compaction_pending):
+            cursor["compacting"] = True
+        with open(temporary_path, "w") as fd:
+            json.dump(cursor, fd)
+            if (durable):
+                fd.flush()
+                os.fsync(fd.fileno())
+        os.replace(temporary_path, cursor_path)
+        if (durable):
+            self._fsync_directory()
+
+
+    def _fsync_directory(self):
+        ## Not every platform can open a directory to fsync it (ex: Windows), and those don't need to anyway
+        try:
+            fd = os.open(self.directory, os.O_RDONLY)
+        except OSError:
+            return
+
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+
+    def _get_compacted_path(self, segment: int) -> Path:
+        return self._get_segment_path(segment).with_suffix(self.COMPACTED_SUFFIX)
+
+
+    def _finish_compaction(self, segment: int):
+        compacted_path = self._get_compacted_path(segment)
+        if (compacted_path.exists()):
+            os.replace(compacted_path, self._get_segment_path(segment))
+            self._fsync_directory()
+
+        self._compaction_pending = False
+        self._save_cursor(durable=True)
+
+
+    def _recover_compaction(self):
+        '''
+        Finishes or discards a compaction that was interrupted by a crash. Once the cursor has been committed to the
+        start of the compacted copy, the copy has to replace the segment. Before that, the copy is just discarded.
+        '''
+
+        for compacted_path in self.directory.glob(f"*{self.COMPACTED_SUFFIX}"):
+            if (not (self._compaction_pending and compacted_path.stem == self._get_segment_path(self.cursor.segment).stem)):
+                compacted_path.unlink(missing_ok=True)
+
+        if (self._compaction_pending):
+            self.logger.warning(f"Finishing an interrupted compaction of spool segment {self.cursor.segment}")
+            self._finish_compaction(self.cursor.segment)
+
+
+    def _fsync(self):
+        if (self._active_file is not None and self._unsynced_records > 0):
+            self._active_file.flush()
+            os.fsync(self._active_file.fileno())
+
+        self._unsynced_records = 0
+        self._last_fsync = time.monotonic()
+
+
+    def _seal_active_segment(self):
+        if (self._active_file is None):
+            return
+
+        self._fsync()
+        self._active_file.close()
+        self._active_file = None
+        self._active_segment = None
+        self._active_size = 0
+
+
+    def _open_segment(self):
+        self._active_segment = self._next_segment
+        self._next_segment += 1
+        self._active_file = open(self._get_segment_path(self._active_segment), "ab")
+        self._active_size = 0
+
+
+    def append(self, record):
+        '''Appends a single JSON serializable record to the spool.'''
+
+        payload = json.dumps(record, separators=(",", ":")).encode("utf-8")
+
+        if (self._active_file is None or self._active_size + self.RECORD_HEADER.size + len(payload) > self.segment_max_bytes):
+            self._seal_active_segment()
+            self._open_segment()
+            self.enforce_caps()
+
+        self._active_file.write(self.RECORD_HEADER.pack(len(payload), zlib.crc32(payload)))
+        self._active_file.write(payload)
+        self._active_size += self.RECORD_HEADER.size + len(payload)
+        self._unsynced_records += 1
+
+        if (self._unsynced_records >= self.fsync_every_records or time.monotonic() - self._last_fsync >= self.fsync_interval_seconds):
+            self._fsync()
+        else:
+            ## Still hand it off to the OS so that readers of the segment can see it
+            self._active_file.flush()
+
+
+    def _read_segment(self, segment: int, offset: int) -> Iterator[Tuple[object, int]]:
+        '''Yields (record, offset of the following record) for each valid record in the segment, starting at offset.'''
+
+        try:
+            fd = open(self._get_segment_path(segment), "rb")
+        except FileNotFoundError:
+            return
+
+        with fd:
+            fd.seek(offset)
+            while (True):
+                header = fd.read(self.RECORD_HEADER.size)
+                if (len(header) < self.RECORD_HEADER.size):
+                    return
+
+                length, crc = self.RECORD_HEADER.unpack(header)
+                payload = fd.read(length)
+                if (len(payload) < length or zlib.crc32(payload) != crc):
+                    self.logger.warning(f"Found a torn or corrupt record in spool segment {segment} at offset {offset}, skipping the rest of the segment")
+                    return
+
+                offset += self.RECORD_HEADER.size + length
+                yield json.loads(payload), offset
+
+
+    def read(self) -> Iterator[Tuple[object, SpoolCursor]]:
+        '''
+        Yields (record, cursor just past that record) for each unconsumed record, oldest first. Pass the cursor to
+        commit() once the record has been dealt with.
+        '''
+
+        if (self._active_file is not None):
+            self._active_file.flush()
+
+        for segment in self.list_segments():
+            if (segment < self.cursor.segment):
+                continue
+
+            offset = self.cursor.offset if segment == self.cursor.segment else 0
+            for record, next_offset in self._read_segment(segment, offset):
+                yield record, SpoolCursor(segment, next_offset)
+
+
+    def commit(self, cursor: SpoolCursor):
+        '''Marks everything before the cursor as consumed.'''
+
+        self.cursor = cursor
+        self._save_cursor()
+
+
+    def compact(self):
+        '''
+        Deletes consumed segments. If the oldest remaining sealed segment has been mostly consumed, then its remaining
+        records are rewritten into a smaller file so the consumed prefix doesn't keep taking up space.
+
+        The rewrite is crash safe: the remaining records are copied (and fsynced) into a separate file first, then the
+        cursor is durably moved to the start of that copy (marked as compacting), and only then does the copy replace
+        the segment. A crash at any point leaves either the old segment with the old cursor, or a compaction that's
+        finished when the spool is next opened.
+        '''
+
+        for segment in self.list_segments():
+            if (segment == self._active_segment):
+                break
+
+            if (segment < self.cursor.segment):
+                self._get_segment_path(segment).unlink(missing_ok=True)
+                continue
+
+            if (segment == self.cursor.segment and self.cursor.offset > 0):
+                path = self._get_segment_path(segment)
+                if (self.cursor.offset >= path.stat().st_size):
+                    path.unlink(missing_ok=True)
+                    self.commit(SpoolCursor(segment + 1, 0))
+                    continue
+
+                if (self.cursor.offset < path.stat().st_size * self.COMPACT_MIN_CONSUMED_FRACTION):
+                    break
+
+                with open(path, "rb") as source, open(self._get_compacted_path(segment), "wb") as destination:
+                    source.seek(self.cursor.offset)
+                    destination.write(source.read())
+                    destination.flush()
+                    os.fsync(destination.fileno())
+
+                self.cursor = SpoolCursor(segment, 0)
+                self._compaction_pending = True
+                self._save_cursor(durable=True)
+                self._finish_compaction(segment)
+
+            break
+
+
+    def enforce_caps(self):
+        '''Drops the oldest sealed segments until the spool is back within its size and age caps.'''
+
+        now = time.time()
+        sealed_segments = [segment for segment in self.list_segments() if segment != self._active_segment]
+        total_bytes = self.total_bytes
+
+        for segment in sealed_segments:
+            path = self._get_segment_path(segment)
+            size = path.stat().st_size
+            too_big = total_bytes > self.max_total_bytes
+            too_old = (now - path.stat().st_mtime) > self.max_age_seconds
+            if (not too_big and not too_old):
+                break
+
+            self.logger.warning(f"Dropping spool segment {segment} ({size} bytes) to stay within the spool's {'size' if too_big else 'age'} cap")
+            path.unlink(missing_ok=True)
+            total_bytes -= size
+            if (self.cursor.segment <= segment):
+                self.commit(SpoolCursor(segment + 1, 0))
+
+
+    def close(self):
+        self._seal_active_segment()
@@ -1,11 +1,16 @@
 from abc import ABC, abstractmethod
-from typing import List
+from typing import Dict, List, Tuple
 
+from sensor.datum_batch import DatumBatch
 from sensor.sensor_datum import SensorDatum
 
 
 class StorageAdapter(ABC):
 
+    ## Whether store_batches() works on the columns directly, in which case the storage writer hands the adapter
+    ## columnar batches rather than datums
+    consumes_batches = False
+
     @property
     @abstractmethod
     def storage_type(self) -> str:
@@ -15,3 +20,29 @@ class StorageAdapter(ABC):
     @abstractmethod
     def store(self, data: List[SensorDatum]):
         pass
+
+
+    def store_batches(self, batches: List[DatumBatch]):
+        '''
+        Stores columnar batches of readings (see DatumBatch.from_data) in a single write. Adapters that can work on
+        columns directly should override this and set consumes_batches, otherwise the batches are just expanded back
+        into datums.
+        '''
+
+        self.store([datum for batch in batches for datum in batch.to_datums()])
+
+
+    def store_relayed(self, data_by_system: Dict[Tuple[str, str], List[SensorDatum]]):
+        '''
+        Stores readings relayed from other stashers, keyed by their (system type, system id). Adapters that tag what
+        they store with the system should override this to keep each system's own tags, otherwise everything is just
+        stored as if it came from this system.
+        '''
+
+        self.store([datum for data in data_by_system.values() for datum in data])
+
+
+    def close(self):
+        '''Releases any resources held by the adapter. Called once the final writes have been flushed.'''
+
+        pass
@@ -1,23 +1,111 @@
-from typing import List
+import asyncio
+from typing import Dict, Iterable, List
 
 from sensor.sensor_datum import SensorDatum
 from storage.storage_adapter import StorageAdapter
+from storage.storage_writer import StorageWriter
+from storage.spool.spool_storage import SpoolStorage
+from storage.compression.compression_storage import CompressionStorage
 
 class StorageManager:
-    def __init__(self, system_type: str, system_id: str):
+    '''
+    Fans data out to any number of storage adapters (sinks). Every sink gets its own StorageWriter, and with it its own
+    queue, worker thread and retry state, so a slow or unreachable sink only ever falls behind on its own.
+    '''
+
+    def __init__(
+            self,
+            system_type: str,
+            system_id: str,
+            writer_config: Dict = None,
+            spool_config: Dict = None,
+            compression_config: Dict = None
+    ):
         self.system_type = system_type
         self.system_id = system_id
+        self.writer_config = writer_config or {}
+        self.spool_config = spool_config or {}
+        self.compression_config = compression_config or {}
+
+        ## Sinks are keyed by a unique name, which defaults to their storage type
+        self.writers: Dict[str, StorageWriter] = {}
+
+    ## Properties
+
+    @property
+    def storage_names(self) -> List[str]:
+        return list(self.writers.keys())
+
+    ## Methods
+
+    def _build_storage_name(self, storage_type: str) -> str:
+        name = storage_type
+        index = 1
+        while (name in self.writers):
+            name = f"{storage_type}-{index}"
+            index += 1
 
-        ## todo: Allow registering multiple storage adapters at once?
-        self.storage: StorageAdapter = None
+        return name
 
 
-    def register_storage(self, storage: StorageAdapter):
-        self.storage = storage(self.system_type, self.system_id)
+    def register_storage(self, storage: StorageAdapter, name: str = None, writer_config: Dict = None) -> StorageAdapter:
+        '''
+        Instantiates and registers a storage adapter. The optional writer_config is merged over the manager's default
+        writer config for this sink only (ex: a larger queue for a remote sink that's prone to outages).
+        '''
 
+        storage_instance = storage(self.system_type, self.system_id)
+        name = name or self._build_storage_name(storage_instance.storage_type)
+        if (name in self.writers):
+            raise ValueError(f"A storage adapter named '{name}' has already been registered")
 
-    def store(self, data: List[SensorDatum]):
-        if (self.storage is None):
+        if (self.spool_config.get('enabled', False)):
+            storage_instance = SpoolStorage.from_config(storage_instance, self.spool_config, name)
+        ## Compressing ahead of the spool means that only the points that are actually needed get spooled
+        if (self.compression_config.get('enabled', False)):
+            storage_instance = CompressionStorage.from_config(storage_instance, self.compression_config)
+
+        config = dict(self.writer_config)
+        config.update(writer_config or {})
+        self.writers[name] = StorageWriter.from_config(storage_instance, config, name)
+
+        return storage_instance
+
+
+    async def start(self):
+        if (not self.writers):
             raise RuntimeError("No storage adapter registered")
 
-        self.storage.store(data)
+        await asyncio.gather(*[writer.start() for writer in self.writers.values()])
+
+
+    async def stop(self, timeout_seconds: float = None):
+        async def stop_writer(writer: StorageWriter):
+            await writer.stop(timeout_seconds)
+            writer.storage.close()
+
+        await asyncio.gather(*[stop_writer(writer) for writer in self.writers.values()])
+
+
+    async def store(self, data: List[SensorDatum], storage_names: Iterable[str] = None):
+        '''
+        Hands the data off to every sink's background writer, or just to the named sinks if storage_names is given.
+        This only waits if a writer's queue is full and its overflow policy is to block.
+        '''
+
+        if (not self.writers):
+            raise RuntimeError("No storage adapter registered")
+
+        if (storage_names is None):
+            writers = self.writers.values()
+        else:
+            unknown_names = [name for name in storage_names if name not in self.writers]
+            if (unknown_names):
+                raise KeyError(f"Unknown storage adapter(s): {unknown_names}, registered adapters are: {self.storage_names}")
+            writers = [self.writers[name] for name in storage_names]
+
+        await asyncio.gather(*[writer.put(data) for writer in writers])
+
+
+    def get_metrics(self) -> Dict[str, Dict]:
+        return {name: writer.get_metrics() for name, writer in self.writers.items()}
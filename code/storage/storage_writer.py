@@ -0,0 +1,294 @@
+import asyncio
+import logging
+import random
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from enum import Enum
+from typing import Deque, Dict, List, Optional, Tuple
+
+from sensor.datum_batch import DatumBatch
+from sensor.sensor_datum import SensorDatum
+from storage.storage_adapter import StorageAdapter
+from telemetry.histogram import Histogram, BATCH_SIZE_BUCKETS, LATENCY_BUCKETS_SECONDS
+from utilities import initialize_logging
+
+
+class OverflowPolicy(Enum):
+    ## Make the producer wait until there's space in the queue
+    BLOCK = "block"
+    ## Discard the oldest queued datums to make room for the new ones
+    DROP_OLDEST = "drop_oldest"
+    ## Discard the incoming datums if there's no room for them
+    DROP_NEWEST = "drop_newest"
+
+
+class StorageWriter:
+    '''
+    Non-blocking write pipeline in front of a StorageAdapter. Datums are put into a bounded in-memory queue, and a
+    background worker drains it in batches (flushed by size or by the age of the oldest queued datum), retrying failed
+    writes with jittered exponential backoff.
+
+    The adapter's blocking store() always runs on the same dedicated worker thread, so clients that hold onto a
+    connection get to reuse it, and a slow storage server never holds up the event loop. Adapters that consume columnar
+    batches are handed each batch as DatumBatches, through store_batches(), instead.
+    '''
+
+    THROUGHPUT_WINDOW_SECONDS = 60.0
+
+    def __init__(
+            self,
+            storage: StorageAdapter,
+            name: str = None,
+            max_queue_size: int = 10000,
+            batch_size: int = 500,
+            batch_max_age_seconds: float = 10.0,
+            overflow_policy: OverflowPolicy = OverflowPolicy.DROP_OLDEST,
+            max_retries: int = 5,
+            retry_base_delay_seconds: float = 1.0,
+            retry_max_delay_seconds: float = 60.0
+    ):
+        self.logger = initialize_logging(logging.getLogger(__name__))
+
+        if (max_queue_size < 1 or batch_size < 1):
+            raise ValueError(f"max_queue_size and batch_size must be at least 1, not {max_queue_size} and {batch_size}")
+
+        self.storage = storage
+        self.name = name or storage.storage_type
+        self.max_queue_size = max_queue_size
+        self.batch_size = min(batch_size, max_queue_size)
+        self.batch_max_age_seconds = batch_max_age_seconds
+        self.overflow_policy = overflow_policy
+        self.max_retries = max_retries
+        self.retry_base_delay_seconds = retry_base_delay_seconds
+        self.retry_max_delay_seconds = retry_max_delay_seconds
+
+        ## Each entry is (monotonic enqueue time, datum)
+        self._queue: Deque[Tuple[float, SensorDatum]] = deque()
+        self._data_available: Optional[asyncio.Event] = None
+        self._space_available: Optional[asyncio.Event] = None
+        self._worker: Optional[asyncio.Task] = None
+        self._stopping = False
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix=f"storage-{self.name}")
+
+        ## Metrics
+        self.enqueued_count = 0
+        self.dropped_count = 0
+        self.written_count = 0
+        self.written_batch_count = 0
+        self.failed_batch_count = 0
+        self.retry_count = 0
+        self.max_queue_depth = 0
+        self.last_batch_size = 0
+        self.last_write_latency_seconds = 0.0
+        self.write_latency_histogram = Histogram(LATENCY_BUCKETS_SECONDS)
+        self.batch_size_histogram = Histogram(BATCH_SIZE_BUCKETS)
+        ## (monotonic write time, datums written) for each recent write, used to work out the sink's throughput
+        self._recent_writes: Deque[Tuple[float, int]] = deque()
+
+
+    @classmethod
+    def from_config(cls, storage: StorageAdapter, config: Dict, name: str = None) -> 'StorageWriter':
+        config = config or {}
+
+        return cls(
+            storage,
+            name=name,
+            max_queue_size=int(config.get('max_queue_size', 10000)),
+            batch_size=int(config.get('batch_size', 500)),
+            batch_max_age_seconds=float(config.get('batch_max_age_seconds', 10.0)),
+            overflow_policy=OverflowPolicy(config.get('overflow_policy', OverflowPolicy.DROP_OLDEST.value)),
+            max_retries=int(config.get('max_retries', 5)),
+            retry_base_delay_seconds=float(config.get('retry_base_delay_seconds', 1.0)),
+            retry_max_delay_seconds=float(config.get('retry_max_delay_seconds', 60.0))
+        )
+
+    ## Properties
+
+    @property
+    def queue_depth(self) -> int:
+        return len(self._queue)
+
+
+    @property
+    def lag_seconds(self) -> float:
+        '''How long the oldest queued datum has been waiting to be written.'''
+
+        return (time.monotonic() - self._queue[0][0]) if self._queue else 0.0
+
+
+    @property
+    def throughput_datums_per_second(self) -> float:
+        '''Average write throughput over the last THROUGHPUT_WINDOW_SECONDS.'''
+
+        self._prune_recent_writes()
+
+        return sum(count for _, count in self._recent_writes) / self.THROUGHPUT_WINDOW_SECONDS
+
+
+    @property
+    def running(self) -> bool:
+        return (self._worker is not None and not self._worker.done())
+
+    ## Methods
+
+    def _prune_recent_writes(self):
+        cutoff = time.monotonic() - self.THROUGHPUT_WINDOW_SECONDS
+        while (self._recent_writes and self._recent_writes[0][0] < cutoff):
+            self._recent_writes.popleft()
+
+
+    def get_metrics(self) -> Dict:
+        return {
+            "name": self.name,
+            "storage_type": self.storage.storage_type,
+            "queue_depth": self.queue_depth,
+            "lag_seconds": self.lag_seconds,
+            "throughput_datums_per_second": self.throughput_datums_per_second,
+            "max_queue_depth": self.max_queue_depth,
+            "enqueued": self.enqueued_count,
+            "dropped": self.dropped_count,
+            "written": self.written_count,
+            "written_batches": self.written_batch_count,
+            "failed_batches": self.failed_batch_count,
+            "retries": self.retry_count,
+            "last_batch_size": self.last_batch_size,
+            "last_write_latency_seconds": self.last_write_latency_seconds
+        }
+
+
+    async def start(self):
+        if (self.running):
+            return
+
+        self._stopping = False
+        self._data_available = asyncio.Event()
+        self._space_available = asyncio.Event()
+        self._worker = asyncio.create_task(self._work())
+
+
+    async def stop(self, timeout_seconds: float = None):
+        '''Stops accepting new data, and waits for the worker to flush whatever is still queued.'''
+
+        if (not self.running):
+            return
+
+        self._stopping = True
+        self._data_available.set()
+
+        try:
+            await asyncio.wait_for(self._worker, timeout_seconds)
+        except asyncio.TimeoutError:
+            self.logger.warning(f"Timed out flushing {self.queue_depth} queued datum(s) to {self.name}, they'll be discarded")
+
+        self._worker = None
+        self._executor.shutdown(wait=False)
+
+
+    async def put(self, data: List[SensorDatum]):
+        '''
+        Queues up the data to be written. Only blocks when the queue is full and the overflow policy is BLOCK.
+        '''
+
+        if (self._stopping):
+            raise RuntimeError(f"{self.name} writer is stopping, and can't accept any more data")
+
+        for datum in data:
+            if (len(self._queue) >= self.max_queue_size):
+                if (self.overflow_policy == OverflowPolicy.BLOCK):
+                    while (len(self._queue) >= self.max_queue_size):
+                        self._data_available.set()
+                        self._space_available.clear()
+                        await self._space_available.wait()
+                elif (self.overflow_policy == OverflowPolicy.DROP_OLDEST):
+                    self._queue.popleft()
+                    self.dropped_count += 1
+                else:
+                    self.dropped_count += 1
+                    continue
+
+            self._queue.append((time.monotonic(), datum))
+            self.enqueued_count += 1
+
+        self.max_queue_depth = max(self.max_queue_depth, len(self._queue))
+        self._data_available.set()
+
+
+    def _take_batch(self) -> List[SensorDatum]:
+        batch_size = min(self.batch_size, len(self._queue))
+        batch = [self._queue.popleft()[1] for _ in range(batch_size)]
+        self._space_available.set()
+
+        return batch
+
+
+    def _get_retry_delay_seconds(self, attempt: int) -> float:
+        ## Exponential backoff with 'full jitter', so a fleet of nodes doesn't hammer a recovering server in lockstep
+        return random.uniform(0, min(self.retry_max_delay_seconds, self.retry_base_delay_seconds * (2 ** attempt)))
+
+
+    async def _write_batch(self, batch: List[SensorDatum]):
+        loop = asyncio.get_running_loop()
+        if (self.storage.consumes_batches):
+            store, payload = self.storage.store_batches, DatumBatch.from_data(batch)
+        else:
+            store, payload = self.storage.store, batch
+
+        for attempt in range(self.max_retries + 1):
+            start = time.perf_counter()
+            try:
+                await loop.run_in_executor(self._executor, store, payload)
+            except Exception as e:
+                if (attempt >= self.max_retries):
+                    self.failed_batch_count += 1
+                    self.logger.exception(f"Giving up on writing {len(batch)} datum(s) to {self.name} after {attempt + 1} attempt(s)", exc_info=e)
+                    return
+
+                delay = self._get_retry_delay_seconds(attempt)
+                self.retry_count += 1
+                self.logger.warning("Failed to write %d datum(s) to %s, retrying in %.2f seconds. %s", len(batch), self.name, delay, e)
+                await asyncio.sleep(delay)
+            else:
+                self.last_write_latency_seconds = time.perf_counter() - start
+                self.last_batch_size = len(batch)
+                self.written_count += len(batch)
+                self.written_batch_count += 1
+                self.write_latency_histogram.observe(self.last_write_latency_seconds)
+                self.batch_size_histogram.observe(len(batch))
+                self._recent_writes.append((time.monotonic(), len(batch)))
+                self._prune_recent_writes()
+                self.logger.debug("Wrote %d datum(s) to %s in %.3fs", len(batch), self.name, self.last_write_latency_seconds)
+                return
+
+
+    async def _wait_for_batch(self):
+        '''Waits until there's either a full batch, or the oldest queued datum has aged out.'''
+
+        while (not self._stopping):
+            if (len(self._queue) >= self.batch_size):
+                return
+
+            if (self._queue):
+                timeout = self._queue[0][0] + self.batch_max_age_seconds - time.monotonic()
+                if (timeout <= 0):
+                    return
+            else:
+                timeout = None
+
+            self._data_available.clear()
+            try:
+                await asyncio.wait_for(self._data_available.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+
+    async def _work(self):
+        while (True):
+            await self._wait_for_batch()
+
+            if (not self._queue):
+                if (self._stopping):
+                    return
+                continue
+
+            await self._write_batch(self._take_batch())
@@ -0,0 +1,131 @@
+import math
+from bisect import bisect_left
+from typing import Dict, List, Sequence
+
+
+## Bucket upper bounds for latencies, from a millisecond up to a minute
+LATENCY_BUCKETS_SECONDS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+## Bucket upper bounds for batch sizes
+BATCH_SIZE_BUCKETS = (1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+
+class Histogram:
+    '''
+    Fixed bucket histogram, in the same shape as a Prometheus histogram. Each observation just increments one bucket's
+    count, so recording stays cheap no matter how many observations there are, and quantiles are estimated by
+    interpolating within the bucket they fall in.
+    '''
+
+    def __init__(self, buckets: Sequence[float] = LATENCY_BUCKETS_SECONDS):
+        if (not buckets or list(buckets) != sorted(set(buckets))):
+            raise ValueError(f"Histogram buckets must be a non-empty, strictly increasing sequence, not {buckets}")
+
+        self.buckets = tuple(float(bucket) for bucket in buckets)
+        ## One count per bucket, plus a final overflow bucket for anything larger than the last bound
+        self.counts: List[int] = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+
+
+    def __str__(self) -> str:
+        if (not self.count):
+            return "no observations"
+
+        return (
+            f"{self.count} observations, mean: {self.mean:.3f}, p50: {self.get_quantile(0.5):.3f}, " +
+            f"p95: {self.get_quantile(0.95):.3f}, max: {self.max:.3f}"
+        )
+
+    ## Properties
+
+    @property
+    def mean(self) -> float:
+        return (self.sum / self.count) if self.count else 0.0
+
+    ## Methods
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        if (value < self.min):
+            self.min = value
+        if (value > self.max):
+            self.max = value
+
+
+    def get_cumulative_counts(self) -> List[int]:
+        '''Running totals of the bucket counts, as used by the Prometheus 'le' buckets (with +Inf last).'''
+
+        cumulative_counts = []
+        total = 0
+        for count in self.counts:
+            total += count
+            cumulative_counts.append(total)
+
+        return cumulative_counts
+
+
+    def get_quantile(self, quantile: float) -> float:
+        '''Estimates the given quantile (0 to 1), or returns 0 if nothing has been observed yet.'''
+
+        if (not self.count):
+            return 0.0
+
+        rank = quantile * self.count
+        seen = 0
+        for index, count in enumerate(self.counts):
+            if (count and seen + count >= rank):
+                lower = self.buckets[index - 1] if index > 0 else min(self.min, self.buckets[0])
+                upper = self.buckets[index] if index < len(self.buckets) else self.max
+                ## Observations can't fall outside of what's actually been seen, so clamp the bucket to that too
+                lower = max(lower, self.min)
+                upper = min(upper, self.max)
+
+                return lower + (upper - lower) * ((rank - seen) / count)
+            seen += count
+
+        return self.max
+
+
+    def copy(self) -> 'Histogram':
+        histogram = Histogram(self.buckets)
+        histogram.counts = list(self.counts)
+        histogram.count = self.count
+        histogram.sum = self.sum
+        histogram.min = self.min
+        histogram.max = self.max
+
+        return histogram
+
+
+    def subtract(self, previous: 'Histogram') -> 'Histogram':
+        '''
+        Gets a histogram of just the observations made since the previous copy was taken. The min and max can't be
+        recovered for an interval, so the overall min and max are kept.
+        '''
+
+        if (previous.buckets != self.buckets):
+            raise ValueError("Can't subtract histograms with different buckets")
+
+        histogram = self.copy()
+        histogram.counts = [count - previous_count for count, previous_count in zip(self.counts, previous.counts)]
+        histogram.count = self.count - previous.count
+        histogram.sum = self.sum - previous.sum
+
+        return histogram
+
+
+    def to_dict(self) -> Dict:
+        return {
+            "count": self.count,
+            "sum": self.sum,
+            "mean": self.mean,
+            "min": self.min if self.count else 0.0,
+            "max": self.max if self.count else 0.0,
+            "p50": self.get_quantile(0.5),
+            "p95": self.get_quantile(0.95),
+            "p99": self.get_quantile(0.99)
+        }
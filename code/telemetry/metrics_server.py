@@ -0,0 +1,174 @@
+import asyncio
+import json
+import logging
+import os
+from http import HTTPStatus
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+from urllib.parse import parse_qs, urlsplit
+
+from .prometheus import MetricFamily, render_metric_families
+from utilities import initialize_logging
+
+
+## Route handlers get the parsed query string, and return the response's content type and body
+RouteHandler = Callable[[Dict[str, List[str]]], Tuple[str, bytes]]
+## Metric providers return the metric families to include in the /metrics exposition
+MetricProvider = Callable[[], Iterable[MetricFamily]]
+
+
+class MetricsServer:
+    '''
+    Minimal asyncio HTTP server for exposing the stasher's metrics locally. It serves the Prometheus text exposition at
+    /metrics (built from any number of registered metric providers), and any other read only GET routes that other
+    components choose to add. It can also serve the same routes on a Unix socket, for local clients that would rather
+    not go through the network stack (ex: `curl --unix-socket <path> http://localhost/metrics`).
+
+    Handlers run right on the event loop, so they should only ever snapshot in-memory state.
+    '''
+
+    PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+    JSON_CONTENT_TYPE = "application/json"
+    REQUEST_TIMEOUT_SECONDS = 5.0
+    MAX_REQUEST_HEADER_BYTES = 16 * 1024
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 9464, unix_socket_path: str = None):
+        self.logger = initialize_logging(logging.getLogger(__name__))
+
+        self.host = host
+        self.port = port
+        self.unix_socket_path = unix_socket_path or None
+
+        self._routes: Dict[str, RouteHandler] = {}
+        self._metric_providers: List[MetricProvider] = []
+        self._server: Optional[asyncio.AbstractServer] = None
+        self._unix_server: Optional[asyncio.AbstractServer] = None
+
+        self.add_route("/metrics", self._handle_metrics)
+
+    ## Properties
+
+    @property
+    def running(self) -> bool:
+        return (self._server is not None)
+
+    ## Methods
+
+    def add_route(self, path: str, handler: RouteHandler):
+        self._routes[path] = handler
+
+
+    def add_metric_provider(self, provider: MetricProvider):
+        self._metric_providers.append(provider)
+
+
+    @staticmethod
+    def build_json_response(payload) -> Tuple[str, bytes]:
+        return (MetricsServer.JSON_CONTENT_TYPE, json.dumps(payload, default=str).encode("utf-8"))
+
+
+    def _handle_metrics(self, query: Dict[str, List[str]]) -> Tuple[str, bytes]:
+        families = [family for provider in self._metric_providers for family in provider()]
+
+        return (self.PROMETHEUS_CONTENT_TYPE, render_metric_families(families))
+
+
+    async def _write_response(
+            self,
+            writer: asyncio.StreamWriter,
+            status: HTTPStatus,
+            content_type: str,
+            body: bytes,
+            include_body: bool = True
+    ):
+        headers = (
+            f"HTTP/1.1 {status.value} {status.phrase}\r\n" +
+            f"Content-Type: {content_type}\r\n" +
+            f"Content-Length: {len(body)}\r\n" +
+            "Connection: close\r\n\r\n"
+        )
+        writer.write(headers.encode("latin-1") + (body if include_body else b""))
+        await writer.drain()
+
+
+    async def _handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            try:
+                request = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), self.REQUEST_TIMEOUT_SECONDS)
+            except (asyncio.TimeoutError, asyncio.IncompleteReadError, asyncio.LimitOverrunError):
+                return
+
+            request_line = request.split(b"\r\n", 1)[0].decode("latin-1")
+            parts = request_line.split(" ")
+            if (len(parts) != 3):
+                await self._write_response(writer, HTTPStatus.BAD_REQUEST, "text/plain", b"Bad request\n")
+                return
+
+            method, target, _ = parts
+            if (method not in ("GET", "HEAD")):
+                await self._write_response(writer, HTTPStatus.METHOD_NOT_ALLOWED, "text/plain", b"Only GET is supported\n")
+                return
+
+            url = urlsplit(target)
+            handler = self._routes.get(url.path)
+            if (handler is None):
+                await self._write_response(writer, HTTPStatus.NOT_FOUND, "text/plain", b"Not found\n")
+                return
+
+            try:
+                content_type, body = handler(parse_qs(url.query))
+                status = HTTPStatus.OK
+            except ValueError as e:
+                content_type, body = "text/plain", f"{e}\n".encode("utf-8")
+                status = HTTPStatus.BAD_REQUEST
+            except Exception as e:
+                self.logger.exception("Error handling metrics request for '%s'", url.path, exc_info=e)
+                content_type, body = "text/plain", b"Internal server error\n"
+                status = HTTPStatus.INTERNAL_SERVER_ERROR
+
+            await self._write_response(writer, status, content_type, body, method == "GET")
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+
+    async def start(self):
+        if (self.running):
+            return
+
+        self._server = await asyncio.start_server(
+            self._handle_connection,
+            self.host,
+            self.port,
+            limit=self.MAX_REQUEST_HEADER_BYTES
+        )
+        self.logger.info("Serving metrics on http://%s:%s/metrics", self.host, self.port)
+
+        if (self.unix_socket_path is not None):
+            ## A stale socket left behind by an unclean shutdown would otherwise fail the bind
+            if (os.path.exists(self.unix_socket_path)):
+                os.unlink(self.unix_socket_path)
+            self._unix_server = await asyncio.start_unix_server(
+                self._handle_connection,
+                self.unix_socket_path,
+                limit=self.MAX_REQUEST_HEADER_BYTES
+            )
+            self.logger.info("Serving metrics on unix socket %s", self.unix_socket_path)
+
+
+    async def stop(self):
+        if (not self.running):
+            return
+
+        self._server.close()
+        await self._server.wait_closed()
+        self._server = None
+
+        if (self._unix_server is not None):
+            self._unix_server.close()
+            await self._unix_server.wait_closed()
+            self._unix_server = None
+            try:
+                os.unlink(self.unix_socket_path)
+            except FileNotFoundError:
+                pass
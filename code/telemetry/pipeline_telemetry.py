@@ -0,0 +1,347 @@
+import asyncio
+import os
+import sys
+import time
+from typing import Dict, List, Optional, Tuple
+
+try:
+    import resource
+except ImportError:
+    ## Not available on Windows, which just means there's no peak memory usage to report
+    resource = None
+
+from sensor.sensor_datum import SensorDatum
+from sensor.sensor_read_result import SensorReadResult
+from scheduler.sensor_scheduler import ScheduledJob
+from storage.storage_adapter import StorageAdapter
+from storage.storage_manager import StorageManager
+from storage.spool.spool_storage import SpoolStorage
+from .histogram import Histogram, LATENCY_BUCKETS_SECONDS
+from .prometheus import MetricFamily
+from .telemetry_datum import ProcessTelemetryDatum, SensorTelemetryDatum, StorageTelemetryDatum
+
+
+class SensorTelemetry:
+    '''Running counters and histograms for a single sensor.'''
+
+    def __init__(self):
+        self.reads = 0
+        self.errors = 0
+        self.timeouts = 0
+        self.datums = 0
+        self.overruns = 0
+        self.skipped_ticks = 0
+        ## A gauge rather than a counter, since adaptive polling can change it
+        self.poll_interval_seconds = 0.0
+        self.read_latency = Histogram(LATENCY_BUCKETS_SECONDS)
+        self.cycle_duration = Histogram(LATENCY_BUCKETS_SECONDS)
+        self.schedule_slip = Histogram(LATENCY_BUCKETS_SECONDS)
+
+    ## Methods
+
+    def copy(self) -> 'SensorTelemetry':
+        telemetry = SensorTelemetry()
+        telemetry.__dict__.update(self.__dict__)
+        telemetry.read_latency = self.read_latency.copy()
+        telemetry.cycle_duration = self.cycle_duration.copy()
+        telemetry.schedule_slip = self.schedule_slip.copy()
+
+        return telemetry
+
+
+    def subtract(self, previous: 'SensorTelemetry') -> 'SensorTelemetry':
+        telemetry = SensorTelemetry()
+        for name in ("reads", "errors", "timeouts", "datums", "overruns", "skipped_ticks"):
+            setattr(telemetry, name, getattr(self, name) - getattr(previous, name))
+        telemetry.poll_interval_seconds = self.poll_interval_seconds
+        telemetry.read_latency = self.read_latency.subtract(previous.read_latency)
+        telemetry.cycle_duration = self.cycle_duration.subtract(previous.cycle_duration)
+        telemetry.schedule_slip = self.schedule_slip.subtract(previous.schedule_slip)
+
+        return telemetry
+
+
+class PipelineTelemetry:
+    '''
+    Collects the stasher's own performance data: per sensor read latency, errors and timeouts, per sensor cycle
+    duration and schedule slip, per sink write latency, batch size and buffer depth, and process memory usage.
+
+    Sensor stats are recorded as reads happen, while storage and process stats are pulled from the storage manager's
+    writers whenever a snapshot is taken. Snapshots are available as Prometheus metric families (for the metrics
+    server), as a JSON friendly dict, and as SYSTEM category datums that can be stored alongside the sensor data.
+    '''
+
+    METRIC_PREFIX = "sensor_stasher"
+    PROCESS_SENSOR_TYPE = "SensorStasher"
+    PROCESS_SENSOR_ID = "process"
+
+    def __init__(self, storage_manager: StorageManager):
+        self.storage_manager = storage_manager
+
+        self.sensors: Dict[Tuple[str, str], SensorTelemetry] = {}
+        self._started = time.monotonic()
+
+        ## State as of the last datum emission, so that emitted datums only cover what's happened since
+        self._emitted_sensors: Dict[Tuple[str, str], SensorTelemetry] = {}
+        self._emitted_storage: Dict[str, Tuple[Dict, Histogram, Histogram]] = {}
+
+    ## Methods
+
+    def _get_sensor_telemetry(self, sensor_type: str, sensor_id: str) -> SensorTelemetry:
+        key = (sensor_type, sensor_id)
+        telemetry = self.sensors.get(key)
+        if (telemetry is None):
+            telemetry = SensorTelemetry()
+            self.sensors[key] = telemetry
+
+        return telemetry
+
+
+    def record_read(self, result: SensorReadResult):
+        telemetry = self._get_sensor_telemetry(result.sensor_type, result.sensor_id)
+        telemetry.reads += 1
+        telemetry.datums += len(result.data)
+        telemetry.read_latency.observe(result.latency_seconds)
+        if (result.timed_out):
+            telemetry.timeouts += 1
+        elif (result.error is not None):
+            telemetry.errors += 1
+
+
+    def record_cycle(self, sensor_type: str, sensor_id: str, duration_seconds: float, job: Optional[ScheduledJob] = None):
+        '''Records how long a sensor's scheduled tick took, and how late it started according to its job.'''
+
+        telemetry = self._get_sensor_telemetry(sensor_type, sensor_id)
+        telemetry.cycle_duration.observe(duration_seconds)
+        if (job is not None):
+            ## Ticks can fire a hair early (within the scheduler's tolerance), which isn't slip worth reporting
+            telemetry.schedule_slip.observe(max(0.0, job.last_slip_seconds))
+            telemetry.overruns = job.overruns
+            telemetry.skipped_ticks = job.skipped_ticks
+            telemetry.poll_interval_seconds = job.interval_seconds
+
+
+    @staticmethod
+    def get_memory_usage() -> Tuple[int, int]:
+        '''Gets the process' current and peak resident memory usage in bytes, or 0 where that isn't available.'''
+
+        resident_bytes = 0
+        try:
+            with open("/proc/self/statm") as statm:
+                resident_bytes = int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+        except (OSError, ValueError, IndexError, AttributeError):
+            pass
+
+        peak_resident_bytes = 0
+        if (resource is not None):
+            peak_resident_bytes = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            ## macOS reports this in bytes, everything else in kilobytes
+            if (sys.platform != "darwin"):
+                peak_resident_bytes *= 1024
+
+        return resident_bytes, max(resident_bytes, peak_resident_bytes)
+
+
+    @staticmethod
+    def _get_spool_bytes(writer) -> int:
+        ## The spool may be wrapped up in other storage adapters (ex: compression), so dig down to it
+        storage = writer.storage
+        while (not isinstance(storage, SpoolStorage) and isinstance(getattr(storage, 'storage', None), StorageAdapter)):
+            storage = storage.storage
+
+        return storage.spool.total_bytes if isinstance(storage, SpoolStorage) else 0
+
+
+    @staticmethod
+    def _count_tasks() -> int:
+        try:
+            return len(asyncio.all_tasks())
+        except RuntimeError:
+            ## No running event loop
+            return 0
+
+
+    def get_process_metrics(self) -> Dict:
+        resident_bytes, peak_resident_bytes = self.get_memory_usage()
+
+        return {
+            "resident_memory_bytes": resident_bytes,
+            "peak_resident_memory_bytes": peak_resident_bytes,
+            "queued_datums": sum(writer.queue_depth for writer in self.storage_manager.writers.values()),
+            "asyncio_tasks": self._count_tasks(),
+            "uptime_seconds": time.monotonic() - self._started
+        }
+
+
+    def get_snapshot(self) -> Dict:
+        sensors = {}
+        for (sensor_type, sensor_id), telemetry in self.sensors.items():
+            sensors[f"{sensor_type} - {sensor_id}"] = {
+                "reads": telemetry.reads,
+                "errors": telemetry.errors,
+                "timeouts": telemetry.timeouts,
+                "datums": telemetry.datums,
+                "overruns": telemetry.overruns,
+                "skipped_ticks": telemetry.skipped_ticks,
+                "poll_interval_seconds": telemetry.poll_interval_seconds,
+                "read_latency_seconds": telemetry.read_latency.to_dict(),
+                "cycle_duration_seconds": telemetry.cycle_duration.to_dict(),
+                "schedule_slip_seconds": telemetry.schedule_slip.to_dict()
+            }
+
+        storage = {}
+        for name, writer in self.storage_manager.writers.items():
+            storage[name] = {
+                **writer.get_metrics(),
+                "spool_bytes": self._get_spool_bytes(writer),
+                "write_latency_seconds": writer.write_latency_histogram.to_dict(),
+                "batch_size": writer.batch_size_histogram.to_dict()
+            }
+
+        return {
+            "sensors": sensors,
+            "storage": storage,
+            "process": self.get_process_metrics()
+        }
+
+
+    def _build_family(self, name: str, metric_type: str, help_text: str) -> MetricFamily:
+        return MetricFamily(f"{self.METRIC_PREFIX}_{name}", metric_type, help_text)
+
+
+    def get_metric_families(self) -> List[MetricFamily]:
+        families = []
+
+        ## Sensors
+        sensor_counters = [
+            ("sensor_reads_total", "reads", "Sensor reads attempted."),
+            ("sensor_read_errors_total", "errors", "Sensor reads that raised an error."),
+            ("sensor_read_timeouts_total", "timeouts", "Sensor reads that timed out."),
+            ("sensor_datums_total", "datums", "Datums read from the sensor."),
+            ("schedule_overruns_total", "overruns", "Ticks that ran past the sensor's next tick."),
+            ("schedule_skipped_ticks_total", "skipped_ticks", "Ticks skipped to catch back up after an overrun.")
+        ]
+        for name, attribute, help_text in sensor_counters:
+            family = self._build_family(name, MetricFamily.COUNTER, help_text)
+            for (sensor_type, sensor_id), telemetry in self.sensors.items():
+                family.add_sample(getattr(telemetry, attribute), {"sensor_type": sensor_type, "sensor_id": sensor_id})
+            families.append(family)
+
+        family = self._build_family("sensor_poll_interval_seconds", MetricFamily.GAUGE, "Time between the sensor's scheduled ticks.")
+        for (sensor_type, sensor_id), telemetry in self.sensors.items():
+            family.add_sample(telemetry.poll_interval_seconds, {"sensor_type": sensor_type, "sensor_id": sensor_id})
+        families.append(family)
+
+        sensor_histograms = [
+            ("sensor_read_latency_seconds", "read_latency", "Time taken by each sensor read."),
+            ("cycle_duration_seconds", "cycle_duration", "Time taken by each scheduled tick, from read to queued for storage."),
+            ("schedule_slip_seconds", "schedule_slip", "How late each scheduled tick started.")
+        ]
+        for name, attribute, help_text in sensor_histograms:
+            family = self._build_family(name, MetricFamily.HISTOGRAM, help_text)
+            for (sensor_type, sensor_id), telemetry in self.sensors.items():
+                family.add_histogram(getattr(telemetry, attribute), {"sensor_type": sensor_type, "sensor_id": sensor_id})
+            families.append(family)
+
+        ## Storage
+        writers = self.storage_manager.writers
+        storage_metrics = [
+            ("storage_queue_depth", MetricFamily.GAUGE, lambda writer: writer.queue_depth, "Datums waiting to be written."),
+            ("storage_lag_seconds", MetricFamily.GAUGE, lambda writer: writer.lag_seconds, "Age of the oldest queued datum."),
+            ("storage_spool_bytes", MetricFamily.GAUGE, self._get_spool_bytes, "Size of the sink's on disk spool."),
+            ("storage_enqueued_total", MetricFamily.COUNTER, lambda writer: writer.enqueued_count, "Datums queued for writing."),
+            ("storage_written_total", MetricFamily.COUNTER, lambda writer: writer.written_count, "Datums written."),
+            ("storage_dropped_total", MetricFamily.COUNTER, lambda writer: writer.dropped_count, "Datums dropped due to a full queue."),
+            ("storage_failed_batches_total", MetricFamily.COUNTER, lambda writer: writer.failed_batch_count, "Batches given up on after retrying."),
+            ("storage_retries_total", MetricFamily.COUNTER, lambda writer: writer.retry_count, "Batch writes retried.")
+        ]
+        for name, metric_type, get_value, help_text in storage_metrics:
+            family = self._build_family(name, metric_type, help_text)
+            for storage_name, writer in writers.items():
+                family.add_sample(get_value(writer), {"storage": storage_name})
+            families.append(family)
+
+        storage_histograms = [
+            ("storage_write_latency_seconds", "write_latency_histogram", "Time taken by each successful batch write."),
+            ("storage_batch_size", "batch_size_histogram", "Datums in each successfully written batch.")
+        ]
+        for name, attribute, help_text in storage_histograms:
+            family = self._build_family(name, MetricFamily.HISTOGRAM, help_text)
+            for storage_name, writer in writers.items():
+                family.add_histogram(getattr(writer, attribute), {"storage": storage_name})
+            families.append(family)
+
+        ## Process
+        process_metrics = self.get_process_metrics()
+        process_gauges = [
+            ("process_resident_memory_bytes", "resident_memory_bytes", "Resident memory usage."),
+            ("process_peak_resident_memory_bytes", "peak_resident_memory_bytes", "Peak resident memory usage."),
+            ("queued_datums", "queued_datums", "Datums waiting to be written, across all sinks."),
+            ("asyncio_tasks", "asyncio_tasks", "Tasks on the event loop."),
+            ("uptime_seconds", "uptime_seconds", "Time since telemetry started being collected.")
+        ]
+        for name, key, help_text in process_gauges:
+            family = self._build_family(name, MetricFamily.GAUGE, help_text)
+            family.add_sample(process_metrics[key])
+            families.append(family)
+
+        return families
+
+
+    def build_datums(self) -> List[SensorDatum]:
+        '''
+        Builds SYSTEM category datums covering the interval since the previous call, so that they can be stored right
+        alongside the sensor data.
+        '''
+
+        data: List[SensorDatum] = []
+
+        for (sensor_type, sensor_id), telemetry in self.sensors.items():
+            previous = self._emitted_sensors.get((sensor_type, sensor_id)) or SensorTelemetry()
+            interval = telemetry.subtract(previous)
+            self._emitted_sensors[(sensor_type, sensor_id)] = telemetry.copy()
+
+            data.append(SensorTelemetryDatum(sensor_type, sensor_id, {
+                "reads": interval.reads,
+                "errors": interval.errors,
+                "timeouts": interval.timeouts,
+                "datums": interval.datums,
+                "read_latency_mean_seconds": interval.read_latency.mean,
+                "read_latency_p95_seconds": interval.read_latency.get_quantile(0.95),
+                "cycle_duration_p95_seconds": interval.cycle_duration.get_quantile(0.95),
+                "schedule_slip_p95_seconds": interval.schedule_slip.get_quantile(0.95),
+                "overruns": interval.overruns,
+                "skipped_ticks": interval.skipped_ticks,
+                "poll_interval_seconds": interval.poll_interval_seconds
+            }))
+
+        for name, writer in self.storage_manager.writers.items():
+            metrics = writer.get_metrics()
+            write_latency = writer.write_latency_histogram
+            batch_size = writer.batch_size_histogram
+
+            previous = self._emitted_storage.get(name)
+            if (previous is None):
+                previous = ({}, Histogram(write_latency.buckets), Histogram(batch_size.buckets))
+            previous_metrics, previous_write_latency, previous_batch_size = previous
+            self._emitted_storage[name] = (metrics, write_latency.copy(), batch_size.copy())
+
+            write_latency = write_latency.subtract(previous_write_latency)
+            batch_size = batch_size.subtract(previous_batch_size)
+            data.append(StorageTelemetryDatum(metrics["storage_type"], name, {
+                "queue_depth": metrics["queue_depth"],
+                "lag_seconds": metrics["lag_seconds"],
+                "throughput_datums_per_second": metrics["throughput_datums_per_second"],
+                "written": metrics["written"] - previous_metrics.get("written", 0),
+                "dropped": metrics["dropped"] - previous_metrics.get("dropped", 0),
+                "failed_batches": metrics["failed_batches"] - previous_metrics.get("failed_batches", 0),
+                "retries": metrics["retries"] - previous_metrics.get("retries", 0),
+                "write_latency_mean_seconds": write_latency.mean,
+                "write_latency_p95_seconds": write_latency.get_quantile(0.95),
+                "batch_size_mean": batch_size.mean,
+                "spool_bytes": self._get_spool_bytes(writer)
+            }))
+
+        data.append(ProcessTelemetryDatum(self.PROCESS_SENSOR_TYPE, self.PROCESS_SENSOR_ID, self.get_process_metrics()))
+
+        return data
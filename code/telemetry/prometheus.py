@@ -0,0 +1,74 @@
+import math
+from typing import Dict, Iterable, List
+
+from .histogram import Histogram
+
+
+class MetricFamily:
+    '''
+    A named group of samples (one per label set) rendered in the Prometheus text exposition format.
+
+    See: https://prometheus.io/docs/instrumenting/exposition_formats/
+    '''
+
+    COUNTER = "counter"
+    GAUGE = "gauge"
+    HISTOGRAM = "histogram"
+
+    _LABEL_ESCAPES = str.maketrans({"\\": "\\\\", "\"": "\\\"", "\n": "\\n"})
+
+    def __init__(self, name: str, metric_type: str, help_text: str):
+        self.name = name
+        self.metric_type = metric_type
+        self.help_text = help_text
+
+        self._lines: List[str] = []
+
+    ## Methods
+
+    @classmethod
+    def _format_value(cls, value: float) -> str:
+        if (isinstance(value, bool)):
+            return "1" if value else "0"
+        if (isinstance(value, float)):
+            if (math.isnan(value)):
+                return "NaN"
+            if (math.isinf(value)):
+                return "+Inf" if value > 0 else "-Inf"
+
+        return repr(value)
+
+
+    @classmethod
+    def _format_labels(cls, labels: Dict[str, object]) -> str:
+        if (not labels):
+            return ""
+
+        return "{" + ",".join(
+            f"{name}=\"{str(value).translate(cls._LABEL_ESCAPES)}\"" for name, value in labels.items()
+        ) + "}"
+
+
+    def add_sample(self, value: float, labels: Dict[str, object] = None, suffix: str = ""):
+        self._lines.append(f"{self.name}{suffix}{self._format_labels(labels)} {self._format_value(value)}")
+
+
+    def add_histogram(self, histogram: Histogram, labels: Dict[str, object] = None):
+        labels = dict(labels or {})
+
+        for bound, count in zip(histogram.buckets + (math.inf,), histogram.get_cumulative_counts()):
+            self.add_sample(count, {**labels, "le": self._format_value(float(bound))}, "_bucket")
+        self.add_sample(histogram.sum, labels, "_sum")
+        self.add_sample(histogram.count, labels, "_count")
+
+
+    def render(self) -> str:
+        return "\n".join([
+            f"# HELP {self.name} {self.help_text}",
+            f"# TYPE {self.name} {self.metric_type}",
+            *self._lines
+        ])
+
+
+def render_metric_families(families: Iterable[MetricFamily]) -> bytes:
+    return ("\n".join(family.render() for family in families) + "\n").encode("utf-8")
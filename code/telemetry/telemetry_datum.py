@@ -0,0 +1,73 @@
+from typing import Dict
+
+from sensor.sensor_datum import SensorDatum
+from sensor.datum_category import DatumCategory
+
+
+class SensorTelemetryDatum(SensorDatum):
+    '''Read and scheduling stats for a single sensor, over the interval since the previous emission.'''
+
+    schema = {
+        "reads": int,
+        "errors": int,
+        "timeouts": int,
+        "datums": int,
+        "read_latency_mean_seconds": float,
+        "read_latency_p95_seconds": float,
+        "cycle_duration_p95_seconds": float,
+        "schedule_slip_p95_seconds": float,
+        "overruns": int,
+        "skipped_ticks": int,
+        "poll_interval_seconds": float
+    }
+    __slots__ = tuple(schema)
+
+    def __init__(self, sensor_type: str, sensor_id: str, measurement: Dict):
+        super().__init__(DatumCategory.SYSTEM, sensor_type, sensor_id)
+
+        for name in self.schema:
+            setattr(self, name, measurement.get(name))
+
+
+class StorageTelemetryDatum(SensorDatum):
+    '''Write stats and buffer depth for a single storage sink, over the interval since the previous emission.'''
+
+    schema = {
+        "queue_depth": int,
+        "lag_seconds": float,
+        "throughput_datums_per_second": float,
+        "written": int,
+        "dropped": int,
+        "failed_batches": int,
+        "retries": int,
+        "write_latency_mean_seconds": float,
+        "write_latency_p95_seconds": float,
+        "batch_size_mean": float,
+        "spool_bytes": int
+    }
+    __slots__ = tuple(schema)
+
+    def __init__(self, storage_type: str, storage_name: str, measurement: Dict):
+        super().__init__(DatumCategory.SYSTEM, storage_type, storage_name)
+
+        for name in self.schema:
+            setattr(self, name, measurement.get(name))
+
+
+class ProcessTelemetryDatum(SensorDatum):
+    '''Resource usage of the stasher process itself.'''
+
+    schema = {
+        "resident_memory_bytes": int,
+        "peak_resident_memory_bytes": int,
+        "queued_datums": int,
+        "asyncio_tasks": int,
+        "uptime_seconds": float
+    }
+    __slots__ = tuple(schema)
+
+    def __init__(self, sensor_type: str, sensor_id: str, measurement: Dict):
+        super().__init__(DatumCategory.SYSTEM, sensor_type, sensor_id)
+
+        for name in self.schema:
+            setattr(self, name, measurement.get(name))
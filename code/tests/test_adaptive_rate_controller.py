@@ -0,0 +1,39 @@
+import random
+
+from scheduler.adaptive_rate_controller import AdaptiveRateController
+from sensor.sensors.synthetic.synthetic_datum import SyntheticDatum
+
+
+DATUM_CLASS = SyntheticDatum.get_class(1)
+
+
+def simulate(signal, duration_seconds: float, sigma: float) -> list:
+    '''Polls the signal (plus gaussian noise) at whatever interval the controller picks, and returns each interval.'''
+
+    noise = random.Random(1)
+    controller = AdaptiveRateController(60, 15, 480)
+    intervals = []
+    time_seconds = 0.0
+    while (time_seconds < duration_seconds):
+        datum = DATUM_CLASS("Synthetic", "synthetic_0", {"value_0": signal(time_seconds) + noise.gauss(0, sigma)})
+        datum.timestamp_ns = round(time_seconds * 1_000_000_000)
+        interval = controller.observe([datum])
+        intervals.append(interval)
+        time_seconds += interval
+
+    return intervals
+
+
+def test_flat_signal_backs_off_regardless_of_noise():
+    for sigma in (0.05, 0.5):
+        intervals = simulate(lambda time_seconds: 20.0, 20000, sigma)
+
+        assert intervals[-1] == 480
+        assert 15 not in intervals
+
+
+def test_trend_speeds_up():
+    ## Flat for a while, and then climbing by 0.05 per second
+    intervals = simulate(lambda time_seconds: 20.0 + max(time_seconds - 8000, 0) * 0.05, 12000, 0.5)
+
+    assert max(intervals[-10:]) <= 60
@@ -0,0 +1,37 @@
+from array import array
+
+from storage.clients.archive.columnar_archive import NS_PER_DAY, ColumnarArchive
+
+
+KEY = ("Synthetic", "synthetic_0", "value_0")
+TODAY = 20000
+
+
+def build_columns(*days: float):
+    return {KEY: (array('q', (round(day * NS_PER_DAY) for day in days)), array('d', (float(day) for day in days)))}
+
+
+def test_future_reading_is_rejected_and_does_not_expire_partitions(tmp_path):
+    archive = ColumnarArchive(tmp_path, retention_days=30, fsync=False, clock=lambda: round((TODAY + 0.75) * NS_PER_DAY))
+    archive.append(build_columns(TODAY - 20.5, TODAY - 10.5, TODAY + 0.5))
+
+    ## A node with a bad clock sends a reading from 400 days ahead
+    archive.append(build_columns(TODAY + 400.5))
+
+    assert archive.days == [TODAY - 21, TODAY - 11, TODAY]
+    assert archive.rejected_count == 1
+    archive.close()
+
+
+def test_retention_follows_the_clock(tmp_path):
+    now_ns = [TODAY * NS_PER_DAY]
+    archive = ColumnarArchive(tmp_path, retention_days=30, fsync=False, clock=lambda: now_ns[0])
+    archive.append(build_columns(TODAY - 29.5, TODAY - 0.5))
+    assert archive.days == [TODAY - 30, TODAY - 1]
+
+    ## Rolling over into the next day expires the partition that's now past the retention
+    now_ns[0] += NS_PER_DAY
+    archive.append(build_columns(TODAY + 0.5))
+
+    assert archive.days == [TODAY - 1, TODAY]
+    archive.close()
@@ -0,0 +1,155 @@
+import bisect
+import math
+import random
+
+import pytest
+
+from sensor.datum_batch import DatumBatch
+from sensor.sensors.synthetic.synthetic_datum import SyntheticDatum
+from storage.compression.compression_filter import CompressionFilter, CompressionMode, FieldCompression
+from storage.compression.compression_storage import CompressionStorage
+from storage.storage_adapter import StorageAdapter
+
+
+DATUM_CLASS = SyntheticDatum.get_class(1)
+INTERVAL_NS = 1_000_000_000
+
+
+class RecordingStorage(StorageAdapter):
+    def __init__(self, consumes_batches: bool = False, failures: int = 0):
+        self.consumes_batches = consumes_batches
+        self.failures = failures
+        self.stored = []
+
+
+    @property
+    def storage_type(self) -> str:
+        return "Recording"
+
+
+    def _record(self, data):
+        if (self.failures > 0):
+            self.failures -= 1
+            raise ConnectionError("Storage is down")
+
+        self.stored.extend(data)
+
+
+    def store(self, data):
+        assert not self.consumes_batches
+        self._record(data)
+
+
+    def store_batches(self, batches):
+        assert self.consumes_batches
+        self._record([datum for batch in batches for datum in batch.to_datums()])
+
+
+def build_data(values, sensor_id: str = "test_0", start_ns: int = 0):
+    data = []
+    for index, value in enumerate(values):
+        datum = DATUM_CLASS("Synthetic", sensor_id, {"value_0": value})
+        datum.timestamp_ns = start_ns + index * INTERVAL_NS
+        data.append(datum)
+
+    return data
+
+
+def build_noisy_values(count: int = 5000):
+    generator = random.Random(1234)
+    return [
+        10 * math.sin(index / 200) + 2 * math.sin(index / 37) + generator.gauss(0, 0.05)
+        for index in range(count)
+    ]
+
+
+def build_filter(mode: CompressionMode, deviation: float) -> CompressionFilter:
+    return CompressionFilter(FieldCompression(mode, deviation))
+
+
+def get_points(data):
+    return sorted((datum.timestamp_ns, datum.value_0) for datum in data if datum.value_0 is not None)
+
+
+def store(storage: CompressionStorage, data, consumes_batches: bool):
+    if (consumes_batches):
+        storage.store_batches(DatumBatch.from_data(data))
+    else:
+        storage.store(data)
+
+
+def get_stored(storage: RecordingStorage):
+    return [(datum.sensor_id, datum.timestamp_ns, datum.value_0) for datum in storage.stored]
+
+
+def test_swinging_door_interpolates_within_the_deviation():
+    compression_filter = build_filter(CompressionMode.SWINGING_DOOR, 0.5)
+    values = build_noisy_values()
+    data = build_data(values)
+
+    points = get_points(compression_filter.filter(data) + compression_filter.flush())
+
+    assert len(points) < len(values) / 10
+    timestamps = [timestamp_ns for timestamp_ns, _ in points]
+    worst_error = 0.0
+    for datum in data:
+        index = bisect.bisect_left(timestamps, datum.timestamp_ns)
+        if (timestamps[index] == datum.timestamp_ns):
+            interpolated = points[index][1]
+        else:
+            (start_ns, start_value), (end_ns, end_value) = points[index - 1], points[index]
+            interpolated = start_value + (end_value - start_value) * (datum.timestamp_ns - start_ns) / (end_ns - start_ns)
+        worst_error = max(worst_error, abs(interpolated - datum.value_0))
+
+    assert worst_error <= 0.5
+
+
+def test_deadband_stores_values_that_moved_past_the_deviation():
+    compression_filter = build_filter(CompressionMode.DEADBAND, 0.5)
+    values = build_noisy_values()
+
+    stored = {timestamp_ns: value for timestamp_ns, value in get_points(compression_filter.filter(build_data(values)))}
+
+    assert len(stored) < len(values) / 5
+    last_stored = None
+    for index, value in enumerate(values):
+        timestamp_ns = index * INTERVAL_NS
+        if (timestamp_ns in stored):
+            assert last_stored is None or abs(value - last_stored) > 0.5
+            last_stored = stored[timestamp_ns]
+        else:
+            assert abs(value - last_stored) <= 0.5
+
+
+def test_snapshot_only_copies_the_series_being_filtered():
+    compression_filter = build_filter(CompressionMode.DEADBAND, 0.5)
+    compression_filter.filter(build_data([1.0, 2.0], "test_0") + build_data([1.0, 2.0], "test_1"))
+
+    snapshot = compression_filter.snapshot(build_data([3.0], "test_1") + build_data([3.0], "test_2"))
+
+    assert {key[2]: state is None for key, state in snapshot.items()} == {"test_1": False, "test_2": True}
+
+
+@pytest.mark.parametrize("consumes_batches", [False, True])
+def test_failed_store_rolls_back_the_compression_state(consumes_batches: bool):
+    values = build_noisy_values(500)
+    ## The second write includes a series first seen in it, which has to be forgotten again on rollback
+    writes = [
+        build_data(values[:250]),
+        build_data(values[250:], start_ns=250 * INTERVAL_NS) + build_data(values[:100], "test_1")
+    ]
+    expected = RecordingStorage(consumes_batches)
+    expected_storage = CompressionStorage(expected, build_filter(CompressionMode.SWINGING_DOOR, 0.5))
+    failing = RecordingStorage(consumes_batches)
+    failing_storage = CompressionStorage(failing, build_filter(CompressionMode.SWINGING_DOOR, 0.5))
+
+    for data in writes:
+        store(expected_storage, data, consumes_batches)
+        failing.failures = 1
+        with pytest.raises(ConnectionError):
+            store(failing_storage, data, consumes_batches)
+        store(failing_storage, data, consumes_batches)
+
+    assert failing.stored
+    assert get_stored(failing) == get_stored(expected)
+
@@ -0,0 +1,70 @@
+import base64
+import json
+import subprocess
+import sys
+from pathlib import Path
+
+from sensor.datum_codec import DatumCodec
+from sensor.sensors.synthetic.synthetic_datum import SyntheticDatum
+from sensor.sensors.test_sensor import test_sensor_datum
+
+
+CODE_PATH = Path(__file__).parent.parent
+
+## Run in a fresh interpreter, so that none of the drivers' datum classes are loaded and the decoded datums have to be
+## rebuilt as stand ins
+DECODE_SCRIPT = """
+import base64, json, sys
+from array import array
+from sensor.datum_batch import DatumBatch
+from sensor.datum_codec import DatumCodec
+from sensor.sensor_datum import SensorDatum
+
+assert not SensorDatum.registry, SensorDatum.registry
+data = DatumCodec.decode(base64.b64decode(sys.stdin.read()))
+print(json.dumps({
+    "records": [datum.to_record() for datum in data],
+    "schemas": {type(datum).__name__: {name: field_type.__name__ for name, field_type in datum.schema.items()} for datum in data},
+    "numeric_columns": sorted(
+        name for batch in DatumBatch.from_data(data) for name, column in batch.columns.items() if isinstance(column, array)
+    )
+}))
+"""
+
+
+def decode_in_subprocess(payload: bytes) -> dict:
+    result = subprocess.run(
+        [sys.executable, "-c", DECODE_SCRIPT],
+        input=base64.b64encode(payload).decode("ascii"),
+        capture_output=True,
+        text=True,
+        cwd=CODE_PATH,
+        check=True
+    )
+
+    return json.loads(result.stdout)
+
+
+def test_round_trip_without_driver_keeps_field_types():
+    synthetic_class = SyntheticDatum.get_class(2)
+    synthetic = synthetic_class("Synthetic", "synthetic_0", {"value_0": 1.5, "value_1": -2.25})
+    synthetic.timestamp_ns = 1_700_000_000_000_000_000
+    test_sensor = test_sensor_datum.TestSensorDatum("TestSensor", "test_sensor_0", {"name": "test", "test_key": "test_value"})
+    data = [synthetic, test_sensor]
+
+    decoded = decode_in_subprocess(DatumCodec.encode(data))
+
+    assert decoded["records"] == [json.loads(json.dumps(datum.to_record())) for datum in data]
+    assert decoded["schemas"][synthetic_class.__name__] == {"value_0": "float", "value_1": "float"}
+    assert decoded["schemas"]["TestSensorDatum"] == {"name": "str", "test_key": "str"}
+    ## Stand ins with untyped schemas would have no numeric columns at all
+    assert decoded["numeric_columns"] == ["value_0", "value_1"]
+
+
+def test_round_trip_in_process():
+    synthetic = SyntheticDatum.get_class(1)("Synthetic", "synthetic_0", {"value_0": 3.0})
+
+    decoded, = DatumCodec.decode(DatumCodec.encode([synthetic]))
+
+    assert type(decoded) is type(synthetic)
+    assert decoded.to_record() == synthetic.to_record()
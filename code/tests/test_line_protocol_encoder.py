@@ -0,0 +1,30 @@
+import math
+
+from sensor.datum_batch import DatumBatch
+from sensor.sensors.synthetic.synthetic_datum import SyntheticDatum
+from storage.clients.influx.line_protocol_encoder import LineProtocolEncoder
+
+
+DATUM_CLASS = SyntheticDatum.get_class(2)
+
+
+def build_datum(value_0, value_1) -> SyntheticDatum:
+    datum = DATUM_CLASS("Synthetic", "synthetic_0", {"value_0": value_0, "value_1": value_1})
+    datum.timestamp_ns = 1_700_000_000_000_000_000
+
+    return datum
+
+
+def test_unwritable_fields_are_left_out():
+    line = LineProtocolEncoder().encode_datum(build_datum(1.5, math.inf), "Test", "test_0")
+
+    assert line.split(" ")[1] == "value_0=1.5"
+
+
+def test_datum_without_writable_fields_has_no_line():
+    encoder = LineProtocolEncoder()
+    data = [build_datum(math.nan, None), build_datum(2.0, 3.0)]
+
+    assert encoder.encode_datum(data[0], "Test", "test_0") is None
+    assert len(list(encoder.iter_lines(data, "Test", "test_0"))) == 1
+    assert len(list(encoder.iter_batch_lines(DatumBatch.from_data(data)[0], "Test", "test_0"))) == 1
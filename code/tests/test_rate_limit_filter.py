@@ -0,0 +1,62 @@
+import logging
+import threading
+
+from utilities import RateLimitFilter
+
+
+def build_record(message: str, *args, lineno: int = 10) -> logging.LogRecord:
+    return logging.LogRecord("sensor", logging.WARNING, "sensor.py", lineno, message, args, None)
+
+
+def test_repeats_with_different_arguments_are_limited():
+    rate_limit = RateLimitFilter(window_seconds=60, burst=2)
+
+    results = [rate_limit.filter(build_record("Read failed after %.2f seconds", index / 10)) for index in range(5)]
+
+    assert results == [True, True, False, False, False]
+    assert rate_limit.filter(build_record("Read failed after %.2f seconds", 1.0, lineno=20))
+
+
+def test_suppressed_count_is_noted_without_formatting_early(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr("utilities.time.monotonic", lambda: now[0])
+    rate_limit = RateLimitFilter(window_seconds=60, burst=1)
+    for _ in range(3):
+        rate_limit.filter(build_record("Read failed: %s", "timeout"))
+
+    now[0] += 61
+    record = build_record("Read failed: %s", "timeout")
+
+    assert rate_limit.filter(record)
+    assert record.args == ("timeout",)
+    assert record.getMessage() == "Read failed: timeout (suppressed 2 repeats of this message)"
+
+
+def test_stale_windows_are_pruned_even_with_suppressed_repeats(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr("utilities.time.monotonic", lambda: now[0])
+    rate_limit = RateLimitFilter(window_seconds=60, burst=1)
+    for _ in range(3):
+        rate_limit.filter(build_record("Read failed"))
+
+    now[0] += 121
+    rate_limit.filter(build_record("Something else"))
+
+    assert list(rate_limit._windows) == [("sensor", logging.WARNING, "sensor.py", 10, "Something else")]
+
+
+def test_concurrent_logging_threads():
+    rate_limit = RateLimitFilter(window_seconds=0, burst=1)
+    passed = []
+
+    def log_repeatedly(thread_index: int):
+        passed.append(sum(rate_limit.filter(build_record(f"Message {index}", lineno=thread_index)) for index in range(2000)))
+
+    threads = [threading.Thread(target=log_repeatedly, args=(index,)) for index in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    ## Every window runs out immediately, so nothing's ever suppressed
+    assert passed == [2000] * 8
@@ -0,0 +1,22 @@
+import json
+import math
+
+from sensor.sensors.synthetic.synthetic_datum import SyntheticDatum
+from storage.recent.recent_readings import RecentReadings
+
+
+DATUM_CLASS = SyntheticDatum.get_class(3)
+
+
+def test_non_finite_values_are_served_as_null():
+    recent_readings = RecentReadings()
+    recent_readings.record([
+        DATUM_CLASS("Synthetic", "synthetic_0", {"value_0": math.nan, "value_1": math.inf, "value_2": 1.5})
+    ])
+
+    latest = {reading["field"]: reading["value"] for reading in recent_readings.get_latest()}
+    ranges = {reading["field"]: reading["values"] for reading in recent_readings.get_range()}
+
+    assert latest == {"value_0": None, "value_1": None, "value_2": 1.5}
+    assert ranges == {"value_0": [None], "value_1": [None], "value_2": [1.5]}
+    json.dumps([latest, ranges], allow_nan=False)
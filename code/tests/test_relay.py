@@ -0,0 +1,115 @@
+import asyncio
+import time
+
+import pytest
+
+from relay.relay_gateway import RelayGateway
+from relay.relay_protocol import ACK, RelayStatus, decode_ack, encode_frame
+from sensor.sensors.synthetic.synthetic_datum import SyntheticDatum
+from storage.clients.relay.relay_storage import RelayStorage
+from storage.storage_adapter import StorageAdapter
+
+
+class RecordingStorage(StorageAdapter):
+    def __init__(self, delay_seconds: float = 0):
+        self.delay_seconds = delay_seconds
+        self.relayed = []
+
+
+    @property
+    def storage_type(self) -> str:
+        return "Recording"
+
+
+    def store(self, data):
+        raise AssertionError("The gateway should only store relayed data")
+
+
+    def store_relayed(self, data_by_system):
+        time.sleep(self.delay_seconds)
+        self.relayed.append(data_by_system)
+
+
+def build_data():
+    return [SyntheticDatum.get_class(1)("Synthetic", "synthetic_0", {"value_0": 1.0})]
+
+
+async def relay(storage: RecordingStorage, gateway_token: str, edge_token: str, timeout_seconds: float = 60):
+    gateway = RelayGateway({"recording": storage}, gateway_token, port=0, flush_interval_seconds=0)
+    await gateway.start()
+    port = gateway._server.sockets[0].getsockname()[1]
+    edge = RelayStorage("edge", "edge_0", {
+        "host": "127.0.0.1",
+        "port": port,
+        "auth_token": edge_token,
+        "timeout_seconds": timeout_seconds
+    })
+
+    try:
+        await asyncio.get_running_loop().run_in_executor(None, edge.store, build_data())
+    finally:
+        edge.close()
+        await gateway.stop()
+
+    return gateway
+
+
+def test_gateway_defaults_to_localhost():
+    assert RelayGateway({"recording": RecordingStorage()}, "secret").host == "127.0.0.1"
+
+
+def test_gateway_requires_an_auth_token():
+    with pytest.raises(ValueError):
+        RelayGateway({"recording": RecordingStorage()}, "")
+
+
+def test_signed_frame_is_relayed():
+    storage = RecordingStorage()
+
+    asyncio.run(relay(storage, "secret", "secret"))
+
+    assert list(storage.relayed[0]) == [("edge", "edge_0")]
+
+
+def test_frame_with_the_wrong_token_is_rejected():
+    storage = RecordingStorage()
+
+    with pytest.raises(RuntimeError, match="UNAUTHORIZED"):
+        asyncio.run(relay(storage, "secret", "not the secret"))
+
+    assert storage.relayed == []
+
+
+def test_resent_frame_is_acked_without_being_stored_again():
+    storage = RecordingStorage()
+    frame = encode_frame("edge", "edge_0", build_data(), "secret", session=1, sequence=1)
+
+    async def send_twice():
+        gateway = RelayGateway({"recording": storage}, "secret", port=0, flush_interval_seconds=0)
+        await gateway.start()
+        port = gateway._server.sockets[0].getsockname()[1]
+        statuses = []
+        try:
+            for _ in range(2):
+                reader, writer = await asyncio.open_connection("127.0.0.1", port)
+                writer.write(frame)
+                statuses.append(decode_ack(await reader.readexactly(ACK.size)))
+                writer.close()
+        finally:
+            await gateway.stop()
+
+        return (statuses, gateway.duplicate_frame_count)
+
+    assert asyncio.run(send_twice()) == ([RelayStatus.OK, RelayStatus.OK], 1)
+    assert len(storage.relayed) == 1
+
+
+def test_edge_resends_a_timed_out_frame_without_duplicating_it():
+    ## The first ack doesn't make it back before the edge's timeout, so it reconnects and resends while the write is
+    ## still underway
+    storage = RecordingStorage(delay_seconds=0.5)
+
+    gateway = asyncio.run(relay(storage, "secret", "secret", timeout_seconds=0.3))
+
+    assert gateway.duplicate_frame_count == 1
+    assert len(storage.relayed) == 1
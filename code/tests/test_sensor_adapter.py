@@ -0,0 +1,36 @@
+import pytest
+
+from sensor.sensor_adapter import SensorAdapter
+from utilities import ConfigError, ConfigSection
+
+
+class UndiscoverableSensor(SensorAdapter):
+    def __init__(self, sensor_id: str):
+        self._sensor_id = sensor_id
+
+
+    @property
+    def sensor_type(self) -> str:
+        return "Undiscoverable"
+
+
+    @property
+    def sensor_id(self) -> str:
+        return self._sensor_id
+
+
+    async def read(self):
+        return []
+
+
+def test_configured_sensor_id():
+    config = ConfigSection({"type": "Undiscoverable", "id": "sensor_0"}, "sensors[0]")
+
+    assert UndiscoverableSensor.get_configured_sensor_ids(config) == ["sensor_0"]
+
+
+def test_discover_without_discovery_support_is_a_config_error():
+    config = ConfigSection({"type": "Undiscoverable", "discover": True}, "sensors[2]")
+
+    with pytest.raises(ConfigError, match=r"sensors\[2\] has 'discover' set"):
+        UndiscoverableSensor.get_configured_sensor_ids(config)
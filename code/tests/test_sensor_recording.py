@@ -0,0 +1,48 @@
+from sensor.sensor_read_result import SensorReadResult
+from sensor.sensor_recording import ReadStatus, SensorRecorder, SensorRecording
+from sensor.sensors.synthetic.synthetic_datum import SyntheticDatum
+
+
+DATUM_CLASS = SyntheticDatum.get_class(1)
+START_NS = 1_700_000_000_000_000_000
+
+
+def record(path, count: int):
+    recorder = SensorRecorder(path)
+    for index in range(count):
+        result = SensorReadResult("Synthetic", "synthetic_0")
+        datum = DATUM_CLASS("Synthetic", "synthetic_0", {"value_0": float(index)})
+        datum.timestamp_ns = START_NS + index
+        result.data = [datum]
+        recorder.record(result, START_NS + index)
+
+    failed = SensorReadResult("Synthetic", "synthetic_1")
+    failed.error = OSError("unplugged")
+    recorder.record(failed, START_NS)
+    recorder.close()
+
+
+def test_recording_round_trip(tmp_path):
+    path = tmp_path / "test.rec"
+    record(path, 10)
+
+    recording = SensorRecording(path)
+
+    reads = recording.reads[("Synthetic", "synthetic_0")]
+    assert [read.decode_data()[0].value_0 for read in reads] == [float(index) for index in range(10)]
+    failed, = recording.reads[("Synthetic", "synthetic_1")]
+    assert failed.status == ReadStatus.FAILED
+    assert failed.error == "OSError: unplugged"
+    assert failed.decode_data() == []
+    assert recording.duration_ns == 9
+
+
+def test_torn_final_record_is_ignored(tmp_path):
+    path = tmp_path / "test.rec"
+    record(path, 10)
+    path.write_bytes(path.read_bytes()[:-5])
+
+    recording = SensorRecording(path)
+
+    assert len(recording.reads[("Synthetic", "synthetic_0")]) == 10
+    assert ("Synthetic", "synthetic_1") not in recording.reads
@@ -0,0 +1,107 @@
+import asyncio
+
+import pytest
+
+from sensor.sensors.synthetic.synthetic_datum import SyntheticDatum
+from storage.clients.influx.influx_stub_server import InfluxStubServer
+from storage.clients.influx.influxdb_client import InfluxDBClient
+from storage.storage_adapter import StorageAdapter
+from storage.storage_writer import OverflowPolicy, StorageWriter
+
+
+DATUM_CLASS = SyntheticDatum.get_class(1)
+
+
+class BatchRecordingStorage(StorageAdapter):
+    consumes_batches = True
+
+    def __init__(self):
+        self.writes = []
+
+
+    @property
+    def storage_type(self) -> str:
+        return "BatchRecording"
+
+
+    def store(self, data):
+        raise AssertionError("Adapters that consume batches should only be handed batches")
+
+
+    def store_batches(self, batches):
+        self.writes.append(batches)
+
+
+@pytest.fixture
+def stub_server():
+    server = InfluxStubServer(keep_lines=True).start()
+    yield server
+    server.stop()
+
+
+def build_client(stub_server: InfluxStubServer) -> InfluxDBClient:
+    return InfluxDBClient("Test", "test_0", {
+        "url": stub_server.url,
+        "organization": "organization",
+        "bucket": "bucket",
+        "api_token": "token"
+    })
+
+
+def build_data(count: int) -> list:
+    data = []
+    for index in range(count):
+        datum = DATUM_CLASS("Synthetic", "synthetic_0", {"value_0": float(index)})
+        datum.timestamp_ns = 1_700_000_000_000_000_000 + index
+        data.append(datum)
+
+    return data
+
+
+def get_written_values(stub_server: InfluxStubServer) -> list:
+    return sorted(float(line.split("value_0=")[1].split(" ")[0]) for line in stub_server.lines)
+
+
+async def write(writer: StorageWriter, data: list):
+    await writer.start()
+    await writer.put(data)
+    await writer.stop(timeout_seconds=10)
+
+
+@pytest.mark.parametrize("overflow_policy, expected_values, expected_dropped", [
+    (OverflowPolicy.BLOCK, [0.0, 1.0, 2.0, 3.0, 4.0], 0),
+    (OverflowPolicy.DROP_OLDEST, [2.0, 3.0, 4.0], 2),
+    (OverflowPolicy.DROP_NEWEST, [0.0, 1.0, 2.0], 2)
+])
+def test_overflow_policy(stub_server, overflow_policy, expected_values, expected_dropped):
+    writer = StorageWriter(build_client(stub_server), max_queue_size=3, batch_size=3, overflow_policy=overflow_policy)
+
+    asyncio.run(write(writer, build_data(5)))
+
+    assert get_written_values(stub_server) == expected_values
+    assert writer.dropped_count == expected_dropped
+    assert writer.max_queue_depth <= 3
+
+
+def test_retry_then_success(stub_server):
+    stub_server.fail_next(2)
+    writer = StorageWriter(build_client(stub_server), batch_size=4, max_retries=3, retry_base_delay_seconds=0)
+
+    asyncio.run(write(writer, build_data(4)))
+
+    assert get_written_values(stub_server) == [0.0, 1.0, 2.0, 3.0]
+    assert stub_server.failed_request_count == 2
+    assert writer.retry_count == 2
+    assert writer.written_batch_count == 1
+    assert writer.failed_batch_count == 0
+
+
+def test_batches_are_handed_to_adapters_that_consume_them():
+    storage = BatchRecordingStorage()
+    data = build_data(2) + [SyntheticDatum.get_class(2)("Synthetic", "synthetic_1", {"value_0": 1.0, "value_1": 2.0})]
+    writer = StorageWriter(storage, batch_size=3)
+
+    asyncio.run(write(writer, data))
+
+    assert len(storage.writes) == 1
+    assert [len(batch) for batch in storage.writes[0]] == [2, 1]
@@ -0,0 +1,70 @@
+import pytest
+
+from storage.spool.write_ahead_spool import WriteAheadSpool
+
+
+class Crash(Exception):
+    pass
+
+
+def build_spool(directory, count: int) -> WriteAheadSpool:
+    '''A spool with count records in a sealed segment, and a fresh active segment after it.'''
+
+    spool = WriteAheadSpool(directory, segment_max_bytes=1024 * 1024)
+    for index in range(count):
+        spool.append({"index": index})
+    spool.close()
+
+    return WriteAheadSpool(directory, segment_max_bytes=1024 * 1024)
+
+
+def consume(spool: WriteAheadSpool, count: int):
+    for consumed, (record, cursor) in enumerate(spool.read()):
+        if (consumed >= count):
+            break
+        spool.commit(cursor)
+
+
+def remaining(directory) -> list:
+    spool = WriteAheadSpool(directory)
+    records = [record["index"] for record, _ in spool.read()]
+    spool.close()
+
+    return records
+
+
+def test_small_partial_replays_are_not_compacted(tmp_path):
+    spool = build_spool(tmp_path, 10)
+    segment_path = spool._get_segment_path(spool.list_segments()[0])
+    size = segment_path.stat().st_size
+    consume(spool, 2)
+
+    spool.compact()
+
+    assert segment_path.stat().st_size == size
+    assert remaining(tmp_path) == list(range(2, 10))
+
+
+def test_compaction_keeps_the_remaining_records(tmp_path):
+    spool = build_spool(tmp_path, 10)
+    consume(spool, 8)
+
+    spool.compact()
+
+    assert spool.cursor.offset == 0
+    assert remaining(tmp_path) == [8, 9]
+
+
+@pytest.mark.parametrize("crash_point", ["_save_cursor", "_finish_compaction"])
+def test_crash_during_compaction_loses_nothing(tmp_path, monkeypatch, crash_point):
+    spool = build_spool(tmp_path, 10)
+    consume(spool, 8)
+
+    def crash(*args, **kwargs):
+        raise Crash()
+    monkeypatch.setattr(spool, crash_point, crash)
+    with pytest.raises(Crash):
+        spool.compact()
+
+    assert remaining(tmp_path) == [8, 9]
+    assert list(tmp_path.glob(f"*{WriteAheadSpool.COMPACTED_SUFFIX}")) == []
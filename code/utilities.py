@@ -1,11 +1,17 @@
 ## Shamelessly stolen from my hawking repo - See: https://github.com/naschorr/hawking/blob/master/code/common/utilities.py
 
+import atexit
+import copy
 import json
 import logging
 import datetime
 import os
+import queue
+import threading
+import time
 from pathlib import Path
-from logging.handlers import TimedRotatingFileHandler
+from logging.handlers import QueueHandler, QueueListener, TimedRotatingFileHandler
+from typing import Dict, Optional, Tuple
 
 ## Config
 CONFIG_NAME = "config.json"	            # The name of the config file
@@ -13,6 +19,16 @@ DEV_CONFIG_NAME = "config.dev.json"     # The name of the dev config file (overr
 PROD_CONFIG_NAME = "config.prod.json"   # The name of the prod config file (overrides properties stored in the normal config file)
 DIRS_FROM_ROOT = 1			            # How many directories away this script is from the root
 
+## Logging
+LOG_FORMAT = "%(asctime)s - %(module)s - %(funcName)s - %(levelname)s - %(message)s"
+LOG_LEVELS = {
+    "DEBUG": logging.DEBUG,
+    "INFO": logging.INFO,
+    "WARNING": logging.WARNING,
+    "ERROR": logging.ERROR,
+    "CRITICAL": logging.CRITICAL
+}
+
 
 def get_root_path() -> Path:
     path = Path(__file__)
@@ -28,16 +44,84 @@ def load_json(path: Path) -> dict:
         return json.load(fd)
 
 
-def load_config(directory_path: Path = None) -> dict:
+class ConfigError(ValueError):
+    pass
+
+
+class ConfigSection(dict):
     '''
-    Parses one or more JSON configuration files to build a dictionary with proper precedence for configuring the program
-    :param directory_path: Optional path to load configuration files from. If None, then the program's root (cwd/..) will be searched.
-    :type directory_path: Path, optional
-    :return: A dictionary containing key-value pairs for use in configuring parts of the program.
-    :rtype: dictionary
+    A dictionary of configuration values with typed, validated getters. Since it's still a dict, it can be handed to
+    anything that expects plain config dictionaries.
     '''
 
-    path = directory_path or get_root_path()
+    def __init__(self, values: dict = None, name: str = "config"):
+        super().__init__(values or {})
+        self.name = name
+
+
+    def _get_typed(self, key: str, value_type: type, default, required: bool):
+        value = dict.get(self, key, default)
+        if (value is None):
+            if (required):
+                raise ConfigError(f"Missing required value '{key}' in {self.name}")
+            return None
+
+        ## bool is a subclass of int, so don't let True/False sneak through as numbers
+        if (value_type in (int, float) and isinstance(value, bool)):
+            raise ConfigError(f"Expected '{key}' in {self.name} to be of type {value_type.__name__}, not bool")
+
+        try:
+            return value_type(value)
+        except (TypeError, ValueError) as e:
+            raise ConfigError(f"Expected '{key}' in {self.name} to be of type {value_type.__name__}, not '{value}'") from e
+
+
+    def _check_minimum(self, key: str, value, minimum):
+        if (value is not None and minimum is not None and value < minimum):
+            raise ConfigError(f"Expected '{key}' in {self.name} to be at least {minimum}, not {value}")
+
+        return value
+
+
+    def get_str(self, key: str, default: str = None, required: bool = False) -> str:
+        return self._get_typed(key, str, default, required)
+
+
+    def get_int(self, key: str, default: int = None, required: bool = False, minimum: int = None) -> int:
+        return self._check_minimum(key, self._get_typed(key, int, default, required), minimum)
+
+
+    def get_float(self, key: str, default: float = None, required: bool = False, minimum: float = None) -> float:
+        return self._check_minimum(key, self._get_typed(key, float, default, required), minimum)
+
+
+    def get_bool(self, key: str, default: bool = None, required: bool = False) -> bool:
+        value = dict.get(self, key, default)
+        if (value is None and required):
+            raise ConfigError(f"Missing required value '{key}' in {self.name}")
+        if (value is not None and not isinstance(value, bool)):
+            raise ConfigError(f"Expected '{key}' in {self.name} to be true or false, not '{value}'")
+
+        return value
+
+
+    def get_section(self, key: str, required: bool = False) -> 'ConfigSection':
+        value = dict.get(self, key)
+        if (value is None):
+            if (required):
+                raise ConfigError(f"Missing required section '{key}' in {self.name}")
+            value = {}
+        if (not isinstance(value, dict)):
+            raise ConfigError(f"Expected '{key}' in {self.name} to be a section (object), not '{value}'")
+
+        return ConfigSection(value, f"{self.name}.{key}")
+
+
+## Merged configs, keyed by the resolved directory they were loaded from
+_config_cache: Dict[Path, dict] = {}
+
+
+def _load_merged_config(path: Path) -> dict:
     config_path = Path.joinpath(path, CONFIG_NAME)
     if (not config_path.exists()):
         raise RuntimeError("Unable to find config.json file in root!")
@@ -63,27 +147,136 @@ def load_config(directory_path: Path = None) -> dict:
     return config
 
 
-def initialize_logging(logger):
-    config = load_config()
+def load_config(directory_path: Path = None) -> ConfigSection:
+    '''
+    Parses one or more JSON configuration files to build a dictionary with proper precedence for configuring the program.
+    Each directory is only read and merged once per process, after that a copy of the cached result is returned.
+    :param directory_path: Optional path to load configuration files from. If None, then the program's root (cwd/..) will be searched.
+    :type directory_path: Path, optional
+    :return: A dictionary containing key-value pairs for use in configuring parts of the program.
+    :rtype: ConfigSection
+    '''
 
-    FORMAT = "%(asctime)s - %(module)s - %(funcName)s - %(levelname)s - %(message)s"
-    formatter = logging.Formatter(FORMAT)
-    logging.basicConfig(format=FORMAT)
-
-    log_level = str(config.get("log_level", "DEBUG"))
-    if (log_level == "DEBUG"):
-        logger.setLevel(logging.DEBUG)
-    elif (log_level == "INFO"):
-        logger.setLevel(logging.INFO)
-    elif (log_level == "WARNING"):
-        logger.setLevel(logging.WARNING)
-    elif (log_level == "ERROR"):
-        logger.setLevel(logging.ERROR)
-    elif (log_level == "CRITICAL"):
-        logger.setLevel(logging.CRITICAL)
-    else:
-        logger.setLevel(logging.DEBUG)
+    path = Path(directory_path or get_root_path()).resolve()
+
+    config = _config_cache.get(path)
+    if (config is None):
+        config = _load_merged_config(path)
+        _config_cache[path] = config
+
+    ## Hand out a copy, so that nobody can accidentally change the config out from under everyone else
+    return ConfigSection(copy.deepcopy(config), str(Path(path, CONFIG_NAME)))
 
+
+def clear_config_cache():
+    _config_cache.clear()
+
+
+## Logging
+_log_handler: logging.Handler = None
+_log_listener: QueueListener = None
+_log_level: int = None
+
+
+class DeferredQueueHandler(QueueHandler):
+    '''
+    Hands records off to the background log listener without formatting them first. The stock QueueHandler formats
+    every record on the calling thread so that it can be pickled, which isn't needed for an in-process queue, and would
+    put the formatting cost right back onto the event loop.
+    '''
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+
+class RateLimitFilter(logging.Filter):
+    '''
+    Stops a repeated message (ex: the same sensor failing on every poll) from flooding the log. Each distinct message at
+    or above the given level is let through at most 'burst' times per window, after which only every Nth repeat is
+    sampled (if sample_every is set). The next message to get through notes how many repeats were suppressed.
+
+    Messages are told apart by their logging call and unformatted message, so repeats are caught even when their
+    arguments (or exception text) differ, and nothing gets formatted early. Filters run on whichever thread is logging,
+    so the windows are guarded by a lock.
+    '''
+
+    def __init__(self, window_seconds: float = 300, burst: int = 3, sample_every: int = 0, level: int = logging.WARNING):
+        super().__init__()
+
+        self.window_seconds = window_seconds
+        self.burst = burst
+        self.sample_every = sample_every
+        self.level = level
+
+        ## message key -> [window start, messages seen in window, messages suppressed]
+        self._windows: Dict[tuple, list] = {}
+        self._last_pruned = time.monotonic()
+        self._lock = threading.Lock()
+
+
+    def _prune(self, now: float):
+        '''
+        Drops the windows that have run out. Ones with suppressed repeats are kept for another window, so that the count
+        can still be noted if the message comes back, but not forever.
+        '''
+
+        if (now - self._last_pruned < self.window_seconds):
+            return
+
+        self._windows = {
+            key: window for key, window in self._windows.items()
+            if now - window[0] < self.window_seconds * (2 if window[2] > 0 else 1)
+        }
+        self._last_pruned = now
+
+
+    def _get_suppressed(self, record: logging.LogRecord) -> Optional[int]:
+        '''Returns None if the record should be dropped, otherwise how many of its repeats were suppressed before it.'''
+
+        now = time.monotonic()
+        key = (record.name, record.levelno, record.pathname, record.lineno, str(record.msg))
+
+        with self._lock:
+            self._prune(now)
+
+            window = self._windows.get(key)
+            if (window is None or now - window[0] >= self.window_seconds):
+                suppressed = window[2] if window is not None else 0
+                window = [now, 0, 0]
+                self._windows[key] = window
+            else:
+                suppressed = 0
+
+            window[1] += 1
+            if (window[1] > self.burst):
+                if (not self.sample_every or (window[1] - self.burst) % self.sample_every != 0):
+                    window[2] += 1
+                    return None
+                suppressed, window[2] = window[2], 0
+
+        return suppressed
+
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if (record.levelno < self.level):
+            return True
+
+        ## Filters run at the logging call site, so never let a problem here break the caller
+        try:
+            suppressed = self._get_suppressed(record)
+        except Exception:
+            return True
+
+        if (suppressed is None):
+            return False
+        if (suppressed > 0):
+            ## Appended to the unformatted message, so that it's still formatted later on the listener's thread
+            record.msg = f"{record.msg} (suppressed {suppressed} repeat{'s' if suppressed != 1 else ''} of this message)"
+
+        return True
+
+
+def _build_file_handler(config: ConfigSection) -> Tuple[logging.Handler, bool]:
     ## Get the directory containing the logs and make sure it exists, creating it if it doesn't
     log_path = config.get("log_path")
     if (log_path):
@@ -104,14 +297,94 @@ def initialize_logging(logger):
             os.remove(log_file)
             removed_previous_logs = True
 
-    ## Setup and add the timed rotating log handler to the logger
-    backup_count = config.get("log_backup_count", 7)    # Store a week's logs then start overwriting them
+    ## Setup the timed rotating log handler
+    backup_count = config.get_int("log_backup_count", 7, minimum=0)    # Store a week's logs then start overwriting them
     log_handler = TimedRotatingFileHandler(str(log_file), when='midnight', interval=1, backupCount=backup_count)
-    log_handler.setFormatter(formatter)
-    logger.addHandler(log_handler)
+    log_handler.setFormatter(logging.Formatter(LOG_FORMAT))
+
+    return log_handler, removed_previous_logs
+
+
+def _start_logging(config: ConfigSection) -> logging.Handler:
+    '''
+    Builds the process-wide logging pipeline. Loggers hand records to a queue, and a background listener thread formats
+    them and writes them out to the log file (and console), so the event loop never waits on disk I/O.
+    '''
+
+    global _log_listener
+
+    file_handler, removed_previous_logs = _build_file_handler(config)
+    handlers = [file_handler]
+    if (config.get_bool("log_to_console", True)):
+        console_handler = logging.StreamHandler()
+        console_handler.setFormatter(logging.Formatter(LOG_FORMAT))
+        handlers.append(console_handler)
+
+    log_queue = queue.SimpleQueue()
+    _log_listener = QueueListener(log_queue, *handlers, respect_handler_level=True)
+    _log_listener.start()
+    ## Make sure anything still queued gets written out on the way down
+    atexit.register(_log_listener.stop)
+
+    queue_handler = DeferredQueueHandler(log_queue)
+    rate_limit_config = config.get_section("log_rate_limit")
+    if (rate_limit_config.get_bool("enabled", False)):
+        queue_handler.addFilter(RateLimitFilter(
+            window_seconds=rate_limit_config.get_float("window_seconds", 300, minimum=0),
+            burst=rate_limit_config.get_int("burst", 3, minimum=1),
+            sample_every=rate_limit_config.get_int("sample_every", 0, minimum=0),
+            level=LOG_LEVELS.get(rate_limit_config.get_str("level", "WARNING"), logging.WARNING)
+        ))
+
+    ## Everything propagates up to the root logger, so it's the only one that needs the handler
+    logging.getLogger().addHandler(queue_handler)
 
     ## With the new logger set up, let the user know if the previously used log file was removed.
     if (removed_previous_logs):
-        logger.info("Removed previous log file.")
+        logging.getLogger(__name__).warning("Removed previous log file.")
+
+    return queue_handler
+
+
+def initialize_logging(logger):
+    '''
+    Sets the logger's level, setting up the process-wide logging pipeline on the first call. The config is only read
+    and the handlers only built once, so every logger shares the same queue and file handle no matter how many modules
+    (or sensor instances) call this.
+
+    Hot paths should use %-style arguments (ex: logger.debug("Read %s", value)) rather than f-strings, so that nothing
+    gets formatted unless the record is actually going to be written.
+    '''
+
+    global _log_handler, _log_level
+
+    if (_log_handler is None):
+        config = load_config()
+        _log_level = LOG_LEVELS.get(str(config.get("log_level", "DEBUG")), logging.DEBUG)
+        _log_handler = _start_logging(config)
+
+    logger.setLevel(_log_level)
 
     return logger
+
+
+def initialize_worker_logging(log_queue):
+    '''
+    Sets up the logging pipeline for a worker process. Records are forwarded to the given (multiprocessing) queue for
+    the parent process to write out, rather than having several processes open and rotate the same log file. Must be
+    called before anything else in the worker initializes logging.
+    '''
+
+    global _log_handler, _log_level
+
+    config = load_config()
+    _log_level = LOG_LEVELS.get(str(config.get("log_level", "DEBUG")), logging.DEBUG)
+    _log_handler = QueueHandler(log_queue)
+    logging.getLogger().addHandler(_log_handler)
+
+
+class ForwardedLogHandler(logging.Handler):
+    '''Passes records forwarded from a worker process on to the same named logger in this process.'''
+
+    def emit(self, record: logging.LogRecord):
+        logging.getLogger(record.name).handle(record)